@@ -36,6 +36,8 @@ Apply Batch Line Edits
 '''
     0.0.1 Created on 2015-02-24 by mattaustin222
     0.0.2 Added the ability to process multiple alt files in sequence by JamesVaughan
+    0.0.3 Added processNetwork, which applies the edits to a Network object in memory for
+        callers which chain several network edits before publishing.
     
 '''
 
@@ -53,7 +55,7 @@ netCalc = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
 
 class ApplyBatchLineEdits(_m.Tool()):
     
-    version = '0.0.1'
+    version = '0.0.3'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
 
@@ -102,18 +104,10 @@ class ApplyBatchLineEdits(_m.Tool()):
         self.Scenario = _m.Modeller().emmebank.scenario(xtmf_ScenarioNumber)
         if (self.Scenario == None):
             raise Exception("Scenario %s was not found!" %xtmf_ScenarioNumber)
+        self.ScenarioId = self.Scenario.id
 
         #---2 Set up instruction file
-        self.InstructionFile = inputFile
-        if (self.InstructionFile == None):
-            raise Exception("Need to provide an input file.")
-        # Process the additional files, if it is the string None then there are no additional files otherwise they are ; separated
-        if additionalInputFiles  == None or additionalInputFiles == "None":
-            self.InputFiles = []
-        else:
-            self.InputFiles = additionalInputFiles.split(';')
-        # Add the base transaction file to the beginning
-        self.InputFiles.insert(0, self.InstructionFile)
+        self._SetInputFiles(inputFile, additionalInputFiles)
         try:
             self._Execute()
         except Exception, e:
@@ -137,6 +131,33 @@ class ApplyBatchLineEdits(_m.Tool()):
                     print "No changes available in this scenario"
                 self.TRACKER.completeTask()
 
+    ##########################################################################################################
+    
+    def processNetwork(self, network, xtmf_ScenarioNumber, inputFile, lineSelector, additionalInputFiles = None):
+        '''
+        Applies the line edits to a Network object in memory, without loading or
+        publishing it.
+        
+        Args:
+            - network: The Network object to modify
+            - xtmf_ScenarioNumber: The number of the scenario the network will be
+                published to, used to find its columns in the input files
+            - inputFile, additionalInputFiles: As for the tool
+            - lineSelector: A network_editing.TransitLineSelector, used to evaluate
+                the filter expressions of the input files.
+        '''
+        self.ScenarioId = str(xtmf_ScenarioNumber)
+        self._SetInputFiles(inputFile, additionalInputFiles)
+        
+        with _m.logbook_trace(name="{classname} v{version} (in memory)".format(classname=(self.__class__.__name__), version=self.version),
+                                     attributes=self._GetAtts()):
+            self.TRACKER = _util.ProgressTracker(len(self.InputFiles))
+            for altFile in self.InputFiles:
+                changesToApply = self._LoadFile(altFile)
+                if changesToApply:
+                    lineSelector.evaluate(changesToApply.keys())
+                    self._ApplyNetworkLineChanges(network, changesToApply, lineSelector)
+                self.TRACKER.completeTask()
 
     ##########################################################################################################    
     
@@ -144,11 +165,23 @@ class ApplyBatchLineEdits(_m.Tool()):
     
     def _GetAtts(self):
         atts = {
-                "Scenario" : str(self.Scenario.id),
+                "Scenario" : str(self.ScenarioId),
                 "Version": self.version, 
                 "self": self.__MODELLER_NAMESPACE__}
             
         return atts 
+    
+    def _SetInputFiles(self, inputFile, additionalInputFiles):
+        self.InstructionFile = inputFile
+        if (self.InstructionFile == None):
+            raise Exception("Need to provide an input file.")
+        # Process the additional files, if it is the string None then there are no additional files otherwise they are ; separated
+        if additionalInputFiles  == None or additionalInputFiles == "None":
+            self.InputFiles = []
+        else:
+            self.InputFiles = additionalInputFiles.split(';')
+        # Add the base transaction file to the beginning
+        self.InputFiles.insert(0, self.InstructionFile)
 
     def _LoadFile(self, fileName):
         with open(fileName) as reader:
@@ -156,19 +189,19 @@ class ApplyBatchLineEdits(_m.Tool()):
             cells = header.strip().split(self.COMMA)
             
             filterCol = cells.index('filter')
-            headwayTitle = self.Scenario.id + '_hdwchange'
-            speedTitle = self.Scenario.id + '_spdchange'
+            headwayTitle = self.ScenarioId + '_hdwchange'
+            speedTitle = self.ScenarioId + '_spdchange'
             try:
                 headwayCol = cells.index(headwayTitle)
             except Exception, e:
-                msg = "Error. No headway match for specified scenario: '%s'." %self.Scenario.id
+                msg = "Error. No headway match for specified scenario: '%s'." %self.ScenarioId
                 _m.logbook_write(msg)
                 print msg
                 return
             try:
                 speedCol = cells.index(speedTitle)
             except Exception, e:
-                msg = "Error. No speed match for specified scenario: '%s'." %self.Scenario.id
+                msg = "Error. No speed match for specified scenario: '%s'." %self.ScenarioId
                 _m.logbook_write(msg)
                 print msg
                 return
@@ -209,6 +242,17 @@ class ApplyBatchLineEdits(_m.Tool()):
                     "selections": {
                         "transit_line": filter}}
                 netCalc(spec, self.Scenario)
+    
+    def _ApplyNetworkLineChanges(self, network, inputData, lineSelector):
+        #Same as _ApplyLineChanges, but the factors are applied to the lines of the network
+        for filter, factors in inputData.iteritems():
+            for id in lineSelector(filter):
+                line = network.transit_line(id)
+                if line == None: continue
+                if factors[0] != 1:
+                    line.headway = factors[0] * line.headway
+                if factors[1] != 1:
+                    line.speed = factors[1] * line.speed
 
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
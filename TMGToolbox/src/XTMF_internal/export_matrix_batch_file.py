@@ -27,6 +27,7 @@ class ExportMatrix(_m.Tool()):
     MatrixId = _m.Attribute(int)
     Filename = _m.Attribute(str)
     ScenarioNumber = _m.Attribute(int)
+    BinaryFormat = _m.Attribute(bool)
     
     def __init__(self):
         self._tracker = _util.ProgressTracker(1)
@@ -39,35 +40,70 @@ class ExportMatrix(_m.Tool()):
         
         return pb.render()
 
-    def __call__(self, MatrixId, Filename, ScenarioNumber):        
+    def __call__(self, MatrixId, Filename, ScenarioNumber, BinaryFormat=False):
+        '''
+        Exports one or more full matrices. MatrixId is either a single matrix number, or
+        a comma-separated list of matrix numbers, in which case Filename is the directory
+        to export to (each matrix is saved as 'mf<number>.mtx', or 'mf<number>.txt' as text).
+        
+        With BinaryFormat, the matrices are saved in the binary .mtx format (see
+        utilities.saveBinaryMatrix) instead of as text.
+        '''
+        matrixIds = [int(id) for id in str(MatrixId).split(',') if id.strip()]
+        if len(matrixIds) == 1:
+            filenames = [Filename]
+        else:
+            if not os.path.isdir(Filename): os.makedirs(Filename)
+            extension = '.mtx' if BinaryFormat else '.txt'
+            filenames = [os.path.join(Filename, "mf%s%s" %(id, extension)) for id in matrixIds]
+        
         with _m.logbook_trace("Exporting matrix %s to XTMF" %MatrixId): 
             scenario = _m.Modeller().emmebank.scenario(ScenarioNumber)
             if (scenario == None):
                 raise Exception("Scenario %s was not found!" %ScenarioNumber)
             
-            try:
-                tool = None
-                try:
-                    tool = _m.Modeller().tool('inro.emme.standard.data.matrix.export_matrices')
-                except Exception, e:
-                    tool = _m.Modeller().tool('inro.emme.data.matrix.export_matrices')
-                
-                mtx = _m.Modeller().emmebank.matrix("mf%s" %MatrixId)
+            matrices = []
+            for id in matrixIds:
+                mtx = _m.Modeller().emmebank.matrix("mf%s" %id)
                 if mtx == None:
-                    raise Exception("No matrix found with id '%s'" %MatrixId)
-                self._tracker.runTool(tool,
-                                      export_file=Filename,
-                                      field_separator='TAB',
-                                      matrices=[mtx],
-                                      full_matrix_line_format="ONE_ENTRY_PER_LINE",
-                                      export_format="PROMPT_DATA_FORMAT",
-                                      scenario=scenario,
-                                      skip_default_values=False)
-                
+                    raise Exception("No matrix found with id '%s'" %id)
+                matrices.append(mtx)
+            
+            try:
+                if BinaryFormat:
+                    self._exportBinary(matrices, filenames, scenario)
+                else:
+                    self._exportText(matrices, filenames, scenario)
             except Exception, e:
                 raise Exception(_traceback.format_exc(e))
+    
+    def _exportText(self, matrices, filenames, scenario):
+        tool = None
+        try:
+            tool = _m.Modeller().tool('inro.emme.standard.data.matrix.export_matrices')
+        except Exception, e:
+            tool = _m.Modeller().tool('inro.emme.data.matrix.export_matrices')
+        
+        self._tracker.reset(len(matrices))
+        for mtx, filename in zip(matrices, filenames):
+            self._tracker.runTool(tool,
+                                  export_file=filename,
+                                  field_separator='TAB',
+                                  matrices=[mtx],
+                                  full_matrix_line_format="ONE_ENTRY_PER_LINE",
+                                  export_format="PROMPT_DATA_FORMAT",
+                                  scenario=scenario,
+                                  skip_default_values=False)
+    
+    def _exportBinary(self, matrices, filenames, scenario):
+        zones = scenario.zone_numbers
+        
+        self._tracker.reset()
+        self._tracker.startProcess(len(matrices))
+        for mtx, filename in zip(matrices, filenames):
+            _util.saveBinaryMatrix(filename, mtx.get_numpy_data(scenario.id), [zones, zones])
+            self._tracker.completeSubtask()
 
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
         return self._tracker.getProgress()
-    
\ No newline at end of file
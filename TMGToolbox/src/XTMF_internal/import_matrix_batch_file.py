@@ -20,13 +20,23 @@
 import os
 import time
 import math
+import shlex
+import numpy as _np
 import inro.modeller as _m
 import traceback as _traceback
+_util = _m.Modeller().module('tmg.common.utilities')
+
+#Characters which can appear in the data section of a full matrix handled by the fast import.
+#Anything else (comments, keywords, ranges such as '1-5') is left to the matrix transaction tool.
+_SUPPORTED_CHARACTERS = '0123456789eE.+-: \t\r\n'
+_CHUNK_SIZE = 1 << 24
 
 class LoadMatrix(_m.Tool()):
     
     MatrixFile = _m.Attribute(str)
     ScenarioId = _m.Attribute(int)
+    FastImport = _m.Attribute(bool)
+    MatrixId = _m.Attribute(str)
     
     def page(self):
         pb = _m.ToolPageBuilder(self, title="Load a matrix",
@@ -36,40 +46,80 @@ class LoadMatrix(_m.Tool()):
         
         return pb.render()
     
-    def __call__(self, MatrixFile, ScenarioId):
+    def __call__(self, MatrixFile, ScenarioId, FastImport=False, MatrixId=""):
         try:
-            batch_matrix = None
-            try:
-                batch_matrix = _m.Modeller().tool("inro.emme.standard.data.matrix.matrix_transaction")
-            except Exception, e:
-                batch_matrix = _m.Modeller().tool("inro.emme.data.matrix.matrix_transaction")
-            
             scenario = _m.Modeller().emmebank.scenario(ScenarioId)
             if not scenario:
                 raise Exception("Scenario %s does not exist." % ScenarioId)
             
+            #---Binary (.mtx) files don't have a header, so the matrix comes from MatrixId or the file name
+            if os.path.splitext(MatrixFile)[1].lower() == '.mtx':
+                self._binaryImport(MatrixFile, MatrixId or os.path.splitext(os.path.basename(MatrixFile))[0], scenario)
+                self.XTMFBridge.ReportProgress(1.0)
+                return
+
             #---Peek at the file to delete
-            self._peek(MatrixFile)
+            header = self._peek(MatrixFile)
             
-            batch_matrix(transaction_file = MatrixFile,
-                            throw_on_error = True,
-                            scenario=scenario)
+            #---Full matrices are parsed straight into a NumPy buffer, anything else goes through Emme
+            if not (FastImport and header is not None and self._fastImport(MatrixFile, header, scenario)):
+                self._transactionImport(MatrixFile, scenario)
         except Exception, e:
             raise Exception(_traceback.format_exc(e))
         
         self.XTMFBridge.ReportProgress(1.0)
         
+    def _transactionImport(self, file, scenario):
+        batch_matrix = None
+        try:
+            batch_matrix = _m.Modeller().tool("inro.emme.standard.data.matrix.matrix_transaction")
+        except Exception, e:
+            batch_matrix = _m.Modeller().tool("inro.emme.data.matrix.matrix_transaction")
+
+        batch_matrix(transaction_file = file,
+                        throw_on_error = True,
+                        scenario=scenario)
+
+    def _binaryImport(self, file, id, scenario):
+        data, indices, matrixType = _util.loadBinaryMatrix(file, mmap= True)
+        if not id.startswith(matrixType):
+            raise Exception("Cannot import a '%s' matrix from '%s' into %s" %(matrixType, file, id))
+
+        #Reorder the data to the scenario's zone system, if it is different
+        zones = _np.array(scenario.zone_numbers, dtype= _np.int32)
+        for axis, index in enumerate(indices):
+            if len(index) == len(zones) and _np.all(index == zones): continue
+            order = _np.argsort(index, kind= 'mergesort')
+            sortedIndex = index[order]
+            positions = _np.searchsorted(sortedIndex, zones).clip(0, len(index) - 1)
+            missing = sortedIndex[positions] != zones
+            data = _np.take(data, order[positions], axis= axis)
+            selection = [slice(None)] * data.ndim
+            selection[axis] = missing
+            data[tuple(selection)] = 0.0
+
+        mtx = _util.initializeMatrix(id)
+        if matrixType == 'ms':
+            mtx.data = float(data)
+        else:
+            mtx.set_numpy_data(_np.asarray(data, dtype= _np.float32), scenario.id)
+        _m.logbook_write("Imported matrix %s from binary file '%s'" %(id, file))
+
     def _peek(self, file):
-        batch = open(file)
+        '''
+        Streams the file up to the first matrix header, deleting the matrix
+        it refers to. Returns the header line, or None if there isn't one.
+        '''
+        with open(file) as batch:
+            for line in batch:
+                if line.startswith('a'):
+                    id = self._parseMatrixHeader(line)
         
-        for line in batch.readlines():
-            if line.startswith('a'):
-                id = self._parseMatrixHeader(line)
-                
-                mtx = _m.Modeller().emmebank.matrix(id)
-                if mtx != None:
-                    _m.Modeller().emmebank.delete_matrix(id)
-                return
+                    mtx = _m.Modeller().emmebank.matrix(id)
+                    if mtx != None:
+                        _m.Modeller().emmebank.delete_matrix(id)
+                    return line
+        return None
     
     def _parseMatrixHeader(self, header):
         args = header.split(' ')
@@ -83,5 +133,144 @@ class LoadMatrix(_m.Tool()):
         # Else, assume the first argument is the matrix name
         return args[1]
         
+    def _parseMatrixHeaderFields(self, header):
+        '''
+        Returns the id, name, default value and description of a matrix header,
+        in either the keyword (matrix=, name=, default=, descr=) or positional form.
+        '''
+        args = shlex.split(header.strip())[1:]
+        keywords = {}
+        positional = []
+        for arg in args:
+            key, sep, value = arg.partition('=')
+            if sep and key in ('matrix', 'name', 'default', 'descr'):
+                keywords[key] = value
+            else:
+                positional.append(arg)
+        
+        #Positional tokens fill the fields not given by keyword, in order (e.g. 'a matrix=mf10 abc 2.5')
+        fields = {'name': '', 'default': 0.0, 'descr': ''}
+        fields.update(keywords)
+        remaining = [key for key in ('matrix', 'name', 'default', 'descr') if key not in keywords]
+        for key, value in zip(remaining, positional):
+            fields[key] = value
+        if remaining and remaining[-1] == 'descr' and len(positional) > len(remaining):
+            fields['descr'] = ' '.join(positional[len(remaining) - 1:])
+        if 'matrix' not in fields:
+            raise ValueError("No matrix id in header '%s'" %header.strip())
+        
+        return fields['matrix'], fields['name'], float(fields['default']), fields['descr']
+
+    def _fastImport(self, file, header, scenario):
+        '''
+        Imports a single full matrix by parsing its data section with NumPy and
+        saving it with one call to set_numpy_data. Returns False, without modifying
+        the databank, if the file uses anything other than plain 'origin dest: value'
+        entries (in which case it should be imported by the transaction tool).
+        '''
+        try:
+            id, name, default, description = self._parseMatrixHeaderFields(header)
+        except ValueError:
+            return False
+        if not id.startswith('mf'): return False
+
+        zones = _np.array(scenario.zone_numbers, dtype= _np.int64)
+        zoneIndex = _np.empty(zones.max() + 1, dtype= _np.int64)
+        zoneIndex.fill(-1)
+        zoneIndex[zones] = _np.arange(len(zones))
+        data = _np.empty((len(zones), len(zones)), dtype= _np.float32)
+        data.fill(default)
+
+        with open(file) as reader:
+            #Skip to the data section
+            line = reader.readline()
+            while line and not line.startswith('a'):
+                line = reader.readline()
+
+            while True:
+                chunk = reader.read(_CHUNK_SIZE)
+                if not chunk: break
+                chunk += reader.readline()
+                if not self._isSupportedChunk(chunk): return False
+
+                if not self._parseChunk(chunk, zoneIndex, data): return False
+
+        mtx = _util.initializeMatrix(id, default= default, name= name, description= description)
+        mtx.set_numpy_data(data, scenario.id)
+        _m.logbook_write("Imported matrix %s from '%s' with NumPy" %(id, file))
+        return True
+
+    def _isSupportedChunk(self, chunk):
+        if chunk.translate(None, _SUPPORTED_CHARACTERS): return False
+        if '-' not in chunk: return True
         
-           
\ No newline at end of file
+        #A minus sign directly after a number is a range
+        characters = _np.frombuffer(chunk, dtype= _np.uint8)
+        minusSigns = _np.flatnonzero(characters[1:] == ord('-'))
+        previous = characters[minusSigns]
+        return not _np.any(((previous >= ord('0')) & (previous <= ord('9'))) | (previous == ord('.')))
+    
+    def _parseChunk(self, chunk, zoneIndex, data):
+        #Each end of line is turned into a NaN, so that the chunk can be parsed with one call
+        #and split back into 'origin dest: value dest: value ...' records afterwards.
+        text = chunk.replace(':', ' ').replace('\n', ' nan ')
+        if not chunk.endswith('\n'): text += ' nan'
+        tokens = _np.fromstring(text, sep= ' ')
+        isLineEnd = _np.isnan(tokens)
+        lineEnds = _np.flatnonzero(isLineEnd)
+        if len(lineEnds) != text.count('nan'): return False #The chunk was not completely parsed
+
+        lineStarts = _np.concatenate(([0], lineEnds[:-1] + 1))
+        lengths = lineEnds - lineStarts
+        if _np.any((lengths > 0) & (lengths % 2 == 0)): return False #Incomplete 'dest: value' pair
+
+        #The position of each token in its line: 0 for the origin, odd for destinations
+        tokenLineStart = lineStarts[_np.cumsum(isLineEnd) - isLineEnd]
+        position = _np.arange(len(tokens)) - tokenLineStart
+        destIndices = _np.flatnonzero(~isLineEnd & (position % 2 == 1))
+
+        origins = tokens[tokenLineStart[destIndices]]
+        dests = tokens[destIndices]
+        values = tokens[destIndices + 1]
+        if len(dests) == 0: return True
+
+        if not (_np.all(dests == _np.floor(dests)) and _np.all(origins == _np.floor(origins))): return False
+        if _np.any(dests < 0) or _np.any(origins < 0): return False
+        if dests.max() >= len(zoneIndex) or origins.max() >= len(zoneIndex): return False
+        rows = zoneIndex[origins.astype(_np.int64)]
+        columns = zoneIndex[dests.astype(_np.int64)]
+        if _np.any(rows < 0) or _np.any(columns < 0): return False
+
+        data[rows, columns] = values
+        return True
+
+#-------------------------------------------------------------------------------------------
+
+def benchmarkImport(matrixFile, scenarioId, repetitions=1):
+    '''
+    Times importing the same file with the matrix transaction tool and with
+    the NumPy fast import. The matrix in the file is overwritten.
+
+    Returns: A dictionary with the 'transaction_time', 'fast_time' (both in
+        seconds for all the repetitions) and 'speedup' keys.
+    '''
+    tool = LoadMatrix()
+    scenario = _m.Modeller().emmebank.scenario(scenarioId)
+    header = tool._peek(matrixFile)
+
+    start = time.time()
+    for i in range(repetitions):
+        tool._peek(matrixFile)
+        tool._transactionImport(matrixFile, scenario)
+    transactionTime = time.time() - start
+
+    start = time.time()
+    for i in range(repetitions):
+        tool._peek(matrixFile)
+        if not tool._fastImport(matrixFile, header, scenario):
+            raise Exception("'%s' cannot be imported with the fast import" %matrixFile)
+    fastTime = time.time() - start
+
+    return {'transaction_time': transactionTime,
+            'fast_time': fastTime,
+            'speedup': transactionTime / fastTime if fastTime > 0 else float('inf')}
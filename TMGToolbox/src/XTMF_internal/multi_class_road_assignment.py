@@ -32,12 +32,17 @@ Toll-Based Road Assignment
     V 1.1.0 Added link volume attributes for increased resolution of analysis.
 
     V 1.1.1 Updated to allow for multi-threaded matrix calcs in 4.2.1+
+
+    V 1.2.0 Added a single-pass skimming mode (Emme 4.3+): the equilibrium is only computed once, and
+        toll, aggregate attribute and time skims are obtained from the stored paths using path-based
+        traffic analyses. The number of assignment runs saved is reported to the logbook.
         
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 import multiprocessing
+from time import time as _time
 from contextlib import contextmanager
 from contextlib import nested
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
@@ -55,7 +60,7 @@ def blankManager(obj):
 
 class MultiClassRoadAssignment(_m.Tool()):
     
-    version = '1.1.1'
+    version = '1.2.0'
     tool_run_msg = ""
     number_of_tasks = 4 # For progress reporting, enter the integer number of tasks here
     
@@ -102,6 +107,7 @@ class MultiClassRoadAssignment(_m.Tool()):
     aggAttributesClassMatrix = _m.Attribute(str)
 
     NumberOfProcessors = _m.Attribute(int)
+    SinglePassFlag = _m.Attribute(bool)
     
     def __init__(self):
         self._tracker = _util.ProgressTracker(self.number_of_tasks)
@@ -125,6 +131,7 @@ class MultiClassRoadAssignment(_m.Tool()):
         self.LinkTollAttributeId = "@toll"
 
         self.NumberOfProcessors = multiprocessing.cpu_count()
+        self.SinglePassFlag = False
         
              
     def page(self):
@@ -138,7 +145,8 @@ class MultiClassRoadAssignment(_m.Tool()):
     def __call__(self, xtmf_ScenarioNumber, Mode_List, xtmf_Demand_String, TimesMatrixId,
                  CostMatrixId, TollsMatrixId, PeakHourFactor, LinkCost,
                  TollWeight, Iterations, rGap, brGap, normGap, PerformanceFlag,
-                 RunTitle, LinkTollAttributeId, xtmf_NameString, ResultAttributes, xtmf_AggAttributes, xtmf_aggAttributesMatrixId):
+                 RunTitle, LinkTollAttributeId, xtmf_NameString, ResultAttributes, xtmf_AggAttributes, xtmf_aggAttributesMatrixId,
+                 SinglePassFlag=False):
         #---1 Set up Scenario
         self.Scenario = _m.Modeller().emmebank.scenario(xtmf_ScenarioNumber)
         if (self.Scenario == None):
@@ -184,6 +192,10 @@ class MultiClassRoadAssignment(_m.Tool()):
         self.brGap = brGap
         self.normGap = normGap      
         self.RunTitle = RunTitle[:25]
+        self.SinglePassFlag = SinglePassFlag
+        if self.SinglePassFlag and EMME_VERSION < (4,3):
+            print "Single-pass skimming requires Emme 4.3 or newer. Running one assignment per skim instead."
+            self.SinglePassFlag = False
 
         #---3. Run
         try:          
@@ -267,94 +279,98 @@ class MultiClassRoadAssignment(_m.Tool()):
                         self._tracker.completeTask()
                         
                         with _m.logbook_trace("Running Road Assignments."):
-                            y = 0 # init assignment flag. if assignment done, then trip flag
-                            x = 0 # init flag. if list has something defined, then trip flag
-                            for i in range(len(self.CostMatrixId)): #check to see if any cost matrices defined
-                                if self.CostMatrixId[i] != None:
-                                    x = 1
-                            if x == 1: # if something, then do the assignment
-                                #get cost matrix
-                                attribute = []
-                                for i in range(len(costAttribute)):
-                                    attribute.append(costAttribute[i].id)                                           
-                                spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
-                                                            Mode_List_for_attributes, costAttribute, attribute, self.CostMatrixId)
-                                report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
-                                y = 1
-                            x = 0
-                            for i in range(len(self.TollsMatrixId)): #check to see if any toll matrices defined
-                                if self.TollsMatrixId[i] != None:
-                                    x = 1
-                            if x == 1: # if something, then do the assignment
-                                # get tolls matrix
-                                spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
-                                                            Mode_List_for_attributes, costAttribute, self.LinkTollAttributeId, self.TollsMatrixId)
-                                report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
-                                y = 1
-                            x = 0
-                            for i in range(len(self.aggAttributesClass)): # check to see if any aggregation attributes defined
-                                for j in range(len(self.aggAttributesClass[i])):
-                                    if self.aggAttributesClass[i][j] != None:
+                            if self.SinglePassFlag:
+                                report = self._runSinglePassAssignment(trafficAssignmentTool, networkCalculationTool, peakHourMatrix, appliedTollFactor,
+                                                                       Mode_List_for_attributes, costAttribute, timeAttribute)
+                            else:
+                                y = 0 # init assignment flag. if assignment done, then trip flag
+                                x = 0 # init flag. if list has something defined, then trip flag
+                                for i in range(len(self.CostMatrixId)): #check to see if any cost matrices defined
+                                    if self.CostMatrixId[i] != None:
                                         x = 1
-                            if x == 1: # if something is defined, then do the assignment
-                                # get the max number of aggregation attributes for all the classes
-                                max = 0
-                                for i in range(len(self.aggAttributesClass)): 
-                                    if (len(self.aggAttributesClass[i])) > max:
-                                        max = len(self.aggAttributesClass[i])
-                                attributes = []
-                                matrices = []
-                                for i in range(max):
-                                    attributes.append([])
-                                    matrices.append([])
-                                    for j in range(len(self.aggAttributesClass)):
-                                        if (len(self.aggAttributesClass[j]) > i):
-                                            attributes[i].append(self.aggAttributesClass[j][i])
-                                            matrices[i].append(self.aggAttributesClassMatrix[j][i])
-                                        else:
-                                            attributes[i].append(None)
-                                            matrices[i].append(None)
-                                for i in range(len(attributes)):
-                                    specAttribute = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
-                                                                 Mode_List_for_attributes, costAttribute, attributes[i], matrices[i])
-                                    report = self._tracker.runTool(trafficAssignmentTool, specAttribute, scenario=self.Scenario)
+                                if x == 1: # if something, then do the assignment
+                                    #get cost matrix
+                                    attribute = []
+                                    for i in range(len(costAttribute)):
+                                        attribute.append(costAttribute[i].id)                                           
+                                    spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
+                                                                Mode_List_for_attributes, costAttribute, attribute, self.CostMatrixId)
+                                    report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
                                     y = 1
-                            x = 0
-                            for i in range(len(self.TimesMatrixId)): #check to see if any time matrices defined
-                                if self.TimesMatrixId[i] != None:
-                                    x = 1
-                            if x == 1: # if something, then do the assignment
-                                if y == 0:
-                                    # need to do blank assignment in order to get auto times saved in timeau
+                                x = 0
+                                for i in range(len(self.TollsMatrixId)): #check to see if any toll matrices defined
+                                    if self.TollsMatrixId[i] != None:
+                                        x = 1
+                                if x == 1: # if something, then do the assignment
+                                    # get tolls matrix
+                                    spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
+                                                                Mode_List_for_attributes, costAttribute, self.LinkTollAttributeId, self.TollsMatrixId)
+                                    report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
+                                    y = 1
+                                x = 0
+                                for i in range(len(self.aggAttributesClass)): # check to see if any aggregation attributes defined
+                                    for j in range(len(self.aggAttributesClass[i])):
+                                        if self.aggAttributesClass[i][j] != None:
+                                            x = 1
+                                if x == 1: # if something is defined, then do the assignment
+                                    # get the max number of aggregation attributes for all the classes
+                                    max = 0
+                                    for i in range(len(self.aggAttributesClass)): 
+                                        if (len(self.aggAttributesClass[i])) > max:
+                                            max = len(self.aggAttributesClass[i])
+                                    attributes = []
+                                    matrices = []
+                                    for i in range(max):
+                                        attributes.append([])
+                                        matrices.append([])
+                                        for j in range(len(self.aggAttributesClass)):
+                                            if (len(self.aggAttributesClass[j]) > i):
+                                                attributes[i].append(self.aggAttributesClass[j][i])
+                                                matrices[i].append(self.aggAttributesClassMatrix[j][i])
+                                            else:
+                                                attributes[i].append(None)
+                                                matrices[i].append(None)
+                                    for i in range(len(attributes)):
+                                        specAttribute = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
+                                                                     Mode_List_for_attributes, costAttribute, attributes[i], matrices[i])
+                                        report = self._tracker.runTool(trafficAssignmentTool, specAttribute, scenario=self.Scenario)
+                                        y = 1
+                                x = 0
+                                for i in range(len(self.TimesMatrixId)): #check to see if any time matrices defined
+                                    if self.TimesMatrixId[i] != None:
+                                        x = 1
+                                if x == 1: # if something, then do the assignment
+                                    if y == 0:
+                                        # need to do blank assignment in order to get auto times saved in timeau
+                                        attribute = []
+                                        matrices = []
+                                        for i in range(len(self.Mode_List_Split)):
+                                            attribute.append(None)
+                                            matrices.append(None)
+                                        spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
+                                                                Mode_List_for_attributes, costAttribute, attribute, matrices)
+                                        report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
+                                    # get true times matrix
+                                    with _m.logbook_trace("Calculating link time"): #Do for each class 
+                                        for i in range(len(self.Mode_List_Split)):
+                                            networkCalculationTool(self._getSaveAutoTimesSpec(timeAttribute[i].id), scenario=self.Scenario)
+                                            self._tracker.completeSubtask()
+                                    attribute = []
+                                    for i in range(len(timeAttribute)):
+                                        attribute.append(timeAttribute[i].id)  
+                                    spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
+                                                                Mode_List_for_attributes, costAttribute, attribute, self.TimesMatrixId)
+                                    report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
+                                    y = 1
+                                if y == 0: # if no assignment has been done, do an assignment
                                     attribute = []
                                     matrices = []
                                     for i in range(len(self.Mode_List_Split)):
                                         attribute.append(None)
                                         matrices.append(None)
                                     spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
-                                                            Mode_List_for_attributes, costAttribute, attribute, matrices)
+                                                                Mode_List_for_attributes, costAttribute, attribute, matrices)
                                     report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
-                                # get true times matrix
-                                with _m.logbook_trace("Calculating link time"): #Do for each class 
-                                    for i in range(len(self.Mode_List_Split)):
-                                        networkCalculationTool(self._getSaveAutoTimesSpec(timeAttribute[i].id), scenario=self.Scenario)
-                                        self._tracker.completeSubtask()
-                                attribute = []
-                                for i in range(len(timeAttribute)):
-                                    attribute.append(timeAttribute[i].id)  
-                                spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
-                                                            Mode_List_for_attributes, costAttribute, attribute, self.TimesMatrixId)
-                                report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
-                                y = 1
-                            if y == 0: # if no assignment has been done, do an assignment
-                                attribute = []
-                                matrices = []
-                                for i in range(len(self.Mode_List_Split)):
-                                    attribute.append(None)
-                                    matrices.append(None)
-                                spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
-                                                            Mode_List_for_attributes, costAttribute, attribute, matrices)
-                                report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
                             stoppingCriterion = report['stopping_criterion']
                             iterations = report['iterations']
                             if len(iterations) > 0: finalIteration = iterations[-1]
@@ -377,6 +393,81 @@ class MultiClassRoadAssignment(_m.Tool()):
                             print "Primary assignment complete at %s iterations." %number
                             print "Stopping criterion was %s with a value of %s." %(stoppingCriterion, val)
         
+    def _runSinglePassAssignment(self, trafficAssignmentTool, networkCalculationTool, peakHourMatrix, appliedTollFactor, \
+                                 linkVolumeAttributes, costAttribute, timeAttribute):
+        '''
+        Runs the SOLA assignment once (skimming costs during the assignment), then gets every other 
+        requested skim from the stored paths of that single solution.
+        '''
+        pathAnalysisTool = _MODELLER.tool('inro.emme.traffic_assignment.path_based_traffic_analysis')
+        
+        def skimAttributes(attributes, matrices):
+            #Only analyze the classes for which a matrix is requested
+            return [attribute if matrix != None else None for attribute, matrix in zip(attributes, matrices)]
+        
+        #Equivalent skims, in the order in which they would have been run by separate assignments
+        analyses = []
+        if any(matrix != None for matrix in self.TollsMatrixId):
+            analyses.append((skimAttributes(self.LinkTollAttributeId, self.TollsMatrixId), self.TollsMatrixId))
+        for attributes, matrices in self._getAggregationLayers():
+            if any(attribute != None for attribute in attributes):
+                analyses.append((attributes, matrices))
+        timesRequested = any(matrix != None for matrix in self.TimesMatrixId)
+        
+        #Separate assignments would need one run per skim, plus a blank run if nothing precedes the times
+        legacyRuns = len(analyses) + int(timesRequested)
+        if any(matrix != None for matrix in self.CostMatrixId) or len(analyses) == 0: legacyRuns += 1
+        
+        with _m.logbook_trace("Single-pass equilibrium assignment"):
+            start = _time()
+            costAttributeIds = skimAttributes([attribute.id for attribute in costAttribute], self.CostMatrixId)
+            spec = self._getPrimarySOLASpec(peakHourMatrix, appliedTollFactor, self.Mode_List_Split,\
+                                            linkVolumeAttributes, costAttribute, costAttributeIds, self.CostMatrixId)
+            report = self._tracker.runTool(trafficAssignmentTool, spec, scenario=self.Scenario)
+            assignmentTime = _time() - start
+        
+        start = _time()
+        if timesRequested:
+            with _m.logbook_trace("Calculating link time"): #Do for each class 
+                for i in range(len(self.Mode_List_Split)):
+                    networkCalculationTool(self._getSaveAutoTimesSpec(timeAttribute[i].id), scenario=self.Scenario)
+                    self._tracker.completeSubtask()
+            analyses.append((skimAttributes([attribute.id for attribute in timeAttribute], self.TimesMatrixId), self.TimesMatrixId))
+        
+        with _m.logbook_trace("Path-based skims"):
+            for attributes, matrices in analyses:
+                pathAnalysisTool(self._getPathBasedAnalysisSpec(attributes, matrices), scenario=self.Scenario)
+        analysisTime = _time() - start
+        
+        savedRuns = legacyRuns - 1
+        msg = "Single-pass skimming ran 1 assignment instead of %s (%s saved). The assignment took %.1f s, " \
+              "so about %.1f s of assignment time was saved; the %s path-based skims took %.1f s." \
+              %(legacyRuns, savedRuns, assignmentTime, savedRuns * assignmentTime, len(analyses), analysisTime)
+        print msg
+        _m.logbook_write(msg)
+        
+        return report
+    
+    def _getAggregationLayers(self):
+        '''
+        Returns a list of (attributes, matrices) tuples, one for each 'layer' of aggregation 
+        attributes (i.e., the i-th aggregation attribute of every class).
+        '''
+        layers = []
+        nLayers = max([len(classAttributes) for classAttributes in self.aggAttributesClass] + [0])
+        for i in range(nLayers):
+            attributes = []
+            matrices = []
+            for j in range(len(self.aggAttributesClass)):
+                if len(self.aggAttributesClass[j]) > i:
+                    attributes.append(self.aggAttributesClass[j][i])
+                    matrices.append(self.aggAttributesClassMatrix[j][i])
+                else:
+                    attributes.append(None)
+                    matrices.append(None)
+            layers.append((attributes, matrices))
+        return layers
+    
     ##########################################################################################################
             
     #----CONTEXT MANAGERS---------------------------------------------------------------------------------
@@ -531,6 +622,7 @@ class MultiClassRoadAssignment(_m.Tool()):
                 "Peak Hour Factor" : str(self.PeakHourFactor),
                 "Link Cost" : str(self.LinkCost),
                 "Iterations" : str(self.Iterations),
+                "Single Pass Skims" : str(self.SinglePassFlag),
                 "self": self.__MODELLER_NAMESPACE__}
             
         return atts       
@@ -641,28 +733,7 @@ class MultiClassRoadAssignment(_m.Tool()):
                 }
             }
         #defines the aggregator     
-        SOLA_path_analysis = []
-        for i in range(len(Mode_List)):
-            if attribute[i] == None:
-                SOLA_path_analysis.append(None)
-            else:
-                path = {
-                        "link_component": attribute[i],
-                        "turn_component": None,
-                        "operator": "+",
-                        "selection_threshold": {
-                            "lower": None,
-                            "upper": None
-                        },
-                        "path_to_od_composition": {
-                            "considered_paths": "ALL",
-                            "multiply_path_proportions_by": {
-                                "analyzed_demand": False,
-                                "path_value": True
-                            }
-                        }
-                    }
-                SOLA_path_analysis.append(path)
+        SOLA_path_analysis = [self._getPathAnalysisSpec(attribute[i]) for i in range(len(Mode_List))]
         #Creates a list entry for each mode specified in the Mode List and its associated Demand Matrix
         SOLA_Class_Generator = [{
                     "mode": Mode_List[i],
@@ -693,6 +764,45 @@ class MultiClassRoadAssignment(_m.Tool()):
         SOLA_spec['classes'] = SOLA_Class_Generator
 
         return SOLA_spec
+    
+    def _getPathAnalysisSpec(self, attribute):
+        if attribute == None:
+            return None
+        return {
+                "link_component": attribute,
+                "turn_component": None,
+                "operator": "+",
+                "selection_threshold": {
+                    "lower": None,
+                    "upper": None
+                },
+                "path_to_od_composition": {
+                    "considered_paths": "ALL",
+                    "multiply_path_proportions_by": {
+                        "analyzed_demand": False,
+                        "path_value": True
+                    }
+                }
+            }
+    
+    def _getPathBasedAnalysisSpec(self, attribute, matrixId):
+        #Path analyses on the paths stored by the last SOLA assignment (Emme 4.3+)
+        return {
+                "type": "PATH_BASED_TRAFFIC_ANALYSIS",
+                "classes": [{
+                    "path_analysis": self._getPathAnalysisSpec(attribute[i]),
+                    "cutoff_analysis": None,
+                    "traversal_analysis": None,
+                    "analysis": {
+                        "analyzed_demand": None,
+                        "results": {
+                            "od_values": matrixId[i],
+                            "selected_link_volumes": None,
+                            "selected_turn_volumes": None
+                        }
+                    }
+                } for i in range(len(self.Mode_List_Split))]
+            }
 
     def _getSaveAutoTimesSpec(self, timeAttribute):
         return {
@@ -35,6 +35,9 @@ Returb Boardings
     0.0.1 Created on 2014-02-05 by pkucirek
     
     0.1.0 Upgraded to work with get_attribute_values (partial read)
+    
+    0.1.1 Uses the columnar loader (_util.fastLoadSummedSegmentColumns) and aggregates
+        line groups with NumPy.
 '''
 
 import inro.modeller as _m
@@ -42,6 +45,7 @@ import traceback as _traceback
 from contextlib import contextmanager
 from contextlib import nested
 from json import loads
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
@@ -50,7 +54,7 @@ _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 
 class ReturnBoardings(_m.Tool()):
     
-    version = '0.1.0'
+    version = '0.1.1'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -104,25 +108,23 @@ class ReturnBoardings(_m.Tool()):
         
         lineAggregation = self._LoadLineAggregationFile()
         
-        lineBoardings = self._GetLineResults(scenario)
-        netSet = set([key for key in lineBoardings.iterkeys()])
+        lineIds, lineBoardings = self._GetLineResults(scenario)
+        netSet = set(lineIds)
         if self.xtmf_CheckAggregationFlag:
             self._CheckAggregationFile(netSet, lineAggregation)
         self.TRACKER.completeTask()
         
+        #Number each line group, and skip unmapped lines
+        groupNumbers = {}
+        lineGroups = _np.array([groupNumbers.setdefault(lineAggregation[lineId], len(groupNumbers))
+                                if lineId in lineAggregation else -1 for lineId in lineIds], dtype= _np.int64)
+        mapped = lineGroups >= 0
+        groupBoardings = _np.bincount(lineGroups[mapped], weights= lineBoardings[mapped],
+                                      minlength= len(groupNumbers))
+        
         results = {}
-        self.TRACKER.startProcess(len(lineBoardings))
-        for lineId, lineCount in lineBoardings.iteritems():
-            if not lineId in lineAggregation:
-                self.TRACKER.completeSubtask()
-                continue #Skip unmapped lines
-            lineGroupId = lineAggregation[lineId]
-            
-            if lineGroupId in results:
-                results[lineGroupId] += lineCount
-            else:
-                results[lineGroupId] = lineCount
-            self.TRACKER.completeSubtask()
+        for lineGroupId, groupNumber in groupNumbers.iteritems():
+            results[lineGroupId] = float(groupBoardings[groupNumber])
             
         print "Extracted results from Emme"
         return str(results)            
@@ -140,13 +142,10 @@ class ReturnBoardings(_m.Tool()):
     
     def _GetLineResults(self, scenario):
         
-        results = _util.fastLoadSummedSegmentAttributes(scenario, ['transit_boardings'])
-        retVal = {}
-        for lineId, attributes in results.iteritems():
-            id = str(lineId)
-            retVal[id] = attributes['transit_boardings']
+        results = _util.fastLoadSummedSegmentColumns(scenario, ['transit_boardings'])
+        lineIds = [str(lineId) for lineId in results.ids]
         
-        return retVal
+        return lineIds, results['transit_boardings']
         
     def _CheckAggregationFile(self, netSet, lineAggregation):
         aggSet = set([key for key in lineAggregation.iterkeys()])
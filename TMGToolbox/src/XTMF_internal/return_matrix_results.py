@@ -34,12 +34,20 @@
     0.0.1 Created on 2014-03-13 by pkucirek
      
     0.0.2 Upgraded to use Strategy-based analysis to extract walk-all-way portion of tripsl.
+    
+    0.0.3 Added the option to return the results as binary matrix (.mtx) files instead of text.
+    
+    0.0.4 Results are assembled with NumPy and ordered by origin and destination. Added the
+        option to return the results as a CSV file.
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 from contextlib import contextmanager
 from contextlib import nested
+from os.path import splitext
+from cStringIO import StringIO
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
@@ -48,9 +56,10 @@ _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 
 class SupplementalTransitMatrices(_m.Tool()):
     
-    version = '0.0.2'
+    version = '0.0.4'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
+    WRITE_CHUNK_SIZE = 65536 # Number of lines of results formatted at once
     
     # Tool Input Parameters
     #    Only those parameters neccessary for Modeller and/or XTMF to dock with
@@ -60,6 +69,7 @@ class SupplementalTransitMatrices(_m.Tool()):
     xtmf_ScenarioNumber = _m.Attribute(int) # parameter used by XTMF only
     xtmf_PartitionId = _m.Attribute(str)
     xtmf_DemandMatrixId = _m.Attribute(str)
+    ResultFile = _m.Attribute(str)
     
     def __init__(self):
         #---Init internal variables
@@ -78,7 +88,16 @@ class SupplementalTransitMatrices(_m.Tool()):
     
     ##########################################################################################################
     
-    def __call__(self, xtmf_ScenarioNumber, xtmf_PartitionId, xtmf_DemandMatrixId):
+    def __call__(self, xtmf_ScenarioNumber, xtmf_PartitionId, xtmf_DemandMatrixId, ResultFile=""):
+        '''
+        Returns the partition-aggregated average boardings and walk-all-way demand as a
+        string of 'origin destination boardings walk' lines, ordered by origin and destination.
+        If a ResultFile ending in '.csv' is given, the lines are instead written to it as
+        'origin,destination,boardings,walk_all_way' records and its name is returned. Any other
+        ResultFile saves the two matrices in the binary .mtx format, to '<ResultFile>_boardings.mtx'
+        and '<ResultFile>_walk_all_way.mtx', and the two file names are returned (one per line).
+        '''
+        self.ResultFile = ResultFile
         
         database = _MODELLER.emmebank
         
@@ -165,30 +184,56 @@ class SupplementalTransitMatrices(_m.Tool()):
             walkOnlyResults = partitionAggTool(walkAllWayMatrix, partition, partition, scenario=scenario)
             avgBoardingResults = partitionAverageTool(scenario.id, partition.id, avgBoardingsMatrix.id, demandMatrix.id)
             
-            results = {}
-            for i, row in enumerate(avgBoardingResults.raw_data):
-                origin = avgBoardingResults.indices[0][i]
-                for j, cell in enumerate(row):
-                    destination = avgBoardingResults.indices[1][j]
-                    key = (origin, destination)
-                    results[key] = [cell]
-            for i, row in enumerate(walkOnlyResults.raw_data):
-                origin = walkOnlyResults.indices[0][i]
-                for j, cell in enumerate(row):
-                    destination = walkOnlyResults.indices[1][j]
-                    key = (origin, destination)
-                    if not key in results:
-                        results[key] = [0.0, cell]
-                    else:
-                        results[key].append(cell)
-            resultList = []
-            for key, val in results.iteritems():
-                origin, destination = key
-                col1 = val[0]
-                col2 = val[1]
-                resultList.append("%s %s %s %s" %(origin, destination, col1, col2))
-            resultList.sort()
-            return "\n".join(resultList)
+            if self.ResultFile and splitext(self.ResultFile)[1].lower() != '.csv':
+                return self._SaveBinaryResults(avgBoardingResults, walkOnlyResults)
+            
+            table = self._StackResults(avgBoardingResults, walkOnlyResults)
+            if self.ResultFile:
+                return self._SaveCsvResults(table)
+            buffer = StringIO()
+            self._WriteResults(buffer, table, " ")
+            return buffer.getvalue().rstrip("\n")
+    
+    def _StackResults(self, avgBoardingResults, walkOnlyResults):
+        '''
+        Returns an (n x 4) array of origin, destination, boardings and walk-all-way
+        demand, ordered by origin and then destination. Cells missing from one
+        of the results are 0.
+        '''
+        origins = _np.union1d(avgBoardingResults.indices[0], walkOnlyResults.indices[0])
+        destinations = _np.union1d(avgBoardingResults.indices[1], walkOnlyResults.indices[1])
+        
+        table = _np.zeros((len(origins), len(destinations), 4))
+        table[:, :, 0] = origins[:, _np.newaxis]
+        table[:, :, 1] = destinations
+        for column, matrixData in [(2, avgBoardingResults), (3, walkOnlyResults)]:
+            rows = _np.searchsorted(origins, matrixData.indices[0])
+            columns = _np.searchsorted(destinations, matrixData.indices[1])
+            table[_np.ix_(rows, columns, [column])] = _np.asarray(matrixData.raw_data, dtype= float)[:, :, _np.newaxis]
+        return table.reshape(-1, 4)
+    
+    def _WriteResults(self, writer, table, separator):
+        #One format operation per chunk of lines, so only a chunk is held as Python objects at a time
+        lineFormat = separator.join(["%d", "%d", "%.12g", "%.12g"])
+        for start in xrange(0, len(table), self.WRITE_CHUNK_SIZE):
+            chunk = table[start: start + self.WRITE_CHUNK_SIZE]
+            writer.write("\n".join([lineFormat] * len(chunk)) % tuple(chunk.ravel().tolist()))
+            writer.write("\n")
+    
+    def _SaveCsvResults(self, table):
+        with open(self.ResultFile, 'w') as writer:
+            writer.write("origin,destination,boardings,walk_all_way\n")
+            self._WriteResults(writer, table, ",")
+        return self.ResultFile
+    
+    def _SaveBinaryResults(self, avgBoardingResults, walkOnlyResults):
+        base = splitext(self.ResultFile)[0]
+        filenames = []
+        for suffix, matrixData in [('_boardings.mtx', avgBoardingResults), ('_walk_all_way.mtx', walkOnlyResults)]:
+            filename = base + suffix
+            _util.saveBinaryMatrix(filename, matrixData.raw_data, matrixData.indices)
+            filenames.append(filename)
+        return "\n".join(filenames)
             
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
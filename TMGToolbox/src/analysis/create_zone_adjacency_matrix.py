@@ -33,22 +33,30 @@ Create Zone Adjaency Matrix
 '''
     0.1.0 Created 21-08-2013
     
+    0.2.0 Replaced the all-pairs intersection test with a spatially-indexed search using 
+        prepared geometries, writing directly into a NumPy array. The old procedure is kept
+        for verification, with an option to compare the two results.
+    
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 from contextlib import contextmanager
 from contextlib import nested
+import math
+import numpy as _np
+from shapely.prepared import prep as _prep
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 _geo = _MODELLER.module('tmg.common.geometry')
+_spindex = _MODELLER.module('tmg.common.spatial_index')
 
 ##########################################################################################################
 
 class CreateZoneAdjacencyMatrix(_m.Tool()):
     
-    version = '0.0.1'
+    version = '0.2.0'
     tool_run_msg = ""
     number_of_tasks = 2 # For progress reporting, enter the integer number of tasks here
     
@@ -62,6 +70,7 @@ class CreateZoneAdjacencyMatrix(_m.Tool()):
     ZoneBoundariesFile = _m.Attribute(str)
     ZoneIdFiledName = _m.Attribute(str)
     BufferSize = _m.Attribute(float)
+    CompareToBruteForceFlag = _m.Attribute(bool)
     
     def __init__(self):
         #---Init internal variables
@@ -70,6 +79,7 @@ class CreateZoneAdjacencyMatrix(_m.Tool()):
         #---Set the defaults of parameters used by Modeller
         self.Scenario = _MODELLER.scenario #Default is primary scenario
         self.BufferSize = 20.0
+        self.CompareToBruteForceFlag = False
     
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="Create Zone Adjacency Matrix v%s" %self.version,
@@ -102,6 +112,11 @@ class CreateZoneAdjacencyMatrix(_m.Tool()):
         pb.add_text_box(tool_attribute_name='BufferSize',
                         size=10, title="Buffer Size")
         
+        pb.add_checkbox(tool_attribute_name='CompareToBruteForceFlag',
+                        label="Compare to brute-force result",
+                        note="Also runs the original all-pairs procedure (very slow) and reports \
+                        any differences in the logbook.")
+        
         return pb.render()
     
     ##########################################################################################################
@@ -138,6 +153,10 @@ class CreateZoneAdjacencyMatrix(_m.Tool()):
             with _m.logbook_trace("Processing zone adjacencies"):
                 self._ProcessAdjacencies(network, adjacencyMatrix)
                 self.TRACKER.completeTask()
+            
+            if self.CompareToBruteForceFlag:
+                with _m.logbook_trace("Comparing to brute-force adjacencies"):
+                    self._CompareToBruteForce(network, adjacencyMatrix)
 
     ##########################################################################################################
     
@@ -176,11 +195,56 @@ class CreateZoneAdjacencyMatrix(_m.Tool()):
         
         _m.logbook_write("Loaded %s features from file" %loaded)
             
-    def _ProcessAdjacencies(self, network, matrix):        
-        data = matrix.get_data(self.Scenario)
-        _m.logbook_write("Loaded matrix data")
-        adjacencies = 0
+    def _ProcessAdjacencies(self, network, matrix):
+        zoneNumbers = list(self.Scenario.zone_numbers)
+        zoneIndex = dict([(number, i) for i, number in enumerate(zoneNumbers)])
         
+        #A zone is always adjacent to itself
+        data = _np.identity(len(zoneNumbers), dtype=_np.float32)
+        
+        zones = [zone for zone in network.centroids() if zone.geometry != None]
+        if zones:
+            spatialIndex = self._IndexZones(zones)
+            
+            self.TRACKER.startProcess(len(zones))
+            pairs = []
+            for p in zones:
+                prepared = _prep(p.geometry)
+                for q in spatialIndex.queryPolygon(p.geometry):
+                    if q.number <= p.number: continue #Each pair is only tested once
+                    if prepared.intersects(q.geometry):
+                        pairs.append((zoneIndex[p.number], zoneIndex[q.number]))
+                self.TRACKER.completeSubtask()
+            
+            if pairs:
+                rows, cols = _np.array(pairs).T
+                data[rows, cols] = 1
+                data[cols, rows] = 1
+        
+        adjacencies = int(data.sum())
+        _m.logbook_write("Found %s adjacencies in the network" %adjacencies)
+        matrix.set_numpy_data(data, self.Scenario.id)
+        _m.logbook_write("Saved matrix data")
+    
+    def _IndexZones(self, zones):
+        minx, miny, maxx, maxy = float('inf'), float('inf'), float('-inf'), float('-inf')
+        for zone in zones:
+            x0, y0, x1, y1 = zone.geometry.bounds
+            minx, miny = min(minx, x0), min(miny, y0)
+            maxx, maxy = max(maxx, x1), max(maxy, y1)
+        
+        #Roughly one zone per cell
+        gridSize = int(math.sqrt(len(zones))) + 1
+        spatialIndex = _spindex.GridIndex((minx, miny, maxx, maxy), gridSize, gridSize, marginSize= 1.0)
+        for zone in zones:
+            spatialIndex.insertbox(zone, *zone.geometry.bounds)
+        return spatialIndex
+    
+    def _ProcessAdjacenciesBruteForce(self, network):
+        '''
+        The original (all-pairs) procedure, kept to verify the results of _ProcessAdjacencies.
+        Returns a set of (p, q) zone number tuples.
+        '''
         def flagPQ(p, q):
             if p == q:
                 return True
@@ -188,19 +252,35 @@ class CreateZoneAdjacencyMatrix(_m.Tool()):
                 return p.geometry.intersects(q.geometry)
             return False
         
-        # This is a deliberately slow procedure. The smarter option would be to do a search grid, but
-        # ATM I don't have time to figure that out. - pkucirek
+        adjacencies = set()
         self.TRACKER.startProcess(network.element_totals['centroids'] * network.element_totals['centroids'])
         for p in network.centroids():
             for q in network.centroids():
                 if flagPQ(p, q):
-                    data.set(p.number, q.number, 1)
-                    adjacencies += 1
+                    adjacencies.add((p.number, q.number))
                 self.TRACKER.completeSubtask()
+        return adjacencies
+    
+    def _CompareToBruteForce(self, network, matrix):
+        data = matrix.get_numpy_data(self.Scenario.id)
+        zoneNumbers = list(self.Scenario.zone_numbers)
+        rows, cols = _np.nonzero(data)
+        indexed = set([(zoneNumbers[p], zoneNumbers[q]) for p, q in zip(rows.tolist(), cols.tolist())])
         
-        _m.logbook_write("Found %s adjacencies in the network" %adjacencies)
-        matrix.set_data(data, self.Scenario)
-        _m.logbook_write("Saved matrix data")
+        bruteForce = self._ProcessAdjacenciesBruteForce(network)
+        
+        missing = sorted(bruteForce - indexed)
+        extra = sorted(indexed - bruteForce)
+        if not missing and not extra:
+            _m.logbook_write("Indexed adjacencies are identical to the brute-force result (%s adjacencies)" %len(bruteForce))
+            return
+        
+        _m.logbook_write("Indexed adjacencies differ from the brute-force result: %s missing, %s extra" %(len(missing), len(extra)))
+        for p, q in missing[:100]:
+            _m.logbook_write("Missing adjacency %s-%s" %(p, q))
+        for p, q in extra[:100]:
+            _m.logbook_write("Extra adjacency %s-%s" %(p, q))
+        raise Exception("Indexed zone adjacencies differ from the brute-force result. See the logbook for details.")
     
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
@@ -40,15 +40,21 @@ Export Matrix Summary
     1.0.0 Added description/better documentation for release. Could not get logbook
         reporting to work properly, so this feature will be added in a later release.
     
+    1.1.0 Filters are evaluated once into boolean zone masks, and statistics are computed
+        directly on the matrix's NumPy data. Added weighted median and (weighted) percentiles,
+        and a batch mode which summarizes many matrices over many zone groups in one call.
+    
+    1.1.1 Zones are taken from the matrix data's own indices, rather than from the first
+        scenario in the emmebank, so that they always line up with the values.
+    
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
 from contextlib import contextmanager
 from contextlib import nested
-from numpy import average, histogram, array, min, max, std, median
+import numpy as _np
 from math import sqrt
-from inro.emme.matrix import submatrix as get_submatrix
 from datetime import datetime as dt
 from os import path
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
@@ -59,7 +65,7 @@ _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 
 class MatrixSummary(_m.Tool()):
     
-    version = '1.0.0'
+    version = '1.1.1'
     tool_run_msg = ""
     number_of_tasks = 8 # For progress reporting, enter the integer number of tasks here
     
@@ -80,6 +86,7 @@ class MatrixSummary(_m.Tool()):
     HistogramMin = _m.Attribute(float)
     HistogramMax = _m.Attribute(float)
     HistogramStepSize = _m.Attribute(float)
+    PercentileString = _m.Attribute(str)
     
     xtmf_ScenarioNumber = _m.Attribute(int) # parameter used by XTMF only
     xtmf_ValueMatrixNumber = _m.Attribute(int)
@@ -95,6 +102,7 @@ class MatrixSummary(_m.Tool()):
         self.HistogramMin = 0.0
         self.HistogramMax = 200.0
         self.HistogramStepSize = 10.0
+        self.PercentileString = "5,25,75,95"
         
         self.OriginFilterExpression = "return p < 9000"
         self.DestinationFilterExpression = "return q < 9000"
@@ -156,6 +164,11 @@ class MatrixSummary(_m.Tool()):
                         note="Enter a Python expression.")
         '''
         
+        pb.add_text_box(tool_attribute_name='PercentileString',
+                        size=100, multi_line=False,
+                        title="Percentiles",
+                        note="Comma-separated list of percentiles (0 to 100) to report.")
+        
         pb.add_header("HISTOGRAM")
         
         with pb.add_table(visible_border=False) as t:
@@ -193,12 +206,26 @@ class MatrixSummary(_m.Tool()):
     
     def __call__(self, xtmf_ValueMatrixNumber, xtmf_WeightingMatrixNumber, xtmf_ScenarioNumber,
                  ReportFile, HistogramMin, HistogramMax, HistogramStepSize, xtmf_OriginRangeSetString,
-                 xtmf_DestinationRangeSetString):
-        
+                 xtmf_DestinationRangeSetString, PercentileString="5,25,75,95", xtmf_BatchMatrixNumbers="",
+                 xtmf_GroupRangeSetStrings=""):
+        '''
+        Batch mode: if xtmf_BatchMatrixNumbers is a comma-separated list of matrix numbers, each
+        matrix is summarized for every origin group in xtmf_GroupRangeSetStrings (formatted as
+        'label:range set;label:range set', e.g. 'Toronto:1-1000;York:1000-2000'), and a table of
+        statistics is written to the ReportFile instead of the single-matrix report.
+        '''
         
-        self.ValueMatrix = _MODELLER.emmebank.matrix('mf%s' %xtmf_ValueMatrixNumber)
-        if self.ValueMatrix == None:
-            raise Exception("Full matrix mf%s was not found!" %xtmf_ValueMatrixNumber)
+        if xtmf_BatchMatrixNumbers:
+            batchMatrixNumbers = [n.strip() for n in str(xtmf_BatchMatrixNumbers).split(',') if n.strip()]
+        else:
+            batchMatrixNumbers = [xtmf_ValueMatrixNumber]
+        self.BatchMatrices = []
+        for number in batchMatrixNumbers:
+            matrix = _MODELLER.emmebank.matrix('mf%s' %number)
+            if matrix == None:
+                raise Exception("Full matrix mf%s was not found!" %number)
+            self.BatchMatrices.append(matrix)
+        self.ValueMatrix = self.BatchMatrices[0]
         
         if xtmf_WeightingMatrixNumber == 0:
             self.WeightingMatrix = None
@@ -208,7 +235,7 @@ class MatrixSummary(_m.Tool()):
                 raise Exception("Full matrix mf%s was not found!" %xtmf_WeightingMatrixNumber)
         
         if xtmf_ScenarioNumber == 0:
-            self.Scenario == None
+            self.Scenario = None
         else:
             self.Scenario = _m.Modeller().emmebank.scenario(xtmf_ScenarioNumber)
             if (self.Scenario == None):
@@ -221,9 +248,14 @@ class MatrixSummary(_m.Tool()):
         self.HistogramMin = HistogramMin
         self.HistogramMax = HistogramMax
         self.HistogramStepSize = HistogramStepSize
+        self.PercentileString = PercentileString
         
         try:
-            self._Execute(originFilter, destinationFilter)
+            if xtmf_BatchMatrixNumbers:
+                groups = self._ParseGroupString(xtmf_GroupRangeSetStrings)
+                self._ExecuteBatch(originFilter, destinationFilter, groups)
+            else:
+                self._Execute(originFilter, destinationFilter)
         except Exception, e:
             msg = str(e) + "\n" + _traceback.format_exc(e)
             raise Exception(msg)
@@ -235,101 +267,105 @@ class MatrixSummary(_m.Tool()):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
             
-            if self.Scenario:
-                valueData = self.ValueMatrix.get_data(self.Scenario.number)
-            else:
-                valueData = self.ValueMatrix.get_data()
+            (origins, destinations), valueData = self._GetMatrixData(self.ValueMatrix)
             self.TRACKER.completeTask() #1
             
-            validIndices = [[p for p in valueData.indices[0] if originFilter(p)],
-                            [q for q in valueData.indices[1] if destinationFilter(q)]]
+            originSelector = self._GetIndexSelector(origins, originFilter)
+            destinationSelector = self._GetIndexSelector(destinations, destinationFilter)
             self.TRACKER.completeTask() #2
             
-            valueSubmatrix = get_submatrix(valueData, validIndices)
-            valueArray = array(valueSubmatrix.raw_data).flatten()
+            valueArray = self._GetSubmatrix(valueData, originSelector, destinationSelector).ravel()
+            percentiles = self._ParsePercentiles(self.PercentileString)
             self.TRACKER.completeTask() #3
             
-            self.TRACKER.startProcess(6)
+            self.TRACKER.startProcess(2)
             #Start getting the relevant data from the matrix
-            unweightedAverage = average(valueArray)
-            self.TRACKER.completeSubtask()
-            minVal = min(valueArray)
-            self.TRACKER.completeSubtask()
-            maxVal = max(valueArray)
-            self.TRACKER.completeSubtask()
-            unweightedStdDev = std(valueArray)
-            self.TRACKER.completeSubtask()
-            unweightedMedian = median(valueArray)
+            unweighted = _SummarizeValues(valueArray, percentiles)
             self.TRACKER.completeSubtask()
             
-            #Create the array of bins
-            bins = [self.HistogramMin]
-            if minVal < self.HistogramMin: bins.insert(0, minVal)
-            c = self.HistogramMin + self.HistogramStepSize
-            while c < self.HistogramMax:
-                bins.append(c)
-                c += self.HistogramStepSize
-            bins.append(self.HistogramMax)
-            if maxVal > self.HistogramMax: bins.append(maxVal)
-            
-            unweightedHistogram, ranges = histogram(valueArray, bins)
+            bins = self._GetBins(unweighted['min'], unweighted['max'])
+            unweightedHistogram, ranges = _np.histogram(valueArray, bins)
             self.TRACKER.completeSubtask()
             self.TRACKER.completeTask() #4
             
             #Get weighted values if neccessary
+            weighted = {}
+            weightedHistogram = None
             if self.WeightingMatrix != None:
-                if self.Scenario:
-                    weightData = self.WeightingMatrix.get_data(self.Scenario.number)
-                else:
-                    weightData = self.WeightingMatrix.get_data()
+                zones, weightData = self._GetMatrixData(self.WeightingMatrix)
                 self.TRACKER.completeTask() #5
                 
-                weightSubmatrix = get_submatrix(weightData, validIndices)
-                weightArray = array(weightSubmatrix.raw_data).flatten()
+                weightArray = self._GetSubmatrix(weightData, originSelector, destinationSelector).ravel()
                 self.TRACKER.completeTask() #6
                 
-                self.TRACKER.startProcess(3)
-                weightedAverage = average(valueArray, weights= weightArray)
+                self.TRACKER.startProcess(2)
+                weighted = _SummarizeValues(valueArray, percentiles, weightArray)
                 self.TRACKER.completeSubtask()
-                weightedStdDev = self._WtdStdDev(valueArray, weightArray)
-                self.TRACKER.completeSubtask()
-                weightedHistogram, ranges = histogram(valueArray, weights= weightArray, bins = bins)
+                weightedHistogram, ranges = _np.histogram(valueArray, weights= weightArray, bins = bins)
                 self.TRACKER.completeSubtask()
                 self.TRACKER.completeTask() #7
-                
-                
-                if self.ReportFile:
-                    self._WriteReportToFile(unweightedAverage,
-                                            minVal, maxVal, unweightedStdDev, 
-                                            unweightedMedian, unweightedHistogram, 
-                                            bins, weightedAverage, weightedStdDev, 
-                                            weightedHistogram)
-                    print "Report written to %s" %self.ReportFile
-                
-                self._WriteReportToLogbook(unweightedAverage, minVal, maxVal, unweightedStdDev, 
-                                           unweightedMedian, unweightedHistogram, bins, 
-                                           weightedAverage, weightedStdDev, weightedHistogram)
-                print "Report written to logbook."
-                
-            elif self.ReportFile:
-                for i in range(3): self.TRACKER.completeTask()
-                self._WriteReportToFile(unweightedAverage, minVal, 
-                                        maxVal, unweightedStdDev, unweightedMedian, 
-                                        unweightedHistogram, bins)
-                print "Report written to %s" %self.ReportFile
-                
-                self._WriteReportToLogbook(unweightedAverage, minVal, maxVal, unweightedStdDev, 
-                                           unweightedMedian, unweightedHistogram, bins)
-                print "Report written to logbook."
-                
             else:
-                self._WriteReportToLogbook(unweightedAverage, minVal, maxVal, unweightedStdDev, 
-                                           unweightedMedian, unweightedHistogram, bins)
-                print "Report written to logbook."
+                for i in range(3): self.TRACKER.completeTask()
             
+            if self.ReportFile:
+                self._WriteReportToFile(unweighted, unweightedHistogram, bins, weighted, weightedHistogram)
+                print "Report written to %s" %self.ReportFile
             
+            self._WriteReportToLogbook(unweighted, unweightedHistogram, bins, weighted, weightedHistogram)
+            print "Report written to logbook."
             
             self.TRACKER.completeTask() #8
+    
+    def _ExecuteBatch(self, originFilter, destinationFilter, groups):
+        '''
+        Summarizes every batch matrix over every origin group, loading each matrix (and the 
+        weighting matrix) only once. Writes one CSV row per matrix and group to the ReportFile.
+        '''
+        with _m.logbook_trace(name="{classname} v{version} (batch)".format(classname=(self.__class__.__name__), version=self.version),
+                                     attributes=self._GetAtts()):
+            
+            self.TRACKER.reset(len(self.BatchMatrices) + 1)
+            
+            #The zones are taken from the first matrix loaded (the weighting matrix, if any)
+            if self.WeightingMatrix != None: firstMatrix = self.WeightingMatrix
+            else: firstMatrix = self.BatchMatrices[0]
+            (origins, destinations), firstData = self._GetMatrixData(firstMatrix)
+            
+            percentiles = self._ParsePercentiles(self.PercentileString)
+            destinationSelector = self._GetIndexSelector(destinations, destinationFilter)
+            originMask = self._GetIndexMask(origins, originFilter)
+            groupSelectors = [("All", self._MaskToSelector(originMask))]
+            for label, groupFilter in groups:
+                groupMask = self._GetIndexMask(origins, groupFilter) & originMask
+                groupSelectors.append((label, self._MaskToSelector(groupMask)))
+            
+            weightArrays = {}
+            if self.WeightingMatrix != None:
+                for label, originSelector in groupSelectors:
+                    weightArrays[label] = self._GetSubmatrix(firstData, originSelector, destinationSelector).ravel()
+                firstData = None
+            self.TRACKER.completeTask()
+            
+            rows = []
+            for matrix in self.BatchMatrices:
+                if matrix is firstMatrix and firstData is not None:
+                    valueData, firstData = firstData, None
+                else:
+                    zones, valueData = self._GetMatrixData(matrix)
+                self.TRACKER.startProcess(len(groupSelectors))
+                for label, originSelector in groupSelectors:
+                    valueArray = self._GetSubmatrix(valueData, originSelector, destinationSelector).ravel()
+                    unweighted = _SummarizeValues(valueArray, percentiles)
+                    weighted = {}
+                    if label in weightArrays:
+                        weighted = _SummarizeValues(valueArray, percentiles, weightArrays[label])
+                    rows.append((matrix.id, label, unweighted, weighted))
+                    self.TRACKER.completeSubtask()
+                self.TRACKER.completeTask()
+            
+            self._WriteBatchReport(rows, percentiles)
+            _m.logbook_write("Summarized %s matrices over %s groups" %(len(self.BatchMatrices), len(groupSelectors)))
+            print "Report written to %s" %self.ReportFile
 
     ##########################################################################################################
     
@@ -354,13 +390,34 @@ class MatrixSummary(_m.Tool()):
             rs = _util.IntRange(start, end)
             ranges.append(rs)
         
+        #Works on single zone numbers as well as on arrays of zone numbers
         def filter(v):
+            result = False
             for r in ranges:
-                if v in r: return True
-            return False
+                result = result | ((v >= r.min) & (v < r.max))
+            return result
         
         return filter
     
+    def _ParseGroupString(self, groupString):
+        groups = []
+        for component in groupString.split(';'):
+            if not component.strip(): continue
+            parts = component.split(':')
+            if len(parts) != 2:
+                raise SyntaxError("Error parsing group string: separate the label and range set with a colon " +
+                                  "label:range set. [%s]" %component)
+            groups.append((parts[0].strip(), self._ParseRangeSetString(parts[1].strip())))
+        return groups
+    
+    def _ParsePercentiles(self, percentileString):
+        if not percentileString: return []
+        percentiles = [float(p) for p in percentileString.split(',') if p.strip()]
+        for p in percentiles:
+            if p < 0 or p > 100:
+                raise ValueError("Percentile %s is not between 0 and 100" %p)
+        return percentiles
+    
     def _GetOriginFilterFunction(self):
         exec('''def filter(p):
     %s''' %self.OriginFilterExpression)
@@ -373,22 +430,58 @@ class MatrixSummary(_m.Tool()):
         
         return filter
     
-    def _WtdStdDev(self, values, weights):
-        avg = average(values, weights=weights)
-        variance = average((values-avg)**2, weights=weights)
-        return sqrt(variance)
-    
-    def _WriteReportToLogbook(self, 
-                            unweightedAverage,
-                            minVal,
-                            maxVal,
-                            unweightedStdDev,
-                            unweightedMedian,
-                            unweightedHistogram,
-                            bins,
-                            weightedAverage=None,
-                            weightedStdDev=None,
-                            weightedHistogram=None):
+    def _GetMatrixData(self, matrix):
+        '''
+        Returns the (origin zones, destination zones) of the matrix, from its own indices,
+        and its data as a NumPy array.
+        '''
+        if self.Scenario:
+            data = matrix.get_data(self.Scenario.number)
+        else:
+            data = matrix.get_data()
+        origins, destinations = data.indices
+        return (_np.array(origins), _np.array(destinations)), data.to_numpy()
+    
+    def _GetIndexMask(self, zones, filter):
+        '''
+        Evaluates a filter function into a boolean mask over the zones. The function is
+        called once on the whole array of zones if it supports it (e.g. 'return p < 9000'), 
+        otherwise once per zone.
+        '''
+        try:
+            mask = _np.asarray(filter(zones))
+            if mask.dtype == bool and mask.shape == zones.shape: return mask
+        except Exception:
+            pass
+        return _np.array([bool(filter(zone)) for zone in zones.tolist()], dtype= bool)
+    
+    def _MaskToSelector(self, mask):
+        #Contiguous selections are returned as slices, so that the submatrix is a view of the data
+        indices = _np.flatnonzero(mask)
+        if len(indices) > 0 and indices[-1] - indices[0] + 1 == len(indices):
+            return slice(indices[0], indices[-1] + 1)
+        return indices
+    
+    def _GetIndexSelector(self, zones, filter):
+        return self._MaskToSelector(self._GetIndexMask(zones, filter))
+    
+    def _GetSubmatrix(self, data, originSelector, destinationSelector):
+        if isinstance(originSelector, slice) or isinstance(destinationSelector, slice):
+            return data[originSelector][:, destinationSelector]
+        return data[_np.ix_(originSelector, destinationSelector)]
+    
+    def _GetBins(self, minVal, maxVal):
+        nSteps = int(_np.ceil((self.HistogramMax - self.HistogramMin) / self.HistogramStepSize))
+        edges = self.HistogramMin + self.HistogramStepSize * _np.arange(1, max(nSteps, 1))
+        
+        bins = [self.HistogramMin]
+        if minVal < self.HistogramMin: bins.insert(0, minVal)
+        bins.extend(edges[edges < self.HistogramMax].tolist())
+        bins.append(self.HistogramMax)
+        if maxVal > self.HistogramMax: bins.append(maxVal)
+        return bins
+    
+    def _WriteReportToLogbook(self, unweighted, unweightedHistogram, bins, weighted={}, weightedHistogram=None):
         
         #print "CURRENTLY DOES NOT WRITE REPORT TO LOGBOOK"
         #return
@@ -405,15 +498,20 @@ class MatrixSummary(_m.Tool()):
         bodyText += "</b><br>"
         
         rows = []
-        rows.append("<b>Average:</b> %s" %unweightedAverage)
-        rows.append("<b>Minimum:</b> %s" %minVal)
-        rows.append("<b>Maximum:</b> %s" %maxVal)
-        rows.append("<b>Standard Deviation:</b> %s" %unweightedStdDev)
-        rows.append("<b>Median:</b> %s" %unweightedMedian)
-        
-        if weightedAverage != None:
-            rows.append("<br><br><b>Weighted Average:</b> %s" %weightedAverage)
-            rows.append("<b>Weighted Standard Deviation:</b> %s" %weightedStdDev)
+        rows.append("<b>Average:</b> %s" %unweighted['average'])
+        rows.append("<b>Minimum:</b> %s" %unweighted['min'])
+        rows.append("<b>Maximum:</b> %s" %unweighted['max'])
+        rows.append("<b>Standard Deviation:</b> %s" %unweighted['stdDev'])
+        rows.append("<b>Median:</b> %s" %unweighted['median'])
+        for p, value in unweighted['percentiles']:
+            rows.append("<b>Percentile %s:</b> %s" %(p, value))
+        
+        if weighted:
+            rows.append("<br><br><b>Weighted Average:</b> %s" %weighted['average'])
+            rows.append("<b>Weighted Standard Deviation:</b> %s" %weighted['stdDev'])
+            rows.append("<b>Weighted Median:</b> %s" %weighted['median'])
+            for p, value in weighted['percentiles']:
+                rows.append("<b>Weighted Percentile %s:</b> %s" %(p, value))
         
         bodyText += "<h3>Matrix Statistics</h3>" + "<br>".join(rows)
         pb.add_text_element(bodyText)
@@ -432,7 +530,7 @@ class MatrixSummary(_m.Tool()):
                 uwVal = unweightedHistogram[i - 1]
             uwData.append((int(prevEdge), float(uwVal)))
             
-            if weightedHistogram != None:
+            if weightedHistogram is not None:
                 if (i - 1) >= len(weightedHistogram):
                     wVal = 0.0
                 else:
@@ -444,7 +542,7 @@ class MatrixSummary(_m.Tool()):
         cds = [{"title": "Unweighted frequency", 
                 "data": uwData,
                 "color": "red"}]
-        if weightedHistogram != None:
+        if weightedHistogram is not None:
             cds.append({"title": "Weighted frequency",
                         "data": wData,
                         "color": "blue"})
@@ -468,17 +566,7 @@ class MatrixSummary(_m.Tool()):
         _m.logbook_write("Matrix Summary Report for %s" %self.ValueMatrix,
                          value= pb.render())
     
-    def _WriteReportToFile(self,
-                            unweightedAverage,
-                            minVal,
-                            maxVal,
-                            unweightedStdDev,
-                            unweightedMedian,
-                            unweightedHistogram,
-                            bins,
-                            weightedAverage=None,
-                            weightedStdDev=None,
-                            weightedHistogram=None):
+    def _WriteReportToFile(self, unweighted, unweightedHistogram, bins, weighted={}, weightedHistogram=None):
         
         with open(self.ReportFile, 'w') as writer:
             writer.write('''Matrix Summary Report
@@ -495,16 +583,20 @@ Generated on %s\n\n''' %dt.now())
                 writer.write(" - {desc!s} ({stamp!s})".format(desc= self.WeightingMatrix.description,
                                                               stamp = self.WeightingMatrix.timestamp))
             
-            writer.write("\n\nAverage:\t%s" %unweightedAverage)
-            writer.write("\nMinimum:\t%s" %minVal)
-            writer.write("\nMaximum:\t%s" %maxVal)
-            writer.write("\nStd. Dev:\t%s" %unweightedStdDev)
-            writer.write("\n Median:\t%s" %unweightedMedian)
+            writer.write("\n\nAverage:\t%s" %unweighted['average'])
+            writer.write("\nMinimum:\t%s" %unweighted['min'])
+            writer.write("\nMaximum:\t%s" %unweighted['max'])
+            writer.write("\nStd. Dev:\t%s" %unweighted['stdDev'])
+            writer.write("\n Median:\t%s" %unweighted['median'])
+            for p, value in unweighted['percentiles']:
+                writer.write("\nPctl. %s:\t%s" %(p, value))
             
-            if weightedAverage != None:
-                writer.write("\nWeighted Avg.:\t%s" %weightedAverage)
-            if weightedStdDev != None:
-                writer.write("\nWeighted StDv:\t%s" %weightedStdDev)
+            if weighted:
+                writer.write("\nWeighted Avg.:\t%s" %weighted['average'])
+                writer.write("\nWeighted StDv:\t%s" %weighted['stdDev'])
+                writer.write("\nWeighted Med.:\t%s" %weighted['median'])
+                for p, value in weighted['percentiles']:
+                    writer.write("\nWeighted Pctl. %s:\t%s" %(p, value))
            
             writer.write('''
 
@@ -512,7 +604,7 @@ Generated on %s\n\n''' %dt.now())
 HISTOGRAM
 BinMin,BinMax,Freq''')
             
-            if weightedHistogram != None: writer.write(",wFreq")
+            if weightedHistogram is not None: writer.write(",wFreq")
             
             for i, binEdge in enumerate(bins):
                 if i == 0:
@@ -525,7 +617,7 @@ BinMin,BinMax,Freq''')
                     uwVal = unweightedHistogram[i - 1]
                 writer.write("\n%s,%s,%s" %(prevEdge, binEdge, uwVal))
                 
-                if weightedHistogram != None:
+                if weightedHistogram is not None:
                     if (i - 1) >= len(weightedHistogram):
                         wVal = 0.0
                     else:
@@ -536,6 +628,23 @@ BinMin,BinMax,Freq''')
 
                 
     
+    def _WriteBatchReport(self, rows, percentiles):
+        statistics = ['count', 'average', 'min', 'max', 'stdDev', 'median']
+        header = ["Matrix", "Group"] + statistics + ["p%s" %p for p in percentiles]
+        hasWeights = self.WeightingMatrix != None
+        if hasWeights:
+            header += ["weightedAverage", "weightedStdDev", "weightedMedian"] + ["weightedP%s" %p for p in percentiles]
+        
+        with open(self.ReportFile, 'w') as writer:
+            writer.write(",".join(header))
+            for matrixId, label, unweighted, weighted in rows:
+                cells = [matrixId, label] + [unweighted[s] for s in statistics]
+                cells += [value for p, value in unweighted['percentiles']]
+                if hasWeights:
+                    cells += [weighted['average'], weighted['stdDev'], weighted['median']]
+                    cells += [value for p, value in weighted['percentiles']]
+                writer.write("\n" + ",".join([str(c) for c in cells]))
+    
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
         return self.TRACKER.getProgress()
@@ -543,4 +652,60 @@ BinMin,BinMax,Freq''')
     @_m.method(return_type=unicode)
     def tool_run_msg_status(self):
         return self.tool_run_msg
-        
\ No newline at end of file
+        
+
+#---
+#---Statistics on NumPy arrays
+
+def _SummarizeValues(values, percentiles, weights=None):
+    '''
+    Computes the summary statistics of an array of values, optionally weighted. Percentiles
+    are given from 0 to 100 and are returned as a list of (percentile, value) tuples.
+    '''
+    if len(values) == 0:
+        nan = float('nan')
+        return {'count': 0, 'average': nan, 'min': nan, 'max': nan, 'stdDev': nan, 'median': nan,
+                'percentiles': [(p, nan) for p in percentiles]}
+    
+    if weights is None:
+        quantiles = _np.percentile(values, [50.0] + percentiles)
+        return {'count': len(values),
+                'average': float(_np.mean(values)),
+                'min': float(_np.min(values)),
+                'max': float(_np.max(values)),
+                'stdDev': float(_np.std(values)),
+                'median': float(quantiles[0]),
+                'percentiles': zip(percentiles, quantiles[1:].tolist())}
+    
+    values = _np.asarray(values, dtype= _np.float64)
+    weights = _np.asarray(weights, dtype= _np.float64)
+    totalWeight = weights.sum()
+    if totalWeight == 0:
+        average = float('nan')
+        variance = float('nan')
+    else:
+        average = _np.dot(values, weights) / totalWeight
+        variance = _np.dot((values - average) ** 2, weights) / totalWeight
+    
+    quantiles = _WeightedPercentiles(values, weights, [50.0] + percentiles)
+    return {'count': len(values),
+            'average': float(average),
+            'min': float(_np.min(values)),
+            'max': float(_np.max(values)),
+            'stdDev': sqrt(variance),
+            'median': quantiles[0],
+            'percentiles': zip(percentiles, quantiles[1:])}
+
+def _WeightedPercentiles(values, weights, percentiles):
+    '''
+    Returns, for each percentile, the smallest value at which the cumulative weight
+    reaches that percentage of the total weight (e.g. the weighted median for 50).
+    '''
+    order = _np.argsort(values, kind= 'mergesort')
+    cumulativeWeights = _np.cumsum(weights[order])
+    totalWeight = cumulativeWeights[-1]
+    if totalWeight <= 0: return [float('nan')] * len(percentiles)
+    
+    targets = _np.asarray(percentiles, dtype= _np.float64) / 100.0 * totalWeight
+    positions = _np.searchsorted(cumulativeWeights, targets, side= 'left').clip(0, len(values) - 1)
+    return values[order[positions]].tolist()
@@ -46,6 +46,9 @@ Export Countpost Results
     
     1.1.3 Added checks to make sure the alternative countpost attribute is not used form XTMF if
           there is a blank string.
+    
+    1.1.4 Loads link results as columns (util.fastLoadLinkColumns) and only processes
+          the links flagged with a countpost.
 '''
 
 import inro.modeller as _m
@@ -53,6 +56,8 @@ import traceback as _traceback
 from contextlib import contextmanager
 from contextlib import nested
 from os.path import splitext
+from itertools import izip
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
@@ -62,7 +67,7 @@ NullPointerException = _util.NullPointerException
 
 class ExportCountpostResults(_m.Tool()):
     
-    version = '1.1.3'
+    version = '1.1.4'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -78,7 +83,6 @@ class ExportCountpostResults(_m.Tool()):
     AlternateCountpostAttributeId = _m.Attribute(str)
     
     ExportFile = _m.Attribute(str)
-    version = '1.1.2'
     
     def __init__(self):
         #---Init internal variables
@@ -234,21 +238,17 @@ class ExportCountpostResults(_m.Tool()):
                                      attributes=self._GetAtts()):
             self.TRACKER.reset()
             
-            linkResults = _util.fastLoadLinkAttributes(self.Scenario, [self.CountpostAttributeId,
-                                                                       'auto_volume',
-                                                                       'additional_volume',
-                                                                       'auto_time'])
-            
-            alternateLinkResults = {}
-            if self.AlternateCountpostAttributeId and self.AlternateCountpostAttributeId != "":
-                alternateLinkResults = _util.fastLoadLinkAttributes(self.Scenario, 
-                                                                    [self.AlternateCountpostAttributeId])
+            attributes = [self.CountpostAttributeId, 'auto_volume', 'additional_volume', 'auto_time']
+            hasAlternate = bool(self.AlternateCountpostAttributeId)
+            if hasAlternate:
+                attributes.append(self.AlternateCountpostAttributeId)
+            linkResults = _util.fastLoadLinkColumns(self.Scenario, attributes)
             
-            #Remove entries not flagged with a countpost
-            self._CleanResults(linkResults, alternateLinkResults)
+            #Only keep entries flagged with a countpost
+            flaggedRows = self._GetFlaggedRows(linkResults, hasAlternate)
             
             #Get the countpost data, sorted
-            lines = self._ProcessResults(linkResults, alternateLinkResults)
+            lines = self._ProcessResults(linkResults, flaggedRows, hasAlternate)
             
             #Write countpost data to file
             self._WriteReport(lines)
@@ -269,36 +269,28 @@ class ExportCountpostResults(_m.Tool()):
             
         return atts
     
-    def _CleanResults(self, linkResults, alternateLinkResults):
-        idsToRemove = []
-        for linkId, attributes in linkResults.iteritems():
-            post1 = attributes[self.CountpostAttributeId]
-            post2 = 0
-            if linkId in alternateLinkResults:
-                post2 = alternateLinkResults[linkId][self.AlternateCountpostAttributeId] 
-            
-            if not post1 and not post2:
-                idsToRemove.append(linkId)
-        for key in idsToRemove:
-            linkResults.pop(key) 
+    def _GetFlaggedRows(self, linkResults, hasAlternate):
+        flagged = linkResults[self.CountpostAttributeId] != 0
+        if hasAlternate:
+            flagged |= linkResults[self.AlternateCountpostAttributeId] != 0
+        return _np.flatnonzero(flagged)
     
-    def _ProcessResults(self, linkResults, alternateLinkResults):
+    def _ProcessResults(self, linkResults, flaggedRows, hasAlternate):
         lines = []
         
+        post1s = linkResults[self.CountpostAttributeId][flaggedRows].tolist()
+        if hasAlternate:
+            post2s = linkResults[self.AlternateCountpostAttributeId][flaggedRows].tolist()
+        else:
+            post2s = [0] * len(flaggedRows)
+        volaus = linkResults['auto_volume'][flaggedRows].tolist()
+        volads = linkResults['additional_volume'][flaggedRows].tolist()
+        timaus = linkResults['auto_time'][flaggedRows].tolist()
+        
         posts = 0
-        self.TRACKER.startProcess(len(linkResults))
-        for linkIdTuple, attributes in linkResults.iteritems():
-            linkId = "%s-%s" %linkIdTuple
-
-            post1 = attributes[self.CountpostAttributeId]
-            post2 = 0
-            if linkIdTuple in alternateLinkResults:
-                post2 = alternateLinkResults[linkIdTuple][self.AlternateCountpostAttributeId]
-            volau = attributes['auto_volume']
-            volad = attributes['additional_volume']
-            timau = attributes['auto_time']
-            
-            data = [linkId, volau, volad, timau]
+        self.TRACKER.startProcess(len(flaggedRows))
+        for row, post1, post2, volau, volad, timau in izip(flaggedRows, post1s, post2s, volaus, volads, timaus):
+            linkId = "%s-%s" %linkResults.ids[row]
             
             if post1:
                 lines.append((post1, linkId, volau, volad, timau))
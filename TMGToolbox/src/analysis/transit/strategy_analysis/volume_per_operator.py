@@ -33,6 +33,8 @@ Volume per Operator
 '''
     0.0.1 Created on 2015-05-04 by tnikolov
     0.0.2 Created on 2015-11-13 by mattaustin222
+    0.0.3 Intrazonal strategy values are cleared with a single NumPy call, for every zone
+        (the multi-class loop used to skip the last zone).
 '''
 
 import inro.modeller as _m
@@ -217,11 +219,7 @@ class VolumePerOperator(_m.Tool()):
                                 report = stratAnalysis(self.count_ridership(operatorMarker, tempIntermediateMatrix, demandMatrixId[key]), scenario=self.Scenario, class_name=key)
                             tempMatrix = _MODELLER.emmebank.matrix(tempIntermediateMatrix.id)
                             numpyData = tempMatrix.get_numpy_data(scenario_id = scenario.id)
-                            count = 0 
-                            for i in range(numpyData.shape[0]-1):
-                                if numpyData[i,i] != 0:
-                                    numpyData[i,i] = 0
-                                    count += 1
+                            np.fill_diagonal(numpyData, 0)
                             tempMatrix.set_numpy_data(numpyData, scenario_id = scenario.id)
                             matrixCalculator(self._CalcRidership(tempIntermediateMatrix.id, demandMatrixId[key]), scenario=self.Scenario)
                             matrixAggregation(tempIntermediateMatrix.id, tempResultMatrix.id, agg_op="+", scenario=self.Scenario)
@@ -239,11 +237,7 @@ class VolumePerOperator(_m.Tool()):
                             report = stratAnalysis(self.count_ridership(operatorMarker, tempIntermediateMatrix, demandMatrixId), scenario=self.Scenario)
                         tempMatrix = _MODELLER.emmebank.matrix(tempIntermediateMatrix.id)
                         numpyData = tempMatrix.get_numpy_data(scenario_id = scenario.id)
-                        count = 0 
-                        for i in range(numpyData.shape[0]):
-                            if numpyData[i,i] != 0:
-                                numpyData[i,i] = 0
-                                count += 1
+                        np.fill_diagonal(numpyData, 0)
                         tempMatrix.set_numpy_data(numpyData, scenario_id = scenario.id)                         
                         matrixCalculator(self._CalcRidership(tempIntermediateMatrix.id, demandMatrixId), scenario=self.Scenario)
                         matrixAggregation(tempIntermediateMatrix.id, tempResultMatrix.id, agg_op="+", scenario=self.Scenario)         
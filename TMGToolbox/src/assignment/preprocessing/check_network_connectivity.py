@@ -23,10 +23,10 @@
     Latest revision by: pkucirek
     
     
-    Runs an auto and/or transit assignment to find nodes with 
-     connectivity issues (for given modes). Identifies fountain nodes (that 
+    Finds zones with connectivity issues (for given modes) from the strongly
+     connected components of the network graph. Identifies fountain nodes (that 
      go out), sink nodes (that only come in), and orphan nodes (that neither 
-     come in nor go out). Islands are NOT identified. 
+     come in nor go out), along with the components they are connected to.
         
 '''
 #---VERSION HISTORY
@@ -37,14 +37,18 @@
     
     1.0.1 Added searchability to mode selectors.
     
+    2.0.0 Replaced the auto and transit assignments with a graph search. The strongly
+        connected components of each mode's network are found with Tarjan's algorithm
+        (respecting prohibited turns for auto modes, and transit line itineraries and
+        boarding / alighting restrictions for transit modes), so no assignment or
+        temporary scenario is needed. The report also lists the components to which
+        the problem zones are connected.
+    
 '''
 
 import traceback as _traceback
-from contextlib import contextmanager
-from contextlib import nested
 from html import HTML
-from numpy import array
-from numpy import where
+import numpy as _np
 
 import inro.modeller as _m
 
@@ -55,11 +59,223 @@ EMME_VERSION = _util.getEmmeVersion(float)
 
 ##########################################################################################################
 
+class ConnectivityGraph():
+    '''
+    A directed graph, stored as arrays of edges, for finding the zones which
+    can't reach (or can't be reached from) the other zones. Each zone has an
+    origin vertex (with only outgoing edges) and a destination vertex (with
+    only incoming edges), so that paths can't go through centroids.
+    '''
+    
+    def __init__(self):
+        self._vertexNodes = [] #The node number of each vertex, for reporting
+        self._vertexZones = [] #The zone number of each origin or destination vertex, None otherwise
+        self._isOrigin = []
+        self._origins = {}
+        self._destinations = {}
+        self._sources = []
+        self._targets = []
+    
+    def addVertex(self, nodeNumber, zone= None, isOrigin= False):
+        self._vertexNodes.append(nodeNumber)
+        self._vertexZones.append(zone)
+        self._isOrigin.append(isOrigin)
+        return len(self._vertexNodes) - 1
+    
+    def getOrigin(self, zone):
+        if zone not in self._origins:
+            self._origins[zone] = self.addVertex(zone, zone, True)
+        return self._origins[zone]
+    
+    def getDestination(self, zone):
+        if zone not in self._destinations:
+            self._destinations[zone] = self.addVertex(zone, zone, False)
+        return self._destinations[zone]
+    
+    def addEdge(self, source, target):
+        self._sources.append(source)
+        self._targets.append(target)
+    
+    def findDisconnectedZones(self, zones):
+        '''
+        Returns lists of fountain zones (which can't be reached from any other zone),
+        sink zones (which can't reach any other zone), orphan zones (both), and a list 
+        of the components (tuples of zones and node numbers) to which those zones are
+        connected, other than the largest component of the network.
+        '''
+        for zone in zones:
+            self.getOrigin(zone)
+            self.getDestination(zone)
+        if len(zones) < 2: return [], [], [], []
+        
+        nVertices = len(self._vertexNodes)
+        sources = _np.array(self._sources, dtype= _np.int64)
+        targets = _np.array(self._targets, dtype= _np.int64)
+        indptr, indices = _buildCSR(nVertices, sources, targets)
+        labels = findStronglyConnectedComponents(indptr, indices)
+        nComponents = labels.max() + 1 if nVertices else 0
+        
+        #Tarjan's algorithm numbers the components in reverse topological order, so every edge
+        #between components goes from a higher label to a lower one.
+        componentSources = labels[sources]
+        componentTargets = labels[targets]
+        between = componentSources != componentTargets
+        componentSources = componentSources[between]
+        componentTargets = componentTargets[between]
+        
+        #The zones reached from (and reaching) each component, up to two of them: for a zone,
+        #reaching two distinct zones means that it reaches at least one other zone.
+        reached = [() for i in xrange(nComponents)]
+        reaching = [() for i in xrange(nComponents)]
+        for zone in zones:
+            reached[labels[self._destinations[zone]]] = (zone,)
+            reaching[labels[self._origins[zone]]] = (zone,)
+        
+        order = _np.argsort(componentSources, kind= 'mergesort')
+        successors = _groupBy(componentSources[order], componentTargets[order], nComponents)
+        for component in xrange(nComponents):
+            for successor in successors.get(component, ()):
+                reached[component] = _mergeZones(reached[component], reached[successor])
+        
+        order = _np.argsort(componentTargets, kind= 'mergesort')
+        predecessors = _groupBy(componentTargets[order], componentSources[order], nComponents)
+        for component in xrange(nComponents - 1, -1, -1):
+            for predecessor in predecessors.get(component, ()):
+                reaching[component] = _mergeZones(reaching[component], reaching[predecessor])
+        
+        fountains, sinks, orphans = [], [], []
+        for zone in zones:
+            reachesOthers = any(other != zone for other in reached[labels[self._origins[zone]]])
+            isReached = any(other != zone for other in reaching[labels[self._destinations[zone]]])
+            
+            if not isReached:
+                if not reachesOthers: orphans.append(zone)
+                else: fountains.append(zone)
+            elif not reachesOthers:
+                sinks.append(zone)
+        
+        return fountains, sinks, orphans, self._getComponents(fountains + sinks + orphans, labels, sources, targets)
+    
+    def _getComponents(self, problemZones, labels, sources, targets):
+        if not problemZones: return []
+        
+        isZoneVertex = _np.array([zone is not None for zone in self._vertexZones], dtype= bool)
+        counts = _np.bincount(labels[~isZoneVertex], minlength= labels.max() + 1)
+        mainComponent = counts.argmax() if len(counts) else -1
+        
+        #The components of the network next to the problem zones' connectors
+        problemVertices = set()
+        for zone in problemZones:
+            problemVertices.add(self._origins[zone])
+            problemVertices.add(self._destinations[zone])
+        componentZones = {}
+        for source, target in zip(sources.tolist(), targets.tolist()):
+            if source in problemVertices and not isZoneVertex[target]:
+                componentZones.setdefault(labels[target], set()).add(self._vertexZones[source])
+            if target in problemVertices and not isZoneVertex[source]:
+                componentZones.setdefault(labels[source], set()).add(self._vertexZones[target])
+        componentZones.pop(mainComponent, None)
+        
+        components = []
+        for component in sorted(componentZones, key= lambda c: min(componentZones[c])):
+            vertices = _np.flatnonzero(labels == component)
+            nodes = sorted(set(self._vertexNodes[vertex] for vertex in vertices))
+            components.append((sorted(componentZones[component]), nodes))
+        return components
+
+def _buildCSR(nVertices, sources, targets):
+    order = _np.argsort(sources, kind= 'mergesort')
+    indices = targets[order]
+    indptr = _np.zeros(nVertices + 1, dtype= _np.int64)
+    _np.cumsum(_np.bincount(sources, minlength= nVertices), out= indptr[1:])
+    return indptr, indices
+
+def _groupBy(keys, values, nKeys):
+    groups = {}
+    if len(keys) == 0: return groups
+    starts = _np.flatnonzero(_np.concatenate(([True], keys[1:] != keys[:-1])))
+    for key, group in zip(keys[starts].tolist(), _np.split(values, starts[1:])):
+        groups[key] = _np.unique(group).tolist()
+    return groups
+
+def _mergeZones(zones, otherZones):
+    if len(zones) >= 2: return zones
+    for zone in otherZones:
+        if zone not in zones:
+            zones += (zone,)
+            if len(zones) >= 2: break
+    return zones
+
+def findStronglyConnectedComponents(indptr, indices):
+    '''
+    Labels the strongly connected components of a graph in compressed sparse
+    row form, with an iterative version of Tarjan's algorithm.
+    
+    Returns: An array of the component of each vertex. Components are labelled
+        in reverse topological order (i.e., edges between components always go
+        from a higher label to a lower one).
+    '''
+    nVertices = len(indptr) - 1
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    
+    visitIndex = [-1] * nVertices
+    lowLink = [0] * nVertices
+    onStack = [False] * nVertices
+    labels = [-1] * nVertices
+    stack = []
+    counter = 0
+    nComponents = 0
+    
+    for root in xrange(nVertices):
+        if visitIndex[root] != -1: continue
+        
+        visitIndex[root] = lowLink[root] = counter
+        counter += 1
+        stack.append(root)
+        onStack[root] = True
+        work = [(root, indptr[root])]
+        
+        while work:
+            vertex, position = work[-1]
+            end = indptr[vertex + 1]
+            while position < end:
+                neighbour = indices[position]
+                position += 1
+                if visitIndex[neighbour] == -1:
+                    #Descend into the neighbour, resuming this vertex afterwards
+                    work[-1] = (vertex, position)
+                    visitIndex[neighbour] = lowLink[neighbour] = counter
+                    counter += 1
+                    stack.append(neighbour)
+                    onStack[neighbour] = True
+                    work.append((neighbour, indptr[neighbour]))
+                    break
+                elif onStack[neighbour] and visitIndex[neighbour] < lowLink[vertex]:
+                    lowLink[vertex] = visitIndex[neighbour]
+            else:
+                work.pop()
+                if lowLink[vertex] == visitIndex[vertex]:
+                    while True:
+                        member = stack.pop()
+                        onStack[member] = False
+                        labels[member] = nComponents
+                        if member == vertex: break
+                    nComponents += 1
+                if work:
+                    parent = work[-1][0]
+                    if lowLink[vertex] < lowLink[parent]:
+                        lowLink[parent] = lowLink[vertex]
+    
+    return _np.array(labels, dtype= _np.int64)
+
+##########################################################################################################
+
 class CheckNetworkConnectivity(_m.Tool()):
     
-    version = '1.0.1'
+    version = '2.0.0'
     tool_run_msg = ""
-    number_of_tasks = 3 # For progress reporting, enter the integer number of tasks here
+    number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
     # Tool Input Parameters
     #    Only those parameters neccessary for Modeller and/or XTMF to dock with
@@ -70,8 +286,6 @@ class CheckNetworkConnectivity(_m.Tool()):
     AutoModeIds = _m.Attribute(_m.ListType)
     TransitModeIds = _m.Attribute(_m.ListType)
     
-    PreserveAssignmentFlag = _m.Attribute(bool)
-    
     xtmf_ScenarioNumber = _m.Attribute(int) # parameter used by XTMF only
     xtmf_AutoModeString = _m.Attribute(str)
     xtmf_TransitModeString = _m.Attribute(str)
@@ -84,19 +298,17 @@ class CheckNetworkConnectivity(_m.Tool()):
         self.Scenario = _MODELLER.scenario #Default is primary scenario
         self.AutoModeIds = []
         self.TransitModeIds = []
-        
-        self.PreserveAssignmentFlag = True
     
     def page(self):
         
         pb = _tmgTPB.TmgToolPageBuilder(self, title="Check Network Connectivity v%s" %self.version,
-                     description="Runs an auto and/or transit assignment to find nodes with \
+                     description="Searches the network graph to find zones with \
                          connectivity issues (for given modes). Identifies fountain nodes (that \
                          go out), sink nodes (that only come in), and orphan nodes (that neither \
-                         come in nor go out). Islands are <b>not</b> identified. \
-                         <br><br><b>Temporary storage requirements:</b> One scenario (if needed), \
-                         one matrix for transit times, and one matrix for <em>each auto mode \
-                         selected</em>.",
+                         come in nor go out), and reports the disconnected parts of the network \
+                         they are attached to. Prohibited turns are respected for auto modes, and \
+                         transit line itineraries for transit modes. \
+                         <br><br><b>Temporary storage requirements:</b> None.",
                      branding_text="- TMG Toolbox")
         
         if self.tool_run_msg != "": # to display messages in the page
@@ -124,10 +336,6 @@ class CheckNetworkConnectivity(_m.Tool()):
                       title= "Select Transit Modes", note= "Leave empty to disable checking for transit connectivity.",
                       searchable= True)
         
-        pb.add_checkbox(tool_attribute_name= 'PreserveAssignmentFlag',
-                        label= "Preserve existing assignment results?",
-                        note= "Space for a temporary scenario is required if checked.")
-        
                 #---JAVASCRIPT
         pb.add_html("""
 <script type="text/javascript">
@@ -178,8 +386,6 @@ class CheckNetworkConnectivity(_m.Tool()):
             self.tool_run_msg = _m.PageBuilder.format_exception(
                 e, _traceback.format_exc(e))
             raise
-        
-        _MODELLER.desktop.refresh_needed(False)
     
     ##########################################################################################################    
     
@@ -188,61 +394,37 @@ class CheckNetworkConnectivity(_m.Tool()):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
             
-            with _util.tempMatrixMANAGER(matrix_type= 'SCALAR', description= "Zero demand matrix") \
-                    as demandMatrix:
-                with self._tempScenarioMANAGER():
-                    dataTuples = []
-                    
-                    if self.AutoModeIds:
-                        self._CheckAutoConnectivity(demandMatrix.id, dataTuples)
-                    
-                    if self.TransitModeIds:
-                        self._CheckTransitConnectivity(demandMatrix.id, dataTuples)
-                    
-                    
-                    
-                    totalFountains = set()
-                    totalSinks = set()
-                    totalOrphans = set()
-                    for type, modes, fountains, sinks, orphans in dataTuples:
-                        for node in fountains: totalFountains.add(node)
-                        for node in sinks: totalSinks.add(node)
-                        for node in orphans: totalOrphans.add(node)
-                    
-                    nFountains = len(totalFountains)
-                    nSinks = len(totalSinks)
-                    nOrphans = len(totalOrphans)
-                    
-                    if (nFountains + nSinks + nOrphans) > 0:
-                        self._WriteReport(dataTuples)
-                        return nFountains, nSinks, nOrphans
-                    else: return 0,0,0
-                    
-    ##########################################################################################################   
-    
-    @contextmanager
-    def _tempScenarioMANAGER(self):
-        hasCopy = False
-        bank = _MODELLER.emmebank
-        
-        if self.Scenario.has_transit_results or self.Scenario.has_traffic_results:
-            if self.PreserveAssignmentFlag:
-                copyId = _util.getAvailableScenarioNumber()
-                
-                originalScenario = self.Scenario
-                copy = bank.copy_scenario(self.Scenario.id, copyId, False, False, False)
-                _m.logbook_write("Copied scenario %s to temporary scenario %s" %(originalScenario, copyId))
-                
-                self.Scenario = copy
-                hasCopy = True
-        
-        try:
-            yield
-        finally:
-            if hasCopy:
-                self.Scenario = originalScenario
-                bank.delete_scenario(copyId)
-                _m.logbook_write("Deleted temporary scenario %s." %copyId)
+            self.TRACKER.startProcess(len(self.AutoModeIds) + int(bool(self.TransitModeIds)) + 1)
+            elementTypes = ['LINK']
+            if self.AutoModeIds: elementTypes.append('TURN')
+            if self.TransitModeIds: elementTypes.append('TRANSIT_SEGMENT')
+            network = self.Scenario.get_partial_network(elementTypes, include_attributes= True)
+            self.TRACKER.completeSubtask()
+            
+            dataTuples = []
+            
+            if self.AutoModeIds:
+                self._CheckAutoConnectivity(network, dataTuples)
+            
+            if self.TransitModeIds:
+                self._CheckTransitConnectivity(network, dataTuples)
+            
+            totalFountains = set()
+            totalSinks = set()
+            totalOrphans = set()
+            for type, modes, fountains, sinks, orphans, components in dataTuples:
+                for node in fountains: totalFountains.add(node)
+                for node in sinks: totalSinks.add(node)
+                for node in orphans: totalOrphans.add(node)
+            
+            nFountains = len(totalFountains)
+            nSinks = len(totalSinks)
+            nOrphans = len(totalOrphans)
+            
+            if (nFountains + nSinks + nOrphans) > 0:
+                self._WriteReport(dataTuples)
+                return nFountains, nSinks, nOrphans
+            else: return 0,0,0
     
     #----SUB FUNCTIONS---------------------------------------------------------------------------------  
     
@@ -254,171 +436,98 @@ class CheckNetworkConnectivity(_m.Tool()):
             
         return atts 
     
-    def _CheckAutoConnectivity(self, demandMatrixId, dataTuples):
-        managers = []
-        for modeId in self.AutoModeIds:
-            managers.append(_util.tempMatrixMANAGER(description= "Temp times matrix for mode %s" %modeId))
+    def _CheckAutoConnectivity(self, network, dataTuples):
+        #Turns with a penalty function of 0 are prohibited. Turns are allowed at all other
+        #nodes, including U-turns.
+        prohibitedTurns = set()
+        for turn in network.turns():
+            if turn.penalty_func == 0:
+                prohibitedTurns.add((turn.i_node.number, turn.j_node.number, turn.k_node.number))
         
-        with nested(*managers) as timesMatrices:
-            classInfo = []
-            for i, modeId in enumerate(self.AutoModeIds):
-                classInfo.append((modeId, timesMatrices[i].id))
+        for modeId in self.AutoModeIds:
+            mode = network.mode(modeId)
+            graph = ConnectivityGraph()
             
-            print "Auto assignment prepared."
-            self._RunAutoAssignment(demandMatrixId, classInfo)
-            print "Auto assignment complete."
+            #Each link is a vertex, so that turns can be prohibited
+            linkVertices = {}
+            for link in network.links():
+                if mode not in link.modes: continue
+                linkVertices[(link.i_node.number, link.j_node.number)] = graph.addVertex(link.j_node.number)
             
-            bank = _MODELLER.emmebank
-            for modeId, matrixId in classInfo:
-                matrix = bank.matrix(matrixId)
-                
+            for link in network.links():
+                if mode not in link.modes: continue
+                i, j = link.i_node.number, link.j_node.number
+                vertex = linkVertices[(i, j)]
                 
-                fountains, sinks, orphans = self._GetDisconnectedNodes(matrix)
-                dataTuples.append(("Auto", [modeId], fountains, sinks, orphans))
+                if link.i_node.is_centroid:
+                    graph.addEdge(graph.getOrigin(i), vertex)
+                if link.j_node.is_centroid:
+                    graph.addEdge(vertex, graph.getDestination(j))
+                    continue #Paths can't go through centroids
                 
-                print "Processed auto mode %s" %modeId
-                
-    def _RunAutoAssignment(self, demandMatrixId, classInfo):
-        
-        classes = []
-        for modeId, timesMatrixId in classInfo:
-            classSpec = {
-                        "mode": modeId,
-                        "demand": demandMatrixId,
-                        "generalized_cost": None,
-                        "results": {
-                            "link_volumes": None,
-                            "turn_volumes": None,
-                            "od_travel_times": {
-                                "shortest_paths": timesMatrixId
-                            }
-                        },
-                        "analysis": {
-                            "analyzed_demand": None,
-                            "results": {
-                                "od_values": None,
-                                "selected_link_volumes": None,
-                                "selected_turn_volumes": None
-                            }
-                        }
-                    }
-            classes.append(classSpec)
-        
-        spec = {
-                "type": "STANDARD_TRAFFIC_ASSIGNMENT",
-                "classes": classes,
-                "performance_settings": {
-                    "number_of_processors": 1
-                },
-                "background_traffic": None,
-                "path_analysis": None,
-                "cutoff_analysis": None,
-                "traversal_analysis": None,
-                "stopping_criteria": {
-                    "max_iterations": 0,
-                    "relative_gap": 0,
-                    "best_relative_gap": 0,
-                    "normalized_gap": 0
-                }
-            }
-        
-        tool = _MODELLER.tool('inro.emme.traffic_assignment.standard_traffic_assignment')
-        
-        tool(spec, self.Scenario)
-    
-    def _CheckTransitConnectivity(self, demandMatrixId, dataTuples):
-        with _util.tempMatrixMANAGER(description="Transit times matrix") as timesMatrix:
-            
-            self._RunTransitAssignment(demandMatrixId, timesMatrix.id)
-            print "Transit assignment complete."
-            
-            matrix = _MODELLER.emmebank.matrix(timesMatrix.id)
-            fountains, sinks, orphans = self._GetDisconnectedNodes(matrix)
-            
-            dataTuples.append(("Transit", self.TransitModeIds, fountains, sinks, orphans))
-            print "Processed transit connectivity."
-    
-    def _RunTransitAssignment(self, demandMatrixId, timesMatrixId):
-        spec = {
-            "modes": self.TransitModeIds,
-            "demand": demandMatrixId,
-            "waiting_time": {
-                "headway_fraction": 0.5,
-                "effective_headways": "hdw",
-                "spread_factor": 1,
-                "perception_factor": 1
-            },
-            "boarding_time": {
-                "penalty": 0,
-                "perception_factor": 1
-            },
-            "aux_transit_time": {
-                "perception_factor": 1
-            },
-            "od_results": {
-                "transit_times": timesMatrixId,
-                "total_waiting_times": None,
-                "first_waiting_times": None,
-                "boarding_times": None,
-                "by_mode_subset": None
-            },
-            "strategy_analysis": None,
-            "type": "STANDARD_TRANSIT_ASSIGNMENT"
-        }
-        
-        tool = _MODELLER.tool('inro.emme.transit_assignment.standard_transit_assignment')
-        
-        tool(spec, scenario= self.Scenario)
-    
-    def _GetDisconnectedNodes(self, matrix):
-        matrixData = matrix.get_data(self.Scenario)
-        
-        numpyArray = array(matrixData.raw_data)
-        infinity = float('1E20') - 0.1 #'Emme infinity' is 1e+20
-        pMatches, qMatches = where(numpyArray > infinity)
-        
-        originIndices, destinationIndices = matrixData.indices
-        nZones = len(originIndices) - 1 #Subtract one since each zone is always connected to itself
-        
-        zoneEnds = {}
-        for pIndex, qIndex in _util.itersync(pMatches, qMatches):
-            p = originIndices[pIndex]
-            q = destinationIndices[qIndex]
-            
-            if p in zoneEnds:
-                zoneEnds[p][0] += 1
-            else:
-                zoneEnds[p] = [1, 0]
+                for nextLink in link.j_node.outgoing_links():
+                    k = nextLink.j_node.number
+                    if (j, k) not in linkVertices: continue
+                    if (i, j, k) in prohibitedTurns: continue
+                    graph.addEdge(vertex, linkVertices[(j, k)])
             
-            if q in zoneEnds:
-                zoneEnds[q][1] += 1
-            else:
-                zoneEnds[q] = [0, 1]
-
-        fountains, sinks, orphans = [], [], []
-        
-        for zone, counts in zoneEnds.iteritems():
-            outCount, inCount = counts
+            fountains, sinks, orphans, components = graph.findDisconnectedZones(self._GetZones(network))
+            dataTuples.append(("Auto", [modeId], fountains, sinks, orphans, components))
             
-            if inCount == nZones:
-                if outCount == nZones:
-                    orphans.append(zone)
-                else:
-                    fountains.append(zone)
-            elif outCount == nZones:
-                sinks.append(zone)
-        
-        return fountains, sinks, orphans
+            self.TRACKER.completeSubtask()
+            print "Processed auto mode %s" %modeId
+    
+    def _CheckTransitConnectivity(self, network, dataTuples):
+        modes = set([network.mode(id) for id in self.TransitModeIds])
+        graph = ConnectivityGraph()
+        
+        nodeVertices = {}
+        def getNodeVertex(node, asOrigin):
+            if node.is_centroid:
+                if asOrigin: return graph.getOrigin(node.number)
+                return graph.getDestination(node.number)
+            if node.number not in nodeVertices:
+                nodeVertices[node.number] = graph.addVertex(node.number)
+            return nodeVertices[node.number]
+        
+        #Walking
+        for link in network.links():
+            if not any(mode in modes and mode.type == 'AUX_TRANSIT' for mode in link.modes): continue
+            graph.addEdge(getNodeVertex(link.i_node, True), getNodeVertex(link.j_node, False))
+        
+        #Riding, following the itinerary of each line
+        for line in network.transit_lines():
+            if line.mode not in modes: continue
+            
+            previousVertex = None
+            for segment in line.segments(include_hidden= True):
+                vertex = graph.addVertex(segment.i_node.number)
+                if previousVertex is not None:
+                    graph.addEdge(previousVertex, vertex)
+                if segment.allow_boardings:
+                    graph.addEdge(getNodeVertex(segment.i_node, True), vertex)
+                if segment.allow_alightings:
+                    graph.addEdge(vertex, getNodeVertex(segment.i_node, False))
+                previousVertex = vertex
+        
+        fountains, sinks, orphans, components = graph.findDisconnectedZones(self._GetZones(network))
+        dataTuples.append(("Transit", self.TransitModeIds, fountains, sinks, orphans, components))
+        
+        self.TRACKER.completeSubtask()
+        print "Processed transit connectivity."
+    
+    def _GetZones(self, network):
+        return sorted(centroid.number for centroid in network.centroids())
     
     def _WriteReport(self, dataTuples):
         pb = _m.PageBuilder("Network Connectivity Report")
         
-        for type, modes, fountains, sinks, orphans in dataTuples:
-            self._AddReportSection(pb, type, modes, fountains, sinks, orphans)
+        for type, modes, fountains, sinks, orphans, components in dataTuples:
+            self._AddReportSection(pb, type, modes, fountains, sinks, orphans, components)
         
         _m.logbook_write("Network connectivity report", value= pb.render())
     
-    def _AddReportSection(self, pb, type, modes, fountains, sinks, orphans):
+    def _AddReportSection(self, pb, type, modes, fountains, sinks, orphans, components):
         modes = [str(mode) for mode in modes]
         
         h = HTML()
@@ -472,6 +581,24 @@ class CheckNetworkConnectivity(_m.Tool()):
             for node in orphans:
                 t.tr().td(str(node))
         
+        if components:
+            
+            plural = ''
+            if len(components) > 1: plural = 's'
+            title= "Found %s disconnected component%s:" %(len(components), plural)
+            
+            t = h.table()
+            tr = t.tr()
+            tr.th(title)
+            tr.th("Zones")
+            tr.th("Nodes")
+            
+            for i, (zones, nodes) in enumerate(components):
+                tr = t.tr()
+                tr.td(str(i + 1))
+                tr.td(", ".join([str(zone) for zone in zones]))
+                tr.td(", ".join([str(node) for node in nodes]))
+        
         pb.wrap_html(sectionTitle, body= str(h))
             
     @_m.method(return_type=_m.TupleType)
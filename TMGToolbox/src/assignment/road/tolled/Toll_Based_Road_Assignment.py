@@ -56,6 +56,8 @@ Toll-Based Road Assignment
     1.2.1 Removed a scaling factor being incorrectly applied to the Best Relative Gap
 
     1.2.1 Added the ability to use a peak period matrix instead of just a scaling factor
+    
+    1.2.2 The time and peak memory usage of each stage are written to the logbook.
 '''
 
 import inro.modeller as _m
@@ -73,7 +75,7 @@ EMME_VERSION = _util.getEmmeVersion(float)
 
 class TollBasedRoadAssignment(_m.Tool()):
     
-    version = '1.2.1'
+    version = '1.2.2'
     tool_run_msg = ""
     number_of_tasks = 4 # For progress reporting, enter the integer number of tasks here
     
@@ -384,20 +386,20 @@ class TollBasedRoadAssignment(_m.Tool()):
                     as (costAttribute, tollAttribute): 
                 with _util.tempMatrixMANAGER(description="Peak hour matrix") as peakHourMatrix:
                     
-                    with _m.logbook_trace("Calculating link costs"):
+                    with _m.logbook_trace("Calculating link costs"), self._tracker.stage("Link costs"):
                         networkCalculationTool(self._getLinkCostCalcSpec(costAttribute.id), scenario=self.Scenario)
                         self._tracker.completeSubtask()
                     
                     if self.SelectTollLinkExpression and not self.SelectTollLinkExpression.isspace():
                         #Only calculate tolls if the selector expression isn't empty or whitespace
-                        with _m.logbook_trace("Calculating link tolls"):
+                        with _m.logbook_trace("Calculating link tolls"), self._tracker.stage("Link tolls"):
                             try:
                                 networkCalculationTool(self._getLinkTollCalcSpec(tollAttribute.id), scenario=self.Scenario)
                                 self._tracker.completeSubtask()
                             except Exception, e:
                                 raise Exception("Error applying toll link selector expression: %s" %e)
                     
-                    with _m.logbook_trace("Calculating peak hour matrix"):
+                    with _m.logbook_trace("Calculating peak hour matrix"), self._tracker.stage("Peak hour matrix"):
                         matrixCalcTool(self._getPeakHourSpec(peakHourMatrix.id),scenario=self.Scenario)
                         self._tracker.completeSubtask()
                         
@@ -405,7 +407,7 @@ class TollBasedRoadAssignment(_m.Tool()):
                     appliedTollFactor = self._calculateAppliedTollFactor()
                     self._tracker.completeTask()
                     
-                    with _m.logbook_trace("Running primary road assignment."):
+                    with _m.logbook_trace("Running primary road assignment."), self._tracker.stage("Primary road assignment"):
                         print "Running primary road assignment"
                         
                         if self.SOLAFlag:
@@ -442,7 +444,8 @@ class TollBasedRoadAssignment(_m.Tool()):
                     with self._AoNScenarioMANAGER() as allOrNothingScenario:
                         self._tracker.completeSubtask
                         
-                        with _m.logbook_trace("All or nothing assignment to recover costs:"):
+                        with _m.logbook_trace("All or nothing assignment to recover costs:"), \
+                                self._tracker.stage("All-or-nothing assignment"):
                             print "Running all-or-nothing assignment to recover costs."
                             
                             with _m.logbook_trace("Copying auto times into UL2"):
@@ -464,6 +467,8 @@ class TollBasedRoadAssignment(_m.Tool()):
                                 
                                 self._tracker.runTool(trafficAssignmentTool,
                                                       spec, scenario= allOrNothingScenario)
+            
+            self._tracker.writeTimings()
         print "Road Assignment complete."
 
     ##########################################################################################################
@@ -79,6 +79,12 @@ Toll-Based Road Assignment
     3.3.2 Updated to allow for multi-threaded matrix calcs in 4.2.1+
 
     3.3.3 Assignment now includes on-link operating costs in generalized costs (instead of only tolls)
+
+    3.4.0 Added a warm start option (SOLA, Emme 4.3+). The secondary and tertiary assignments
+        solve the same problem as the primary assignment, so instead of re-converging from
+        zero flows they are replaced by path-based analyses of the paths stored by the
+        primary assignment. The iterations saved and the gaps reached are written to the
+        logbook.
         
     
 '''
@@ -104,7 +110,7 @@ def blankManager(obj):
 
 class TollBasedRoadAssignment(_m.Tool()):
     
-    version = '3.3.3'
+    version = '3.4.0'
     tool_run_msg = ""
     number_of_tasks = 5 # For progress reporting, enter the integer number of tasks here
     
@@ -136,6 +142,7 @@ class TollBasedRoadAssignment(_m.Tool()):
     
     PerformanceFlag = _m.Attribute(bool)
     SOLAFlag = _m.Attribute(bool)
+    WarmStartFlag = _m.Attribute(bool)
 
     NumberOfProcessors = _m.Attribute(int)
     
@@ -163,6 +170,7 @@ class TollBasedRoadAssignment(_m.Tool()):
             self.SOLAFlag = True
         else:
             self.SOLAFlag = False
+        self.WarmStartFlag = False
 
         self.NumberOfProcessors = multiprocessing.cpu_count()
 
@@ -314,6 +322,12 @@ class TollBasedRoadAssignment(_m.Tool()):
             pb.add_checkbox(tool_attribute_name= 'SOLAFlag',
                             label= "Use SOLA traffic assignment?")
         
+        if EMME_VERSION >= (4,3):
+            pb.add_checkbox(tool_attribute_name= 'WarmStartFlag',
+                            label= "Warm start the secondary and tertiary assignments?",
+                            note="SOLA only. Times and tolls are skimmed from the paths of the<br>\
+                                primary assignment instead of re-running it from zero flows.")
+        
         pb.add_html("""
 <script type="text/javascript">
     $(document).ready( function ()
@@ -362,7 +376,7 @@ class TollBasedRoadAssignment(_m.Tool()):
     
     def __call__(self, xtmf_ScenarioNumber, xtmf_DemandMatrixNumber, TimesMatrixId, CostMatrixId, TollsMatrixId,
                  PeakHourFactor, LinkCost, TollWeight, Iterations, rGap, brGap, normGap, PerformanceFlag,
-                 RunTitle, LinkTollAttributeId, SOLAFlag):
+                 RunTitle, LinkTollAttributeId, SOLAFlag, WarmStartFlag=False):
         
         #---1 Set up Scenario
         self.Scenario = _m.Modeller().emmebank.scenario(xtmf_ScenarioNumber)
@@ -399,6 +413,7 @@ class TollBasedRoadAssignment(_m.Tool()):
             self.SOLAFlag = SOLAFlag
         else:
             self.SOLAFlag = False
+        self.WarmStartFlag = WarmStartFlag
         
         #---3. Run
         try:
@@ -431,6 +446,10 @@ class TollBasedRoadAssignment(_m.Tool()):
                 else:
                     trafficAssignmentTool = _MODELLER.tool("inro.emme.traffic_assignment.standard_traffic_assignment")
             
+            warmStart = self._isWarmStartAvailable()
+            if warmStart:
+                pathAnalysisTool = _MODELLER.tool('inro.emme.traffic_assignment.path_based_traffic_analysis')
+            
             self._tracker.startProcess(5)
             
             self._initOutputMatrices()
@@ -492,6 +511,8 @@ class TollBasedRoadAssignment(_m.Tool()):
                     
                     print "Primary assignment complete at %s iterations." %number
                     print "Stopping criterion was %s with a value of %s." %(stoppingCriterion, val)
+                
+                warmStartedRuns = 0
 
                 self._tracker.startProcess(1)
                 with _m.logbook_trace("Secondary assignment to recover true travel times:"):
@@ -501,13 +522,18 @@ class TollBasedRoadAssignment(_m.Tool()):
                             self._tracker.completeSubtask
                         
                     with _m.logbook_trace("Running secondary assignment"):
-                        if self.SOLAFlag:
-                            spec = self._getSecondarySOLASpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
+                        if warmStart:
+                            self._tracker.runTool(pathAnalysisTool,
+                                                  self._getPathBasedAnalysisSpec(timeAttribute.id, self.TimesMatrixId), scenario=self.Scenario)
+                            warmStartedRuns += 1
                         else:
-                            spec = self._getSecondaryAssignmentSpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
-                                
-                        self._tracker.runTool(trafficAssignmentTool,
-                                                spec, scenario=self.Scenario)                  
+                            if self.SOLAFlag:
+                                spec = self._getSecondarySOLASpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
+                            else:
+                                spec = self._getSecondaryAssignmentSpec(peakHourMatrix.id, timeAttribute.id, appliedTollFactor, costAttribute.id)
+
+                            self._tracker.runTool(trafficAssignmentTool,
+                                                    spec, scenario=self.Scenario)
                     
                 self._tracker.startProcess(1)
                 if not (self.TollsMatrixId == "null" or self.TollsMatrixId == None):
@@ -527,13 +553,21 @@ class TollBasedRoadAssignment(_m.Tool()):
                         self._tracker.completeTask()
                         
                         with _m.logbook_trace("Running secondary assignment"):
-                            if self.SOLAFlag:
-                                spec = self._getTertiarySOLASpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
+                            if warmStart:
+                                self._tracker.runTool(pathAnalysisTool,
+                                                      self._getPathBasedAnalysisSpec(self.LinkTollAttributeId, self.TollsMatrixId), scenario=self.Scenario)
+                                warmStartedRuns += 1
                             else:
-                                spec = self._getTertiaryAssignmentSpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
-                                
-                            self._tracker.runTool(trafficAssignmentTool,
-                                                  spec, scenario=self.Scenario)                               
+                                if self.SOLAFlag:
+                                    spec = self._getTertiarySOLASpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
+                                else:
+                                    spec = self._getTertiaryAssignmentSpec(peakHourMatrix.id, appliedTollFactor, costAttribute.id)
+
+                                self._tracker.runTool(trafficAssignmentTool,
+                                                      spec, scenario=self.Scenario)
+                
+                if warmStart:
+                    self._writeWarmStartSummary(finalIteration, warmStartedRuns)
 
     ##########################################################################################################
 
@@ -674,6 +708,7 @@ class TollBasedRoadAssignment(_m.Tool()):
                 "Link Cost" : str(self.LinkCost),
                 "Toll Weight" : str(self.TollWeight),
                 "Iterations" : str(self.Iterations),
+                "Warm Start" : str(self.WarmStartFlag),
                 "self": self.__MODELLER_NAMESPACE__}
             
         return atts       
@@ -729,6 +764,29 @@ class TollBasedRoadAssignment(_m.Tool()):
             appliedTollFactor = 60.0 / self.TollWeight #Toll weight is in $/hr, needs to be converted to min/$
         return appliedTollFactor
     
+    def _isWarmStartAvailable(self):
+        if not self.WarmStartFlag: return False
+        if not self.SOLAFlag or EMME_VERSION < (4,3):
+            msg = "Warm start requires SOLA traffic assignment in Emme 4.3 or newer. Running every assignment from zero flows instead."
+            print msg
+            _m.logbook_write(msg)
+            return False
+        return True
+    
+    def _writeWarmStartSummary(self, finalIteration, warmStartedRuns):
+        #Each replaced assignment would have re-converged the same problem from zero flows
+        iterations = finalIteration['number']
+        gaps = finalIteration.get('gaps', {})
+        atts = {"Primary iterations": iterations,
+                "Assignments replaced": warmStartedRuns,
+                "Iterations saved": iterations * warmStartedRuns,
+                "Relative gap reached": gaps.get('relative'),
+                "Best relative gap reached": gaps.get('best_relative'),
+                "Normalized gap reached": gaps.get('normalized')}
+        _m.logbook_write("Warm start: %s assignments replaced, about %s iterations saved" %(warmStartedRuns, iterations * warmStartedRuns),
+                         attributes= atts)
+        print "Warm start saved about %s iterations." %(iterations * warmStartedRuns)
+    
     def _getPrimarySOLASpec(self, peakHourMatrixId, costAttributeId, appliedTollFactor):
         if self.PerformanceFlag:
             numberOfPocessors = multiprocessing.cpu_count()
@@ -1163,6 +1221,42 @@ class TollBasedRoadAssignment(_m.Tool()):
                                                }
                          }
     
+    def _getPathBasedAnalysisSpec(self, linkComponent, matrixId):
+        #Path analysis on the paths stored by the primary SOLA assignment (Emme 4.3+)
+        return {
+                "type": "PATH_BASED_TRAFFIC_ANALYSIS",
+                "classes": [
+                    {
+                        "path_analysis": {
+                            "link_component": linkComponent,
+                            "turn_component": None,
+                            "operator": "+",
+                            "selection_threshold": {
+                                "lower": None,
+                                "upper": None
+                            },
+                            "path_to_od_composition": {
+                                "considered_paths": "ALL",
+                                "multiply_path_proportions_by": {
+                                    "analyzed_demand": False,
+                                    "path_value": True
+                                }
+                            }
+                        },
+                        "cutoff_analysis": None,
+                        "traversal_analysis": None,
+                        "analysis": {
+                            "analyzed_demand": None,
+                            "results": {
+                                "od_values": matrixId,
+                                "selected_link_volumes": None,
+                                "selected_turn_volumes": None
+                            }
+                        }
+                    }
+                ]
+            }
+    
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
         return self._tracker.getProgress()
@@ -101,6 +101,12 @@ V4 Transit Assignment
 
     5.0.0 Forked
 
+    5.0.1 Stage timings and peak memory usage are written to the logbook.
+
+    5.1.0 The custom congestion function now looks up the conical parameters of each
+        ttf in a precomputed table (generated by congestion_functions) instead of
+        testing each ttf in turn.
+
 '''
 import traceback as _traceback
 from contextlib import contextmanager
@@ -114,6 +120,7 @@ _MODELLER = _m.Modeller() #Instantiate Modeller once.
 
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_congestion = _MODELLER.module('tmg.assignment.transit.congestion_functions')
 
 congestedAssignmentTool = _MODELLER.tool('inro.emme.transit_assignment.congested_transit_assignment')
 networkCalcTool = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
@@ -137,7 +144,7 @@ def blankManager(obj):
 
 class V4_FareBaseTransitAssignment(_m.Tool()):
     
-    version = '5.0.0'
+    version = '5.1.0'
     tool_run_msg = ""
     number_of_tasks = 7 # For progress reporting, enter the integer number of tasks here
     
@@ -770,7 +777,7 @@ class V4_FareBaseTransitAssignment(_m.Tool()):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
             
-            with _m.logbook_trace("Checking travel time functions"):
+            with _m.logbook_trace("Checking travel time functions"), self.TRACKER.stage("Travel time functions"):
                 changes = self._HealTravelTimeFunctions()
                 if changes == 0: _m.logbook_write("No problems were found")
             
@@ -801,31 +808,7 @@ class V4_FareBaseTransitAssignment(_m.Tool()):
             if self.ImpedanceMatrixId:
                 _util.initializeMatrix(id= self.ImpedanceMatrixId,
                                        description= "Transit impedances")
-                self.TRACKER.startProcess(3)
-                
-                self._AssignHeadwayFraction()
-                self.TRACKER.completeSubtask()
-
-                self._AssignEffectiveHeadway()
-                self.TRACKER.completeSubtask()
-                
-                self._AssignWalkPerception()
-                self.TRACKER.completeSubtask()
-                
-                spec = self._GetBaseAssignmentSpec()
-                
-                self.TRACKER.runTool(congestedAssignmentTool,
-                                        transit_assignment_spec= spec,
-                                        congestion_function= self._GetFuncSpec(),
-                                        stopping_criteria= self._GetStopSpec(),
-                                        impedances= _MODELLER.emmebank.matrix(self.ImpedanceMatrixId),
-                                        scenario= self.Scenario)                
-                
-                self._ExtractOutputMatrices()
-
-            else: 
-                with _util.tempMatrixMANAGER('Temp impedances') as impedanceMatrix:
-                                
+                with self.TRACKER.stage("Prepare network"):
                     self.TRACKER.startProcess(3)
                 
                     self._AssignHeadwayFraction()
@@ -837,17 +820,49 @@ class V4_FareBaseTransitAssignment(_m.Tool()):
                     self._AssignWalkPerception()
                     self.TRACKER.completeSubtask()
                 
-                    spec = self._GetBaseAssignmentSpec()
+                spec = self._GetBaseAssignmentSpec()
                 
+                with self.TRACKER.stage("Congested transit assignment"):
                     self.TRACKER.runTool(congestedAssignmentTool,
                                             transit_assignment_spec= spec,
                                             congestion_function= self._GetFuncSpec(),
                                             stopping_criteria= self._GetStopSpec(),
-                                            impedances= impedanceMatrix,
+                                            impedances= _MODELLER.emmebank.matrix(self.ImpedanceMatrixId),
                                             scenario= self.Scenario)                
                 
+                with self.TRACKER.stage("Output matrices"):
                     self._ExtractOutputMatrices()
 
+            else: 
+                with _util.tempMatrixMANAGER('Temp impedances') as impedanceMatrix:
+                                
+                    with self.TRACKER.stage("Prepare network"):
+                        self.TRACKER.startProcess(3)
+                
+                        self._AssignHeadwayFraction()
+                        self.TRACKER.completeSubtask()
+
+                        self._AssignEffectiveHeadway()
+                        self.TRACKER.completeSubtask()
+                
+                        self._AssignWalkPerception()
+                        self.TRACKER.completeSubtask()
+                
+                    spec = self._GetBaseAssignmentSpec()
+                
+                    with self.TRACKER.stage("Congested transit assignment"):
+                        self.TRACKER.runTool(congestedAssignmentTool,
+                                                transit_assignment_spec= spec,
+                                                congestion_function= self._GetFuncSpec(),
+                                                stopping_criteria= self._GetStopSpec(),
+                                                impedances= impedanceMatrix,
+                                                scenario= self.Scenario)                
+                
+                    with self.TRACKER.stage("Output matrices"):
+                        self._ExtractOutputMatrices()
+            
+            self.TRACKER.writeTimings()
+
     ##########################################################################################################
         
     #----SUB FUNCTIONS---------------------------------------------------------------------------------  
@@ -1134,43 +1149,7 @@ class V4_FareBaseTransitAssignment(_m.Tool()):
         return baseSpec
     
     def _GetFuncSpec(self):
-
-        parameterList = self._ParseExponentString()
-
-        partialSpec = """import math 
-def calc_segment_cost(transit_volume, capacity, segment): """
-
-        for count, item in enumerate(parameterList):
-            alpha = float(item[2])
-            beta = (2 * alpha - 1) / (2 * alpha - 2)
-            alphaSquare = alpha ** 2
-            betaSquare = beta ** 2
-            if count == 0:                
-                partialSpec += """
-    if segment.transit_time_func == """ + item[0] + """: 
-        return (""" + item[1] + """ * (1 + math.sqrt(""" + str(alphaSquare) + """ * 
-            (1 - transit_volume / capacity) ** 2 + """ + str(betaSquare) + """) - """ + str(alpha) + """ 
-            * (1 - transit_volume / capacity) - """ + str(beta) + """))"""
-            else: 
-                partialSpec += """
-    elif segment.transit_time_func == """ + item[0] + """: 
-        return (""" + item[1] + """ * (1 + math.sqrt(""" + str(alphaSquare) + """ *  
-            (1 - transit_volume / capacity) ** 2 + """ + str(betaSquare) + """) - """ + str(alpha) + """ 
-            * (1 - transit_volume / capacity) - """ + str(beta) + """))"""
-        
-        partialSpec += """
-    else: 
-        raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)"""
-            
-        funcSpec = {
-            "type": "CUSTOM",
-            "assignment_period": self.AssignmentPeriod,
-            "orig_func": False,
-            "congestion_attribute": "us3", #Hard-coded to US3
-            "python_function": partialSpec                     
-            }
-               
-        return funcSpec
+        return _congestion.getConicalFunctionSpec(self._ParseExponentString(), self.AssignmentPeriod)
     
     def _GetStopSpec(self):
         stopSpec = {
@@ -0,0 +1,161 @@
+'''
+    Copyright 2017 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+#---METADATA---------------------
+'''
+Transit Congestion Functions
+
+    Generates the custom (Python) conical congestion function used by the
+    congested transit assignment tools (V4_FBTA and multi_class_congested_FBTA).
+    The parameters of each ttf are precomputed into a table, so that the
+    function Emme calls for every segment in every iteration only does one
+    lookup and computes the volume-capacity term once.
+'''
+
+import time
+import random
+from collections import namedtuple
+import inro.modeller as _m
+
+##################################################################################################################
+
+class Face(_m.Tool()):
+
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Transit Congestion Functions",
+                                description="Collection of private functions used to generate \
+                                        the custom congestion function of the congested transit \
+                                        assignment tools.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" %str(self))
+
+        return pb.render()
+
+##################################################################################################################
+
+def getConicalParameters(parameterList):
+    '''
+    Computes the conical function parameters of each ttf.
+
+    Args:
+        - parameterList: A list of [ttf, weight, alpha] items (as strings or
+            numbers), such as returned by _ParseExponentString.
+
+    Returns: A dictionary of ttf : (weight, alpha squared, beta squared, alpha, beta).
+        If a ttf appears more than once, its first parameters are used.
+    '''
+    parameters = {}
+    for item in parameterList:
+        ttf = int(item[0])
+        if ttf in parameters: continue
+
+        weight = float(item[1])
+        alpha = float(item[2])
+        beta = (2 * alpha - 1) / (2 * alpha - 2)
+        parameters[ttf] = (weight, alpha ** 2, beta ** 2, alpha, beta)
+    return parameters
+
+def buildConicalFunctionSource(parameterList):
+    '''
+    Returns the source code of a calc_segment_cost function which looks up
+    the parameters of the segment's ttf in a precomputed table.
+    '''
+    parameters = getConicalParameters(parameterList)
+    rows = ["    %r: (%r, %r, %r, %r, %r)," %((ttf,) + parameters[ttf]) for ttf in sorted(parameters)]
+
+    return """import math
+_CONICAL_PARAMETERS = {
+%s
+    }
+def calc_segment_cost(transit_volume, capacity, segment):
+    try:
+        weight, alphaSquare, betaSquare, alpha, beta = _CONICAL_PARAMETERS[segment.transit_time_func]
+    except KeyError:
+        raise Exception("ttf=%%s congestion values not defined in input" %%segment.transit_time_func)
+    x = 1 - transit_volume / capacity
+    return weight * (1 + math.sqrt(alphaSquare * x ** 2 + betaSquare) - alpha * x - beta)""" %"\n".join(rows)
+
+def getConicalFunctionSpec(parameterList, assignmentPeriod):
+    '''
+    Returns the congestion function specification of the congested transit
+    assignment, for a custom conical function.
+    '''
+    return {
+            "type": "CUSTOM",
+            "assignment_period": assignmentPeriod,
+            "orig_func": False,
+            "congestion_attribute": "us3", #Hard-coded to US3
+            "python_function": buildConicalFunctionSource(parameterList)
+            }
+
+#-------------------------------------------------------------------------------------------
+
+def _buildBranchedFunctionSource(parameterList):
+    #The if/elif function generated before the table was introduced, kept for benchmarking
+    branches = []
+    for count, item in enumerate(parameterList):
+        weight, alphaSquare, betaSquare, alpha, beta = getConicalParameters([item])[int(item[0])]
+        branches.append("""
+    %s segment.transit_time_func == %s:
+        return (%r * (1 + math.sqrt(%r *
+            (1 - transit_volume / capacity) ** 2 + %r) - %r
+            * (1 - transit_volume / capacity) - %r))""" %('if' if count == 0 else 'elif', item[0], weight, alphaSquare, betaSquare, alpha, beta))
+
+    return """import math
+def calc_segment_cost(transit_volume, capacity, segment): %s
+    else:
+        raise Exception("ttf=%%s congestion values not defined in input" %%segment.transit_time_func)""" %"".join(branches)
+
+def _compileFunction(source):
+    namespace = {}
+    exec compile(source, '<congestion function>', 'exec') in namespace
+    return namespace['calc_segment_cost']
+
+_Segment = namedtuple('_Segment', ['transit_time_func'])
+
+def benchmarkConicalFunction(parameterList, numberOfSegments=100000, repetitions=10, seed=None):
+    '''
+    Times the table-driven congestion function against the if/elif function
+    over synthetic segments, outside of Emme. The volumes and capacities are
+    random, and the segments are spread evenly over the ttfs in parameterList.
+
+    Returns: A dictionary with the 'branched_time', 'table_time' (both in seconds
+        for all the repetitions), 'speedup' and 'max_difference' keys.
+    '''
+    rng = random.Random(seed)
+    ttfs = sorted(getConicalParameters(parameterList))
+    segments = [_Segment(rng.choice(ttfs)) for i in xrange(numberOfSegments)]
+    capacities = [rng.uniform(100.0, 2000.0) for i in xrange(numberOfSegments)]
+    volumes = [capacity * rng.uniform(0.0, 1.5) for capacity in capacities]
+
+    results = {}
+    for name, source in [('branched', _buildBranchedFunctionSource(parameterList)),
+                         ('table', buildConicalFunctionSource(parameterList))]:
+        function = _compileFunction(source)
+        start = time.time()
+        for i in xrange(repetitions):
+            costs = map(function, volumes, capacities, segments)
+        results[name + '_time'] = time.time() - start
+        results[name] = costs
+
+    branchedCosts, tableCosts = results.pop('branched'), results.pop('table')
+    results['max_difference'] = max(abs(a - b) for a, b in zip(branchedCosts, tableCosts)) if numberOfSegments else 0.0
+    results['speedup'] = results['branched_time'] / results['table_time'] if results['table_time'] > 0 else float('inf')
+    return results
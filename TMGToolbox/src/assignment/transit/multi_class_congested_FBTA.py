@@ -26,6 +26,7 @@ import inro.modeller as _m
 _MODELLER = _m.Modeller()
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_congestion = _MODELLER.module('tmg.assignment.transit.congestion_functions')
 congestedAssignmentTool = _MODELLER.tool('inro.emme.transit_assignment.congested_transit_assignment')
 extendedAssignmentTool =_MODELLER.tool('inro.emme.transit_assignment.extended_transit_assignment')
 networkCalcTool = _MODELLER.tool('inro.emme.network_calculation.network_calculator')
@@ -36,7 +37,7 @@ NullPointerException = _util.NullPointerException
 EMME_VERSION = _util.getEmmeVersion(tuple)
 
 class MultiClassTransitAssignment(_m.Tool()):
-    version = '1.0.0'
+    version = '1.2.0'
     tool_run_msg = ''
     number_of_tasks = 7
 
@@ -328,7 +329,7 @@ class MultiClassTransitAssignment(_m.Tool()):
 
     def _Execute(self):
         with _m.logbook_trace(name='{classname} v{version}'.format(classname=self.__class__.__name__, version=self.version), attributes=self._GetAtts()):
-            with _m.logbook_trace('Checking travel time functions'):
+            with _m.logbook_trace('Checking travel time functions'), self.TRACKER.stage('Travel time functions'):
                 changes = self._HealTravelTimeFunctions()
                 if changes == 0:
                     _m.logbook_write('No problems were found')
@@ -366,25 +367,29 @@ class MultiClassTransitAssignment(_m.Tool()):
                     self.ImpedanceMatrixList[i] = None
 
             with _util.tempMatrixMANAGER('Temp impedances') as impedanceMatrix:
-                self.TRACKER.startProcess(3)
-                self._AssignHeadwayFraction()
-                self.TRACKER.completeSubtask()
-                self._AssignEffectiveHeadway()
-                self.TRACKER.completeSubtask()
-                for i in range(0, len(self.ClassNames)):
-                    WalkPerceptionArray = self._ParsePerceptionString(i)
-                    self._AssignWalkPerception(WalkPerceptionArray, self.WalkAttributeIdList[i])
-
-                self.TRACKER.completeSubtask()
+                with self.TRACKER.stage('Prepare network'):
+                    self.TRACKER.startProcess(3)
+                    self._AssignHeadwayFraction()
+                    self.TRACKER.completeSubtask()
+                    self._AssignEffectiveHeadway()
+                    self.TRACKER.completeSubtask()
+                    for i in range(0, len(self.ClassNames)):
+                        WalkPerceptionArray = self._ParsePerceptionString(i)
+                        self._AssignWalkPerception(WalkPerceptionArray, self.WalkAttributeIdList[i])
+
+                    self.TRACKER.completeSubtask()
                 spec = self._GetBaseAssignmentSpec()
 
-                if self.xtmf_congestedAssignment==True:
-                    self.TRACKER.runTool(congestedAssignmentTool, transit_assignment_spec=spec, congestion_function=self._GetFuncSpec(), stopping_criteria=self._GetStopSpec(), class_names=self.ClassNames, scenario=self.Scenario)
-                else:
-                    for i in range(0, len(self.ClassNames)):
-                        specUncongested = self._GetBaseAssignmentSpecUncongested(i)
-                        self.TRACKER.runTool(extendedAssignmentTool, specification=specUncongested, class_name=self.ClassNames[i], scenario=self.Scenario, add_volumes=(i!=0))
-                self._ExtractOutputMatrices()
+                with self.TRACKER.stage('Transit assignment'):
+                    if self.xtmf_congestedAssignment==True:
+                        self.TRACKER.runTool(congestedAssignmentTool, transit_assignment_spec=spec, congestion_function=self._GetFuncSpec(), stopping_criteria=self._GetStopSpec(), class_names=self.ClassNames, scenario=self.Scenario)
+                    else:
+                        for i in range(0, len(self.ClassNames)):
+                            specUncongested = self._GetBaseAssignmentSpecUncongested(i)
+                            self.TRACKER.runTool(extendedAssignmentTool, specification=specUncongested, class_name=self.ClassNames[i], scenario=self.Scenario, add_volumes=(i!=0))
+                with self.TRACKER.stage('Output matrices'):
+                    self._ExtractOutputMatrices()
+            self.TRACKER.writeTimings()
 
     def _GetAtts(self):
         atts = {'Scenario': '%s - %s' % (self.Scenario, self.Scenario.title),
@@ -722,25 +727,7 @@ class MultiClassTransitAssignment(_m.Tool()):
             ]
         return baseSpec
     def _GetFuncSpec(self):
-        parameterList = self._ParseExponentString()
-        partialSpec = 'import math \ndef calc_segment_cost(transit_volume, capacity, segment): '
-        for count, item in enumerate(parameterList):
-            alpha = float(item[2])
-            beta = (2 * alpha - 1) / (2 * alpha - 2)
-            alphaSquare = alpha ** 2
-            betaSquare = beta ** 2
-            if count == 0:
-                partialSpec += '\n    if segment.transit_time_func == ' + item[0] + ': \n        return (' + item[1] + ' * (1 + math.sqrt(' + str(alphaSquare) + ' * \n            (1 - transit_volume / capacity) ** 2 + ' + str(betaSquare) + ') - ' + str(alpha) + ' \n            * (1 - transit_volume / capacity) - ' + str(beta) + '))'
-            else:
-                partialSpec += '\n    elif segment.transit_time_func == ' + item[0] + ': \n        return (' + item[1] + ' * (1 + math.sqrt(' + str(alphaSquare) + ' *  \n            (1 - transit_volume / capacity) ** 2 + ' + str(betaSquare) + ') - ' + str(alpha) + ' \n            * (1 - transit_volume / capacity) - ' + str(beta) + '))'
-
-        partialSpec += '\n    else: \n        raise Exception("ttf=%s congestion values not defined in input" %segment.transit_time_func)'
-        funcSpec = {'type': 'CUSTOM',
-         'assignment_period': self.AssignmentPeriod,
-         'orig_func': False,
-         'congestion_attribute': 'us3',
-         'python_function': partialSpec}
-        return funcSpec
+        return _congestion.getConicalFunctionSpec(self._ParseExponentString(), self.AssignmentPeriod)
 
     def _GetStopSpec(self):
         stopSpec = {'max_iterations': self.Iterations,
@@ -749,31 +736,32 @@ class MultiClassTransitAssignment(_m.Tool()):
         return stopSpec
 
     def _ExtractOutputMatrices(self):
-        for i, demand in enumerate(self.DemandMatrixList):
-            if self.InVehicleTimeMatrixList[i] or self.WalkTimeMatrixList[i] or self.WaitTimeMatrixList[i] or self.PenaltyMatrixList[i]:
-                self._ExtractTimesMatrices(i)
-            if not self.CongestionMatrixList[i] and self.InVehicleTimeMatrixList[i] and not self.CalculateCongestedIvttFlag:
-
-                def congestionMatrixManager():
-                    return _util.tempMatrixMANAGER()
-
-            else:
-
-                @contextmanager
-                def congestionMatrixManager():
-                    try:
-                        yield _MODELLER.emmebank.matrix(self.CongestionMatrixList[i])
-                    finally:
-                        pass
-
-            if self.xtmf_congestedAssignment==True:
-                if self.InVehicleTimeMatrixList[i] and not self.CalculateCongestedIvttFlag or self.CongestionMatrixList[i]:
-                    with congestionMatrixManager() as congestionMatrix:
-                        self._ExtractCongestionMatrix(congestionMatrix.id, i)
-                    if self.InVehicleTimeMatrixList[i] and not self.CalculateCongestedIvttFlag:
-                        self._FixRawIVTT(congestionMatrix.id, i)
-            if self.FareMatrixList[i]:
-                self._ExtractCostMatrix(i)
+        #Strategy analyses and matrix results only accept one class per call, but the
+        #raw in-vehicle times of all classes are fixed in a single matrix calculation.
+        fixIvttClasses = []
+        if self.xtmf_congestedAssignment==True and not self.CalculateCongestedIvttFlag:
+            fixIvttClasses = [i for i in range(len(self.DemandMatrixList)) if self.InVehicleTimeMatrixList[i]]
+        tempClasses = [i for i in fixIvttClasses if not self.CongestionMatrixList[i]]
+
+        with nested(*[_util.tempMatrixMANAGER() for i in tempClasses]) as tempMatrices:
+            congestionMatrixIds = dict((i, mtx.id) for i, mtx in zip(tempClasses, tempMatrices))
+
+            for i, demand in enumerate(self.DemandMatrixList):
+                with self.TRACKER.stage('Class %s skims' %self.ClassNames[i]):
+                    if self.InVehicleTimeMatrixList[i] or self.WalkTimeMatrixList[i] or self.WaitTimeMatrixList[i] or self.PenaltyMatrixList[i]:
+                        self._ExtractTimesMatrices(i)
+                    if self.xtmf_congestedAssignment==True and (i in fixIvttClasses or self.CongestionMatrixList[i]):
+                        self._ExtractCongestionMatrix(congestionMatrixIds.get(i, self.CongestionMatrixList[i]), i)
+                    if self.FareMatrixList[i]:
+                        self._ExtractCostMatrix(i)
+
+            if fixIvttClasses:
+                with self.TRACKER.stage('Fix in-vehicle times'):
+                    specs = [self._GetFixRawIVTTSpec(congestionMatrixIds.get(i, self.CongestionMatrixList[i]), i) for i in fixIvttClasses]
+                    if EMME_VERSION >= (4,2,1):
+                        matrixCalcTool(specs, scenario=self.Scenario, num_processors=self.NumberOfProcessors)
+                    else:
+                        matrixCalcTool(specs, scenario=self.Scenario)
 
     def _ExtractTimesMatrices(self, i):
         spec = {'by_mode_subset': {'modes': ['*'],
@@ -837,7 +825,7 @@ class MultiClassTransitAssignment(_m.Tool()):
         else:
             self.TRACKER.runTool(strategyAnalysisTool, spec, scenario= self.Scenario, class_name=self.ClassNames[i])
 
-    def _FixRawIVTT(self, congestionMatrix, i):
+    def _GetFixRawIVTTSpec(self, congestionMatrix, i):
         expression = '{mfivtt} - {mfcong}'.format(mfivtt=self.InVehicleTimeMatrixList[i], mfcong=congestionMatrix)
         matrixCalcSpec = {'expression': expression,
          'result': self.InVehicleTimeMatrixList[i],
@@ -846,7 +834,7 @@ class MultiClassTransitAssignment(_m.Tool()):
          'aggregation': {'origins': None,
                          'destinations': None},
          'type': 'MATRIX_CALCULATION'}
-        matrixCalcTool(matrixCalcSpec, scenario=self.Scenario)
+        return matrixCalcSpec
 
     def short_description(self):
         return 'MultiClass transit assignment tool for GTAModel V4'
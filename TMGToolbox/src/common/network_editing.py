@@ -20,6 +20,9 @@
 from inro.emme.network import Network
 import inro.modeller as _m
 import math as _math
+import heapq as _heapq
+from array import array as _array
+from time import time as _time
 from warnings import warn as _warn
 import traceback as _traceback
 _MODELLER = _m.Modeller()
@@ -511,6 +514,67 @@ def copyNetwork(network_to_copy):
 
 #===========================================================================================
 
+class TransitLineSelector():
+    '''
+    Evaluates network calculator selection expressions for transit lines (e.g.
+    "line=T_____ or mode=b") against a scenario, and remembers the IDs of the
+    lines selected by each expression. Tools which edit a Network object in
+    memory can then use the same line filters as the network calculator, without
+    publishing the network to evaluate them.
+
+    The expressions are evaluated on the scenario, so the selections only reflect
+    the attributes the lines have in the scenario (not any in-memory edits).
+
+    Example:
+        selector = TransitLineSelector(scenario)
+        for lineId in selector("mode=b"):
+            line = network.transit_line(lineId)
+    '''
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self._selections = {}
+
+    def __call__(self, expression):
+        '''Returns the (frozen) set of IDs of the lines selected by the expression.'''
+        if expression not in self._selections:
+            self.evaluate([expression])
+        return self._selections[expression]
+
+    def evaluate(self, expressions):
+        '''
+        Evaluates several expressions, re-using one temporary flag attribute.
+        Expressions which have already been evaluated are skipped.
+        '''
+        expressions = [e for e in set(expressions) if e not in self._selections]
+        if not expressions: return
+
+        try:
+            networkCalculationTool = _MODELLER.tool("inro.emme.network_calculation.network_calculator")
+        except Exception, e:
+            networkCalculationTool = _MODELLER.tool("inro.emme.standard.network_calculation.network_calculator")
+
+        with _util.tempExtraAttributeMANAGER(self.scenario, 'TRANSIT_LINE', returnId= True) as flagAttributeId:
+            for expression in expressions:
+                #Clear the flags of the previous expression first
+                networkCalculationTool(self._GetSpec(flagAttributeId, "0", "all"), self.scenario)
+                networkCalculationTool(self._GetSpec(flagAttributeId, "1", expression), self.scenario)
+
+                flags = _util.fastLoadTransitLineAttributes(self.scenario, [flagAttributeId])
+                self._selections[expression] = frozenset(id for id, line in flags.iteritems()
+                                                         if line[flagAttributeId] == 1)
+
+    def _GetSpec(self, flagAttributeId, value, expression):
+        return {
+                "result": flagAttributeId,
+                "expression": value,
+                "aggregation": None,
+                "selections": {
+                    "transit_line": expression
+                },
+                "type": "NETWORK_CALCULATION"
+                }
+
 #===========================================================================================
 
 #---
@@ -941,6 +1005,9 @@ class _ModeFilter():
 
 class AStarLinks():
     '''
+    REFERENCE IMPLEMENTATION - new code should use HeapAStarLinks (below),
+    which has the same interface and costing but is much faster.
+    
     Implementation of the A-Star (A*) shortest-path algorithm, using links
     to store pending costs. This is a SLOW implementation because I don't
     have access to a good priority queue implementation, which means the 
@@ -1243,5 +1310,424 @@ class AStarLinks():
 
 ###############################################################################################
 
+class HeapAStarLinks():
+    '''
+    Faster implementation of the link-based A-Star (A*) shortest-path
+    algorithm. Link, turn and heuristic costs are identical to AStarLinks,
+    but:
+        - Links are prioritized by the cost to reach their j-node (i.e., 
+            including the link's own cost) plus the heuristic. AStarLinks
+            omits the link's own cost, which sometimes causes it to close
+            nodes too early and return a sub-optimal path. As a result, the
+            paths returned by this class can differ from (and be cheaper
+            than) those returned by AStarLinks.
+        - The open list is a binary heap (heapq) with lazy decrease-key:
+            improved links are simply re-pushed, and stale entries are
+            skipped when popped. No sorting is done inside the main loop.
+        - No temporary attributes are created on the network. Instead,
+            links and nodes are numbered once, and per-query state (pending
+            cost, previous link, degree, closed flags) is kept in compact
+            arrays indexed by those numbers. Arrays are 'reset' between
+            queries by incrementing a query stamp, rather than re-allocated.
+        - Link costs, turn costs and the adjacency (successor) lists are
+            prepared once per link filter and re-used between queries. This
+            assumes that the network and the cost functions do not change
+            in-between queries; call reset() if they do.
+    
+    USAGE:
+    - Instantiate this class exactly like AStarLinks: 
+        algo = HeapAStarLinks(network, link_speed_unit, link_speed_func,
+                              link_penalty_func, turn_penalty_func)
+    
+    - algo.calcPath(start, end, mode=None) returns the list of links making 
+        up the shortest path between the start and end nodes, or [] if no 
+        path is found. Unlike AStarLinks, the maximum link speed is NOT 
+        re-calculated on every call unless reset_max_speed=True is given.
+    
+    - algo.calcPaths(pairs, mode=None) takes an iterable of (start, end) 
+        node pairs and returns a list of paths (one for each pair). The 
+        prepared adjacency is re-used for all pairs.
+    
+    - The public properties max_degrees, link_filter and coord_factor 
+        behave as they do in AStarLinks. The context manager interface is
+        kept for compatibility, although there is nothing to clean up.
+    '''
+    
+    def __init__(self, network,
+                 link_speed_unit=1.0, 
+                 link_speed_func=None,
+                 link_penalty_func=None,
+                 turn_penalty_func=None):
+        
+        #Private variables
+        self.__speedFactor = link_speed_unit
+        
+        self.__getLinkSpeed = link_speed_func
+        if link_speed_func == None:
+            self.__getLinkSpeed = self.__speedInUl2
+        
+        self.__calcTurnCost = turn_penalty_func
+        if turn_penalty_func == None:
+            self.__calcTurnCost = self.__zeroTurnPenalty
+        
+        self.__calcLinkPenalty = link_penalty_func
+        if link_penalty_func == None:
+            self.__calcLinkPenalty = self.__zeroLinkPenalty
+        
+        self.__network = network
+        self.__prepared = {} # link_filter -> _PreparedLinkGraph
+        self.__modeFilters = {} # mode id -> _ModeFilter, so that prepared graphs can be re-used
+        
+        #Public variables
+        self.coord_factor = _MODELLER.emmebank.coord_unit_length
+        self.max_degrees = 20
+        self.link_filter = self.__nullFilter
+        
+        #Link & node numbering, which does not depend on the filter
+        self.__links = [link for link in network.links()]
+        self.__nodeIndex = {}
+        self.__nodes = []
+        nodeX = _array('d')
+        nodeY = _array('d')
+        for node in network.nodes():
+            self.__nodeIndex[node.number] = len(self.__nodes)
+            self.__nodes.append(node)
+            nodeX.append(node.x)
+            nodeY.append(node.y)
+        self.__nodeX = nodeX
+        self.__nodeY = nodeY
+        
+        self.__linkIndex = {}
+        linkJ = _array('l')
+        for index, link in enumerate(self.__links):
+            self.__linkIndex[(link.i_node.number, link.j_node.number)] = index
+            linkJ.append(self.__nodeIndex[link.j_node.number])
+        self.__linkJ = linkJ
+        
+        #Per-query state. The last link slot is reserved for the destination.
+        nLinks = len(self.__links)
+        nNodes = len(self.__nodes)
+        self.__pendingCost = _array('d', [0.0]) * (nLinks + 1)
+        self.__degree = _array('l', [0]) * (nLinks + 1)
+        self.__previousLink = _array('l', [-1]) * (nLinks + 1)
+        self.__linkStamp = _array('l', [0]) * (nLinks + 1) #Link state is valid iff stamp == current query
+        self.__settledStamp = _array('l', [0]) * (nLinks + 1)
+        self.__closedStamp = _array('l', [0]) * nNodes
+        self.__query = 0
+    
+    def reset(self):
+        '''
+        Discards the prepared link costs & adjacency. Call this if link or turn 
+        attributes used by the cost functions have been modified since the last
+        query.
+        '''
+        self.__prepared = {}
+    
+    def calcPath(self, start, end, mode=None, reset_max_speed=False, prior_link=None):
+        if start.network != self.__network:
+            raise Exception("Start node does not belong to prepared network or is not a node")
+        if end.network != self.__network:
+            raise Exception("End node does not belong to prepared network or is not a node")
+        
+        if mode:
+            self.link_filter = self.__getModeFilter(mode)
+        if reset_max_speed:
+            self.reset()
+        graph = self.__prepare(self.link_filter)
+        
+        return self.__search(graph, self.__nodeIndex[start.number], self.__nodeIndex[end.number])
+    
+    def calcPaths(self, pairs, mode=None):
+        '''
+        Batch version of calcPath.
+        
+        Args:
+            - pairs: Iterable of (start, end) node tuples
+            - mode (=None): Optional Emme mode object to filter links.
+        
+        Returns: A list of paths (each path being a list of links), in the same
+            order as the given pairs.
+        '''
+        if mode:
+            self.link_filter = self.__getModeFilter(mode)
+        graph = self.__prepare(self.link_filter)
+        
+        paths = []
+        for start, end in pairs:
+            if start.network != self.__network:
+                raise Exception("Start node does not belong to prepared network or is not a node")
+            if end.network != self.__network:
+                raise Exception("End node does not belong to prepared network or is not a node")
+            paths.append(self.__search(graph, self.__nodeIndex[start.number], self.__nodeIndex[end.number]))
+        return paths
+    
+    ##############################################################
+    #---HELPER METHODS
+    
+    def __getModeFilter(self, mode):
+        if not mode.id in self.__modeFilters:
+            self.__modeFilters[mode.id] = _ModeFilter(mode)
+        return self.__modeFilters[mode.id]
+    
+    def __prepare(self, linkFilter):
+        if linkFilter in self.__prepared:
+            return self.__prepared[linkFilter]
+        
+        links = self.__links
+        linkIndex = self.__linkIndex
+        nLinks = len(links)
+        
+        isValid = [bool(linkFilter(link)) for link in links]
+        
+        #Link costs & max speed
+        maxSpeed = 0.0
+        linkCost = _array('d', [float('inf')]) * nLinks
+        for index, link in enumerate(links):
+            if not isValid[index]: continue
+            speed = self.__getLinkSpeed(link) * self.__speedFactor
+            if speed > maxSpeed:
+                maxSpeed = speed
+            if speed > 0:
+                linkCost[index] = link.length / speed + self.__calcLinkPenalty(link)
+        if not any(isValid):
+            _warn("Filter function returns no valid links")
+        
+        #Adjacency lists, including turn costs. Successors of a link at a regular 
+        #node get a turn cost of 0 and are subject to the closed-node check; 
+        #successors at intersections are not.
+        successors = [None] * nLinks
+        for index, link in enumerate(links):
+            if not isValid[index]: continue
+            jNode = link.j_node
+            adjacent = []
+            if jNode.is_intersection:
+                for turn in link.outgoing_turns():
+                    if turn.penalty_func == 0: continue #Skip prohibited turns
+                    toIndex = linkIndex[(turn.to_link.i_node.number, turn.to_link.j_node.number)]
+                    if not isValid[toIndex]: continue
+                    adjacent.append((toIndex, self.__calcTurnCost(turn)))
+            else:
+                for toLink in jNode.outgoing_links():
+                    if toLink.j_node.is_intersection and toLink.j_node == link.i_node:
+                        continue #Skip u-turns connected to an intersection nodes (which don't get closed)
+                    toIndex = linkIndex[(toLink.i_node.number, toLink.j_node.number)]
+                    if not isValid[toIndex]: continue
+                    adjacent.append((toIndex, 0.0))
+            successors[index] = tuple(adjacent)
+        
+        graph = _PreparedLinkGraph(isValid, linkCost, successors, maxSpeed)
+        self.__prepared[linkFilter] = graph
+        return graph
+    
+    def __search(self, graph, startIndex, endIndex):
+        self.__query += 1
+        query = self.__query
+        
+        isValid = graph.is_valid
+        linkCost = graph.link_cost
+        successors = graph.successors
+        maxSpeed = graph.max_speed
+        
+        linkJ = self.__linkJ
+        nodeX = self.__nodeX
+        nodeY = self.__nodeY
+        pendingCost = self.__pendingCost
+        degree = self.__degree
+        previousLink = self.__previousLink
+        linkStamp = self.__linkStamp
+        settledStamp = self.__settledStamp
+        closedStamp = self.__closedStamp
+        maxDegrees = self.max_degrees
+        destination = len(self.__links)
+        
+        ex = nodeX[endIndex]
+        ey = nodeY[endIndex]
+        factor = self.coord_factor
+        def heuristic(nodeIndex):
+            if maxSpeed <= 0: return 0.0
+            dx = nodeX[nodeIndex] - ex
+            dy = nodeY[nodeIndex] - ey
+            return _math.sqrt(dx*dx + dy*dy) * factor / maxSpeed
+        
+        heap = []
+        push = _heapq.heappush
+        pop = _heapq.heappop
+        counter = 0 #Tie-breaker, to keep the search deterministic
+        
+        #---Visit the starting node
+        closedStamp[startIndex] = query
+        startNode = self.__nodes[startIndex]
+        count = 0
+        for link in startNode.outgoing_links():
+            index = self.__linkIndex[(link.i_node.number, link.j_node.number)]
+            if not isValid[index]: continue
+            pendingCost[index] = 0.0
+            degree[index] = 0
+            previousLink[index] = -1
+            linkStamp[index] = query
+            push(heap, (linkCost[index] + heuristic(linkJ[index]), counter, index))
+            counter += 1
+            count += 1
+        if count == 0:
+            _warn("Start node has no valid outgoing links")
+            return []
+        
+        endNode = self.__nodes[endIndex]
+        count = 0
+        for link in endNode.incoming_links():
+            if isValid[self.__linkIndex[(link.i_node.number, link.j_node.number)]]:
+                count += 1
+        if count == 0:
+            _warn("End node has no valid incoming links")
+            return []
+        
+        pendingCost[destination] = float('inf')
+        previousLink[destination] = -1
+        linkStamp[destination] = query
+        
+        #---MAIN LOOP
+        while heap:
+            estimate, tie, index = pop(heap)
+            if settledStamp[index] == query:
+                continue #Stale entry (lazy decrease-key)
+            settledStamp[index] = query
+            
+            #---Check for completion
+            if index == destination:
+                return self.__constructPath(destination)
+            
+            if degree[index] > maxDegrees:
+                continue #Link is too many jumps from start
+            
+            cost = linkCost[index]
+            if cost < 0:
+                raise Exception("Cost for link %s was negative" %self.__links[index])
+            baseCost = pendingCost[index] + cost
+            nextDegree = degree[index] + 1
+            
+            jIndex = linkJ[index]
+            #Link is connected to the end-node
+            if jIndex == endIndex:
+                if baseCost < pendingCost[destination]:
+                    pendingCost[destination] = baseCost
+                    previousLink[destination] = index
+                    degree[destination] = nextDegree
+                    push(heap, (baseCost, counter, destination))
+                    counter += 1
+                continue
+            
+            isRegular = not self.__nodes[jIndex].is_intersection
+            for toIndex, turnCost in successors[index]:
+                if isRegular and closedStamp[linkJ[toIndex]] == query:
+                    continue #Skip closed nodes
+                if settledStamp[toIndex] == query:
+                    continue
+                updatedCost = baseCost + turnCost
+                if linkStamp[toIndex] != query or updatedCost < pendingCost[toIndex]:
+                    linkStamp[toIndex] = query
+                    pendingCost[toIndex] = updatedCost
+                    previousLink[toIndex] = index
+                    degree[toIndex] = nextDegree
+                    push(heap, (updatedCost + linkCost[toIndex] + heuristic(linkJ[toIndex]), counter, toIndex))
+                    counter += 1
+            if isRegular:
+                closedStamp[jIndex] = query #Only close nodes which are not intersections
+        
+        return [] #Priority queue is empty, shortest-path not found
+    
+    def __constructPath(self, destination):
+        if self.__pendingCost[destination] == float('inf'):
+            return [] #Start & end nodes are connected but path cost is infeasible
+        
+        path = []
+        index = self.__previousLink[destination]
+        while index >= 0:
+            path.append(self.__links[index])
+            index = self.__previousLink[index]
+        path.reverse()
+        return path
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args, **kwargs):
+        pass
+    
+    #####################################################
+    #---DEFAULT LAMBDAS
+        
+    def __speedInUl2(self, link):
+        return link.data2
+    
+    def __zeroTurnPenalty(self, turn):
+        return 0.0
+    
+    def __nullFilter(self, link):
+        return True
+    
+    def __zeroLinkPenalty(self, link):
+        return 0.0
 
-    
\ No newline at end of file
+class _PreparedLinkGraph():
+    '''
+    Link costs & adjacency for one link filter, used by HeapAStarLinks.
+    '''
+    def __init__(self, isValid, linkCost, successors, maxSpeed):
+        self.is_valid = isValid
+        self.link_cost = linkCost
+        self.successors = successors
+        self.max_speed = maxSpeed
+
+def benchmarkAStar(network, pairs, repetitions=1, **kwargs):
+    '''
+    Runs the reference AStarLinks and the HeapAStarLinks algorithms over the same 
+    set of OD pairs, and compares their run times and results.
+    
+    Args:
+        - network: A valid Emme Network object
+        - pairs: List of (start, end) node tuples
+        - repetitions (=1): Number of times to repeat the full set of pairs
+        - **kwargs: Any keyword arguments accepted by the AStarLinks constructor, 
+                plus 'max_degrees' and 'link_filter'.
+    
+    Returns: A dictionary with the keys 'reference_time', 'heap_time', 'speedup', 
+        'n_queries' and 'n_mismatched' (number of pairs for which the two
+        algorithms returned different paths - this can happen legitimately
+        when two paths have the same cost).
+    '''
+    maxDegrees = kwargs.pop('max_degrees', None)
+    linkFilter = kwargs.pop('link_filter', None)
+    
+    def configure(algo):
+        if maxDegrees is not None: algo.max_degrees = maxDegrees
+        if linkFilter is not None: algo.link_filter = linkFilter
+        return algo
+    
+    referencePaths = []
+    with configure(AStarLinks(network, **kwargs)) as algo:
+        referenceStart = _time()
+        for rep in xrange(repetitions):
+            referencePaths = [algo.calcPath(start, end) for start, end in pairs]
+        referenceTime = _time() - referenceStart
+    
+    with configure(HeapAStarLinks(network, **kwargs)) as algo:
+        heapStart = _time()
+        for rep in xrange(repetitions):
+            heapPaths = algo.calcPaths(pairs)
+        heapTime = _time() - heapStart
+    
+    nMismatched = 0
+    for referencePath, heapPath in _util.itersync(referencePaths, heapPaths):
+        referenceIds = [(link.i_node.number, link.j_node.number) for link in referencePath]
+        heapIds = [(link.i_node.number, link.j_node.number) for link in heapPath]
+        if referenceIds != heapIds:
+            nMismatched += 1
+    
+    speedup = referenceTime / heapTime if heapTime > 0 else float('inf')
+    return {'reference_time': referenceTime,
+            'heap_time': heapTime,
+            'speedup': speedup,
+            'n_queries': len(pairs) * repetitions,
+            'n_mismatched': nMismatched}
+
+###############################################################################################
@@ -1,4 +1,5 @@
 import warnings as warn
+from itertools import chain
 from inro.emme.matrix import MatrixData
 import inro.modeller as _m
 mm = _m.Modeller()
@@ -21,7 +22,118 @@ try:
     import pandas as pd
     import numpy as np
 
-    def load_node_dataframe(scenario, pythonize_exatts = False):
+    # Cache of the element indices built from get_attribute_values, keyed on (emmebank path, scenario
+    # number, domain). Each entry holds the raw index returned by Emme, which is compared (in C) to the
+    # current one, so an index is only rebuilt when the network itself has changed.
+    _index_cache = {}
+
+    def clear_index_cache():
+        '''Clears the cached element indices of all scenarios.'''
+        _index_cache.clear()
+
+    def _build_node_index(index_data):
+        n = len(index_data)
+        numbers = np.fromiter(index_data.iterkeys(), np.int64, n)
+        positions = np.fromiter(index_data.itervalues(), np.int64, n)
+
+        order = numbers.argsort(kind='mergesort')
+        return pd.Index(numbers[order], name='i'), positions[order]
+
+    def _build_link_index(index_data):
+        counts = np.fromiter((len(outgoing_data) for outgoing_data in index_data.itervalues()), np.int64,
+                             len(index_data))
+        n = int(counts.sum())
+        i_nodes = np.repeat(np.fromiter(index_data.iterkeys(), np.int64, len(index_data)), counts)
+        j_nodes = np.fromiter(chain.from_iterable(outgoing_data.iterkeys() for outgoing_data in index_data.itervalues()),
+                              np.int64, n)
+        positions = np.fromiter(chain.from_iterable(outgoing_data.itervalues() for outgoing_data in index_data.itervalues()),
+                                np.int64, n)
+
+        order = np.lexsort((j_nodes, i_nodes))
+        index = pd.MultiIndex.from_arrays([i_nodes[order], j_nodes[order]], names=['i', 'j'])
+        return index, positions[order]
+
+    def _build_turn_index(index_data):
+        counts = np.fromiter((len(outgoing_data) for outgoing_data in index_data.itervalues()), np.int64,
+                             len(index_data))
+        n = int(counts.sum())
+        ij_nodes = np.fromiter(chain.from_iterable(index_data.iterkeys()), np.int64, 2 * len(index_data)).reshape(-1, 2)
+        i_nodes = np.repeat(ij_nodes[:, 0], counts)
+        j_nodes = np.repeat(ij_nodes[:, 1], counts)
+        k_nodes = np.fromiter(chain.from_iterable(outgoing_data.iterkeys() for outgoing_data in index_data.itervalues()),
+                              np.int64, n)
+        positions = np.fromiter(chain.from_iterable(outgoing_data.itervalues() for outgoing_data in index_data.itervalues()),
+                                np.int64, n)
+
+        order = np.lexsort((k_nodes, j_nodes, i_nodes))
+        index = pd.MultiIndex.from_arrays([i_nodes[order], j_nodes[order], k_nodes[order]], names=['i', 'j', 'k'])
+        return index, positions[order]
+
+    def _build_transit_line_index(index_data):
+        line_ids = np.array(index_data.keys(), dtype=object)
+        positions = np.fromiter(index_data.itervalues(), np.int64, len(index_data))
+
+        order = line_ids.argsort(kind='mergesort')
+        return pd.Index(line_ids[order], name='line'), positions[order]
+
+    def _build_transit_segment_index(index_data):
+        counts = np.fromiter((len(segment_data) for segment_data in index_data.itervalues()), np.int64,
+                             len(index_data))
+        n = int(counts.sum())
+        line_ids = np.repeat(np.array(index_data.keys(), dtype=object), counts)
+        keys = list(chain.from_iterable(segment_data.iterkeys() for segment_data in index_data.itervalues()))
+        i_nodes = np.fromiter((key[0] for key in keys), np.int64, n)
+        j_nodes = np.fromiter((key[1] for key in keys), np.int64, n)
+        loops = np.fromiter((key[2] if len(key) == 3 else 1 for key in keys), np.int64, n)
+        positions = np.fromiter(chain.from_iterable(segment_data.itervalues() for segment_data in index_data.itervalues()),
+                                np.int64, n)
+
+        order = np.lexsort((loops, j_nodes, i_nodes, line_ids))
+        index = pd.MultiIndex.from_arrays([line_ids[order], i_nodes[order], j_nodes[order], loops[order]],
+                                          names=['line', 'i', 'j', 'loop'])
+        return index, positions[order]
+
+    _index_builders = {'NODE': _build_node_index,
+                       'LINK': _build_link_index,
+                       'TURN': _build_turn_index,
+                       'TRANSIT_LINE': _build_transit_line_index,
+                       'TRANSIT_SEGMENT': _build_transit_segment_index}
+
+    def _get_element_index(scenario, domain, index_data):
+        '''
+        Gets the (sorted) Index of the elements of a domain, built directly from NumPy arrays, along
+        with the position of each element in the tables returned by scenario.get_attribute_values.
+        The index is re-used for as long as the scenario's network is unchanged.
+
+        Returns: Index or MultiIndex, int64 array of positions
+        '''
+        key = (scenario.emmebank.path, scenario.number, domain)
+        cached = _index_cache.get(key)
+        if cached is not None and cached[0] == index_data:
+            return cached[1], cached[2]
+
+        index, positions = _index_builders[domain](index_data)
+        _index_cache[key] = index_data, index, positions
+        return index, positions
+
+    def _load_dataframe(scenario, domain, attributes, pythonize_exatts):
+        if attributes is None:
+            attributes = scenario.attributes(domain)
+            if domain == 'LINK' and "vertices" in attributes: attributes.remove("vertices")
+        else:
+            attributes = list(attributes)
+
+        package = scenario.get_attribute_values(domain, attributes)
+        index, positions = _get_element_index(scenario, domain, package[0])
+        tables = package[1:]
+
+        if pythonize_exatts:
+            attributes = [attname.replace("@", "x_")  for attname in attributes]
+
+        columns = dict((attr_name, np.asarray(table).take(positions)) for attr_name, table in zip(attributes, tables))
+        return pd.DataFrame(columns, index=index, columns=attributes)
+
+    def load_node_dataframe(scenario, pythonize_exatts = False, attributes = None):
         '''
         Creates a table for node attributes in a scenario.
 
@@ -29,31 +141,17 @@ try:
             scenario: An instance of inro.emme.scenario.Scenario
             pythonize_exatts: Flag to make extra attribute names 'Pythonic'. If set
                 to True, then "@stn1" will become "x_stn1".
+            attributes: List of the attributes to load. If None, all attributes are loaded.
 
         Returns:
 
         '''
-        attr_list = scenario.attributes("NODE")
-        package = scenario.get_attribute_values("NODE", attr_list)
-
-        node_indexer = pd.Series(package[0])
-        node_indexer.index.name = 'i'
-        tables = package[1:]
-
-        if pythonize_exatts:
-            attr_list = [attname.replace("@", "x_")  for attname in attr_list]
-
-        df = pd.DataFrame(index=node_indexer.index)
-        for attr_name, table in zip(attr_list, tables):
-            data_array = np.array(table)
-            reindexed = data_array.take(node_indexer.values)
-            df[attr_name] = reindexed
-
+        df = _load_dataframe(scenario, "NODE", attributes, pythonize_exatts)
         df['is_centroid'] = df.index.isin(scenario.zone_numbers)
 
         return df
 
-    def load_link_dataframe(scenario, pythonize_exatts = False):
+    def load_link_dataframe(scenario, pythonize_exatts = False, attributes = None):
         '''
         Creates a table for link attributes in a scenario.
 
@@ -61,36 +159,15 @@ try:
             scenario: An instance of inro.emme.scenario.Scenario
             pythonize_exatts: Flag to make extra attribute names 'Pythonic'. If set
                 to True, then "@stn1" will become "x_stn1".
+            attributes: List of the attributes to load. If None, all attributes (except
+                'vertices') are loaded.
 
         Returns: pandas.DataFrame
 
         '''
-        attr_list = scenario.attributes('LINK')
-        if "vertices" in attr_list: attr_list.remove("vertices")
-
-        data_pack = scenario.get_attribute_values('LINK', attr_list)
-        data_positions = data_pack[0]
-        tables = data_pack[1:]
+        return _load_dataframe(scenario, 'LINK', attributes, pythonize_exatts)
 
-        link_indexer = {}
-        for i, outgoing_data in data_positions.iteritems():
-            for j, pos in outgoing_data.iteritems():
-                link_indexer[(i,j)] = pos
-        link_indexer = pd.Series(link_indexer)
-        link_indexer.index.names = 'i j'.split()
-
-        if pythonize_exatts:
-            attr_list = [attname.replace("@", "x_")  for attname in attr_list]
-
-        df = pd.DataFrame(index= link_indexer.index)
-        for attr_name, table in zip(attr_list, tables):
-            data_array = np.array(table)
-            reindexed = data_array.take(link_indexer.values)
-            df[attr_name] = reindexed
-
-        return df
-
-    def load_turn_dataframe(scenario, pythonize_exatts = False):
+    def load_turn_dataframe(scenario, pythonize_exatts = False, attributes = None):
         '''
         Creates a table for turn attributes in a scenario.
 
@@ -98,39 +175,18 @@ try:
             scenario: An instance of inro.emme.scenario.Scenario
             pythonize_exatts: Flag to make extra attribute names 'Pythonic'. If set
                 to True, then "@stn1" will become "x_stn1".
+            attributes: List of the attributes to load. If None, all attributes are loaded.
 
         Returns:
             A dataframe with the results.  None if there are no turns.
         '''
-        attr_list = scenario.attributes("TURN")
-        package = scenario.get_attribute_values("TURN", attr_list)
-
-        index_data = package[0]
-        tables = package[1:]
-
-        turn_index = []
-        indexer_values = []
-
-        for (i,j), outgoing_data in index_data.iteritems():
-            for k, pos in outgoing_data.iteritems():
-                turn_index.append((i,j,k))
-                indexer_values.append(pos)
-        if len(turn_index) == 0:
+        df = _load_dataframe(scenario, "TURN", attributes, pythonize_exatts)
+        if len(df) == 0:
             return None
-        turn_indexer = pd.Series(indexer_values, pd.MultiIndex.from_tuples(turn_index, names=['i', 'j', 'k']))
-
-        if pythonize_exatts:
-            attr_list = [attname.replace("@", "x_")  for attname in attr_list]
-
-        df = pd.DataFrame(index= turn_indexer.index)
-        for attr_name, table in zip(attr_list, tables):
-            data_array = np.array(table)
-            reindexed = data_array.take(turn_indexer.values)
-            df[attr_name] = reindexed
 
         return df
 
-    def load_transit_line_dataframe(scenario, pythonize_exatts = False):
+    def load_transit_line_dataframe(scenario, pythonize_exatts = False, attributes = None):
         '''
         Creates a table for transit line attributes in a scenario.
 
@@ -138,27 +194,12 @@ try:
             scenario: An instance of inro.emme.scenario.Scenario
             pythonize_exatts: Flag to make extra attribute names 'Pythonic'. If set
                 to True, then "@stn1" will become "x_stn1".
+            attributes: List of the attributes to load. If None, all attributes are loaded.
 
         Returns:
 
         '''
-        attr_list = scenario.attributes("TRANSIT_LINE")
-        package = scenario.get_attribute_values("TRANSIT_LINE", attr_list)
-
-        line_indexer = pd.Series(package[0])
-        line_indexer.index.name = 'line'
-        tables = package[1:]
-
-        if pythonize_exatts:
-            attr_list = [attname.replace("@", "x_")  for attname in attr_list]
-
-        df = pd.DataFrame(index=line_indexer.index)
-        for attr_name, table in zip(attr_list, tables):
-            data_array = np.array(table)
-            reindexed = data_array.take(line_indexer.values)
-            df[attr_name] = reindexed
-
-        return df
+        return _load_dataframe(scenario, "TRANSIT_LINE", attributes, pythonize_exatts)
 
     def matrix_to_pandas(mtx, scenario_id=None):
         '''
@@ -217,7 +258,7 @@ try:
             return md
         else: raise TypeError("Expected a Series or DataFrame, got %s" %type(series_or_dataframe))
 
-    def load_transit_segment_dataframe(scenario, pythonize_exatts = False):
+    def load_transit_segment_dataframe(scenario, pythonize_exatts = False, attributes = None):
         '''
         Creates a table for transit segment attributes in a scenario.
 
@@ -225,38 +266,12 @@ try:
             scenario: An instance of inro.emme.scenario.Scenario
             pythonize_exatts: Flag to make extra attribute names 'Pythonic'. If set
                 to True, then "@stn1" will become "x_stn1".
+            attributes: List of the attributes to load. If None, all attributes are loaded.
 
         Returns:
 
         '''
-        attr_list = scenario.attributes("TRANSIT_SEGMENT")
-        package = scenario.get_attribute_values("TRANSIT_SEGMENT", attr_list)
-
-        index_data = package[0]
-        tables = package[1:]
-
-        segment_indexer = {}
-        for line, segment_data in index_data.iteritems():
-            for tupl, pos in segment_data.iteritems():
-                if len(tupl) == 3: i,j, loop = tupl
-                else:
-                    i,j = tupl
-                    loop = 1
-
-                segment_indexer[(line, i, j, loop)] = pos
-        segment_indexer = pd.Series(segment_indexer)
-        segment_indexer.index.names = "line i j loop".split()
-
-        if pythonize_exatts:
-            attr_list = [attname.replace("@", "x_")  for attname in attr_list]
-
-        df = pd.DataFrame(index=segment_indexer.index)
-        for attr_name, table in zip(attr_list, tables):
-            data_array = np.array(table)
-            reindexed = data_array.take(segment_indexer.values)
-            df[attr_name] = reindexed
-
-        return df
+        return _load_dataframe(scenario, "TRANSIT_SEGMENT", attributes, pythonize_exatts)
 
     def _align_multiindex(index, levels_to_keep):
         '''Removes levels of a MultiIndex that are not required for the join.'''
@@ -313,11 +328,140 @@ try:
             right_series.index = right_index
 
 
+    class ZoneSplitOperator(object):
+        '''
+        Transformation operator for splitting many zones of a zone system at once. Each new zone
+        comes from exactly one old zone, so the operator P (new zones x old zones) has a single
+        non-zero per row, and is stored as the position of that old zone and its weight (the
+        proportion for split zones, 1.0 for the others). Applying it as P.M.P' is then a single
+        gather of the matrix's rows and columns, with only the rows and columns of split zones
+        being scaled.
+
+        Args:
+            zones: The zone numbers of the matrices to be split, in order
+            split_table: A dictionary of old zone : (list of new zones, list of proportions). The
+                proportions of each old zone must sum to 1.0
+
+        Example:
+            operator = ZoneSplitOperator(df.index, {1001: ([1001, 1002], [0.4, 0.6])})
+            new_df = operator.apply(df)
+        '''
+
+        def __init__(self, zones, split_table):
+            zones = pd.Index(zones)
+            assert zones.is_unique, "Zones must be unique"
+
+            old_zones = set()
+            new_zone_list, source_list, weight_list = [], [], []
+            for old_zone, (new_zones, proportions) in split_table.iteritems():
+                old_zone = int(old_zone)
+                new_zones = np.array(new_zones, dtype=np.int32)
+                proportions = np.array(proportions, dtype=np.float64)
+
+                assert len(new_zones) == len(proportions), \
+                    "Proportion array must be the same length as the new zone array (zone %s)" %old_zone
+                assert len(new_zones.shape) == 1, "New zones must be a vector (zone %s)" %old_zone
+                assert np.isclose(proportions.sum(), 1.0), "Proportions must sum to 1.0 (zone %s)" %old_zone
+                if old_zone not in zones: raise KeyError(old_zone)
+
+                old_zones.add(old_zone)
+                new_zone_list.append(new_zones)
+                source_list.append(np.repeat(zones.get_loc(old_zone), len(new_zones)))
+                weight_list.append(proportions)
+
+            kept = ~zones.isin(list(old_zones))
+            new_zone_list.append(np.asarray(zones[kept], dtype=np.int32))
+            source_list.append(np.flatnonzero(kept))
+            weight_list.append(np.ones(kept.sum(), dtype=np.float64))
+
+            new_zones = np.concatenate(new_zone_list)
+            order = new_zones.argsort(kind='mergesort')
+            new_zones = new_zones[order]
+            assert len(np.unique(new_zones)) == len(new_zones), "New zones must not already exist or be repeated"
+
+            self.zones = zones
+            self.new_zones = pd.Index(new_zones)
+            self.sources = np.concatenate(source_list)[order]
+            self.weights = np.concatenate(weight_list)[order]
+            self._scaled = np.flatnonzero(self.weights != 1.0)
+            self._unscaled = np.flatnonzero(self.weights == 1.0)
+
+        def apply(self, base_matrix):
+            '''
+            Splits the zones of a matrix.
+
+            Args:
+                base_matrix: The matrix to re-shape, as a DataFrame whose index and columns are
+                    the operator's zones, or as a 2-D NumPy array in the same order.
+
+            Returns: Re-shaped DataFrame (or array, if an array was given), of the same dtype.
+            '''
+            is_frame = isinstance(base_matrix, pd.DataFrame)
+            if is_frame:
+                assert base_matrix.index.equals(base_matrix.columns), "DataFrame is not a matrix"
+                assert base_matrix.index.equals(self.zones), "Matrix zones do not match the operator's"
+                values = base_matrix.values
+            else:
+                values = np.asarray(base_matrix)
+                assert values.shape == (len(self.zones), len(self.zones)), "Matrix shape does not match the operator's"
+
+            new_values = values.take(self.sources, axis=0).take(self.sources, axis=1)
+
+            scaled, unscaled = self._scaled, self._unscaled
+            if len(scaled) > 0:
+                # Rows of split zones are scaled by both weights; the other rows only need their
+                # columns of split zones scaled (their own weight being 1)
+                new_values[scaled, :] = new_values[scaled, :] * np.outer(self.weights[scaled], self.weights)
+                columns = np.ix_(unscaled, scaled)
+                new_values[columns] = new_values[columns] * self.weights[scaled]
+
+            if is_frame:
+                return pd.DataFrame(new_values, index=self.new_zones, columns=self.new_zones)
+            return new_values
+
+    def split_zones_in_matrix(base_matrix, split_table):
+        '''
+        Splits many zones in a matrix (represented as a DataFrame) at once, prorating affected
+        cells by each zone's proportions. The old zones are removed.
+
+        Args:
+            base_matrix: The matrix to re-shape, as a DataFrame
+            split_table: A dictionary of old zone : (list of new zones, list of proportions).
+
+        Returns: Re-shaped DataFrame
+
+        '''
+        assert isinstance(base_matrix, pd.DataFrame), "Base matrix must be a DataFrame"
+        return ZoneSplitOperator(base_matrix.index, split_table).apply(base_matrix)
+
+    def split_zones_in_matrices(matrices, split_table):
+        '''
+        Splits many zones in a stream of matrices. The operator is only rebuilt when the
+        zones of a matrix differ from those of the previous one.
+
+        Args:
+            matrices: An iterable of DataFrames (or of (key, DataFrame) pairs)
+            split_table: A dictionary of old zone : (list of new zones, list of proportions).
+
+        Returns: A generator of the re-shaped DataFrames (or of (key, DataFrame) pairs)
+
+        '''
+        operator = None
+        for item in matrices:
+            if isinstance(item, tuple): key, base_matrix = item
+            else: key, base_matrix = None, item
+
+            if operator is None or not base_matrix.index.equals(operator.zones):
+                operator = ZoneSplitOperator(base_matrix.index, split_table)
+
+            new_matrix = operator.apply(base_matrix)
+            yield new_matrix if key is None else (key, new_matrix)
+
     def split_zone_in_matrix(base_matrix, old_zone, new_zones, proportions):
         '''
         Takes a zone in a matrix (represented as a DataFrame) and splits it into several new zones,
         prorating affected cells by a vector of proportions (one value for each new zone). The old
-        zone is removed.
+        zone is removed. To split several zones, use split_zones_in_matrix.
 
         Args:
             base_matrix: The matrix to re-shape, as a DataFrame
@@ -329,59 +473,7 @@ try:
         Returns: Re-shaped DataFrame
 
         '''
-        assert isinstance(base_matrix, pd.DataFrame), "Base matrix must be a DataFrame"
-
-        old_zone = int(old_zone)
-        new_zones = np.array(new_zones, dtype=np.int32)
-        proportions = np.array(proportions, dtype=np.float64)
-
-        assert len(new_zones) == len(proportions), "Proportion array must be the same length as the new zone array"
-        assert len(new_zones.shape) == 1, "New zones must be a vector"
-        assert base_matrix.index.equals(base_matrix.columns), "DataFrame is not a matrix"
-        assert np.isclose(proportions.sum(), 1.0), "Proportions must sum to 1.0 "
-
-        n_new_zones = len(new_zones)
-
-        intersection_index = base_matrix.index.drop(old_zone)
-        new_index = intersection_index
-        for z in new_zones: new_index = new_index.insert(-1, z)
-        new_index = pd.Index(sorted(new_index))
-
-        new_matrix = pd.DataFrame(0, index=new_index, columns=new_index, dtype=base_matrix.dtypes.iat[0])
-
-        # 1. Copy over the values from the regions of the matrix not being updated
-        new_matrix.loc[intersection_index, intersection_index] = base_matrix
-
-        # 2. Prorate the row corresponding to the dropped zone
-        # This section (and the next) works with the underlying Numpy arrays, since they handle
-        # broadcasting better than Pandas does
-        original_row = base_matrix.loc[old_zone, intersection_index]
-        original_row = original_row.values[:] # Make a shallow copy to preserve shape of the original data
-        original_row.shape = 1, len(intersection_index)
-        proportions.shape = n_new_zones, 1
-        result = pd.DataFrame(original_row * proportions, index=new_zones, columns=intersection_index)
-        new_matrix.loc[result.index, result.columns] = result
-
-        # 3. Proprate the column corresponding to the dropped zone
-        original_column = base_matrix.loc[intersection_index, old_zone]
-        original_column = original_column.values[:]
-        original_column.shape = len(intersection_index), 1
-        proportions.shape = 1, n_new_zones
-        result = pd.DataFrame(original_column * proportions, index=intersection_index, columns=new_zones)
-        new_matrix.loc[result.index, result.columns] = result
-
-        # 4. Expand the old intrazonal
-        proportions_copy = proportions[:,:]
-        proportions_copy.shape = 1, n_new_zones
-        proportions.shape = n_new_zones, 1
-
-        intrzonal_matrix = proportions * proportions_copy
-        intrazonal_scalar = base_matrix.at[old_zone, old_zone]
-
-        result = pd.DataFrame(intrazonal_scalar * intrzonal_matrix, index=new_zones, columns=new_zones)
-        new_matrix.loc[result.index, result.columns] = result
-
-        return new_matrix
+        return split_zones_in_matrix(base_matrix, {old_zone: (new_zones, proportions)})
 
 except ImportError:
     warn.warn(ImportWarning("Older versions of Emme Modeller do not come with pandas library installed."))
\ No newline at end of file
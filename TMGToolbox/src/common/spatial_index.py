@@ -30,8 +30,11 @@ TODO LIST:
 from numpy import array
 from numpy import min as nmin
 from numpy import max as nmax
+import numpy as _np
 from shapely import geometry as _geo
 import math
+from time import time as _time
+import random as _random
 
 import inro.modeller as _m
 from copy import copy
@@ -209,7 +212,13 @@ class GridIndex():
     
     Querying: Queries the grid index for objects. [More to come]
     
-    Nearest: Only one nearest operation is supported. [More to come]
+    Nearest: Three nearest operations are supported:
+        nearestToPoint: Returns the single nearest object (legacy)
+        nearestK: Returns the k nearest objects to a point, with distances
+        nearestMany: Bulk version of nearestK for many points at once
+    The latter two store the coordinates of point-like objects (e.g.
+    nodes) in NumPy arrays per grid cell, so that distances are computed
+    in bulk.
     '''
     
     __READ_ONLY_FLAG = False
@@ -252,6 +261,7 @@ class GridIndex():
         
         self._grid = grid(xSize, ySize)
         self._addressbook = {}
+        self._nearestCache = {} #Cache of coordinate arrays used by nearestK, cleared on insertion or removal
         
         self.__READ_ONLY_FLAG = True
     
@@ -426,6 +436,7 @@ class GridIndex():
         col, row = self._index_point(x, y)
         self._grid[col, row].add(obj)
         self._addressbook[obj] = [(col, row)]
+        self._nearestCache.clear()
         
     
     def insertpline(self, obj, coordinates):
@@ -450,6 +461,7 @@ class GridIndex():
             for col, row in addresses:
                 self._grid[col, row].add(obj)
             self._addressbook[obj] = addresses
+        self._nearestCache.clear()
     
     def insertbox(self, obj, minx, miny, maxx, maxy):
         '''
@@ -472,6 +484,7 @@ class GridIndex():
         for col, row in addresses:
             self._grid[col, row].add(obj)
         self._addressbook[obj] = addresses
+        self._nearestCache.clear()
     
     def insertPoint(self, pointOrNode):
         '''
@@ -529,6 +542,7 @@ class GridIndex():
         
         for col, row in self._addressbook[obj]:
             self._grid[col, row].remove(obj)
+        self._nearestCache.clear()
             
         self._addressbook.pop(obj)
     
@@ -835,6 +849,308 @@ class GridIndex():
                 else:
                     i+=1
             return ["Nothing Found"]
+    
+    def nearestK(self, x, y, k=1, maxRadius=None):
+        '''
+        Finds the k nearest objects to a given point. The grid is searched in
+        growing square boxes of cells around the point, stopping once k objects
+        have been found which are closer than any un-searched cell, or once the 
+        entire grid has been searched.
+        
+        Distances to point-like objects (anything with 'x' and 'y' properties,
+        such as Emme nodes) are computed in bulk using NumPy. Other objects 
+        are measured using Shapely, as in find_nearest().
+        
+        Args:
+            - x, y: The coordinates of interest. Unlike nearestToPoint, the 
+                point does NOT need to overlap the grid.
+            - k (=1): The maximum number of objects to return.
+            - maxRadius (=None): Optional search radius. Objects further than
+                this distance from the point are not returned.
+        
+        Returns:
+            A list of up to k (object, distance) tuples, sorted by distance. The
+            list is empty if no objects are found.
+        '''
+        return self.nearestMany([(x, y)], k, maxRadius)[0]
+    
+    def nearestMany(self, points, k=1, maxRadius=None):
+        '''
+        Bulk version of nearestK. Points are grouped by the grid cell in which
+        they fall, and each group is searched together (candidates are only 
+        gathered once per group, and distances for the whole group are 
+        computed in a single NumPy operation).
+        
+        Args:
+            - points: An iterable of (x, y) tuples, or an N x 2 array. Points 
+                do not need to overlap the grid.
+            - k (=1): The maximum number of objects to return for each point.
+            - maxRadius (=None): Optional search radius.
+        
+        Returns:
+            A list with one entry for each point, in the same order. Each entry
+            is a list of up to k (object, distance) tuples sorted by distance.
+        '''
+        k = int(k)
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        if maxRadius is None:
+            maxRadius = float('inf')
+        
+        coordinates = _np.asarray(points, dtype=_np.float64)
+        if coordinates.size == 0:
+            return []
+        coordinates = coordinates.reshape(-1, 2)
+        
+        cols = _np.floor((coordinates[:, 0] - self.minX) / self._deltaX).astype(_np.int64) + 1
+        rows = _np.floor((coordinates[:, 1] - self.minY) / self._deltaY).astype(_np.int64) + 1
+        
+        groups = {}
+        for index, address in enumerate(zip(cols.tolist(), rows.tolist())):
+            if address in groups: groups[address].append(index)
+            else: groups[address] = [index]
+        
+        arrays = self._get_nearest_arrays()
+        results = [None] * len(coordinates)
+        for (col, row), indices in groups.iteritems():
+            indices = _np.array(indices)
+            groupResults = self._search_boxes(arrays, coordinates[indices, 0], coordinates[indices, 1], 
+                                              col, row, k, maxRadius)
+            for index, result in zip(indices.tolist(), groupResults):
+                results[index] = result
+        return results
+    
+    def _get_nearest_arrays(self):
+        '''
+        Builds (and caches) the arrays used by the nearest queries. Point-like objects 
+        are sorted by cell number (cell number = (col - 1) * nRows + row - 1), such that
+        the points in any column-span of cells are contiguous. Other objects are kept
+        with the bounds of the cells they are indexed in.
+        '''
+        if 'points' in self._nearestCache:
+            return self._nearestCache
+        
+        nRows = self._grid._maxRow
+        nCells = self._grid._maxCol * nRows
+        
+        pointObjects, xs, ys, cellNumbers = [], [], [], []
+        otherObjects, otherBounds = [], []
+        for obj, addresses in self._addressbook.iteritems():
+            addresses = list(addresses)
+            if len(addresses) == 1 and hasattr(obj, 'x') and hasattr(obj, 'y'):
+                col, row = addresses[0]
+                pointObjects.append(obj)
+                xs.append(obj.x)
+                ys.append(obj.y)
+                cellNumbers.append((col - 1) * nRows + row - 1)
+            else:
+                cols = [col for col, row in addresses]
+                rows = [row for col, row in addresses]
+                otherObjects.append(obj)
+                otherBounds.append((min(cols), max(cols), min(rows), max(rows)))
+        
+        cellNumbers = _np.array(cellNumbers, dtype=_np.int64)
+        order = _np.argsort(cellNumbers, kind='mergesort')
+        
+        self._nearestCache['points'] = [pointObjects[i] for i in order.tolist()]
+        self._nearestCache['xs'] = _np.array(xs, dtype=_np.float64)[order]
+        self._nearestCache['ys'] = _np.array(ys, dtype=_np.float64)[order]
+        self._nearestCache['cell_start'] = _np.searchsorted(cellNumbers[order], _np.arange(nCells + 1))
+        self._nearestCache['others'] = otherObjects
+        self._nearestCache['other_bounds'] = _np.array(otherBounds, dtype=_np.int64).reshape(-1, 4)
+        return self._nearestCache
+    
+    def _query_box_points(self, arrays, col0, col1, row0, row1):
+        '''
+        Returns the positions (in the sorted point arrays) of all point-like objects
+        in a box of cells, clipped to the grid. One contiguous slice per column.
+        '''
+        nRows = self._grid._maxRow
+        col0, col1 = max(col0, 1), min(col1, self._grid._maxCol)
+        row0, row1 = max(row0, 1), min(row1, nRows)
+        if col0 > col1 or row0 > row1:
+            return _np.zeros(0, dtype=_np.int64)
+        
+        firstCells = (_np.arange(col0, col1 + 1) - 1) * nRows
+        starts = arrays['cell_start'][firstCells + row0 - 1]
+        ends = arrays['cell_start'][firstCells + row1]
+        lengths = ends - starts
+        total = lengths.sum()
+        if total == 0:
+            return _np.zeros(0, dtype=_np.int64)
+        #Vectorized concatenation of the ranges [start, end) for each column
+        offsets = _np.repeat(starts - _np.cumsum(lengths) + lengths, lengths)
+        return offsets + _np.arange(total)
+    
+    def _searched_radius(self, xs, ys, originCol, originRow, radius):
+        '''
+        For points in the origin cell, returns the radii (as an array) around each point
+        which are guaranteed to have been fully searched after searching the box of cells
+        within 'radius' cells of the origin. Sides of the box which extend to (or past) 
+        the edge of the grid are not limiting. Returns infinity if the whole grid was 
+        searched.
+        
+        Note that this uses the true size of the grid, since maxCol and maxRow can be
+        one short due to floating-point rounding of the extents.
+        '''
+        searched = _np.empty(len(xs))
+        searched.fill(float('inf'))
+        if originCol - radius > 1:
+            searched = _np.minimum(searched, xs - (self.minX + (originCol - radius - 1) * self._deltaX))
+        if originCol + radius < self._grid._maxCol:
+            searched = _np.minimum(searched, (self.minX + (originCol + radius) * self._deltaX) - xs)
+        if originRow - radius > 1:
+            searched = _np.minimum(searched, ys - (self.minY + (originRow - radius - 1) * self._deltaY))
+        if originRow + radius < self._grid._maxRow:
+            searched = _np.minimum(searched, (self.minY + (originRow + radius) * self._deltaY) - ys)
+        return searched
+    
+    def _search_boxes(self, arrays, xs, ys, originCol, originRow, k, maxRadius):
+        '''
+        Box search for a group of points sharing the same origin cell. The box is grown
+        (doubled until k candidates are found, then enlarged to cover the k-th distance)
+        until every point is resolved. Returns a list (one for each point) of lists of up
+        to k (object, distance) tuples.
+        '''
+        nPoints = len(xs)
+        results = [None] * nPoints
+        unresolved = _np.arange(nPoints)
+        cellSize = min(self._deltaX, self._deltaY)
+        otherBounds = arrays['other_bounds']
+        
+        #Boxes smaller than this do not overlap the grid at all
+        radius = max(0, 1 - originCol, originCol - self._grid._maxCol, 
+                     1 - originRow, originRow - self._grid._maxRow)
+        while len(unresolved) > 0:
+            col0, col1 = originCol - radius, originCol + radius
+            row0, row1 = originRow - radius, originRow + radius
+            
+            groupXs, groupYs = xs[unresolved], ys[unresolved]
+            positions = self._query_box_points(arrays, col0, col1, row0, row1)
+            objects = [arrays['points'][i] for i in positions.tolist()]
+            dx = groupXs[:, _np.newaxis] - arrays['xs'][positions][_np.newaxis, :]
+            dy = groupYs[:, _np.newaxis] - arrays['ys'][positions][_np.newaxis, :]
+            distances = _np.sqrt(dx * dx + dy * dy)
+            
+            if len(otherBounds):
+                inBox = (otherBounds[:, 0] <= col1) & (otherBounds[:, 1] >= col0) & \
+                        (otherBounds[:, 2] <= row1) & (otherBounds[:, 3] >= row0)
+                others = [arrays['others'][i] for i in _np.nonzero(inBox)[0].tolist()]
+                if others:
+                    otherDistances = _np.array([[_geometry_distance(obj, x, y) for obj in others]
+                                                for x, y in zip(groupXs, groupYs)])
+                    objects.extend(others)
+                    distances = _np.hstack([distances, otherDistances])
+            
+            searched = self._searched_radius(groupXs, groupYs, originCol, originRow, radius)
+            finished = _np.isinf(searched[0]) #The whole box covers the grid
+            
+            nObjects = len(objects)
+            if nObjects > k:
+                kth = _np.partition(distances, k - 1, axis=1)[:, k - 1]
+            elif nObjects == k:
+                kth = distances.max(axis=1)
+            else:
+                kth = _np.empty(len(unresolved))
+                kth.fill(float('inf'))
+            
+            done = (kth <= searched) | (searched >= maxRadius)
+            if finished: done[:] = True
+            
+            for row in _np.nonzero(done)[0].tolist():
+                results[unresolved[row]] = self._select_nearest(objects, distances[row], k, maxRadius)
+            
+            if not done.all():
+                #Grow the box: enough to cover the largest k-th distance or the search radius if
+                #possible, otherwise double it.
+                target = min(kth[~done].max(), maxRadius)
+                if _np.isinf(target):
+                    radius = radius * 2 + 1
+                else:
+                    radius = max(radius + 1, int(math.ceil(target / cellSize)) + 1)
+            unresolved = unresolved[~done]
+        
+        return results
+    
+    @staticmethod
+    def _select_nearest(objects, distances, k, maxRadius):
+        if len(distances) > k:
+            candidates = _np.argpartition(distances, k - 1)[:k]
+        else:
+            candidates = _np.arange(len(distances))
+        candidates = candidates[_np.argsort(distances[candidates], kind='mergesort')]
+        return [(objects[index], float(distances[index])) for index in candidates.tolist()
+                if distances[index] <= maxRadius]
+
+def _geometry_distance(candidate, x, y):
+    '''
+    Distance from a non-point object (as indexed by GridIndex) to a point. Uses the 
+    same rules as find_nearest to convert the object to a Shapely geometry.
+    '''
+    point = _geo.Point(x, y)
+    if hasattr(candidate, 'shape'): #Link
+        return _geo.LineString(candidate.shape).distance(point)
+    elif hasattr(candidate, 'headway'): #Transit line
+        return min([_geo.LineString([(segment.i_node.x, segment.i_node.y), (segment.j_node.x, segment.j_node.y)]).distance(point)
+                    for segment in candidate.segments()])
+    elif hasattr(candidate, 'line'): #Transit segment
+        return _geo.LineString([(candidate.i_node.x, candidate.i_node.y), (candidate.j_node.x, candidate.j_node.y)]).distance(point)
+    return candidate.distance(point) #Shapely geometry
+
+def benchmarkNearest(network, nQueries=100000, xSize=1000, ySize=1000, seed=None):
+    '''
+    Compares GridIndex.nearestToPoint (queried one point at a time) against
+    GridIndex.nearestMany, for random points within the extents of a network's
+    regular nodes.
+    
+    Args:
+        - network: An Emme Network object
+        - nQueries (=100000): The number of random query points
+        - xSize, ySize (=1000): The size of the grid
+        - seed (=None): Optional random seed, for repeatable query points
+    
+    Returns: A dictionary with the keys 'point_time', 'bulk_time', 'speedup', 
+        'n_queries' and 'n_mismatched' (number of points for which the two 
+        methods returned nodes at different distances). Mismatches are expected
+        where nearestToPoint gives up at the edge of the grid ("Nothing Found")
+        or misses the last row or column of the grid.
+    '''
+    nodes = [node for node in network.regular_nodes()]
+    xs = [node.x for node in nodes]
+    ys = [node.y for node in nodes]
+    extents = (min(xs) - 1.0, min(ys) - 1.0, max(xs) + 1.0, max(ys) + 1.0)
+    
+    index = GridIndex(extents, xSize, ySize)
+    for node in nodes:
+        index.insertPoint(node)
+    
+    generator = _random.Random(seed)
+    points = [(generator.uniform(extents[0] + 1.0, extents[2] - 1.0), 
+               generator.uniform(extents[1] + 1.0, extents[3] - 1.0)) for i in xrange(nQueries)]
+    
+    start = _time()
+    pointResults = [index.nearestToPoint(x, y)[0] for x, y in points]
+    pointTime = _time() - start
+    
+    start = _time()
+    bulkResults = index.nearestMany(points)
+    bulkTime = _time() - start
+    
+    nMismatched = 0
+    for (x, y), pointResult, bulkResult in zip(points, pointResults, bulkResults):
+        if not bulkResult or not hasattr(pointResult, 'x'):
+            if bool(bulkResult) != hasattr(pointResult, 'x'): nMismatched += 1
+            continue
+        pointDistance = math.sqrt((pointResult.x - x) ** 2 + (pointResult.y - y) ** 2)
+        if abs(pointDistance - bulkResult[0][1]) > 1e-6:
+            nMismatched += 1
+    
+    speedup = pointTime / bulkTime if bulkTime > 0 else float('inf')
+    return {'point_time': pointTime,
+            'bulk_time': bulkTime,
+            'speedup': speedup,
+            'n_queries': nQueries,
+            'n_mismatched': nMismatched}
 
 def find_nearest( candidates, x, y ):
     nearest = None
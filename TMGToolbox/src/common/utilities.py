@@ -30,9 +30,13 @@ from contextlib import contextmanager, nested
 import warnings as _warn
 import sys as _sys
 import traceback as _tb
+import numpy as _np
 import subprocess as _sp
 from itertools import izip
+from array import array as _array
 from json import loads as _parsedict
+from json import dump as _jsondump
+from time import time as _time
 from os.path import dirname
 
 _MODELLER = _m.Modeller()
@@ -235,6 +239,70 @@ def initializeMatrix(id=None, default=0, name="", description="", matrix_type='F
 
 #-------------------------------------------------------------------------------------------
 
+_MTX_MAGIC_NUMBER = 0xC4D4F1B2
+_MTX_DATA_TYPES = {1: _np.float32, 2: _np.float64, 3: _np.int32, 4: _np.uint32}
+_MTX_TYPE_CODES = {'ms': 1, 'mo': 2, 'md': 3, 'mf': 4}
+
+def saveBinaryMatrix(filename, data, indices, matrix_type='mf'):
+    '''
+    Saves matrix data in the binary matrix (.mtx) format also used by MatrixData.save
+    and by XTMF: a small int32 header followed by the zone indices and the raw
+    float32 data, so that it can be memory-mapped by the reader.
+    
+    Args:
+        - filename: The file to write.
+        - data: A NumPy array (or anything that can be converted to one) with
+            one dimension per index list.
+        - indices: A list of zone number lists, one for each dimension 
+            (e.g. [zones, zones] for a full matrix, [] for a scalar).
+        - matrix_type (='mf'): The prefix of the matrix type ('ms', 'mo', 'md' or 'mf').
+    '''
+    data = _np.asarray(data, dtype= _np.float32)
+    indices = [_np.asarray(index, dtype= _np.int32) for index in indices]
+    if data.shape != tuple(len(index) for index in indices):
+        raise IndexError("Matrix data with shape %s does not match indices of lengths %s"
+                         %(data.shape, [len(index) for index in indices]))
+    
+    header = _np.array([_MTX_MAGIC_NUMBER, 1, _MTX_TYPE_CODES[matrix_type], 1, len(indices)], dtype= _np.uint32)
+    with open(filename, 'wb') as writer:
+        header.tofile(writer)
+        _np.array([len(index) for index in indices], dtype= _np.int32).tofile(writer)
+        for index in indices:
+            index.tofile(writer)
+        _np.ascontiguousarray(data).tofile(writer)
+
+def loadBinaryMatrix(filename, mmap= False):
+    '''
+    Loads matrix data saved in the binary matrix (.mtx) format (see saveBinaryMatrix).
+    
+    Args:
+        - filename: The file to read.
+        - mmap (=False): If True, the data is memory-mapped (read-only) instead of read.
+    
+    Returns: A (data, indices, matrix_type) tuple, where indices is a list of
+        zone number arrays, one for each dimension of the data.
+    '''
+    with open(filename, 'rb') as reader:
+        magic, version, type_code, data_type, dimensions = _np.fromfile(reader, dtype= _np.uint32, count= 5)
+        if magic != _MTX_MAGIC_NUMBER:
+            raise IOError("'%s' is not a binary matrix file" %filename)
+        if not data_type in _MTX_DATA_TYPES:
+            raise IOError("Unsupported data type %s in '%s'" %(data_type, filename))
+        
+        shape = tuple(_np.fromfile(reader, dtype= _np.int32, count= dimensions))
+        indices = [_np.fromfile(reader, dtype= _np.int32, count= size) for size in shape]
+        dtype = _MTX_DATA_TYPES[data_type]
+        
+        if mmap:
+            data = _np.memmap(filename, dtype= dtype, mode= 'r', offset= reader.tell(), shape= shape)
+        else:
+            data = _np.fromfile(reader, dtype= dtype, count= int(_np.prod(shape))).reshape(shape)
+    
+    matrix_type = dict((code, prefix) for prefix, code in _MTX_TYPE_CODES.iteritems())[type_code]
+    return data, indices, matrix_type
+
+#-------------------------------------------------------------------------------------------
+
 def getAvailableScenarioNumber():
     '''
     Returns: The number of an available scenario. Raises an exception
@@ -494,6 +562,196 @@ def fastLoadLinkAttributes(scenario, list_of_attributes):
             retval[link] = attributes
     return retval
 
+#-------------------------------------------------------------------------------------------
+
+class AttributeColumns():
+    '''
+    Columnar counterpart to the dictionaries returned by the fastLoad*Attributes functions.
+    Each attribute is stored as a single NumPy float64 array, and the elements' IDs are stored
+    in a list in the same (row) order.
+    
+    Attributes:
+        - domain: The Emme network domain of the element IDs (e.g. 'LINK' or 'TRANSIT_LINE')
+        - ids: The list of element IDs, in row order
+        - rows: An int array of the elements' positions in the Emme attribute tables
+        - columns: A dictionary of attribute name : float64 array
+        - index: A dictionary of element ID : row number, built on first use.
+    
+    Example:
+        columns = fastLoadLinkColumns(scenario, ['auto_volume'])
+        volau = columns['auto_volume']
+        print volau[columns.row((10001, 10002))]
+    '''
+    
+    def __init__(self, domain, ids, rows, columns, package_index= None, table_size= 0):
+        self.domain = domain
+        self.ids = ids
+        self.rows = rows
+        self.columns = columns
+        
+        self._package_index = package_index
+        self._table_size = table_size
+        self._index = None
+    
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = dict((id, row) for row, id in enumerate(self.ids))
+        return self._index
+    
+    def row(self, id):
+        return self.index[id]
+    
+    def get(self, id, attribute_name):
+        return self.columns[attribute_name][self.index[id]]
+    
+    def __getitem__(self, attribute_name):
+        return self.columns[attribute_name]
+    
+    def __setitem__(self, attribute_name, column):
+        column = _np.asarray(column, dtype= _np.float64)
+        if column.shape != (len(self.ids),):
+            raise IndexError("Column '%s' has shape %s but %s rows were expected" %(attribute_name, column.shape, len(self.ids)))
+        self.columns[attribute_name] = column
+    
+    def __contains__(self, id):
+        return id in self.index
+    
+    def __len__(self):
+        return len(self.ids)
+
+def _loadColumns(scenario, domain, list_of_attributes):
+    package = scenario.get_attribute_values(domain, list_of_attributes)
+    tables = [_np.asarray(table, dtype= _np.float64) for table in package[1:]]
+    if len(tables) > 0: table_size = len(tables[0])
+    else: table_size = 0
+    return package[0], tables, table_size
+
+def fastLoadLinkColumns(scenario, list_of_attributes):
+    '''
+    Performs a fast partial read of link attributes, using
+    scenario.get_attribute_values. Unlike fastLoadLinkAttributes, only
+    one array is created per attribute.
+    
+    Args:
+        - scenario: The scenario to load from
+        - list_of_attributes: A list of attributes to load.
+    
+    Returns:
+        An AttributeColumns object, whose IDs are (i_node, j_node) tuples
+        (link IDs). The node numbers are also available as the 'i_node'
+        and 'j_node' columns.
+    '''
+    
+    indices, tables, table_size = _loadColumns(scenario, 'LINK', list_of_attributes)
+    
+    ids = []
+    rows = []
+    for i_node, outgoing_links in indices.iteritems():
+        for j_node, index in outgoing_links.iteritems():
+            ids.append((i_node, j_node))
+            rows.append(index)
+    rows = _np.array(rows, dtype= _np.int64)
+    
+    columns = dict((att_name, table[rows]) for att_name, table in itersync(list_of_attributes, tables))
+    nodes = _np.array(ids, dtype= _np.int64).reshape(-1, 2)
+    columns['i_node'] = nodes[:, 0]
+    columns['j_node'] = nodes[:, 1]
+    
+    return AttributeColumns('LINK', ids, rows, columns, indices, table_size)
+
+def fastLoadTransitLineColumns(scenario, list_of_attributes):
+    '''
+    Performs a fast partial read of transit line attributes, using 
+    scenario.get_attribute_values. Unlike fastLoadTransitLineAttributes,
+    only one array is created per attribute.
+    
+    Args:
+        - scenario: The Emme Scenario object to load from
+        - list_of_attributes: A list of TRANSIT LINE attribute names to load.
+    
+    Returns: An AttributeColumns object, whose IDs are transit line IDs.
+    '''
+    
+    indices, tables, table_size = _loadColumns(scenario, 'TRANSIT_LINE', list_of_attributes)
+    
+    ids = indices.keys()
+    rows = _np.array([indices[lineId] for lineId in ids], dtype= _np.int64)
+    
+    columns = dict((att_name, table[rows]) for att_name, table in itersync(list_of_attributes, tables))
+    
+    return AttributeColumns('TRANSIT_LINE', ids, rows, columns, indices, table_size)
+
+def fastLoadSummedSegmentColumns(scenario, list_of_attributes):
+    '''
+    Performs a fast partial read of transit segment attributes, aggregated to each line,
+    using scenario.get_attribute_values. Unlike fastLoadSummedSegmentAttributes, the
+    sums are computed with one NumPy call per attribute.
+    
+    Args:
+        - scenario: The Emme Scenario object to load from
+        - list_of_attributes: A list of TRANSIT SEGMENT attribute names to load.
+        
+    Returns: An AttributeColumns object, whose IDs are transit line IDs. Since
+        the values are sums, it cannot be saved back to the scenario.
+    '''
+    
+    indices, tables, table_size = _loadColumns(scenario, 'TRANSIT_SEGMENT', list_of_attributes)
+    
+    major, minor, release, beta = getEmmeVersion(tuple)
+    if (major,minor,release) >= (4,1,2):
+        get_rows = lambda segmentIndices: segmentIndices.itervalues()
+    else:
+        get_rows = lambda segmentIndices: segmentIndices[1]
+    
+    ids = []
+    segmentRows = []
+    segmentLines = []
+    for lineNumber, (lineId, segmentIndices) in enumerate(indices.iteritems()):
+        ids.append(lineId)
+        lineRows = list(get_rows(segmentIndices))
+        segmentRows.extend(lineRows)
+        segmentLines.extend([lineNumber] * len(lineRows))
+    segmentRows = _np.array(segmentRows, dtype= _np.int64)
+    segmentLines = _np.array(segmentLines, dtype= _np.int64)
+    
+    columns = {}
+    for att_name, table in itersync(list_of_attributes, tables):
+        columns[att_name] = _np.bincount(segmentLines, weights= table[segmentRows], minlength= len(ids))
+    
+    return AttributeColumns('TRANSIT_LINE', ids, _np.arange(len(ids)), columns)
+
+def fastSaveColumns(scenario, columns, list_of_attributes= None):
+    '''
+    Writes columns back to the scenario in bulk, using scenario.set_attribute_values.
+    
+    Args:
+        - scenario: The scenario to save to. It must have the same network elements as 
+            the scenario the columns were loaded from.
+        - columns: An AttributeColumns object returned by fastLoadLinkColumns or
+            fastLoadTransitLineColumns.
+        - list_of_attributes (=None): The attributes to save. If None, all the loaded 
+            attributes are saved (except the 'i_node' and 'j_node' columns of links).
+    '''
+    
+    if columns._package_index is None:
+        raise TypeError("Columns of the %s domain cannot be saved (were they aggregated?)" %columns.domain)
+    
+    if list_of_attributes is None:
+        list_of_attributes = [att_name for att_name in columns.columns.iterkeys()
+                              if not (columns.domain == 'LINK' and att_name in ('i_node', 'j_node'))]
+    
+    table_size = columns._table_size
+    if len(columns.rows) > 0: table_size = max(table_size, int(columns.rows.max()) + 1)
+    
+    tables = []
+    for att_name in list_of_attributes:
+        table = _np.zeros(table_size, dtype= _np.float64)
+        table[columns.rows] = columns[att_name]
+        tables.append(_array('d', table.tostring()))
+    
+    scenario.set_attribute_values(columns.domain, list_of_attributes, [columns._package_index] + tables)
+
 
 #-------------------------------------------------------------------------------------------
 
@@ -675,6 +933,13 @@ class ProgressTracker():
     Update April 2014: Can be 'reset' with a new number of tasks,
     for when two task-levels are needed but the number of full
     tasks are not known at initialization.
+    
+    The tracker also records the wall-clock time and the peak memory
+    usage (RSS) of each Task and Tool run, optionally grouped into
+    named stages (see stage()). Subtasks are only counted, and are
+    reported as one record per Task, so that completeSubtask() stays
+    cheap inside loops. Call writeTimings() at the end of a run to
+    write the hierarchical timing table to the logbook.
     '''
     
     def __init__(self, numberOfTasks):
@@ -683,6 +948,11 @@ class ProgressTracker():
         self._errorTools = set()
     
     def reset(self, numberOfTasks=None):
+        '''
+        Resets the progress. The timings are also cleared, unless the
+        tracker is being reset with a new number of tasks partway
+        through a run.
+        '''
         self._subTasks = 0
         self._completedSubtasks = 0
         self._progress = 0.0 #floating point number
@@ -692,6 +962,29 @@ class ProgressTracker():
         
         if numberOfTasks != None: #Can be reset with a new number of tasks
             self._taskIncr = 1000.0 / numberOfTasks
+        else:
+            self.resetTimings()
+    
+    def resetTimings(self):
+        now = _time()
+        self._timingRoot = {'name': "Total", 'start': now, 'children': []}
+        self._stageStack = [self._timingRoot]
+        self._taskCount = 0
+        self._taskStart = now
+        self._subtaskStart = now
+        self._subtaskCount = 0
+        self._taskChildren = []
+        self._taskName = None
+    
+    def _newTimingRecord(self, name, elapsed, peakRss, children=None):
+        return {'name': name, 'elapsed': elapsed, 'peak_rss': peakRss, 'children': children or []}
+    
+    def _flushSubtasks(self, now, peakRss):
+        #Subtasks completed since the process started are reported as a single record
+        if self._subtaskCount > 0:
+            name = "%s subtasks" %self._subtaskCount
+            self._taskChildren.append(self._newTimingRecord(name, now - self._subtaskStart, peakRss))
+            self._subtaskCount = 0
     
     def completeTask(self):
         '''
@@ -706,6 +999,18 @@ class ProgressTracker():
             self._subTasks = 0
             self._completedSubtasks = 0
         self._progress += self._taskIncr
+        
+        now = _time()
+        peakRss = getPeakMemoryUsage()
+        self._flushSubtasks(now, peakRss)
+        for child in self._taskChildren:
+            if child['peak_rss'] is None: child['peak_rss'] = peakRss #Tool runs are sampled with their Task
+        self._taskCount += 1
+        name = self._taskName or ("Task %s" %self._taskCount)
+        self._stageStack[-1]['children'].append(self._newTimingRecord(name, now - self._taskStart, peakRss, self._taskChildren))
+        self._taskStart = now
+        self._taskChildren = []
+        self._taskName = None
     
     def runTool(self, tool, *args, **kwargs):
         '''
@@ -719,10 +1024,15 @@ class ProgressTracker():
         '''
         self._activeTool = tool
         self._toolIsRunning = True
+        start = _time()
         #actually run the tool. no knowledge of the arguments is required.
         ret = self._activeTool(*args, **kwargs) 
         self._toolIsRunning = False
         self._activeTool = None
+        
+        name = getattr(tool, '__MODELLER_NAMESPACE__', None) or tool.__class__.__name__
+        self._taskChildren.append(self._newTimingRecord(name, _time() - start, None))
+        self._taskName = name
         self.completeTask()
         return ret
     
@@ -737,6 +1047,8 @@ class ProgressTracker():
         self._subTasks = numberOfSubtasks
         self._completedSubtasks = 0
         self._processIsRunning = True            
+        self._subtaskStart = _time()
+        self._subtaskCount = 0
     
     def completeSubtask(self):
         '''
@@ -753,6 +1065,82 @@ class ProgressTracker():
             self.completeTask()
         else:
             self._completedSubtasks += 1
+            self._subtaskCount += 1
+    
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager which groups the Tasks completed inside it
+        under a named stage in the timing table.
+        
+        Example:
+            with self.TRACKER.stage("Loading network"):
+                ...
+        '''
+        #Time spent before the stage isn't attributed to its first Task
+        self._taskStart = _time()
+        outerTaskChildren = self._taskChildren
+        outerSubtasks = (self._subtaskCount, self._subtaskStart)
+        self._taskChildren = []
+        self._subtaskCount = 0
+        self._subtaskStart = self._taskStart
+        
+        record = {'name': name, 'start': _time(), 'children': []}
+        self._stageStack[-1]['children'].append(record)
+        self._stageStack.append(record)
+        try:
+            yield record
+        finally:
+            #Subtasks and Tool runs whose Task continues after the stage are kept in the stage
+            now = _time()
+            peakRss = getPeakMemoryUsage()
+            self._flushSubtasks(now, peakRss)
+            record['children'].extend(self._taskChildren)
+            self._taskChildren = outerTaskChildren
+            self._subtaskCount, self._subtaskStart = outerSubtasks
+            self._taskStart = now
+            
+            self._stageStack.pop()
+            record['elapsed'] = now - record.pop('start')
+            record['peak_rss'] = peakRss
+    
+    def getTimings(self):
+        '''
+        Returns the timing records as a nested dictionary with the 'name',
+        'elapsed' (in seconds), 'peak_rss' (in bytes, or None if it isn't
+        available on this platform) and 'children' keys.
+        '''
+        root = dict(self._timingRoot)
+        root['elapsed'] = _time() - root.pop('start')
+        root['peak_rss'] = getPeakMemoryUsage()
+        return root
+    
+    def writeTimings(self, title="Timings", jsonFile=None):
+        '''
+        Writes the hierarchical table of timings to the logbook, and
+        optionally to a JSON file.
+        '''
+        timings = self.getTimings()
+        
+        rows = []
+        def addRows(record, depth):
+            rss = record.get('peak_rss')
+            if rss is None: rssText = "n/a"
+            else: rssText = "%.1f" %(rss / 1048576.0)
+            rows.append("<tr><td style='padding-left:%spx'>%s</td><td>%.3f</td><td>%s</td></tr>" 
+                        %(depth * 20, record['name'], record['elapsed'], rssText))
+            for child in record['children']:
+                addRows(child, depth + 1)
+        addRows(timings, 0)
+        
+        html = "<table><tr><th>Stage</th><th>Time (s)</th><th>Peak RSS (MB)</th></tr>%s</table>" %"".join(rows)
+        _m.logbook_write(title, value= html)
+        
+        if jsonFile:
+            with open(jsonFile, 'w') as writer:
+                _jsondump(timings, writer, indent= 2)
+        
+        return timings
     
     @_m.method(return_type=_m.TupleType)
     def getProgress(self):
@@ -774,6 +1162,54 @@ class ProgressTracker():
         else:
             return (0, 1000, self._progress)
 
+if _sys.platform == 'win32':
+    try:
+        import ctypes as _ctypes
+        from ctypes import wintypes as _wintypes
+        
+        class _PROCESS_MEMORY_COUNTERS(_ctypes.Structure):
+            _fields_ = [('cb', _wintypes.DWORD),
+                        ('PageFaultCount', _wintypes.DWORD),
+                        ('PeakWorkingSetSize', _ctypes.c_size_t),
+                        ('WorkingSetSize', _ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', _ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', _ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', _ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', _ctypes.c_size_t),
+                        ('PagefileUsage', _ctypes.c_size_t),
+                        ('PeakPagefileUsage', _ctypes.c_size_t)]
+    except Exception:
+        _ctypes = None
+    _resource = None
+else:
+    _ctypes = None
+    try:
+        import resource as _resource
+    except ImportError:
+        _resource = None
+
+def getPeakMemoryUsage():
+    '''
+    Returns the peak resident set size (working set on Windows) of the
+    current process, in bytes, or None if it cannot be determined.
+    '''
+    if _ctypes is not None:
+        try:
+            counters = _PROCESS_MEMORY_COUNTERS()
+            counters.cb = _ctypes.sizeof(counters)
+            process = _ctypes.windll.kernel32.GetCurrentProcess()
+            if not _ctypes.windll.psapi.GetProcessMemoryInfo(process, _ctypes.byref(counters), counters.cb):
+                return None
+            return int(counters.PeakWorkingSetSize)
+        except Exception:
+            return None
+    if _resource is None: return None
+    peak = _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+    if _sys.platform == 'darwin': return int(peak) #Already in bytes
+    return int(peak) * 1024
+
+#-------------------------------------------------------------------------------------------
+
 class CSVReader():
     def __init__(self, filepath, append_blanks=True):
         self.filepath = filepath
@@ -22,8 +22,13 @@ import traceback as _traceback
 from contextlib import contextmanager
 from os import path as _path
 from datetime import datetime as _dt
+import Queue as _queue
 import shutil as _shutil
+import sys as _sys
+import threading as _threading
+import time as _time
 import zipfile as _zipfile
+import zlib as _zlib
 import tempfile as _tf
 
 _MODELLER = _m.Modeller()  # Instantiate Modeller once.
@@ -38,11 +43,125 @@ _export_link_shapes = _MODELLER.tool('inro.emme.data.network.base.export_link_sh
 _export_turns = _MODELLER.tool('inro.emme.data.network.turn.export_turns')
 _export_attributes = _MODELLER.tool('inro.emme.data.extra_attribute.export_extra_attributes')
 _export_functions = _MODELLER.tool('inro.emme.data.function.export_functions')
-_pdu = _MODELLER.module('tmg.common.pandas_utils')
+
+_CHUNK_SIZE = 1 << 20
+
+
+class PackageWriter(object):
+    """
+    Writes the components of a network package to a zip file from a background
+    thread, so that compressing one component overlaps with exporting the next.
+    Files are streamed into the archive in chunks, and strings are written
+    straight from memory.
+
+    Args:
+        - filepath: The zip file to create
+        - compression_level: 0 to store the components without compression,
+            or a zlib compression level from 1 (fastest) to 9 (smallest)
+    """
+
+    def __init__(self, filepath, compression_level=6):
+        compression = _zipfile.ZIP_DEFLATED if compression_level > 0 else _zipfile.ZIP_STORED
+        self._zf = _zipfile.ZipFile(filepath, 'w', compression, allowZip64=True)
+        self._level = compression_level
+        self._queue = _queue.Queue()
+        self._error = None
+
+        self._thread = _threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, filepath, arcname):
+        self._check_error()
+        self._queue.put((arcname, filepath, None))
+
+    def writestr(self, arcname, data):
+        self._check_error()
+        self._queue.put((arcname, None, data))
+
+    def close(self):
+        """Waits for the queued components to be written, then closes the archive."""
+        self._queue.put(None)
+        self._thread.join()
+        self._zf.close()
+        self._check_error()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue  # Drain the queue
+            try:
+                self._write_entry(*item)
+            except Exception:
+                self._error = _sys.exc_info()
+
+    def _write_entry(self, arcname, filepath, data):
+        # zipfile (in Python 2) always deflates with the default level, so the entry
+        # is written here. This follows ZipFile.write: the local header is re-written
+        # with the CRC and sizes once the data has been compressed.
+        zf = self._zf
+        zinfo = _zipfile.ZipInfo(arcname, _time.localtime(_time.time())[:6])
+        zinfo.compress_type = zf.compression
+        zinfo.external_attr = 0600 << 16
+        if filepath is not None:
+            zinfo.file_size = _path.getsize(filepath)
+        else:
+            zinfo.file_size = len(data)
+        zip64 = zinfo.file_size * 1.05 > _zipfile.ZIP64_LIMIT
+
+        zinfo.CRC = zinfo.compress_size = 0
+        zinfo.header_offset = zf.fp.tell()
+        zf.fp.write(zinfo.FileHeader(zip64))
+        if zinfo.compress_type == _zipfile.ZIP_DEFLATED:
+            compressor = _zlib.compressobj(self._level, _zlib.DEFLATED, -15)
+        else:
+            compressor = None
+
+        crc, compress_size = 0, 0
+        for chunk in self._iter_chunks(filepath, data):
+            crc = _zlib.crc32(chunk, crc) & 0xffffffff
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            zf.fp.write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            zf.fp.write(chunk)
+        zinfo.CRC = crc
+        zinfo.compress_size = compress_size
+
+        position = zf.fp.tell()
+        zf.fp.seek(zinfo.header_offset, 0)
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.seek(position, 0)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[arcname] = zinfo
+        zf._didModify = True
+
+    @staticmethod
+    def _iter_chunks(filepath, data):
+        if filepath is None:
+            for start in xrange(0, len(data), _CHUNK_SIZE):
+                yield data[start: start + _CHUNK_SIZE]
+            return
+        with open(filepath, 'rb') as reader:
+            while True:
+                chunk = reader.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
 
 
 class ExportNetworkPackage(_m.Tool()):
-    version = '1.2.1'
+    version = '1.3.0'
     tool_run_msg = ""
     number_of_tasks = 11  # For progress reporting, enter the integer number of tasks here
 
@@ -51,6 +170,7 @@ class ExportNetworkPackage(_m.Tool()):
     ExportAllFlag = _m.Attribute(bool)
     AttributeIdsToExport = _m.Attribute(_m.ListType)
     ExportMetadata = _m.Attribute(str)
+    CompressionLevel = _m.Attribute(int)
 
     xtmf_AttributeIdString = _m.Attribute(str)
     xtmf_ScenarioNumber = _m.Attribute(int)
@@ -62,6 +182,7 @@ class ExportNetworkPackage(_m.Tool()):
         # Set the defaults of parameters used by Modeller
         self.Scenario = _MODELLER.scenario  # Default is primary scenario
         self.ExportMetadata = ""
+        self.CompressionLevel = 6
 
     def page(self):
         pb = _tmg_tpb.TmgToolPageBuilder(
@@ -94,6 +215,13 @@ class ExportNetworkPackage(_m.Tool()):
                         size=255, multi_line=True,
                         title="Export comments")
 
+        pb.add_select(tool_attribute_name='CompressionLevel',
+                      keyvalues=[(0, "0 - Store only (fastest, largest file)"),
+                                 (1, "1 - Fastest compression"),
+                                 (6, "6 - Default compression"),
+                                 (9, "9 - Smallest file")],
+                      title="Compression level")
+
         pb.add_html("""
 <script type="text/javascript">
     $(document).ready( function ()
@@ -148,7 +276,7 @@ class ExportNetworkPackage(_m.Tool()):
     def check_all_flag(self):
         return self.ExportAllFlag
 
-    def __call__(self, xtmf_ScenarioNumber, ExportFile, xtmf_AttributeIdString):
+    def __call__(self, xtmf_ScenarioNumber, ExportFile, xtmf_AttributeIdString, CompressionLevel=6):
 
         self.Scenario = _m.Modeller().emmebank.scenario(xtmf_ScenarioNumber)
         if self.Scenario is None:
@@ -160,6 +288,7 @@ class ExportNetworkPackage(_m.Tool()):
         else:
             cells = xtmf_AttributeIdString.split(',')
             self.AttributeIdsToExport = [str(c.strip()) for c in cells if c.strip()]  # Clean out null values
+        self.CompressionLevel = CompressionLevel
 
         try:
             self._execute()
@@ -178,15 +307,11 @@ class ExportNetworkPackage(_m.Tool()):
                 self.AttributeIdsToExport = [att.name for att in self.Scenario.extra_attributes()]
 
             self._check_attributes()
-            with _zipfile.ZipFile(self.ExportFile, 'w', _zipfile.ZIP_DEFLATED) as zf, self._temp_file() as temp_folder:
-                version_file = _path.join(temp_folder, "version.txt")
-                with open(version_file, 'w') as writer:
-                    writer.write("4.0")
-                zf.write(version_file, arcname="version.txt")
-
-                info_path = _path.join(temp_folder, "info.txt")
-                self._write_info_file(info_path)
-                zf.write(info_path, arcname="info.txt")
+            # The package is closed (waiting for the last components to be compressed) before
+            # the temporary folder is deleted
+            with self._temp_file() as temp_folder, self._open_package() as zf:
+                zf.writestr("version.txt", "4.0")
+                zf.writestr("info.txt", self._get_info_text())
 
                 self._batchout_modes(temp_folder, zf)
                 self._batchout_vehicles(temp_folder, zf)
@@ -298,44 +423,61 @@ class ExportNetworkPackage(_m.Tool()):
             filename = _path.join(temp_folder, "extra_%ss_%s.csv" % (t, self.Scenario.number))
             zf.write(filename, arcname="exatt_%ss.241" % t)
 
-        summary_file = _path.join(temp_folder, "exatts.241")
-        self._export_attribute_definition_file(summary_file, extra_attributes)
-        zf.write(summary_file, arcname="exatts.241")
+        zf.writestr("exatts.241", self._get_attribute_definition_text(extra_attributes))
 
+    @_m.logbook_trace("Exporting traffic results")
     def _batchout_traffic_results(self, temp_folder, zf):
-        link_filepath = _path.join(temp_folder, "link_results.csv")
-        turn_filepath = _path.join(temp_folder, "turn_results.csv")
         traffic_result_attributes = ['auto_volume', 'additional_volume', 'auto_time']
 
-        links = _pdu.load_link_dataframe(self.Scenario).loc[:, traffic_result_attributes]
-        links.to_csv(link_filepath, index=True)
-        zf.write(link_filepath, arcname=_path.basename(link_filepath))
-
-        turns = _pdu.load_turn_dataframe(self.Scenario)
-        if not (turns is None):
-            turns = turns.loc[:, traffic_result_attributes]
-            turns.to_csv(turn_filepath)
-            zf.write(turn_filepath, arcname=_path.basename(turn_filepath))
+        zf.writestr("link_results.csv", self._get_results_text('LINK', traffic_result_attributes))
 
+        if self.Scenario.element_totals['turns'] > 0:
+            zf.writestr("turn_results.csv", self._get_results_text('TURN', traffic_result_attributes))
 
+    @_m.logbook_trace("Exporting transit results")
     def _batchout_transit_results(self, temp_folder, zf):
-        segment_filename = "segment_results.csv"
-        segment_filepath = _path.join(temp_folder, segment_filename)
         result_attributes = ['transit_boardings', 'transit_time', 'transit_volume', 'aux_transit_volume']
+        zf.writestr("segment_results.csv", self._get_results_text('TRANSIT_SEGMENT', result_attributes))
 
-        segments = _pdu.load_transit_segment_dataframe(self.Scenario).loc[:, result_attributes]
-        segments.to_csv(segment_filepath)
-        zf.write(segment_filepath, arcname=segment_filename)
-
-
-        aux_transit_filename = "aux_transit_results.csv"
-        aux_transit_filepath = _path.join(temp_folder,aux_transit_filename)
         aux_result_attributes = ['aux_transit_volume']
+        zf.writestr("aux_transit_results.csv", self._get_results_text('LINK', aux_result_attributes))
+
+    def _get_results_text(self, domain, attribute_names):
+        """
+        Formats the results of one domain as a CSV, in the same layout as a pandas
+        DataFrame indexed by the elements' IDs. Only the given attributes are loaded.
+        """
+        package = self.Scenario.get_attribute_values(domain, attribute_names)
+        index, tables = package[0], package[1:]
+
+        if domain == 'LINK':
+            key_names = ['i', 'j']
+            rows = [((i, j), position) for i, outgoing_links in index.iteritems()
+                    for j, position in outgoing_links.iteritems()]
+        elif domain == 'TURN':
+            key_names = ['i', 'j', 'k']
+            rows = [((i, j, k), position) for (i, j), outgoing_turns in index.iteritems()
+                    for k, position in outgoing_turns.iteritems()]
+        else:
+            key_names = ['line', 'i', 'j', 'loop']
+            rows = [((line,) + (key if len(key) == 3 else key + (1,)), position)
+                    for line, segments in index.iteritems() for key, position in segments.iteritems()]
+        rows.sort()
+
+        row_format = ','.join(['%s'] * len(key_names) + ['%r'] * len(attribute_names))
+        lines = [','.join(key_names + attribute_names)]
+        for key, position in rows:
+            lines.append(row_format % (key + tuple(table[position] for table in tables)))
+        lines.append('')
+        return '\n'.join(lines)
 
-        aux_transit = _pdu.load_link_dataframe(self.Scenario).loc[:, aux_result_attributes]
-        aux_transit.to_csv(aux_transit_filepath)
-        zf.write(aux_transit_filepath, arcname=aux_transit_filename)
-
+    @contextmanager
+    def _open_package(self):
+        writer = PackageWriter(self.ExportFile, self.CompressionLevel)
+        try:
+            yield writer
+        finally:
+            writer.close()
 
     @contextmanager
     def _temp_file(self):
@@ -351,6 +493,7 @@ class ExportNetworkPackage(_m.Tool()):
         atts = {
             "Scenario": str(self.Scenario.id),
             "Export File": _path.splitext(self.ExportFile)[0],
+            "Compression Level": self.CompressionLevel,
             "Version": self.version,
             "self": self.__MODELLER_NAMESPACE__}
 
@@ -368,26 +511,25 @@ class ExportNetworkPackage(_m.Tool()):
             file_.write("t %s init" % t_record)
 
     @staticmethod
-    def _export_attribute_definition_file(filename, attribute_list):
-        with open(filename, 'w') as writer:
-            writer.write("name,type, default")
-            for att in attribute_list:
-                writer.write("\n{name},{type},{default},'{desc}'".format(
-                    name=att.name, type=att.type, default=att.default_value, desc=att.description
-                ))
-
-    def _write_info_file(self, path):
-        with open(path, 'w') as writer:
-            bank = _MODELLER.emmebank
-            time = _dt.now()
-            lines = [str(bank.title),
-                     str(bank.path),
-                     "%s - %s" % (self.Scenario, self.Scenario.title),
-                     "{y}-{m}-{d} {h}:{mm}".format(y=time.year, m=time.month, d=time.day,
-                                                   h=time.hour, mm=time.minute),
-                     self.ExportMetadata]
-
-            writer.write("\n".join(lines))
+    def _get_attribute_definition_text(attribute_list):
+        text = "name,type, default"
+        for att in attribute_list:
+            text += "\n{name},{type},{default},'{desc}'".format(
+                name=att.name, type=att.type, default=att.default_value, desc=att.description
+            )
+        return text
+
+    def _get_info_text(self):
+        bank = _MODELLER.emmebank
+        time = _dt.now()
+        lines = [str(bank.title),
+                 str(bank.path),
+                 "%s - %s" % (self.Scenario, self.Scenario.title),
+                 "{y}-{m}-{d} {h}:{mm}".format(y=time.year, m=time.month, d=time.day,
+                                               h=time.hour, mm=time.minute),
+                 self.ExportMetadata]
+
+        return "\n".join(lines)
 
     def _get_select_attribute_options_json(self):
         keyval = {}
@@ -19,11 +19,14 @@
 
 import inro.modeller as _m
 import traceback as _traceback
+from array import array as _array
 from contextlib import contextmanager
 import zipfile as _zipfile
 from os import path as _path
 import shutil as _shutil
 import tempfile as _tf
+import time as _time
+import numpy as _np
 
 _MODELLER = _m.Modeller()  # Instantiate Modeller once.
 _bank = _MODELLER.emmebank
@@ -38,6 +41,15 @@ import_lines = _MODELLER.tool('inro.emme.data.network.transit.transit_line_trans
 import_turns = _MODELLER.tool('inro.emme.data.network.turn.turn_transaction')
 import_attributes = _MODELLER.tool('inro.emme.data.network.import_attribute_values')
 
+# Key columns of the results files written by export_network_package, as import_attributes
+# column labels and as the types used to parse them.
+_RESULT_KEY_LABELS = {'LINK': ['i_node', 'j_node'],
+                      'TURN': ['i_node', 'j_node', 'k_node'],
+                      'TRANSIT_SEGMENT': ['line', 'i_node', 'j_node', 'loop_idx']}
+_RESULT_KEY_TYPES = {'LINK': (int, int),
+                     'TURN': (int, int, int),
+                     'TRANSIT_SEGMENT': (str, int, int, int)}
+
 
 class ComponentContainer(object):
     """A simple data container. It's fully written out so I can get auto-completion"""
@@ -74,7 +86,7 @@ class ComponentContainer(object):
 
 
 class ImportNetworkPackage(_m.Tool()):
-    version = '1.2.1'
+    version = '1.3.0'
     tool_run_msg = ""
     number_of_tasks = 9  # For progress reporting, enter the integer number of tasks here
 
@@ -261,27 +273,31 @@ class ImportNetworkPackage(_m.Tool()):
                 _m.logbook_write("Created new scenario %s" % self.ScenarioId)
                 self.TRACKER.completeTask()
 
-                self._batchin_modes(scenario, temp_folder, zf)
-                self._batchin_vehicles(scenario, temp_folder, zf)
-                self._batchin_base(scenario, temp_folder, zf)
-                self._batchin_link_shapes(scenario, temp_folder, zf)
-                self._batchin_lines(scenario, temp_folder, zf)
-                self._batchin_turns(scenario, temp_folder, zf)
-
-                if self._components.traffic_results_files is not None:
-                    self._batchin_traffic_results(scenario, temp_folder, zf)
-
-                if self._components.transit_results_files is not None:
-                    self._batchin_transit_results(scenario, temp_folder, zf)
-
-                if self._components.attribute_header_file is not None:
-                    self._batchin_extra_attributes(scenario, temp_folder, zf)
+                with self.TRACKER.stage("Network"):
+                    self._batchin_modes(scenario, temp_folder, zf)
+                    self._batchin_vehicles(scenario, temp_folder, zf)
+                    self._batchin_base(scenario, temp_folder, zf)
+                    self._batchin_link_shapes(scenario, temp_folder, zf)
+                    self._batchin_lines(scenario, temp_folder, zf)
+                    self._batchin_turns(scenario, temp_folder, zf)
+
+                with self.TRACKER.stage("Results"):
+                    results_files = self._extract_results_files(scenario, temp_folder, zf)
+                    if results_files:
+                        self._batchin_results(scenario, results_files)
+
+                with self.TRACKER.stage("Extra attributes"):
+                    if self._components.attribute_header_file is not None:
+                        self._batchin_extra_attributes(scenario, temp_folder, zf)
                 self.TRACKER.completeTask()
 
-                if self._components.functions_file is not None:
-                    self._batchin_functions(temp_folder, zf)
+                with self.TRACKER.stage("Functions"):
+                    if self._components.functions_file is not None:
+                        self._batchin_functions(temp_folder, zf)
                 self.TRACKER.completeTask()
 
+            self.TRACKER.writeTimings()
+
     @_m.logbook_trace("Reading modes")
     def _batchin_modes(self, scenario, temp_folder, zf):
         fileName = zf.extract(self._components.mode_file, temp_folder)
@@ -360,88 +376,133 @@ class ImportNetworkPackage(_m.Tool()):
         except:
             return zipPath
     
-    @_m.logbook_trace("Importing traffic results")
-    def _batchin_traffic_results(self, scenario, temp_folder, zf):
-        scenario.has_traffic_results = True
-
-        links_filename, turns_filename = self._components.traffic_results_files
-        zf.extract(links_filename, temp_folder); zf.extract(turns_filename, temp_folder)
-
-        links_filepath = _path.join(temp_folder, links_filename)
-        turns_filepath = _path.join(temp_folder, turns_filename)
-
-        attribute_names = 'auto_volume', 'additional_volume', 'auto_time'
-
-        index, _ = scenario.get_attribute_values('LINK', ['data1'])
-        tables = []
-        with _util.tempExtraAttributeMANAGER(scenario, 'LINK', returnId=True) as temp_attribute:
-            column_labels = {0: 'i_node', 1: 'j_node'}
-            for i, attribute_name in enumerate(attribute_names):
-                column_labels[i + 2] = temp_attribute
-                import_attributes(links_filepath, ',', column_labels, scenario=scenario)
-                del column_labels[i + 2]
-
-                _, table = scenario.get_attribute_values('LINK', [temp_attribute])
-                tables.append(table)
-        scenario.set_attribute_values('LINK', attribute_names, [index] + tables)
-
-        index, _ = scenario.get_attribute_values('TURN', ['data1'])
-        tables = []
-        with _util.tempExtraAttributeMANAGER(scenario, 'TURN', returnId=True) as temp_attribute:
-            column_labels = {0: 'i_node', 1: 'j_node', 2: 'k_node'}
-            for i, attribute_name in enumerate(attribute_names):
-                column_labels[i + 3] = temp_attribute
-                import_attributes(turns_filepath, ',', column_labels, scenario=scenario)
-                del column_labels[i + 3]
-
-                _, table = scenario.get_attribute_values('TURN', [temp_attribute])
-                tables.append(table)
-        scenario.set_attribute_values('TURN', attribute_names, [index] + tables)
-
-    @_m.logbook_trace("Importing transit results")
-    def _batchin_transit_results(self, scenario, temp_folder, zf):
-        scenario.has_transit_results = True
-
-        segments_filename = self._components.transit_results_files
-        zf.extract(segments_filename, temp_folder)
-        segments_filepath = _path.join(temp_folder, segments_filename)
-
-        attribute_names = ['transit_boardings', 'transit_time', 'transit_volume']
-        index, _ = scenario.get_attribute_values('TRANSIT_SEGMENT', ['data1'])
-        tables = []
-        with _util.tempExtraAttributeMANAGER(scenario, 'TRANSIT_SEGMENT', returnId=True) as temp_attribute:
-            column_labels= {0: 'line', 1: 'i_node', 2: 'j_node', 3: 'loop_idx'}
-            for i, attribute_name in enumerate(attribute_names):
-                column_labels[i + 4] = temp_attribute
-                import_attributes(segments_filepath, ',', column_labels, scenario=scenario)
-                del column_labels[i + 4]
-
-                _, table = scenario.get_attribute_values('TRANSIT_SEGMENT', [temp_attribute])
-                tables.append(table)
-        scenario.set_attribute_values('TRANSIT_SEGMENT', attribute_names, [index] + tables)
-
-        # Technically, a file generated by 'export_network_package.py' should already have this file so long as there
-        # are transit results. However, some older versions of the tool do NOT have this feature, but can actually have
-        # transit results. So this conditional exists for backwards-compatibility.
-        if self._components.aux_transit_results_file is not None:
-            aux_transit_filename = self._components.aux_transit_results_file
-            zf.extract(aux_transit_filename,temp_folder)
-            aux_transit_filepath = _path.join(temp_folder, aux_transit_filename)
-
-            aux_attribute_names = ['aux_transit_volume']
-            index, _ = scenario.get_attribute_values('LINK', ['data1'])
-
+    def _extract_results_files(self, scenario, temp_folder, zf):
+        """
+        Extracts the traffic and transit results files in the package, flagging the
+        scenario as having results.
+
+        Returns: A list of (file path, domain, attribute names) tuples
+        """
+        results_files = []
+        traffic_attribute_names = ['auto_volume', 'additional_volume', 'auto_time']
+
+        if self._components.traffic_results_files is not None:
+            scenario.has_traffic_results = True
+
+            links_filename, turns_filename = self._components.traffic_results_files
+            results_files.append((zf.extract(links_filename, temp_folder), 'LINK', traffic_attribute_names))
+            results_files.append((zf.extract(turns_filename, temp_folder), 'TURN', traffic_attribute_names))
+
+        if self._components.transit_results_files is not None:
+            scenario.has_transit_results = True
+
+            segments_filename = self._components.transit_results_files
+            results_files.append((zf.extract(segments_filename, temp_folder), 'TRANSIT_SEGMENT',
+                                  ['transit_boardings', 'transit_time', 'transit_volume']))
+
+            # Technically, a file generated by 'export_network_package.py' should already have this file so long as
+            # there are transit results. However, some older versions of the tool do NOT have this feature, but can
+            # actually have transit results. So this conditional exists for backwards-compatibility.
+            if self._components.aux_transit_results_file is not None:
+                aux_transit_filename = self._components.aux_transit_results_file
+                results_files.append((zf.extract(aux_transit_filename, temp_folder), 'LINK', ['aux_transit_volume']))
+
+        return results_files
+
+    @_m.logbook_trace("Importing results")
+    def _batchin_results(self, scenario, results_files):
+        """
+        Parses each results file once, aligning its columns to the scenario's attribute
+        tables in memory, then saves the results with one set_attribute_values call per domain.
+        Elements missing from a file get a result of 0.
+        """
+        results = {}
+        for filepath, domain, attribute_names in results_files:
+            if domain not in results:
+                index, table = scenario.get_attribute_values(domain, ['data1'])
+                results[domain] = index, len(table), self._get_result_positions(domain, index), {}
+            index, table_size, positions, tables = results[domain]
+
+            rows, values = self._read_results_file(filepath, domain, positions, len(attribute_names))
+            for attribute_name, column in zip(attribute_names, values.T):
+                table = _np.zeros(table_size, dtype=_np.float64)
+                table[rows] = column
+                tables[attribute_name] = table
+
+        for domain, (index, table_size, positions, tables) in results.iteritems():
+            attribute_names = tables.keys()
+            scenario.set_attribute_values(domain, attribute_names,
+                                          [index] + [_array('d', tables[name].tostring()) for name in attribute_names])
+            _m.logbook_write("Imported %s %s results" % (domain, ', '.join(attribute_names)))
+
+    def _get_result_positions(self, domain, index):
+        """Flattens the index returned by get_attribute_values into a dictionary of key : table position"""
+        positions = {}
+        if domain == 'LINK':
+            for i, outgoing_links in index.iteritems():
+                for j, position in outgoing_links.iteritems():
+                    positions[(i, j)] = position
+        elif domain == 'TURN':
+            for (i, j), outgoing_turns in index.iteritems():
+                for k, position in outgoing_turns.iteritems():
+                    positions[(i, j, k)] = position
+        elif domain == 'TRANSIT_SEGMENT':
+            for line, segments in index.iteritems():
+                for key, position in segments.iteritems():
+                    if len(key) == 3:
+                        i, j, loop = key
+                    else:
+                        i, j = key
+                        loop = 1
+                    positions[(line, i, j, loop)] = position
+        return positions
+
+    def _read_results_file(self, filepath, domain, positions, n_columns):
+        """
+        Reads a results file in a single pass.
+
+        Returns: An int array of the table positions of the rows and a (rows x n_columns)
+            float array of their values.
+        """
+        key_types = _RESULT_KEY_TYPES[domain]
+        n_keys = len(key_types)
+
+        rows, values = [], []
+        n_missing = 0
+        with open(filepath) as reader:
+            reader.readline()  # toss the header
+            for line in reader:
+                cells = line.rstrip().split(',')
+                if len(cells) < n_keys + n_columns:
+                    continue
+                key = tuple(key_type(cell) for key_type, cell in zip(key_types, cells))
+                position = positions.get(key)
+                if position is None:
+                    n_missing += 1
+                    continue
+                rows.append(position)
+                values.append(cells[n_keys: n_keys + n_columns])
+        if n_missing > 0:
+            _m.logbook_write("Skipped %s rows of '%s' which are not in the scenario" % (n_missing, _path.basename(filepath)))
+
+        return _np.array(rows, dtype=_np.int64), _np.array(values, dtype=_np.float64).reshape(-1, n_columns)
+
+    def _batchin_results_by_column(self, scenario, results_files):
+        """Imports the results one column at a time with import_attributes, for comparison with _batchin_results"""
+        for filepath, domain, attribute_names in results_files:
+            index, _ = scenario.get_attribute_values(domain, ['data1'])
             tables = []
-            with _util.tempExtraAttributeMANAGER(scenario, 'LINK', returnId=True) as temp_attribute:
-                column_labels = {0:  'i_node', 1: 'j_node'}
-                for i, attribute_name in enumerate(aux_attribute_names):
-                    column_labels[i + 2] = temp_attribute
-                    import_attributes(aux_transit_filepath, ',', column_labels, scenario=scenario)
-                    del column_labels[i + 2]
-
-                    _, table = scenario.get_attribute_values('LINK', [temp_attribute])
+            with _util.tempExtraAttributeMANAGER(scenario, domain, returnId=True) as temp_attribute:
+                column_labels = dict(enumerate(_RESULT_KEY_LABELS[domain]))
+                n_keys = len(column_labels)
+                for i, attribute_name in enumerate(attribute_names):
+                    column_labels[i + n_keys] = temp_attribute
+                    import_attributes(filepath, ',', column_labels, scenario=scenario)
+                    del column_labels[i + n_keys]
+
+                    _, table = scenario.get_attribute_values(domain, [temp_attribute])
                     tables.append(table)
-            scenario.set_attribute_values('LINK', aux_attribute_names, [index] + tables)
+            scenario.set_attribute_values(domain, attribute_names, [index] + tables)
 
     @contextmanager
     def _temp_file(self):
@@ -604,3 +665,39 @@ class ImportNetworkPackage(_m.Tool()):
     @_m.method(return_type=str)
     def get_existing_scenario_title(self):
         return _bank.scenario(self.ScenarioId).title
+
+#-------------------------------------------------------------------------------------------
+
+def benchmarkResultsImport(networkPackageFile, scenarioId, repetitions=1):
+    """
+    Times importing the traffic and transit results of a network package one column
+    at a time with import_attributes, and in a single pass. The package is imported
+    into the scenario first, overwriting it.
+
+    Returns: A dictionary with the 'by_column_time', 'single_pass_time' (both in
+        seconds for all the repetitions) and 'speedup' keys.
+    """
+    tool = ImportNetworkPackage()
+    tool(networkPackageFile, scenarioId, merge_functions.EDIT_OPTION, False)
+    scenario = _bank.scenario(scenarioId)
+
+    with _zipfile.ZipFile(networkPackageFile) as zf, tool._temp_file() as temp_folder:
+        tool._components.reset()
+        tool._check_network_package(zf)
+        results_files = tool._extract_results_files(scenario, temp_folder, zf)
+        if not results_files:
+            raise Exception("'%s' does not contain any results" % networkPackageFile)
+
+        start = _time.time()
+        for i in range(repetitions):
+            tool._batchin_results_by_column(scenario, results_files)
+        by_column_time = _time.time() - start
+
+        start = _time.time()
+        for i in range(repetitions):
+            tool._batchin_results(scenario, results_files)
+        single_pass_time = _time.time() - start
+
+    return {'by_column_time': by_column_time,
+            'single_pass_time': single_pass_time,
+            'speedup': by_column_time / single_pass_time if single_pass_time > 0 else float('inf')}
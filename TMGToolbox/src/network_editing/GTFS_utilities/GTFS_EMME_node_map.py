@@ -17,12 +17,33 @@
     along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+#---VERSION HISTORY
+'''
+    0.0.1 Created
+    
+    0.1.0 Rebuilt around arrays: the stops are projected in one call, and mapped to their
+        nearest nodes in bulk (GridIndex.nearestMany) with an optional distance cutoff. Up to
+        k candidate nodes can be written per stop, and candidates can be restricted to
+        nodes whose transit modes serve the stop's route types. Stops without a match are
+        written with node 0 (no mapping) instead of 'Nothing Found'. Fixed the shapefile
+        input, which read an undefined attribute.
+    
+    0.1.1 Stops whose route types are not served by any Emme mode can be mapped to any node
+        (as stops with unknown route types are), instead of being written with node 0. The
+        mode to route type map is taken from generate_transit_lines_from_GTFS.
+    
+    0.1.2 Stops with missing or invalid coordinates are no longer projected or mapped, and
+        are written with node 0.
+    
+'''
+
 import inro.modeller as _m
 import csv
+import math
 import traceback as _traceback
-from contextlib import contextmanager
-from contextlib import nested
+from itertools import izip
 from os import path as _path
+import numpy as _np
 from pyproj import Proj
 from osgeo import ogr
 import osgeo.ogr
@@ -32,22 +53,45 @@ _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 _geo = _MODELLER.module('tmg.common.geometry')
 _spindex = _MODELLER.module('tmg.common.spatial_index')
+_gtfs = _MODELLER.module('tmg.network_editing.GTFS_utilities.gtfs_reader')
 networkExportTool = _MODELLER.tool('inro.emme.data.network.export_network_as_shapefile')
 gtfsExportTool = _MODELLER.tool('tmg.network_editing.GTFS_utilities.export_GTFS_stops_as_shapefile')
+_gtfsLines = _MODELLER.module('tmg.network_editing.GTFS_utilities.generate_transit_lines_from_GTFS')
 EMME_VERSION = _util.getEmmeVersion(tuple)
 
+#GTFS route types served by each Emme transit mode (the reverse of GtfsModeMap in generate_transit_lines_from_GTFS)
+EmmeModeRouteTypes = dict((mode, int(type)) for mode, type in _gtfsLines.GtfsModeMap.iteritems())
+
+#Characters used for GTFS route types in the 'Modes' field of export_GTFS_stops_as_shapefile
+ModeCharacterRouteTypes = {'s': 0,
+                           'm': 1,
+                           'r': 2,
+                           'b': 3,
+                           'f': 4,
+                           'c': 5,
+                           'g': 6,
+                           'x': 7}
+
 class GTFStoEmmeMap(_m.Tool()):
-    version = '0.0.1'
+    version = '0.1.2'
     tool_run_msg = ""
-    number_of_tasks = 1 
+    number_of_tasks = 4 
 
     #Tool Parameters
     FileName = _m.Attribute(str)
     MappingFileName = _m.Attribute(str)
+    MaxDistance = _m.Attribute(float)
+    NumberOfCandidates = _m.Attribute(int)
+    CheckModesFlag = _m.Attribute(bool)
 
     def __init__(self):
         #---Init internal variables
         self.TRACKER = _util.ProgressTracker(self.number_of_tasks) #init the ProgressTracker
+        
+        #---Set the defaults of parameters used by Modeller
+        self.MaxDistance = 0.0
+        self.NumberOfCandidates = 1
+        self.CheckModesFlag = False
 
     
     def page(self):
@@ -69,12 +113,28 @@ class GTFStoEmmeMap(_m.Tool()):
         pb.add_select_file(tool_attribute_name="MappingFileName",
                            window_type='save_file',
                            title="Map file to export")
+        
+        pb.add_text_box(tool_attribute_name="MaxDistance",
+                        size=10, title="Maximum distance",
+                        note="Stops further than this from any node are not mapped. Enter 0 for no limit.")
+        
+        pb.add_text_box(tool_attribute_name="NumberOfCandidates",
+                        size=2, title="Number of candidate nodes",
+                        note="The nearest node is the mapped node; the others are written as extra columns for review.")
+        
+        pb.add_checkbox(tool_attribute_name="CheckModesFlag",
+                        label="Only map stops to nodes served by their transit modes?",
+                        note="Uses the routes, trips and stop times next to the stops.txt file, or \
+                        the 'Modes' field of a stops shapefile.")
 
         return pb.render()
 
-    def __call__(self, StopFileName, MappingFileName):
+    def __call__(self, StopFileName, MappingFileName, MaxDistance= 0.0, NumberOfCandidates= 1, CheckModesFlag= False):
         self.FileName = StopFileName
         self.MappingFileName = MappingFileName
+        self.MaxDistance = MaxDistance
+        self.NumberOfCandidates = NumberOfCandidates
+        self.CheckModesFlag = CheckModesFlag
         
         self.tool_run_msg = ""
         self.TRACKER.reset()
@@ -104,30 +164,52 @@ class GTFStoEmmeMap(_m.Tool()):
     def _Execute(self):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
+            if self.NumberOfCandidates < 1:
+                raise Exception("The number of candidate nodes must be at least 1")
+            
             #def file type
             if self.FileName[-3:].lower() == "txt":
-                stops = self._LoadStopsTxt()
+                stopIds, lons, lats, stopRouteTypes = self._LoadStopsTxt()
             elif self.FileName[-3:].lower() == "shp":
-                stops = self._LoadStopsShp()
+                stopIds, lons, lats, stopRouteTypes = self._LoadStopsShp()
             else:
                 raise Exception("Not a correct format")
+            self.TRACKER.completeTask()
+            
             #need to convert stops from lat lon to UTM
-            convertedStops = self._ConvertStops(stops)
-            #load nodes from network
-            allnodes = _MODELLER.scenario.get_network().regular_nodes()
-            #create node dictionary like converted stops?
-            nodes = {}
-            for n in allnodes:
-                nodes[int(n.id)] = (float(n.x),float(n.y))
-            #find extents
-            extents = self._FindExtents(convertedStops,nodes)
-            #load and find nearest point
-            self._FindNearest(extents,convertedStops,nodes)
+            xs, ys = self._ConvertStops(lons, lats)
+            self.TRACKER.completeTask()
+            
+            #Stops without valid coordinates (e.g. blank in stops.txt) are left unmapped
+            valid = _np.flatnonzero(_np.isfinite(xs) & _np.isfinite(ys))
+            if len(valid) < len(xs):
+                msg = "%s stops have missing or invalid coordinates, and were not mapped." %(len(xs) - len(valid))
+                print msg
+                _m.logbook_write(msg)
+            
+            nodes = list(_MODELLER.scenario.get_network().regular_nodes())
+            if stopRouteTypes is not None:
+                stopRouteTypes = [stopRouteTypes[i] for i in valid]
+            matches = [[] for i in xrange(len(xs))]
+            for i, candidates in izip(valid, self._FindNearest(xs[valid], ys[valid], stopRouteTypes, nodes)):
+                matches[i] = candidates
+            self.TRACKER.completeTask()
+            
+            self._WriteMappingFile(stopIds, xs, ys, matches)
+            self.TRACKER.completeTask()
+            
+            nMapped = sum(1 for candidates in matches if candidates)
+            msg = "%s of %s stops were mapped to nodes." %(nMapped, len(stopIds))
+            print msg
+            _m.logbook_write(msg)
 
 
     def _GetAtts(self):
         atts = {
                 "Version": self.version, 
+                "Max Distance": self.MaxDistance,
+                "Number of Candidates": self.NumberOfCandidates,
+                "Check Modes": self.CheckModesFlag,
                 "self": self.__MODELLER_NAMESPACE__}
             
         return atts 
@@ -135,44 +217,69 @@ class GTFStoEmmeMap(_m.Tool()):
 
     
     def _LoadStopsTxt(self):
-        stops = {}
-        with open(self.FileName) as reader:
-            #stop_lat,zone_id,stop_lon,stop_id,stop_desc,stop_name,location_type
-            header = reader.readline().strip().split(',')
-            latCol = header.index('stop_lat')
-            lonCol = header.index('stop_lon')
-            idCol = header.index('stop_id')
-            nameCol = header.index('stop_name')
-            descCol = header.index('stop_desc')
-            
-            for line in reader.readlines():
-                cells = line.strip().split(',')
-                id = cells[idCol]
-                stop = GtfsStop(id,
-                                cells[lonCol],
-                                cells[latCol],
-                                cells[nameCol],
-                                cells[descCol])
-                stops[id] = [float(cells[lonCol]),float(cells[latCol])]
-        return stops 
+        stops = _gtfs.loadTable(self.FileName)
+        stopIds = stops.values('stop_id').tolist()
+        
+        stopRouteTypes = None
+        if self.CheckModesFlag:
+            stopRouteTypes = self._LoadStopRouteTypes(stopIds)
+        return stopIds, stops.values('stop_lon'), stops.values('stop_lat'), stopRouteTypes
+    
+    def _LoadStopRouteTypes(self, stopIds):
+        #The route types serving each stop, from the other files of the feed
+        folder = _path.dirname(self.FileName)
+        routes = _gtfs.loadTable(folder + "/routes.txt")
+        routeTypes = dict((id, int(type)) for id, type in routes.iterRows(['route_id', 'route_type']))
+        trips = _gtfs.loadTable(folder + "/trips.txt")
+        tripTypes = dict((id, routeTypes.get(routeId, -1)) for id, routeId in trips.iterRows(['trip_id', 'route_id']))
+        
+        stopTimes = _gtfs.loadTable(folder + "/stop_times.txt")
+        stopLabels = stopTimes.labels('stop_id').tolist()
+        types = sorted(set(routeTypes.itervalues()))
+        typeIndices = dict((type, i) for i, type in enumerate(types))
+        tripTypeIndices = _np.array([typeIndices.get(tripTypes.get(id, -1), -1) for id in stopTimes.labels('trip_id').tolist()],
+                                    dtype= _np.int64)
+        
+        #Distinct (stop, route type) pairs
+        rowTypeIndices = tripTypeIndices[stopTimes.codes('trip_id')]
+        found = rowTypeIndices >= 0
+        nTypes = max(1, len(types))
+        pairs = _np.unique(stopTimes.codes('stop_id')[found].astype(_np.int64) * nTypes + rowTypeIndices[found])
+        
+        stopIndices = dict((id, i) for i, id in enumerate(stopIds))
+        stopRouteTypes = [set() for id in stopIds]
+        for stopCode, typeIndex in izip(*divmod(pairs, nTypes)):
+            index = stopIndices.get(stopLabels[stopCode])
+            if index is not None:
+                stopRouteTypes[index].add(types[typeIndex])
+        return stopRouteTypes
 
     def _LoadStopsShp(self):
-        stops = {}
-        shp = ogr.Open(self.ShpFileName)
+        stopIds, lons, lats, stopRouteTypes = [], [], [], []
+        shp = ogr.Open(self.FileName)
         layer = shp.GetLayer(0)
         if layer.GetGeomType() == 1:
             for feat in layer:
                 index1 = feat.GetFieldIndex("StopID")
                 id = feat.GetField(index1)
+                modesIndex = feat.GetFieldIndex("Modes")
+                if modesIndex >= 0:
+                    modes = feat.GetField(modesIndex) or ""
+                else:
+                    modes = ""
                 geom  = feat.GetGeometryRef()
                 points = geom.GetPointCount()
                 for point in xrange(points):
                     lon, lat, z = geom.GetPoint(point)
-                    stops[id] = [float(lon),float(lat)]
-        return stops 
-
-    def _ConvertStops(self, stops):
-        convertedStops = {}
+                    stopIds.append(id)
+                    lons.append(float(lon))
+                    lats.append(float(lat))
+                    stopRouteTypes.append(set(ModeCharacterRouteTypes[c] for c in modes if c in ModeCharacterRouteTypes))
+        if not self.CheckModesFlag:
+            stopRouteTypes = None
+        return stopIds, _np.array(lons, dtype= _np.float64), _np.array(lats, dtype= _np.float64), stopRouteTypes
+    
+    def _GetProjection(self):
         # find what zone system the file is using
         fullzonestring = _m.Modeller().desktop.project.spatial_reference_file
         if EMME_VERSION >= (4,3,0):
@@ -185,69 +292,122 @@ class GTFStoEmmeMap(_m.Tool()):
             prjzone = int(fullzonestring[-7:-5])
         # put try and exception statements here?
         if hemisphere.lower() == 's':
-            p = Proj("+proj=utm +ellps=WGS84 +zone=%d +south" %prjzone)
+            return Proj("+proj=utm +ellps=WGS84 +zone=%d +south" %prjzone)
         else:
-            p = Proj("+proj=utm +ellps=WGS84 +zone=%d" %prjzone)
-        stoplons = ()
-        stoplats = ()
-        for stop in stops.keys():
-            templons = (float(stops[stop][0]),)
-            templats = (float(stops[stop][1]),)
-            x, y = p(templons, templats)
-            convertedStops[stop] = x+y
-            convertedStops[stop] = (float(convertedStops[stop][0]),float(convertedStops[stop][1]))
-        return convertedStops
+            return Proj("+proj=utm +ellps=WGS84 +zone=%d" %prjzone)
 
+    def _ConvertStops(self, lons, lats):
+        if len(lons) == 0:
+            return _np.zeros(0), _np.zeros(0)
+        p = self._GetProjection()
+        lons = _np.asarray(lons, dtype= _np.float64)
+        lats = _np.asarray(lats, dtype= _np.float64)
+        #All the stops with valid coordinates are projected in a single call; the others are NaN
+        xs = _np.empty(len(lons))
+        ys = _np.empty(len(lons))
+        xs.fill(_np.nan)
+        ys.fill(_np.nan)
+        valid = _np.isfinite(lons) & _np.isfinite(lats)
+        if valid.any():
+            validXs, validYs = p(lons[valid], lats[valid])
+            xs[valid] = validXs
+            ys[valid] = validYs
+        return xs, ys
 
-    def _FindExtents(self, convertedStops, nodes):
-        #find extents
-        maxExtentx = float("-inf")
-        minExtentx =  float("inf")
-        maxExtenty = float("-inf")
-        minExtenty =  float("inf")
-        for key in convertedStops:
-            if convertedStops[key][0] < minExtentx:
-                minExtentx = float(convertedStops[key][0])
-            if convertedStops[key][0] > maxExtentx:
-                maxExtentx = float(convertedStops[key][0])
-            if convertedStops[key][1] < minExtenty:
-                minExtenty = float(convertedStops[key][1])
-            if convertedStops[key][1] > maxExtenty:
-                maxExtenty = float(convertedStops[key][1])
+    def _FindNearest(self, xs, ys, stopRouteTypes, nodes):
+        '''
+        Returns a list with, for each stop, a list of up to k (node, distance) candidates
+        sorted by distance (empty if no node is within the maximum distance).
+        '''
+        k = self.NumberOfCandidates
+        maxRadius = self.MaxDistance if self.MaxDistance > 0 else None
+        points = _np.column_stack((xs, ys))
+        matches = [[] for i in xrange(len(points))]
+        if not len(points) or not nodes:
+            return matches
+        
+        if stopRouteTypes is None:
+            index = self._IndexNodes(nodes)
+            return index.nearestMany(points, k, maxRadius)
+        
+        #Stops are only mapped to nodes served by one of their route types. Stops with
+        #unknown route types (e.g. no stop times), or only route types which no Emme mode
+        #serves, can be mapped to any node.
+        nodeRouteTypes = [self._GetNodeRouteTypes(node) for node in nodes]
+        mappedTypes = set(EmmeModeRouteTypes.itervalues())
+        stopsByType = {}
+        nUnmapped = 0
+        for i, types in enumerate(stopRouteTypes):
+            types = types & mappedTypes
+            if stopRouteTypes[i] and not types: nUnmapped += 1
+            for type in (types or [None]):
+                stopsByType.setdefault(type, []).append(i)
+        if nUnmapped:
+            msg = "%s stops are only served by route types with no Emme mode, and were checked against all nodes." %nUnmapped
+            print msg
+            _m.logbook_write(msg)
+        
+        for type, stops in stopsByType.iteritems():
+            if type is None: typeNodes = nodes
+            else: typeNodes = [node for node, types in izip(nodes, nodeRouteTypes) if type in types]
+            if not typeNodes: continue
+            
+            index = self._IndexNodes(typeNodes)
+            for i, candidates in izip(stops, index.nearestMany(points[stops], k, maxRadius)):
+                matches[i].extend(candidates)
+        
+        for i, types in enumerate(stopRouteTypes):
+            if len(types & mappedTypes) > 1:
+                #Merge the candidates of each route type
+                candidates = {}
+                for node, distance in matches[i]: candidates[node.number] = (distance, node)
+                matches[i] = [(node, distance) for distance, node in sorted(candidates.itervalues())[:k]]
+        return matches
+    
+    def _IndexNodes(self, nodes):
+        xs = _np.array([node.x for node in nodes], dtype= _np.float64)
+        ys = _np.array([node.y for node in nodes], dtype= _np.float64)
+        extents = (xs.min() - 1.0, ys.min() - 1.0, xs.max() + 1.0, ys.max() + 1.0)
+        
+        #Roughly four nodes per cell
+        gridSize = max(1, min(1000, int(math.sqrt(len(nodes) / 4.0))))
+        spatialIndex = _spindex.GridIndex(extents, gridSize, gridSize)
         for node in nodes:
-            if nodes[node][0] < minExtentx:
-                minExtentx = float(nodes[node][0])
-            if nodes[node][0] > maxExtentx:
-                maxExtentx = float(nodes[node][0])
-            if nodes[node][1] < minExtenty:
-                minExtenty = float(nodes[node][1])
-            if nodes[node][1] > maxExtenty:
-                maxExtenty = float(nodes[node][1])
-        extents = (minExtentx-1,minExtenty-1,maxExtentx+1,maxExtenty+1)
-        return extents
-
-    def _FindNearest(self, extents, convertedStops, nodes):
-        map = []
-        spatialIndex = _spindex.GridIndex(extents, 1000, 1000)
-        network = _MODELLER.scenario.get_network()
-        for node in network.regular_nodes():
             spatialIndex.insertPoint(node)
-        for stop in convertedStops:
-            nearestNode = spatialIndex.nearestToPoint(convertedStops[stop][0], convertedStops[stop][1])
-            if nearestNode[0] == "Nothing Found":
-                map.append([stop, nearestNode[0],convertedStops[stop][0],convertedStops[stop][1],-1,-1])
-            elif nearestNode[0] == None:
-                map.append([stop, nearestNode[0],convertedStops[stop][0],convertedStops[stop][1],0,0])
-            else:
-                cleanedNumber = int(nearestNode[0])
-                map.append([stop, cleanedNumber,convertedStops[stop][0],convertedStops[stop][1],nodes[cleanedNumber][0],nodes[cleanedNumber][1]])
-
+        return spatialIndex
+    
+    def _GetNodeRouteTypes(self, node):
+        types = set()
+        for link in node.outgoing_links():
+            for mode in link.modes:
+                if mode.id in EmmeModeRouteTypes: types.add(EmmeModeRouteTypes[mode.id])
+        for link in node.incoming_links():
+            for mode in link.modes:
+                if mode.id in EmmeModeRouteTypes: types.add(EmmeModeRouteTypes[mode.id])
+        return types
+    
+    def _WriteMappingFile(self, stopIds, xs, ys, matches):
+        k = self.NumberOfCandidates
+        header = ["stopID","emmeID","stop x", "stop y", "node x", "node y", "distance"]
+        
+        #Stops without a match are written with node 0, which is read as 'no mapping'
+        nearest = [candidates[0] if candidates else None for candidates in matches]
+        columns = [stopIds,
+                   [int(match[0].number) if match else 0 for match in nearest],
+                   xs.tolist(),
+                   ys.tolist(),
+                   [float(match[0].x) if match else -1 for match in nearest],
+                   [float(match[0].y) if match else -1 for match in nearest],
+                   [match[1] if match else '' for match in nearest]]
+        for rank in xrange(1, k):
+            header.extend(["emmeID %s" %(rank + 1), "distance %s" %(rank + 1)])
+            columns.append([int(candidates[rank][0].number) if len(candidates) > rank else '' for candidates in matches])
+            columns.append([candidates[rank][1] if len(candidates) > rank else '' for candidates in matches])
+        
         with open(self.MappingFileName, 'wb') as csvfile:
             mapFile = csv.writer(csvfile, delimiter=',')
-            header = ["stopID","emmeID","stop x", "stop y", "node x", "node y"]
             mapFile.writerow(header)
-            for row in map:
-                mapFile.writerow([row[0],row[1], row[2], row[3], row[4], row[5]])
+            mapFile.writerows(izip(*columns))
 
         
     @_m.method(return_type=_m.TupleType)
@@ -257,15 +417,3 @@ class GTFStoEmmeMap(_m.Tool()):
     @_m.method(return_type=unicode)
     def tool_run_msg_status(self):
         return self.tool_run_msg
-    
-    
-class GtfsStop():
-    
-    def __init__(self, id, lon, lat, name, description):
-        self.id = id
-        self.lat = float(lat)
-        self.lon = float(lon)
-        self.name= name
-        self.description = description
-        self.modes = set()
-    
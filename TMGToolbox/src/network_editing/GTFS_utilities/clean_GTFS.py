@@ -18,17 +18,27 @@
 '''
 
 
+#---VERSION HISTORY
+'''
+    0.0.1 Created
+
+    0.1.0 The files are read with the shared GTFS reader (gtfs_reader), which streams them and
+        caches their columns, instead of reading each file whole. Filtered trips are no longer
+        written with a leading space.
+
+'''
+
 import inro.modeller as _m
 import traceback as _traceback
-from contextlib import contextmanager
-from contextlib import nested
-_util = _m.Modeller().module('tmg.common.utilities')
+_MODELLER = _m.Modeller() #Instantiate Modeller once.
+_util = _MODELLER.module('tmg.common.utilities')
+_gtfs = _MODELLER.module('tmg.network_editing.GTFS_utilities.gtfs_reader')
 
 ##########################################################################################################
 
 class CleanGTFS(_m.Tool()):
     
-    version = '0.0.1'
+    version = '0.1.0'
     tool_run_msg = ""
     number_of_tasks = 4 # For progress reporting, enter the integer number of tasks here
     
@@ -119,71 +129,25 @@ class CleanGTFS(_m.Tool()):
     #----SUB FUNCTIONS---------------------------------------------------------------------------------  
     
     def _GetRouteIdSet(self, routesFile):
-        idSet = set()
-        with open(routesFile) as reader:
-            header = reader.readline().split(",")
-            idCol = header.index("route_id")
-            
-            for line in reader.readlines():
-                cells = line.split(",")
-                idSet.add(cells[idCol])
-        return idSet
+        routes = _gtfs.loadTable(routesFile)
+        return routes.uniqueValues('route_id')
     
     def _FilterTripsFile(self, routeIdSet, serviceIdSet):
-        tripIdSet = set()
-        with nested(open(self.GTFSFolderName + "/trips.txt"), 
-                    open(self.GTFSFolderName + "/trips.updated.csv", 'w')) as (reader, writer):
-            header = reader.readline().strip()
-            cells = header.split(",")
-            writer.write(header)
-            routeIdCol = cells.index("route_id")
-            serviceIdCol = cells.index("service_id")
-            tripIdCol = cells.index("trip_id")
-            
-            for line in reader.readlines():
-                line = line.strip()
-                cells = line.split(",")
-                if not cells[routeIdCol] in routeIdSet:
-                    continue
-                if not cells[serviceIdCol] in serviceIdSet:
-                    continue
-                tripIdSet.add(cells[tripIdCol])
-                writer.write("\n %s" %line)
-        return tripIdSet
+        trips = _gtfs.loadTable(self.GTFSFolderName + "/trips.txt")
+        mask = trips.isin('route_id', routeIdSet) & trips.isin('service_id', serviceIdSet)
+        _gtfs.writeRows(trips, mask, self.GTFSFolderName + "/trips.updated.csv")
+        return trips.uniqueValues('trip_id', mask)
     
     def _FilterStopTimesFile(self, tripIdSet):
-        servicedStopsSet = set()
-        with nested(open(self.GTFSFolderName + "/stop_times.txt"),
-                    open(self.GTFSFolderName + "/stop_times.updated.csv", 'w')) as (reader, writer):
-            header = reader.readline().strip()
-            writer.write(header)
-            cells = header.split(",")
-            tripIdCol = cells.index("trip_id")
-            stopIdCol = cells.index("stop_id")
-            
-            for line in reader.readlines():
-                line = line.strip()
-                cells = line.split(',')
-                if not cells[tripIdCol] in tripIdSet:
-                    continue
-                servicedStopsSet.add(cells[stopIdCol])
-                writer.write("\n%s" %line)
-        return servicedStopsSet
+        stopTimes = _gtfs.loadTable(self.GTFSFolderName + "/stop_times.txt")
+        mask = stopTimes.isin('trip_id', tripIdSet)
+        _gtfs.writeRows(stopTimes, mask, self.GTFSFolderName + "/stop_times.updated.csv")
+        return stopTimes.uniqueValues('stop_id', mask)
 
     def _FilterStopsFile(self, servicedStopsSet):
-        with nested(open(self.GTFSFolderName + "/stops.txt"),
-                    open(self.GTFSFolderName + "/stops.updated.csv", 'w')) as (reader, writer):
-            header = reader.readline().strip()
-            writer.write(header)
-            cells = header.split(",")
-            stopIdCol = cells.index("stop_id")
-            
-            for line in reader.readlines():
-                line = line.strip()
-                cells = line.split(",")
-                if not cells[stopIdCol] in servicedStopsSet:
-                    continue
-                writer.write("\n%s" %line)
+        stops = _gtfs.loadTable(self.GTFSFolderName + "/stops.txt")
+        mask = stops.isin('stop_id', servicedStopsSet)
+        _gtfs.writeRows(stops, mask, self.GTFSFolderName + "/stops.updated.csv")
     
     @_m.method(return_type=_m.TupleType)
     def percent_completed(self):
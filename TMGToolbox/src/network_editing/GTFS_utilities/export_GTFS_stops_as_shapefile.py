@@ -33,23 +33,27 @@ Export Gtfs Stops as Shapefile
 '''
     0.0.1 Created
     
+    0.1.0 The files are read with the shared GTFS reader (gtfs_reader), which streams them and
+        caches their columns. The modes of each stop are found from the distinct (stop, mode)
+        pairs of the stop times, rather than row by row.
+    
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
-from contextlib import contextmanager
-from contextlib import nested
 from os import path as _path
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 _geo = _MODELLER.module('tmg.common.geometry')
+_gtfs = _MODELLER.module('tmg.network_editing.GTFS_utilities.gtfs_reader')
 
 ##########################################################################################################
 
 class ExportGtfsStopsAsShapefile(_m.Tool()):
     
-    version = '0.0.1'
+    version = '0.1.0'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -131,49 +135,23 @@ class ExportGtfsStopsAsShapefile(_m.Tool()):
         return atts 
 
     def _LoadRoutes(self):
-        output = {}
-        with open(self.GtfsFolderName + "/routes.txt") as reader:
-            header = reader.readline().strip().split(',')
-            routeIdCol = header.index('route_id')
-            modeCol = header.index('route_type')
-            
-            for line in reader.readlines():
-                cells = line.strip().split(',')
-                output[cells[routeIdCol]] = int(cells[modeCol])
-        return output #RouteID -> mode
+        routes = _gtfs.loadTable(self.GtfsFolderName + "/routes.txt")
+        return dict((id, int(mode)) for id, mode in routes.iterRows(['route_id', 'route_type'])) #RouteID -> mode
     
     def _LoadTrips(self, routeModes):
-        output = {}
-        with open(self.GtfsFolderName + "/trips.txt") as reader:
-            header = reader.readline().strip().split(',')
-            routeIdCol = header.index('route_id')
-            tripIdCol = header.index('trip_id')
-            
-            for line in reader.readlines():
-                cells = line.strip().split(',')
-                output[cells[tripIdCol]] = routeModes[cells[routeIdCol]]
-        return output #TripID -> mode
+        trips = _gtfs.loadTable(self.GtfsFolderName + "/trips.txt")
+        return dict((id, routeModes[routeId]) for id, routeId in trips.iterRows(['trip_id', 'route_id'])) #TripID -> mode
     
     def _LoadStops(self):
         stops = {}
-        with open(self.GtfsFolderName + "/stops.txt") as reader:
-            #stop_lat,zone_id,stop_lon,stop_id,stop_desc,stop_name,location_type
-            header = reader.readline().strip().split(',')
-            latCol = header.index('stop_lat')
-            lonCol = header.index('stop_lon')
-            idCol = header.index('stop_id')
-            nameCol = header.index('stop_name')
-            descCol = header.index('stop_desc')
-            
-            for line in reader.readlines():
-                cells = line.strip().split(',')
-                id = cells[idCol]
-                stop = GtfsStop(id,
-                                cells[lonCol],
-                                cells[latCol],
-                                cells[nameCol],
-                                cells[descCol])
-                stops[id] = stop
+        #stop_lat,zone_id,stop_lon,stop_id,stop_desc,stop_name,location_type
+        table = _gtfs.loadTable(self.GtfsFolderName + "/stops.txt")
+        columns = ['stop_id', 'stop_lon', 'stop_lat', 'stop_name']
+        if 'stop_desc' in table: columns.append('stop_desc')
+        
+        for cells in table.iterRows(columns):
+            if len(cells) < 5: cells += ('',)
+            stops[cells[0]] = GtfsStop(*cells)
         return stops #StopID -> stop
     
     def _LoadStopTimes(self, stops, tripModes):
@@ -187,25 +165,32 @@ class ExportGtfsStopsAsShapefile(_m.Tool()):
                             6: 'g',
                             7: 'x'}
         
-        with open(self.GtfsFolderName + "/stop_times.txt") as reader:
-            #trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,shape_dist_traveled
-            header = reader.readline().strip().split(',')
-            tripIdCol = header.index('trip_id')
-            stopIdCol = header.index('stop_id')
-            
-            for line in reader.readlines():
-                cells = line.strip().split(',')
-                if not cells[stopIdCol] in stops: 
-                    print "Could not find stop '%s'" %cells[stopIdCol]
-                    continue
-                stop = stops[cells[stopIdCol]]                    
-                
-                if not cells[tripIdCol] in tripModes:
-                    print "Could not find trip '%s'" %cells[tripIdCol]
-                    continue
-                mode = tripModes[cells[tripIdCol]]
-                
-                stop.modes.add(modeCharacterMap[mode])
+        stopTimes = _gtfs.loadTable(self.GtfsFolderName + "/stop_times.txt")
+        stopLabels = stopTimes.labels('stop_id').tolist()
+        tripLabels = stopTimes.labels('trip_id').tolist()
+        stopCodes = stopTimes.codes('stop_id')
+        tripCodes = stopTimes.codes('trip_id')
+        
+        #Index the modes of the trips, with -1 for trips which couldn't be found
+        modes = sorted(set(tripModes.itervalues()))
+        modeIndices = dict((mode, i) for i, mode in enumerate(modes))
+        tripModeIndices = _np.array([modeIndices[tripModes[id]] if id in tripModes else -1 for id in tripLabels], dtype= _np.int64)
+        for code in _np.unique(tripCodes[tripModeIndices[tripCodes] < 0]):
+            print "Could not find trip '%s'" %tripLabels[code]
+        
+        #Each stop only needs to be flagged once per mode
+        rowModeIndices = tripModeIndices[tripCodes]
+        found = rowModeIndices >= 0
+        pairs = _np.unique(stopCodes[found].astype(_np.int64) * max(1, len(modes)) + rowModeIndices[found])
+        missingStops = set()
+        for stopCode, modeIndex in zip(*divmod(pairs, max(1, len(modes)))):
+            id = stopLabels[stopCode]
+            if not id in stops:
+                missingStops.add(id)
+                continue
+            stops[id].modes.add(modeCharacterMap[modes[modeIndex]])
+        for id in sorted(missingStops):
+            print "Could not find stop '%s'" %id
     
     def _WriteStopsToShapefile(self, stops):
         
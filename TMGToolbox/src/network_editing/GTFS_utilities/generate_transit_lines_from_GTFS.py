@@ -58,17 +58,25 @@ Generate Transit Lines from GTFS
     0.0.5 Fixed a bug where the optional 'direction_id' in the trips file causes the tool to crash if omitted.
     
     0.0.6 Upgraded to using a better, turn-restricted shortest-path algorithm. 
+    
+    0.0.7 Switched to the heap-based shortest-path algorithm, which re-uses link costs between
+        requests.
+    
+    0.1.0 The trips and stop times are read with the shared GTFS reader (gtfs_reader), which
+        streams the files and caches their columns. Stop times are sorted by trip and sequence
+        in one pass, so each trip only keeps its stop sequence and first and last times. Times
+        in the service table are now always written as HH:MM:SS.
 '''
 
 import inro.modeller as _m
 import traceback as _traceback
-from contextlib import contextmanager
-from contextlib import nested
 from os import path as _path
+import numpy as _np
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _editing = _MODELLER.module('tmg.common.network_editing')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_gtfs = _MODELLER.module('tmg.network_editing.GTFS_utilities.gtfs_reader')
 
 ##########################################################################################################
 
@@ -87,7 +95,7 @@ def last(list):
 
 class GenerateTransitLinesFromGTFS(_m.Tool()):
     
-    version = '0.0.6'
+    version = '0.1.0'
     tool_run_msg = ""
     number_of_tasks = 8 # For progress reporting, enter the integer number of tasks here
     
@@ -349,20 +357,21 @@ class GenerateTransitLinesFromGTFS(_m.Tool()):
     
     def _LoadTrips(self, routes):
         trips = {}
-        with _util.CSVReader(self.GtfsFolder + "/trips.txt") as reader:
-            self.TRACKER.startProcess(len(reader))
-            directionGiven = 'direction_id' in reader.header
-            for record in reader.readlines():
-                route = routes[record['route_id']] #Assume the GTFS feed is well-formatted & contains all routes
-                if directionGiven:
-                    direction = record['direction_id']
-                else:
-                    direction = None
-                trip = Trip(record['trip_id'], route, direction)
-                route.trips[trip.id] = trip
-                trips[trip.id] = trip
-                self.TRACKER.completeSubtask()
-            self.TRACKER.completeTask()
+        table = _gtfs.loadTable(self.GtfsFolder + "/trips.txt")
+        directionGiven = 'direction_id' in table
+        columns = ['trip_id', 'route_id']
+        if directionGiven: columns.append('direction_id')
+        
+        for cells in table.iterRows(columns):
+            route = routes[cells[1]] #Assume the GTFS feed is well-formatted & contains all routes
+            if directionGiven:
+                direction = cells[2]
+            else:
+                direction = None
+            trip = Trip(cells[0], route, direction)
+            route.trips[trip.id] = trip
+            trips[trip.id] = trip
+        self.TRACKER.completeTask()
         msg = "%s trips loaded." %len(trips)
         print msg
         _m.logbook_write(msg)
@@ -370,38 +379,39 @@ class GenerateTransitLinesFromGTFS(_m.Tool()):
         return trips
     
     def _LoadPrintStopTimes(self, trips, stops2nodes):
-        count = 0
-        with nested(_util.CSVReader(self.GtfsFolder + "/stop_times.txt"),
-                    open(self.GtfsFolder + "/stop_times_emme_nodes.txt", 'w'))\
-                     as (reader, writer):
-            
-            s = reader.header[0]
-            for i in range(1, len(reader.header)):
-                s += "," + reader.header[i]
-            writer.write(s)
-            writer.write(",emme_node")
-            
-            self.TRACKER.startProcess(len(reader))
-            for record in reader.readlines():
-                try:
-                    trip = trips[record['trip_id']]
-                except KeyError, ke:
-                    continue
-                index = int(record['stop_sequence'])
-                stopId = record['stop_id']
-                stopTime = StopTime(stopId, record['departure_time'], record['arrival_time'])
-                trip.stopTimes.append((index, stopTime))
-                
-                if stopId in stops2nodes:
-                    node = stops2nodes[stopId]
-                else:
-                    node = None
-                writer.write("\n%s,%s" %(record, node))
-                count += 1
-                self.TRACKER.completeSubtask()
-            self.TRACKER.completeTask()
+        stopTimes = _gtfs.loadTable(self.GtfsFolder + "/stop_times.txt")
+        tripLabels = stopTimes.labels('trip_id').tolist()
+        stopLabels = stopTimes.labels('stop_id')
+        tripCodes = stopTimes.codes('trip_id')
+        stopCodes = stopTimes.codes('stop_id')
+        
+        #Only the stop times of loaded trips are kept
+        tripLoaded = _np.array([id in trips for id in tripLabels], dtype= bool)
+        mask = tripLoaded[tripCodes]
+        
+        nodes = _np.array([stops2nodes.get(id, 'None') for id in stopLabels.tolist()], dtype= object)
+        _gtfs.writeRows(stopTimes, mask, self.GtfsFolder + "/stop_times_emme_nodes.txt",
+                        extraColumns= [('emme_node', nodes[stopCodes])])
+        
+        #Sort the stop times by trip, then by sequence
+        rows = _np.flatnonzero(mask)
+        rows = rows[_np.lexsort((stopTimes.values('stop_sequence')[rows], tripCodes[rows]))]
+        sortedTrips = tripCodes[rows]
+        breaks = _np.flatnonzero(sortedTrips[1:] != sortedTrips[:-1]) + 1
+        starts = _np.concatenate(([0], breaks)) if len(rows) else breaks
+        ends = _np.concatenate((breaks, [len(rows)])) if len(rows) else breaks
+        
+        departures = stopTimes.values('departure_time')
+        arrivals = stopTimes.values('arrival_time')
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            tripRows = rows[start:end]
+            trip = trips[tripLabels[sortedTrips[start]]]
+            trip.stopIds = stopLabels[stopCodes[tripRows]].tolist()
+            trip.departureTime = _gtfs.formatTime(departures[tripRows[0]])
+            trip.arrivalTime = _gtfs.formatTime(arrivals[tripRows[-1]])
+        self.TRACKER.completeTask()
                 
-        msg = "%s stop times loaded" %count
+        msg = "%s stop times loaded" %len(rows)
         print msg
         _m.logbook_write(msg)
         print "Stop times file updated with emme node mapping."
@@ -432,7 +442,7 @@ class GenerateTransitLinesFromGTFS(_m.Tool()):
                 if link.data2 == 0:
                     return 30.0 * factor
                 return link.data2 * factor
-        algo = _editing.AStarLinks(network, link_speed_func=speed)
+        algo = _editing.HeapAStarLinks(network, link_speed_func=speed)
         algo.max_degrees = self.MaxNonStopNodes
         functionBank = self._GetModeFilterMap(network)
         
@@ -547,7 +557,7 @@ class GenerateTransitLinesFromGTFS(_m.Tool()):
                 
                 #Write to service table
                 for trip in trips:
-                    writer.write("\n%s,%s,%s" %(id, trip.stopTimes[0][1].departure_time, trip.lastStopTime()[1].arrival_time))
+                    writer.write("\n%s,%s,%s" %(id, trip.departureTime, trip.arrivalTime))
             print "Added route %s" %route.emme_id
                 
             self.TRACKER.completeSubtask()
@@ -569,13 +579,7 @@ class GenerateTransitLinesFromGTFS(_m.Tool()):
     def _GetOrganizedTrips(self, route):
         tripSet = {}
         for trip in route.trips.itervalues():
-            trip.stopTimes.sort()
-            
-            seq = [st[1].stop_id for st in trip.stopTimes]
-            
-            seqs = seq[0]
-            for i in range(1, len(seq)):
-                seqs += ";" + seq[i]
+            seqs = ";".join(trip.stopIds)
             
             if seqs in tripSet:
                 tripSet[seqs].append(trip)
@@ -701,10 +705,9 @@ class Trip():
         self.route = route #backwards pointer to the route object
         self.direction = directionId
         
-        self.stopTimes = []
-    
-    def lastStopTime(self):
-        return self.stopTimes[len(self.stopTimes) - 1]
+        self.stopIds = [] #In order of stop sequence
+        self.departureTime = ''
+        self.arrivalTime = ''
     
 class Route():
     def __init__(self, record, description=""):
@@ -715,12 +718,6 @@ class Route():
         self.trips = {}
         self.description = description
 
-class StopTime():
-    def __init__(self, stop, depart, arrive):
-        self.stop_id = stop
-        self.departure_time = depart
-        self.arrival_time = arrive
-
 class ModeOnlyFilter():
     def __init__(self, mode):
         self.__mode = mode
@@ -0,0 +1,411 @@
+'''
+    Copyright 2017 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+#---METADATA---------------------
+'''
+GTFS Reader
+
+    Reads the files of a GTFS feed into columns of NumPy arrays, shared by the
+    GTFS utilities. Files are streamed (never read whole), identifiers are
+    interned into integer codes, and times are stored as integer seconds. The
+    columns are cached next to the file, and re-used for as long as the file
+    is unchanged, so that a feed is only parsed once.
+
+'''
+#---VERSION HISTORY
+'''
+    0.0.1 Created
+
+'''
+
+import csv
+import os
+from array import array
+from itertools import islice
+from os import path as _path
+import numpy as _np
+import inro.modeller as _m
+
+##########################################################################################################
+
+class Face(_m.Tool()):
+
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="GTFS Reader",
+                                description="Collection of private functions used by the GTFS utilities \
+                                        to read and cache the files of a GTFS feed.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" %str(self))
+
+        return pb.render()
+
+##########################################################################################################
+
+#Column types. Columns not listed below are read as (interned) strings.
+STRING = 'string'
+TIME = 'time' #Integer seconds after midnight, -1 if blank
+INTEGER = 'integer' #-1 if blank
+FLOAT = 'float' #NaN if blank
+
+COLUMN_TYPES = {'arrival_time': TIME,
+                'departure_time': TIME,
+                'start_time': TIME,
+                'end_time': TIME,
+                'stop_sequence': INTEGER,
+                'headway_secs': INTEGER,
+                'stop_lat': FLOAT,
+                'stop_lon': FLOAT,
+                'shape_pt_lat': FLOAT,
+                'shape_pt_lon': FLOAT,
+                'shape_dist_traveled': FLOAT}
+
+CACHE_FOLDER = '.gtfs_cache'
+_CACHE_VERSION = 1
+_CHUNK_SIZE = 100000
+
+#---
+#---TIMES
+
+def parseTime(s):
+    '''
+    Converts a GTFS time (HH:MM:SS, where the hour can be greater than 23)
+    into seconds after midnight. Blank times are returned as -1.
+    '''
+    s = s.strip()
+    if not s: return -1
+    hms = s.split(':')
+    if len(hms) != 3: raise ValueError("Invalid time '%s'" %s)
+    return int(hms[0]) * 3600 + int(hms[1]) * 60 + int(hms[2])
+
+def formatTime(seconds):
+    '''
+    Converts seconds after midnight into a GTFS time (HH:MM:SS). Negative
+    (blank) times are returned as an empty string.
+    '''
+    if seconds < 0: return ''
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%02d:%02d:%02d" %(hours, minutes, seconds)
+
+def _parseInteger(s):
+    s = s.strip()
+    if not s: return -1
+    return int(s)
+
+def _parseFloat(s):
+    s = s.strip()
+    if not s: return float('nan')
+    return float(s)
+
+#---
+#---TABLES
+
+class GtfsTable():
+    '''
+    The columns of a GTFS file. String columns are stored as an array of codes
+    into an array of labels (the distinct values of the column).
+    '''
+
+    def __init__(self, filePath, header, columns):
+        self.filePath = filePath
+        self.header = header
+        self._columns = columns #Name : (type, values or codes, labels or None)
+        self._labelIndices = {}
+
+        if header:
+            self._nRows = len(columns[header[0]][1])
+        else:
+            self._nRows = 0
+
+    def __len__(self):
+        return self._nRows
+
+    def __contains__(self, column):
+        return column in self._columns
+
+    def _get(self, column):
+        if column not in self._columns:
+            raise IOError("File '%s' does not define column '%s'" %(self.filePath, column))
+        return self._columns[column]
+
+    def getType(self, column):
+        return self._get(column)[0]
+
+    def values(self, column):
+        '''
+        Returns an array of the values of a column, as strings for string
+        columns.
+        '''
+        type, values, labels = self._get(column)
+        if type == STRING: return labels[values]
+        return values
+
+    def codes(self, column):
+        type, codes, labels = self._get(column)
+        if type != STRING: raise TypeError("Column '%s' is not a string column" %column)
+        return codes
+
+    def labels(self, column):
+        type, codes, labels = self._get(column)
+        if type != STRING: raise TypeError("Column '%s' is not a string column" %column)
+        return labels
+
+    def getCode(self, column, label):
+        '''Returns the code of a value of a string column, or -1 if the column doesn't contain it.'''
+        if column not in self._labelIndices:
+            labels = self.labels(column)
+            self._labelIndices[column] = dict((label, code) for code, label in enumerate(labels.tolist()))
+        return self._labelIndices[column].get(label, -1)
+
+    def isin(self, column, values):
+        '''Returns a mask of the rows whose value of a string column is in a set of values.'''
+        type, codes, labels = self._get(column)
+        if type != STRING: raise TypeError("Column '%s' is not a string column" %column)
+        values = [str(value) for value in values]
+        if not values or not len(labels): return _np.zeros(self._nRows, dtype= bool)
+        return _np.in1d(labels, _np.array(values))[codes]
+
+    def uniqueValues(self, column, mask= None):
+        '''Returns the set of values of a string column (in the selected rows, if a mask is given).'''
+        type, codes, labels = self._get(column)
+        if type != STRING: raise TypeError("Column '%s' is not a string column" %column)
+        if mask is not None: codes = codes[mask]
+        return set(labels[_np.unique(codes)].tolist())
+
+    def iterRows(self, columns, mask= None):
+        '''Returns a list of tuples of the values of the given columns, for the selected rows.'''
+        arrays = []
+        for column in columns:
+            values = self.values(column)
+            if mask is not None: values = values[mask]
+            arrays.append(values.tolist())
+        return zip(*arrays)
+
+def readHeader(filePath):
+    with open(filePath, 'rb') as reader:
+        return _cleanHeader(csv.reader(reader).next())
+
+def _cleanHeader(header):
+    if header and header[0].startswith('\xef\xbb\xbf'): #UTF-8 byte order mark
+        header[0] = header[0][3:]
+    return [label.strip() for label in header]
+
+def iterRecords(filePath):
+    '''
+    Streams the rows of a GTFS file as lists of strings, padded with blanks
+    to the length of the header. The header is yielded first.
+    '''
+    with open(filePath, 'rb') as reader:
+        rows = csv.reader(reader)
+        header = _cleanHeader(rows.next())
+        yield header
+
+        nColumns = len(header)
+        for row in rows:
+            if not row: continue #Skip blank lines
+            if len(row) < nColumns: row += [''] * (nColumns - len(row))
+            yield row
+
+def loadTable(filePath, useCache= True):
+    '''
+    Loads the columns of a GTFS file, from the cache if the file hasn't
+    changed since it was cached.
+    '''
+    if not _path.exists(filePath):
+        raise IOError("File '%s' does not exist" %filePath)
+
+    cachePath = _getCachePath(filePath)
+    key = _getFileKey(filePath)
+    if useCache:
+        table = _loadCache(filePath, cachePath, key)
+        if table is not None: return table
+
+    table = _parseTable(filePath)
+    if useCache:
+        _saveCache(table, cachePath, key)
+    return table
+
+def _parseTable(filePath):
+    records = iterRecords(filePath)
+    header = records.next()
+
+    builders = []
+    for column in header:
+        type = COLUMN_TYPES.get(column, STRING)
+        if type == STRING: builders.append(_StringColumnBuilder())
+        elif type == TIME: builders.append(_ParsedColumnBuilder(column, type, _np.int32, parseTime))
+        elif type == INTEGER: builders.append(_ParsedColumnBuilder(column, type, _np.int64, _parseInteger))
+        else: builders.append(_ParsedColumnBuilder(column, type, _np.float64, _parseFloat))
+
+    while True:
+        chunk = list(islice(records, _CHUNK_SIZE))
+        if not chunk: break
+        for builder, cells in zip(builders, zip(*chunk)):
+            builder.extend(cells)
+
+    columns = {}
+    for column, builder in zip(header, builders):
+        if column in columns: continue
+        try:
+            columns[column] = builder.finish()
+        except ValueError, e:
+            raise IOError("Error reading '%s': %s" %(filePath, e))
+    return GtfsTable(filePath, header, columns)
+
+class _StringColumnBuilder():
+    def __init__(self):
+        self.type = STRING
+        self.codes = array('i')
+        self.index = {}
+        self.labels = []
+
+    def extend(self, cells):
+        index = self.index
+        labels = self.labels
+        #Codes are assigned in order of first appearance
+        for cell in cells:
+            if cell not in index:
+                index[cell] = len(labels)
+                labels.append(cell)
+        self.codes.extend(map(index.__getitem__, cells))
+
+    def finish(self):
+        return self.type, _np.frombuffer(self.codes, dtype= _np.int32).copy(), _toLabelArray(self.labels)
+
+class _ParsedColumnBuilder(_StringColumnBuilder):
+    #Values such as times and sequence numbers repeat a lot, so each distinct value is only parsed once.
+    def __init__(self, column, type, dtype, parse):
+        _StringColumnBuilder.__init__(self)
+        self.column = column
+        self.type = type
+        self.dtype = dtype
+        self.parse = parse
+
+    def finish(self):
+        parsed = _np.zeros(len(self.labels), dtype= self.dtype)
+        for code, label in enumerate(self.labels):
+            try:
+                parsed[code] = self.parse(label)
+            except ValueError:
+                raise ValueError("Invalid value '%s' in column '%s'" %(label, self.column))
+        return self.type, parsed[_np.frombuffer(self.codes, dtype= _np.int32)], None
+
+def _toLabelArray(labels):
+    if not labels: return _np.zeros(0, dtype= 'S1')
+    return _np.array(labels, dtype= 'S%s' %max(1, max(len(label) for label in labels)))
+
+#---
+#---CACHE
+
+def _getCachePath(filePath):
+    folder, name = _path.split(_path.abspath(filePath))
+    return _path.join(folder, CACHE_FOLDER, name + '.npz')
+
+def _getFileKey(filePath):
+    stat = os.stat(filePath)
+    return _np.array([_CACHE_VERSION, stat.st_size, stat.st_mtime], dtype= _np.float64)
+
+def _loadCache(filePath, cachePath, key):
+    if not _path.exists(cachePath): return None
+    try:
+        with _np.load(cachePath) as archive:
+            if not _np.array_equal(archive['key'], key): return None
+            header = archive['header'].tolist()
+            columns = {}
+            for i, column in enumerate(header):
+                if column in columns: continue
+                type = str(archive['type_%s' %i])
+                if type == STRING:
+                    columns[column] = (type, archive['codes_%s' %i], archive['labels_%s' %i])
+                else:
+                    columns[column] = (type, archive['values_%s' %i], None)
+        return GtfsTable(filePath, header, columns)
+    except Exception, e:
+        print "Could not read the cache of '%s': %s" %(filePath, e)
+        return None
+
+def _saveCache(table, cachePath, key):
+    arrays = {'key': key, 'header': _toLabelArray(table.header)}
+    for i, column in enumerate(table.header):
+        type, values, labels = table._columns[column]
+        arrays['type_%s' %i] = _np.array(type)
+        if type == STRING:
+            arrays['codes_%s' %i] = values
+            arrays['labels_%s' %i] = labels
+        else:
+            arrays['values_%s' %i] = values
+
+    try:
+        folder = _path.dirname(cachePath)
+        if not _path.exists(folder): os.makedirs(folder)
+        #Write to a temporary file first, so that an interrupted write doesn't leave a corrupt cache
+        tempPath = cachePath + '.tmp'
+        with open(tempPath, 'wb') as writer:
+            _np.savez(writer, **arrays)
+        if _path.exists(cachePath): os.remove(cachePath)
+        os.rename(tempPath, cachePath)
+    except (IOError, OSError), e:
+        print "Could not cache '%s': %s" %(table.filePath, e)
+
+def clearCache(folder):
+    '''Deletes the cached columns of the GTFS files in a folder.'''
+    cacheFolder = _path.join(folder, CACHE_FOLDER)
+    if not _path.exists(cacheFolder): return
+    for name in os.listdir(cacheFolder):
+        if name.endswith('.npz'): os.remove(_path.join(cacheFolder, name))
+
+#---
+#---WRITING
+
+def writeRows(table, mask, outputPath, extraColumns= None):
+    '''
+    Streams the source file of a table, writing the header and the selected
+    rows to a new file. Rows are written as they appear in the source file.
+
+    Args:
+        - table: The GtfsTable of the file to copy
+        - mask: Boolean array of the rows to write
+        - outputPath: The file to write
+        - extraColumns (=None): Optional list of (name, values) columns to append,
+            where values is an array with one value for each row of the table.
+
+    Returns: The number of rows written.
+    '''
+    mask = _np.asarray(mask, dtype= bool)
+    if extraColumns:
+        extraNames = [name for name, values in extraColumns]
+        extraValues = iter(zip(*[_np.asarray(values)[mask].tolist() for name, values in extraColumns]))
+    else:
+        extraNames = []
+        extraValues = None
+
+    count = 0
+    with open(outputPath, 'wb') as file:
+        writer = csv.writer(file, lineterminator= '\n')
+        records = iterRecords(table.filePath)
+        writer.writerow(records.next() + extraNames)
+
+        selected = mask.tolist()
+        for i, row in enumerate(records):
+            if not selected[i]: continue
+            if extraValues is not None: row = row + list(extraValues.next())
+            writer.writerow(row)
+            count += 1
+    return count
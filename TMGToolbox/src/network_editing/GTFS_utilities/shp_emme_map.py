@@ -233,14 +233,13 @@ class ShptoEmmeMap(_m.Tool()):
         network = _MODELLER.scenario.get_network()
         for node in network.regular_nodes():
             spatialIndex.insertPoint(node)
-        for stop in convertedStops:
-            nearestNode = spatialIndex.nearestToPoint(convertedStops[stop][0], convertedStops[stop][1])
-            if nearestNode[0] == "Nothing Found":
-                map.append([stop, nearestNode[0],convertedStops[stop][0],convertedStops[stop][1],-1,-1])
-            elif nearestNode[0] == None:
-                map.append([stop, nearestNode[0],convertedStops[stop][0],convertedStops[stop][1],0,0])
+        stopIds = convertedStops.keys()
+        nearestNodes = spatialIndex.nearestMany([convertedStops[stop] for stop in stopIds])
+        for stop, nearest in zip(stopIds, nearestNodes):
+            if not nearest:
+                map.append([stop, "Nothing Found",convertedStops[stop][0],convertedStops[stop][1],-1,-1])
             else:
-                cleanedNumber = int(nearestNode[0])
+                cleanedNumber = int(nearest[0][0])
                 map.append([stop, cleanedNumber,convertedStops[stop][0],convertedStops[stop][1],nodes[cleanedNumber][0],nodes[cleanedNumber][1]])
 
         with open(self.MappingFileName, 'wb') as csvfile:
@@ -68,6 +68,18 @@ Kucirek-Vaughan Automated Centroid Connector Generator (CCGen)
         loading properly after a run. Also fixed a bug where the tool would crash if
         no zones were selected to be connected.  
     
+    1.0.2 Now uses GridIndex.nearestK to find the closest node to a zone, which also works for
+        zones outside of the bounds of the feasible node set.
+    
+    1.1.0 Configurations are now scored in vectorized batches by ConfigurationSearch, which skips
+        batches that can't contain the best configuration. The utility statistics are only
+        computed for the full report.
+    
+    1.2.0 Added a parallel mode: the connectors of each zone are chosen in a pool of worker
+        processes (by ccgen_search) and added to the network in zone order, so the result
+        is the same as a serial run. Candidates are now ordered by their position in the
+        set of feasible nodes, rather than by their (arbitrary) order in a dict.
+    
 '''
 
 import inro.modeller as _m
@@ -75,15 +87,14 @@ import traceback as _traceback
 from contextlib import contextmanager
 from contextlib import nested
 from os import path
-from itertools import combinations
+from itertools import izip
 import math
 import inspect
-import numpy
 _MODELLER = _m.Modeller()
 _g = _MODELLER.module('tmg.common.geometry')
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
-_spindex = _MODELLER.module('tmg.common.spatial_index')
+_search = _MODELLER.module('tmg.network_editing.centroid_connectors.ccgen_search')
 
 def _straightLineDist(x1, y1, x2, y2):
     return math.sqrt((x1 - x2)*(x1 - x2) + (y1 - y2)*(y1 - y2))
@@ -95,7 +106,7 @@ def _manhattanDist(x1, y1, x2, y2):
 
 class CCGEN(_m.Tool()):
     
-    version = '1.0.1'
+    version = '1.2.0'
     tool_run_msg = ""
     report_html = ""
     
@@ -127,6 +138,7 @@ class CCGEN(_m.Tool()):
     MassAttribute = _m.Attribute(_m.InstanceType)
     virtual_mass = _m.Attribute(float)
     SplitLinks = _m.Attribute(bool)
+    NumberOfProcesses = _m.Attribute(int)
 
     
     def __init__(self):
@@ -149,6 +161,7 @@ class CCGEN(_m.Tool()):
         self.virtual_mass = 3.0
         self.SplitLinks = False
         self.NewNodeCount = 0
+        self.NumberOfProcesses = 1
 
     
     def page(self):
@@ -298,6 +311,12 @@ class CCGEN(_m.Tool()):
                                 title="Summary report?",
                                 note="Report will be written to the logbook.")
         
+        pb.add_text_box(tool_attribute_name='NumberOfProcesses',
+                        size=2,
+                        title='Number of processes',
+                        note="The connectors of each zone are chosen in parallel when greater than 1.\
+                        <br>The results are the same as with a single process.")
+        
         pb.add_select_file(tool_attribute_name="FullReportFile",
                             window_type="save_file",
                             file_filter="*.txt",
@@ -424,10 +443,10 @@ class CCGEN(_m.Tool()):
                 #---4. Get feasible nodes
                 feasibleNodes = None
                 with _m.logbook_trace("Getting set of feasible nodes"):
-                    feasibleNodes, nFeasibleNodes = {2 : self._getFeasibleNodesGreedy,
+                    feasibleNodes = {2 : self._getFeasibleNodesGreedy,
                                      1 : self._getFeasibleNodesReluctant}[self.NodeExcluderOption](network, flagAttr.id)
-                    _m.logbook_write("%s nodes were selected as feasible in the network." %nFeasibleNodes)
-                    print "Filtered and indexed feasible nodes"
+                    _m.logbook_write("%s nodes were selected as feasible in the network." %len(feasibleNodes))
+                    print "Filtered feasible nodes"
                 self._tracker.completeTask() # TASK 3
                 
                 #---5. Process new zones
@@ -449,10 +468,20 @@ class CCGEN(_m.Tool()):
                 errors = 0
                 self._tracker.startProcess(len(zonesToProcess)) # TASK 4
                 print "Processing zones"
-                for zone in zonesToProcess: #{1
+
+                #The connectors are chosen from a snapshot of the feasible nodes (possibly in
+                #parallel), but are always added to the network in zone order.
+                snapshot = self._getSnapshot(feasibleNodes)
+                zones = [(zone.x, zone.y, zone._geometry) for zone in zonesToProcess]
+                if self.NumberOfProcesses > 1:
+                    selections = _search.selectConnectorsParallel(snapshot, zones, self.NumberOfProcesses)
+                else:
+                    selections = (_search.selectConnectors(snapshot, *zone) for zone in zones)
+
+                for zone, selection in izip(zonesToProcess, selections): #{1
                     try:
                         #{
-                        atts = self._HANDLE_ZONE(zone, feasibleNodes, network)
+                        atts = self._HANDLE_ZONE(zone, selection, feasibleNodes, network)
                         zonesHandled += 1
                         
                         if self.DoSummaryReport:
@@ -516,11 +545,6 @@ class CCGEN(_m.Tool()):
     
     def _loadBoundaryFile(self, filename):
         with _g.Shapely2ESRI(filename) as reader:
-            minx = float('inf')
-            miny = float('inf')
-            maxx = float('-inf')
-            maxy = float('-inf')
-            
             boundaries = []
             for boundary in reader.readThrough():
 
@@ -531,21 +555,11 @@ class CCGEN(_m.Tool()):
                     boundary = boundary.exterior
 
 
-                bminx, bminy, bmaxx, bmaxy = boundary.bounds
-                if bminx < minx: minx = bminx
-                if bminy < miny: miny = bminy
-                if bmaxx > maxx: maxx = bmaxx
-                if bmaxy > maxy: maxy = bmaxy
                 boundaries.append(boundary)
             
-            extents = minx - 1.0, miny - 1.0, maxx + 1.0, maxy + 1.0
-            spatialIndex = _spindex.GridIndex(extents, 200, 200)
-            for ls in boundaries:
-                spatialIndex.insertLineString(ls)
-            
-            self._Boundaries = spatialIndex
+            self._Boundaries = boundaries
             
-        print "Loaded and indexed boundaries."
+        print "Loaded boundaries."
         _m.logbook_write("Boundary file loaded: '%s'" %filename)
     
     def _loadZoneShape(self, filename, network):
@@ -718,36 +732,40 @@ class CCGEN(_m.Tool()):
     
     #####################################################################################################################
     
-    def _HANDLE_ZONE(self, zone, feasibleNodes, network):
-        
+    def _getSnapshot(self, feasibleNodes):
+        parameters = {'SearchRadius': self.SearchRadius,
+                      'MaxCandidates': self.MaxCandidates,
+                      'MaxConnectors': self.MaxConnectors,
+                      'BetaMassSum': self.BetaMassSum,
+                      'BetaRadialDist': self.BetaRadialDist,
+                      'BetaLengthStdDev': self.BetaLengthStdDev,
+                      'BetaGravity': self.BetaGravity,
+                      #The utility statistics are only reported in the full report; without them,
+                      #configurations which can't be the best are skipped.
+                      'KeepStatistics': bool(self.DoFullReport)}
+        masses = [self._getNodeMass(node) for node in feasibleNodes]
+        return _search.createSnapshot(feasibleNodes, masses, self._Boundaries, parameters)
+
+    def _HANDLE_ZONE(self, zone, selection, feasibleNodes, network):
+
         '''
-        First, get all of the nodes within the search radius of the zone.
-        Then, remove all those nodes which create connectors that cross boundaries.
-        Finally, truncate the size of the set of candidate nodes.
+        Adds the connectors chosen for the zone by ccgen_search.selectConnectors
+        (which searches, bounds and truncates the set of candidate nodes, then
+        finds the best configuration) to the network.
         '''
-        self._getCandidateNodes(zone, feasibleNodes)
+        if zone._geometry == None:
+            _m.logbook_write("No zone shape found for zone %s." %zone.id)
+        zone._candidateNodes = dict((feasibleNodes[i], length) for (i, length) in izip(selection['candidates'], selection['lengths']))
 
-        #get node number for adding virtual nodes
-        next_node = float('inf')
-        for node in zone._candidateNodes:
-            #only get numbers from non-virtual nodes
-            try:
-                if node.number < next_node:
-                    next_node = node.number
-            except:
-                pass
-            #TODO: fix?
+        #get node number for adding virtual nodes (only from non-virtual nodes)
+        next_node = selection['firstNodeNumber']
         if next_node == float('inf'):
             next_node = 20000
-        searchSetSize = len(zone._candidateNodes)
-        
-        self._removeCrossBoundaryConnectors(zone)
-        boundedSetSize = len(zone._candidateNodes)
-        
-        self._truncateCandidateSet(zone)
-        finalSetSize = len(zone._candidateNodes)
+        next_node = int(next_node)
+        searchSetSize = selection['initialSet']
+        boundedSetSize = selection['boundSet']
+        finalSetSize = selection['finalSet']
 
-        
         if len(zone._candidateNodes) < 1:
             raise ObjectProcessingError("No candidate nodes were selected for zone %s. \
                         This probably means that it is completely enclosed by the boundaries \
@@ -782,37 +800,9 @@ class CCGEN(_m.Tool()):
             most_common_type = 1
 
 
-        distanceMatrix = self._calculateDistanceMatrix(zone)
-        
-        maxUtil = - float('inf') #Negative infinity
-        bestConfig = None
-        utils = []
-        maxComponents = {}
-        
-        #Special handling for the case of one connector
-        for node in zone._candidateNodes:
-
-                
-            util = self.BetaMassSum * self._getNodeMass(node)
-            if util > maxUtil:
-                bestConfig = [node]
-                maxUtil = util
-           
-        
-        # The number of connectors goes from 2 to the lesser of the size of the set of
-        #    candidates and the maximum number of connectors.
-        for setSize in range(2, min(self.MaxConnectors, len(zone._candidateNodes)) + 1):
-            for configuration in combinations(zone._candidateNodes, setSize):
-                utilComponents = self._calculateUtility(zone, configuration, distanceMatrix)
-                util = sum([beta * param for (beta, param) in utilComponents.itervalues()])
-                utils.append(util)
-                
-                if util > maxUtil: #Pick the configuration with the highest utility
-                    bestConfig = configuration
-
-                    maxUtil = util
-                    maxComponents = dict([(key, tuple[1]) for (key, tuple) in utilComponents.iteritems()])
-        
+        bestConfig = [feasibleNodes[i] for i in selection['bestConfig']]
+        maxUtil = selection['maxUtil']
+        maxComponents = selection['components']
 
         for node in bestConfig:
             '''
@@ -851,19 +841,14 @@ class CCGEN(_m.Tool()):
             inConnector.data3 = 9999
             inConnector.type = most_common_type
         
-        if len(utils) == 0:
-            utils = [- float('inf')]
-        
         atts = {'connectors' : len(bestConfig),
                 'maxUtil' : maxUtil,
                 'initialSet': searchSetSize,
                 'boundSet' : boundedSetSize,
                 'finalSet': finalSetSize,
-                'maxUtil' : maxUtil,
-                'minUtil' : min(utils),
-                'meanUtil' : numpy.mean(utils),
-                'medianUtil' : numpy.median(utils),
-                'sDevUtil' : numpy.std(utils)}
+                'maxUtil' : maxUtil}
+        if self.DoFullReport:
+            atts.update(selection['statistics'])
         
         for (key, value) in maxComponents.iteritems():
             atts[key] = value
@@ -927,16 +912,7 @@ class CCGEN(_m.Tool()):
         #add virtual nodes
         if self.SplitLinks:
             minx, miny, maxx, maxy, feasibleNodes = self.add_virtual_nodes(network,attributeId, feasibleNodes,minx,miny,maxx,maxy)
-        extents = minx - 1.0, miny - 1.0, maxx + 1.0, maxy + 1.0
-        index = _spindex.GridIndex(extents)
-        
-        for node in feasibleNodes:
-            p = _g.Point(node.x, node.y)
-            node._geometry = p
-            
-            index.insertPoint(node)
-
-        return index, len(feasibleNodes)
+        return feasibleNodes
         
     def _getFeasibleNodesReluctant(self, network, attributeId):
         '''
@@ -970,16 +946,7 @@ class CCGEN(_m.Tool()):
         if self.SplitLinks:
             minx, miny, maxx, maxy, feasibleNodes = self.add_virtual_nodes(network,attributeId, feasibleNodes,minx,miny,maxx,maxy)
 
-        extents = minx - 1.0, miny - 1.0, maxx + 1.0, maxy + 1.0
-        index = _spindex.GridIndex(extents)
-        
-        for node in feasibleNodes:
-            p = _g.Point(node.x, node.y)
-            node._geometry = p
-            
-            index.insertPoint(node)
-        
-        return index, len(feasibleNodes)
+        return feasibleNodes
 
     #add mid-block nodes on links that don't have them (add to grid index, not to network)
     def add_virtual_nodes(self,network,attributeId, NodesList,minx,miny,maxx,maxy):
@@ -1014,217 +981,10 @@ class CCGEN(_m.Tool()):
                             if y > maxy: maxy = y
         return minx, miny, maxx, maxy, NodesList
         
-    #----Candidate Node Functions--------------------------------------------------------------------
-    
-    def _getCandidateNodes(self, zone, feasibleNodes):
-        if zone._geometry != None:
-            self._searchByPoly(zone, feasibleNodes)
-        else:
-            _m.logbook_write("No zone shape found for zone %s." %zone.id)
-            zone._candidateNodes = {}
-            #self._searchByPoint(zone, feasibleNodes)
-    
-    def _searchByPoly(self, zone, feasibleNodes):
-        '''
-        Gets a list of all network nodes within the specified distance from the edge of
-        the zone's boundary.
-        '''
-
-        buffer = zone._geometry.buffer(self.SearchRadius, resolution=2)
-        candidateNodes = {}
-        for node in feasibleNodes.queryPolygon(buffer):
-            if not buffer.contains(node._geometry):
-                continue #Skip over nodes indexed nearby but not contained within the polygon
-            candidateNodes[node] = self._measureDistance(node, zone)
-        zone._candidateNodes = candidateNodes #Attach candidate nodes to the zone
-        
-    def _searchByPoint(self, zone, feasibleNodes):
-        '''
-        Gets a list of all network nodes within the specified radius of the zone centroid,
-        with at least one node in the list.
-        '''
-        
-        minDistance = float('inf') #positive infinity
-        closestNode = None
-        candidateNodes = {}
-        
-        for node in feasibleNodes.queryCircle(zone.x, zone.y, self.SearchRadius):
-            dist = self._measureDistance(node, zone)
-            if dist < self.SearchRadius/1000: # compare distance (in km) to SearchRadius (in m)
-                candidateNodes[node] = dist
-        try:
-            for node in feasibleNodes.nearestToPoint(zone.x, zone.y):
-                dist = self._measureDistance(node, zone)
-                if dist < minDistance: 
-                    minDistance = dist
-                    closestNode = node
-        except IndexError: #Expected if the zone is outside the bounds of the feasible node set
-            pass 
-        #if no nodes are found within the search radius, select closest node
-        if len(candidateNodes) == 0 and closestNode != None:
-            candidateNodes[closestNode] = minDistance
-        
-        zone._candidateNodes = candidateNodes 
-    
-    def _removeCrossBoundaryConnectors(self, zone):
-        '''
-        Removes from the set of candidate nodes those which cross boundaries.
-        '''
-        
-        if self._Boundaries == None: #If no boundaries have been loaded, skip this step.
-            return 
-        
-        # Filters the zone's candidate nodes
-        zone._candidateNodes = dict([(node, dist) for (node, dist) in zone._candidateNodes.items() if self._checkForCrossing(node, zone)])
-        
-    def _checkForCrossing(self, node, zone):
-        geom = _g.LineString([(zone.x, zone.y),(node.x, node.y)])
-        for boundary in self._Boundaries.queryLineString(geom):
-            if geom.intersects(boundary): return False
-        return True
-    
-    def _truncateCandidateSet(self, zone):
-        '''
-        Truncates the set of candidate nodes to the maximum set size by
-        removing the farthest candidates.
-        '''
-        
-        if len(zone._candidateNodes) <= self.MaxCandidates:
-            return
-        
-        sorter = [(dist, node) for (node, dist) in zone._candidateNodes.items()]            
-        sorter.sort() # List of tuples get sorted by their first element
-        
-        while len(sorter) > self.MaxCandidates:
-            q = sorter.pop()
-        
-        zone._candidateNodes = dict((node, dist) for dist, node in sorter)
-        
-    
-    #-----Utility Metric Functions--------------------------------------------------------------------------
-        
-    ####################################################################################################
-        
-    def _calculateUtility(self, zone, configuration, distanceMatrix):
-        '''
-        The main function for calculating the utility of a combination of candidate nodes.
-        '''
-        
-        return {'mass' : (self.BetaMassSum, self._calculateMassSum(configuration)), 
-                'radialDist' : (self.BetaRadialDist, self._calculateRadialDistribution(zone, configuration)), 
-                'lengthSDev' : (self.BetaLengthStdDev, self._calculateLengthDistribution(zone, configuration)),
-                'gravity' : (self.BetaGravity, self._calculateGravityTerm(distanceMatrix, configuration))}
-        
-        #return self.BetaMassSum * mass + self.BetaRadialDist * rd + self.BetaLengthStdDev * lnsd \
-                #+ self.BetaGravity * grav
-    
-    ####################################################################################################
-    
-    def _calculateMassSum(self, configuration):
-        sum = 0
-        for node in configuration:
-            sum += self._getNodeMass(node)
-        
-        return sum
-    
-    def _calculateRadialDistribution(self, zone, configuration):
-        '''
-        Measures the aggregated squared differences between the angles formed by the
-        candidate connectors and that of the ideal. For example, a perfect distribution
-        for four connectors would have all angles = 90 degrees, with a value of 0.
-        '''
-        bearings = []
-        for node in configuration:
-            bearings.append(self._getSegmentBearing(zone, node))
-            
-        bearings.sort()
-        
-        angleSum = 0
-        total = 2
-        idealAngle = 2 * math.pi / len(configuration)
-        
-        iter = bearings.__iter__()
-        prevB = iter.next()
-        for B in iter:
-            a = B - prevB
-            if a < 0:
-                a += math.pi * 2
-                
-            angleSum += ((idealAngle - a) * (idealAngle - a))
-            total += 1 
-            prevB = B
-        a = bearings[0] - prevB
-        if a < 0:
-            a += math.pi * 2
-        angleSum += ((idealAngle - a) * (idealAngle - a))
-        
-        return (angleSum / total)
-    
-    def _calculateDistanceMatrix(self, zone):
-        dm = {}
-        for iNode in zone._candidateNodes.iterkeys():
-            im = {}
-            for jNode in zone._candidateNodes.iterkeys():
-                if iNode == jNode:
-                    continue
-                
-                d = self._measureDistance(iNode, jNode)
-                if d == 0:
-                    print "Zero distance found: %s -> %s" %(iNode, jNode)
-                    d = 0.0001
-                    
-                im[jNode] = d
-            dm[iNode] = im
-        
-        return dm
-    
-    def _calculateGravityTerm(self, distanceMatrix, configuration):
-        sum = 0.0
-        #count = 0
-        
-        #Iterate through the unique pairings of all nodes in the configuration.
-        for pair in combinations(configuration, 2): 
-            #m0 = self._getNodeMass(pair[0])
-            #m1 = self._getNodeMass(pair[1])
-            d = distanceMatrix[pair[0]][pair[1]]
-            
-            sum += 1 / (d*d)
-            
-            #count += 1
-        
-        return sum # Return the sum
-        #return sum / count #Return the average 
-    
-    def _calculateLengthDistribution(self, zone, configuration):
-        '''
-        Gets the normalized standard deviation of connector lengths in
-        the configuration. 
-        '''
-        lengths = []
-        sum = 0
-        for node in configuration:
-            l = zone._candidateNodes[node]
-            lengths.append(l)
-            sum += l
-        
-        mean = sum / len(configuration)
-        
-        return numpy.std(lengths) / mean
+    #----Miscellaneous Functions
     
     def _measureDistance(self, node1, node2):
         return _straightLineDist(node1.x, node1.y, node2.x, node2.y) / 1000.0
-        
-    def _getSegmentBearing(self, zone, node):
-        rad = math.atan2(node.x - zone.x, node.y - zone.y)
-        if rad < 0:
-            return rad + math.pi * 2
-        return rad
-    
-    def _calcMaxADist(self, n):
-        ia = 2 * math.pi / n
-        return (n * pow(ia,2) - 4 * math.pi * ia + pow(2 * math.pi, 2)) / n
-    
-    #----Miscellaneous Functions
     
     def _getNodeMass(self, node):
         if self.MassAttribute:# != None:
@@ -0,0 +1,472 @@
+'''
+    Copyright 2026 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+#---METADATA---------------------
+'''
+CCGEN Connector Search
+
+    Chooses the centroid connectors of a zone for CCGEN: the candidate node search,
+    boundary exclusion, truncation and configuration scoring. It only works on a
+    snapshot of the network (plain arrays and Shapely geometries), and doesn't use
+    the Modeller API, so that zones can be handled in worker processes.
+'''
+
+import sys
+import math
+import multiprocessing
+from os import path
+from itertools import combinations
+import numpy
+from shapely import geometry as _geo
+from shapely.prepared import prep as _prep
+from shapely import wkb as _wkb
+from shapely.ops import unary_union as _unary_union
+import inro.modeller as _m
+
+##################################################################################################################
+
+class Face(_m.Tool()):
+
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="CCGEN Connector Search",
+                                description="Collection of private functions used by CCGEN to \
+                                        choose the centroid connectors of a zone.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" %str(self))
+
+        return pb.render()
+
+##################################################################################################################
+
+def createSnapshot(feasibleNodes, masses, boundaries, parameters):
+    '''
+    Creates the read-only snapshot used to choose the connectors of zones.
+
+    Args:
+        - feasibleNodes: The list of feasible nodes (network nodes or virtual
+            nodes). Candidates are identified by their position in this list.
+        - masses: The list of node masses, in the same order.
+        - boundaries: The list of boundary geometries connectors can't cross,
+            or None.
+        - parameters: A dictionary with the SearchRadius, MaxCandidates,
+            MaxConnectors, BetaMassSum, BetaRadialDist, BetaLengthStdDev,
+            BetaGravity and KeepStatistics keys.
+
+    Returns: The snapshot, as a dictionary (so that it can be sent to worker processes)
+    '''
+    numbers = []
+    for node in feasibleNodes:
+        try: numbers.append(node.number)
+        except AttributeError: numbers.append(float('inf')) #Virtual nodes don't have a number yet
+
+    snapshot = dict(parameters)
+    snapshot['x'] = numpy.array([node.x for node in feasibleNodes], dtype= numpy.float64)
+    snapshot['y'] = numpy.array([node.y for node in feasibleNodes], dtype= numpy.float64)
+    snapshot['numbers'] = numpy.array(numbers, dtype= numpy.float64)
+    snapshot['masses'] = numpy.array(masses, dtype= numpy.float64)
+    #Geometries are copied as plain Shapely geometries, so that they can be sent to worker processes
+    snapshot['boundaries'] = [_wkb.loads(boundary.wkb) for boundary in boundaries] if boundaries else None
+    if boundaries:
+        snapshot['boundaryBounds'] = numpy.array([boundary.bounds for boundary in boundaries], dtype= numpy.float64)
+    return snapshot
+
+def selectConnectors(snapshot, zoneX, zoneY, zoneGeometry):
+    '''
+    Chooses the connectors of one zone. First, gets all of the nodes within the
+    search radius of the zone. Then, removes all those nodes which create connectors
+    that cross boundaries. Finally, truncates the set of candidate nodes and picks the
+    configuration with the highest utility.
+
+    Returns: A dictionary with the following keys:
+        - 'initialSet', 'boundSet', 'finalSet': The number of candidates after each step.
+        - 'firstNodeNumber': The lowest node number in the initial set (inf if there are none)
+        - 'candidates': The list of final candidates (as indices in the snapshot)
+        - 'lengths': The list of connector lengths of the candidates
+        - 'bestConfig': The list of indices of the best configuration
+        - 'maxUtil': The utility of the best configuration
+        - 'components': A dictionary of the utility terms of the best configuration
+        - 'statistics': A dictionary of the utility statistics, if KeepStatistics is True
+    '''
+    selection = {'initialSet': 0, 'boundSet': 0, 'finalSet': 0, 'firstNodeNumber': float('inf'),
+                 'candidates': [], 'lengths': [], 'bestConfig': None, 'maxUtil': - float('inf'),
+                 'components': {}, 'statistics': None}
+    if zoneGeometry is None:
+        return selection
+
+    candidates = _searchByPoly(snapshot, zoneX, zoneY, zoneGeometry)
+    selection['initialSet'] = len(candidates)
+    if candidates:
+        selection['firstNodeNumber'] = float(snapshot['numbers'][candidates].min())
+
+    candidates = _removeCrossBoundaryConnectors(snapshot, zoneX, zoneY, candidates)
+    selection['boundSet'] = len(candidates)
+
+    lengths = [_measureDistance(snapshot, i, zoneX, zoneY) for i in candidates]
+    candidates, lengths = _truncateCandidateSet(snapshot, candidates, lengths)
+    selection['finalSet'] = len(candidates)
+    selection['candidates'] = candidates
+    selection['lengths'] = lengths
+    if not candidates:
+        return selection
+
+    search = ConfigurationSearch.fromCandidates(snapshot, zoneX, zoneY, candidates, lengths)
+    bestConfig, maxUtil, maxComponents = search.run(snapshot['MaxConnectors'])
+    selection['bestConfig'] = [candidates[i] for i in bestConfig] if bestConfig is not None else None
+    selection['maxUtil'] = maxUtil
+    selection['components'] = maxComponents
+    if snapshot['KeepStatistics']:
+        selection['statistics'] = search.getStatistics()
+    return selection
+
+def selectConnectorsParallel(snapshot, zones, processes):
+    '''
+    Chooses the connectors of several zones in a pool of worker processes.
+
+    Args:
+        - snapshot: The snapshot returned by createSnapshot
+        - zones: A list of (x, y, geometry) tuples (the geometry can be None)
+        - processes: The number of worker processes
+
+    Returns: An iterator of the selections (see selectConnectors), in the order of the zones
+    '''
+    worker = _getWorkerModule()
+    _setWorkerExecutable()
+    chunkSize = max(1, len(zones) // (processes * 8))
+
+    zones = [(x, y, geometry.wkb if geometry is not None else None) for (x, y, geometry) in zones]
+    pool = multiprocessing.Pool(processes, worker._initializeWorker, (snapshot,))
+    try:
+        for selection in pool.imap(worker._selectConnectorsInWorker, zones, chunkSize):
+            yield selection
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+#---
+#---Worker processes
+
+_workerSnapshot = None
+
+def _initializeWorker(snapshot):
+    global _workerSnapshot
+    _workerSnapshot = snapshot
+
+def _selectConnectorsInWorker(zone):
+    zoneX, zoneY, zoneGeometry = zone
+    if zoneGeometry is not None:
+        zoneGeometry = _wkb.loads(zoneGeometry)
+    return selectConnectors(_workerSnapshot, zoneX, zoneY, zoneGeometry)
+
+def _getWorkerModule():
+    #Workers import the module which defines the functions they are sent by its name,
+    #which isn't possible for the name given by Modeller. So this module is also
+    #imported directly from its folder.
+    folder = path.dirname(path.abspath(__file__))
+    if folder not in sys.path:
+        sys.path.append(folder)
+    return __import__(path.splitext(path.basename(__file__))[0])
+
+def _setWorkerExecutable():
+    #Inside Emme, sys.executable is the Emme program rather than a Python interpreter
+    if sys.platform != 'win32': return
+    interpreter = path.join(sys.exec_prefix, 'python.exe')
+    if path.exists(interpreter) and path.basename(sys.executable).lower() not in ('python.exe', 'pythonw.exe'):
+        multiprocessing.set_executable(interpreter)
+
+#---
+#---Candidate node functions
+
+def _searchByPoly(snapshot, zoneX, zoneY, zoneGeometry):
+    '''
+    Gets a list of all feasible nodes within the search radius from the edge of
+    the zone's boundary.
+    '''
+    buffer = zoneGeometry.buffer(snapshot['SearchRadius'], resolution=2)
+    preparedBuffer = _prep(buffer)
+    minx, miny, maxx, maxy = buffer.bounds
+    x, y = snapshot['x'], snapshot['y']
+    nearby = numpy.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+    return [int(i) for i in nearby if preparedBuffer.contains(_geo.Point(x[i], y[i]))]
+
+def _removeCrossBoundaryConnectors(snapshot, zoneX, zoneY, candidates):
+    '''
+    Removes from the list of candidate nodes those which cross boundaries.
+    '''
+    boundaries = snapshot['boundaries']
+    if not boundaries or not candidates: #If no boundaries have been loaded, skip this step.
+        return candidates
+
+    #All of the zone's connectors fall within this box, so only the boundaries
+    #overlapping it are tested, as a single prepared geometry (boundaries can be
+    #of any geometry type).
+    x, y = snapshot['x'][candidates], snapshot['y'][candidates]
+    minx, miny = min(x.min(), zoneX), min(y.min(), zoneY)
+    maxx, maxy = max(x.max(), zoneX), max(y.max(), zoneY)
+    bounds = snapshot['boundaryBounds']
+    nearby = numpy.flatnonzero((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx)
+                               & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+    if len(nearby) == 0:
+        return candidates
+    nearbyBoundaries = _prep(_unary_union([boundaries[b] for b in nearby]))
+
+    return [i for i in candidates
+            if not nearbyBoundaries.intersects(_geo.LineString([(zoneX, zoneY), (snapshot['x'][i], snapshot['y'][i])]))]
+
+def _truncateCandidateSet(snapshot, candidates, lengths):
+    '''
+    Truncates the set of candidate nodes to the maximum set size by
+    removing the farthest candidates. Candidates are kept in snapshot order.
+    '''
+    if len(candidates) <= snapshot['MaxCandidates']:
+        return candidates, lengths
+
+    sorter = sorted(zip(lengths, candidates))[:snapshot['MaxCandidates']]
+    sorter.sort(key= lambda item: item[1])
+    return [i for (length, i) in sorter], [length for (length, i) in sorter]
+
+def _measureDistance(snapshot, i, x, y):
+    x1, y1 = float(snapshot['x'][i]), float(snapshot['y'][i])
+    return math.sqrt((x1 - x)*(x1 - x) + (y1 - y)*(y1 - y)) / 1000.0
+
+def _getSegmentBearing(snapshot, i, zoneX, zoneY):
+    rad = math.atan2(float(snapshot['x'][i]) - zoneX, float(snapshot['y'][i]) - zoneY)
+    if rad < 0:
+        return rad + math.pi * 2
+    return rad
+
+##################################################################################################################
+
+class ConfigurationSearch():
+    '''
+    Finds the configuration (set of candidate nodes) with the highest utility for
+    a zone. This gives the same result as scoring every configuration from
+    itertools.combinations one at a time: the terms are computed in the same order,
+    so the utilities are identical, and ties are still won by the configuration
+    which comes first.
+
+    The per-candidate masses, bearings and lengths and the pairwise gravity terms
+    are pre-computed as arrays. Configurations are scored in batches of all those
+    with the same size and first node, and a batch is skipped when an upper bound
+    on its utilities shows that it can't contain the best configuration.
+
+    If keepStatistics is True, every configuration is scored (no batch is skipped)
+    so that the utility statistics of the full report can be computed.
+    '''
+
+    def __init__(self, masses, bearings, lengths, gravity, betas, keepStatistics=False):
+        self.masses = numpy.asarray(masses, dtype= numpy.float64)
+        self.bearings = numpy.asarray(bearings, dtype= numpy.float64)
+        self.lengths = numpy.asarray(lengths, dtype= numpy.float64)
+        self.gravity = numpy.asarray(gravity, dtype= numpy.float64)
+        self.betaMassSum, self.betaRadialDist, self.betaLengthStdDev, self.betaGravity = betas
+        self.keepStatistics = keepStatistics
+
+        #Running accumulators for the utility statistics
+        self.count = 0
+        self.mean = 0.0
+        self.sumSquaredDeviations = 0.0
+        self.minimum = float('inf')
+        self.batches = []
+
+        self.configurationsScored = 0
+        self.configurationsSkipped = 0
+
+    @staticmethod
+    def fromCandidates(snapshot, zoneX, zoneY, candidates, lengths):
+        n = len(candidates)
+        gravity = numpy.zeros((n, n))
+        for k, i in enumerate(candidates):
+            for l, j in enumerate(candidates):
+                if k == l: continue
+
+                d = _measureDistance(snapshot, i, float(snapshot['x'][j]), float(snapshot['y'][j]))
+                if d == 0: d = 0.0001
+                gravity[k, l] = 1 / (d*d)
+
+        return ConfigurationSearch(snapshot['masses'][candidates],
+                                   [_getSegmentBearing(snapshot, i, zoneX, zoneY) for i in candidates],
+                                   lengths, gravity,
+                                   (snapshot['BetaMassSum'], snapshot['BetaRadialDist'],
+                                    snapshot['BetaLengthStdDev'], snapshot['BetaGravity']),
+                                   snapshot['KeepStatistics'])
+
+    def run(self, maxConnectors):
+        '''
+        Returns the best configuration (a tuple of candidate indices), its utility and
+        a dictionary of its utility terms (which is empty if the best configuration
+        has a single connector).
+        '''
+        maxUtil = - float('inf')
+        bestConfig = None
+        maxComponents = {}
+
+        #Special handling for the case of one connector
+        for i in xrange(len(self.masses)):
+            util = self.betaMassSum * self.masses[i]
+            if util > maxUtil:
+                bestConfig = (i,)
+                maxUtil = util
+
+        setSizes = range(2, min(maxConnectors, len(self.masses)) + 1)
+
+        #The utility of any configuration is a lower bound for the best one, so a
+        #good guess at the start allows skipping batches which come before it.
+        lowerBound = - float('inf')
+        if not self.keepStatistics:
+            lowerBound = max([lowerBound] + [self._getGuessUtility(setSize) for setSize in setSizes])
+
+        for setSize in setSizes:
+            configurations = numpy.array(list(combinations(range(len(self.masses)), setSize)), dtype= numpy.int32)
+            firstNodes = configurations[:, 0]
+            for first in xrange(len(self.masses) - setSize + 1):
+                if not self.keepStatistics:
+                    upperBound = self._getUpperBound(first, setSize)
+                    #Ties go to the configuration which comes first, so the batch is only skipped
+                    #if it can't beat the lower bound, or can't beat the best configuration so far.
+                    if upperBound < lowerBound or upperBound <= maxUtil:
+                        self.configurationsSkipped += numpy.count_nonzero(firstNodes == first)
+                        continue
+
+                batch = configurations[firstNodes == first]
+                utilComponents = self._calculateUtilities(batch)
+                utils = self._sumUtility(utilComponents)
+                self.configurationsScored += len(batch)
+                if self.keepStatistics:
+                    self._accumulate(utils)
+
+                #NaN utilities never replace the best configuration
+                index = numpy.argmax(numpy.where(numpy.isnan(utils), - float('inf'), utils))
+                if utils[index] > maxUtil:
+                    bestConfig = tuple(int(i) for i in batch[index])
+                    maxUtil = utils[index]
+                    maxComponents = dict([(key, param[index]) for (key, (beta, param)) in utilComponents.iteritems()])
+
+        return bestConfig, float(maxUtil), maxComponents
+
+    def getStatistics(self):
+        if self.count == 0:
+            return {'minUtil': - float('inf'), 'meanUtil': - float('inf'),
+                    'medianUtil': - float('inf'), 'sDevUtil': float('nan')}
+        return {'minUtil': self.minimum,
+                'meanUtil': self.mean,
+                'medianUtil': float(numpy.median(numpy.concatenate(self.batches))),
+                'sDevUtil': math.sqrt(self.sumSquaredDeviations / self.count)}
+
+    def _calculateUtilities(self, configurations):
+        '''
+        Calculates the utility terms of an array of configurations (one row of candidate
+        indices per configuration), in the same order as CCGEN did for one configuration.
+        '''
+        setSize = configurations.shape[1]
+
+        massSum = numpy.zeros(len(configurations))
+        for column in configurations.T:
+            massSum += self.masses[column]
+
+        #Aggregated squared differences between the angles formed by the connectors and the ideal
+        bearings = numpy.sort(self.bearings[configurations], axis= 1)
+        idealAngle = 2 * math.pi / setSize
+        angleSum = numpy.zeros(len(configurations))
+        for k in xrange(1, setSize):
+            a = bearings[:, k] - bearings[:, k - 1]
+            angleSum += ((idealAngle - a) * (idealAngle - a))
+        a = bearings[:, 0] - bearings[:, -1]
+        a = numpy.where(a < 0, a + math.pi * 2, a)
+        angleSum += ((idealAngle - a) * (idealAngle - a))
+        radialDist = angleSum / (setSize + 1)
+
+        #Normalized standard deviation of connector lengths
+        lengths = self.lengths[configurations]
+        lengthSum = numpy.zeros(len(configurations))
+        for k in xrange(setSize):
+            lengthSum += lengths[:, k]
+        with numpy.errstate(divide= 'ignore', invalid= 'ignore'):
+            lengthSDev = numpy.std(lengths, axis= 1) / (lengthSum / setSize)
+
+        gravity = numpy.zeros(len(configurations))
+        for k, l in combinations(range(setSize), 2):
+            gravity += self.gravity[configurations[:, k], configurations[:, l]]
+
+        return {'mass' : (self.betaMassSum, massSum),
+                'radialDist' : (self.betaRadialDist, radialDist),
+                'lengthSDev' : (self.betaLengthStdDev, lengthSDev),
+                'gravity' : (self.betaGravity, gravity)}
+
+    def _sumUtility(self, utilComponents):
+        #Summed in the same order as in CCGEN, which depends on the order of the dictionary
+        util = 0
+        for (beta, param) in utilComponents.itervalues():
+            util = util + beta * param
+        return util
+
+    def _getGuessUtility(self, setSize):
+        #The configuration of the candidates with the largest (or smallest) masses
+        order = numpy.argsort(self.masses, kind= 'mergesort')
+        if self.betaMassSum >= 0:
+            order = order[::-1]
+        configuration = numpy.sort(order[:setSize])[numpy.newaxis, :]
+        util = self._sumUtility(self._calculateUtilities(configuration))[0]
+        return - float('inf') if numpy.isnan(util) else util
+
+    def _getUpperBound(self, first, setSize):
+        '''
+        Returns an upper bound on the utility of the configurations of a given size
+        starting with candidate 'first' (whose other candidates all come after it).
+        '''
+        others = setSize - 1
+        remainingMasses = numpy.sort(self.masses[first + 1:])
+        if self.betaMassSum >= 0:
+            massSum = self.masses[first] + remainingMasses[len(remainingMasses) - others:].sum()
+        else:
+            massSum = self.masses[first] + remainingMasses[:others].sum()
+        bound = self.betaMassSum * massSum
+
+        #The radial distribution is 0 for evenly spread bearings, and highest when they are all the same
+        if self.betaRadialDist > 0:
+            idealAngle = 2 * math.pi / setSize
+            bound += self.betaRadialDist * (others * idealAngle * idealAngle
+                                            + (idealAngle - 2 * math.pi) * (idealAngle - 2 * math.pi)) / (setSize + 1)
+
+        #The coefficient of variation of n non-negative lengths is at most sqrt(n - 1)
+        if self.betaLengthStdDev > 0:
+            bound += self.betaLengthStdDev * math.sqrt(others)
+
+        if self.betaGravity > 0:
+            firstPairs = numpy.sort(self.gravity[first, first + 1:])[::-1][:others].sum()
+            remaining = self.gravity[first + 1:, first + 1:]
+            otherPairs = numpy.sort(remaining[numpy.triu_indices(len(remaining), 1)])[::-1][:others * (others - 1) // 2].sum()
+            bound += self.betaGravity * (firstPairs + otherPairs)
+
+        #Allow for rounding errors, as the bound is summed in a different order than the utilities
+        return bound + 1e-9 * (abs(bound) + 1.0)
+
+    def _accumulate(self, utils):
+        #Merges the batch's count, mean and sum of squared deviations into the running totals
+        count = len(utils)
+        mean = utils.mean()
+        sumSquaredDeviations = ((utils - mean) * (utils - mean)).sum()
+        delta = mean - self.mean
+        total = self.count + count
+        self.sumSquaredDeviations += sumSquaredDeviations + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.minimum = min(self.minimum, utils.min())
+        self.batches.append(utils)
@@ -46,6 +46,19 @@ Full Network Set Generator
         requiring all edits to be in the same document.  Typically this will get used by having
         a master alt file, and then an additional one containing scenario specific changes.
     0.3.1 Added call to remove_extra_links tool. 2016-08-24
+    0.4.0 The transit service table is loaded and indexed once, and the service of every time
+        period is computed in a single pass before the time period networks are created. The
+        base network is no longer loaded and re-published without changes.
+    0.5.0 Added an optional in-memory pipeline mode. Each time period network is loaded
+        once from the base scenario, edited in memory by every step, and published once to each
+        of the uncleaned and cleaned scenarios, instead of being loaded and published by each
+        tool. The time spent in each step, and the network loads and publishes avoided, are
+        written to the logbook. Line filters are evaluated on the base scenario in this mode,
+        so it is off by default.
+    0.5.1 In the in-memory mode, the time period network is published to the uncleaned scenario
+        once its headways and speeds are set, and the line filters are evaluated on it (as the
+        tools do). If a line filter refers to headways or speeds, which the batch line edits
+        change, the networks are generated with the tools instead.
     
 '''
 
@@ -56,9 +69,13 @@ from contextlib import contextmanager
 from contextlib import nested
 from html import HTML
 from re import split as _regex_split
+from re import search as _regex_search
+from time import time as _time
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_serviceTable = _MODELLER.module('tmg.network_editing.time_of_day_changes.service_table')
+_editing = _MODELLER.module('tmg.common.network_editing')
 
 removeExtraNodes = _MODELLER.tool('tmg.network_editing.remove_extra_nodes')
 removeExtraLinks = _MODELLER.tool('tmg.network_editing.remove_extra_links')
@@ -71,12 +88,14 @@ lineEdit = _MODELLER.tool('tmg.XTMF_internal.apply_batch_line_edits')
 
 class FullNetworkSetGenerator(_m.Tool()):
     
-    version = '0.3.1'
+    version = '0.5.1'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
     COLON = ':'
     COMMA = ','
+    
+    TOOL_NETWORK_LOADS = 4 #Number of times each time period network is loaded (and published) when each step is run as a tool
                 
     # Tool Input Parameters
     #    Only those parameters neccessary for Modeller and/or XTMF to dock with
@@ -150,6 +169,8 @@ class FullNetworkSetGenerator(_m.Tool()):
 
     LineFilterExpression = _m.Attribute(str)     
     
+    InMemoryPipelineFlag = _m.Attribute(bool)
+    
     def __init__(self):
         #---Init internal variables
         self.TRACKER = _util.ProgressTracker(self.number_of_tasks) #init the ProgressTracker
@@ -234,6 +255,8 @@ class FullNetworkSetGenerator(_m.Tool()):
         self.LineFilterExpression = "line=______ xor line=TS____ xor line=GT____" 
 
         self.CustomScenarioSetFlag = False
+        
+        self.InMemoryPipelineFlag = False
 
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="Full Network Set Generator v%s" %self.version,
@@ -309,6 +332,13 @@ class FullNetworkSetGenerator(_m.Tool()):
         pb.add_checkbox(tool_attribute_name= 'PublishFlag',
                         label= "Publish network?")
         
+        pb.add_checkbox(tool_attribute_name='InMemoryPipelineFlag',
+                        label="Edit networks in memory?",
+                        note="Each time period network is loaded once, and published once to the cleaned \
+                        scenario and twice to the uncleaned scenario (so that line filters can be evaluated \
+                        on it). If a line filter refers to hdw or speed, which the batch line edits change, \
+                        each step is run as a tool instead.")
+        
         pb.add_checkbox(tool_attribute_name='CustomScenarioSetFlag',
                            label="Use custom scenario list?")
 
@@ -785,8 +815,10 @@ class FullNetworkSetGenerator(_m.Tool()):
                  TransitServiceTableFile, AggTypeSelectionFile, AlternativeDataFile, BatchEditFile,
                  DefaultAgg, PublishFlag, TransferModesString, OverwriteScenarioFlag, NodeFilterAttributeId,
                  StopFilterAttributeId, ConnectorFilterAttributeId, AttributeAggregatorString,
-                 LineFilterExpression, AdditionalAlternativeDataFiles):
+                 LineFilterExpression, AdditionalAlternativeDataFiles, InMemoryPipelineFlag= False):
 
+        self.TRACKER.reset()
+        
         #---1 Set up scenario
         self.BaseScenario = _m.Modeller().emmebank.scenario(xtmf_ScenarioNumber)
         if (self.BaseScenario == None):
@@ -842,6 +874,7 @@ class FullNetworkSetGenerator(_m.Tool()):
         self.CustomScenarioSetFlag = True
         self.CustomScenarioSetString = CustomScenarioSetString
         self.AdditionalAlternativeDataFiles = AdditionalAlternativeDataFiles
+        self.InMemoryPipelineFlag = InMemoryPipelineFlag
 
 
         print "Running full network set generation"
@@ -904,8 +937,6 @@ class FullNetworkSetGenerator(_m.Tool()):
     def _Execute(self):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
-                        
-            network = self.BaseScenario.get_network()
             
             if not self.CustomScenarioSetFlag:
                 firstScenario = [self.Scen1UnNumber, self.Scen1Number, self.Scen1UnDescription, self.Scen1Description,
@@ -926,35 +957,19 @@ class FullNetworkSetGenerator(_m.Tool()):
             if self.OverwriteScenarioFlag:
                 self._DeleteOldScenarios(scenarioSet)
             
-            # Create time period networks in all the unclean scenario spots
-            # Calls create_transit_time_period
-            for scenarios in scenarioSet:
-                createTimePeriod(self.BaseScenario, scenarios[0], scenarios[2], self.TransitServiceTableFile,
-                                 self.AggTypeSelectionFile, self.AlternativeDataFile,
-                                 self.DefaultAgg, scenarios[4], scenarios[5], self.AdditionalAlternativeDataFiles)
-                if not (scenarios[6] == None or scenarios[6].lower() == "none"):
-                    applyNetUpdate(str(scenarios[0]),scenarios[6])                
-
-            print "Created uncleaned time period networks and applied network updates"
-
-            if self.BatchEditFile:
-                for scenarios in scenarioSet:
-                    lineEdit(scenarios[0], self.BatchEditFile) #note that batch edit file should use uncleaned scenario numbers
-                print "Edited transit line data"
-
-            # Prorate the transit speeds in all uncleaned networks
-            for scenarios in scenarioSet:
-                prorateTransitSpeed(scenarios[0], self.LineFilterExpression)
-
-            print "Prorated transit speeds"
-
-            for scenarios in scenarioSet:
-                removeExtraLinks(scenarios[0], self.TransferModesString, True, scenarios[1], scenarios[3])
-                
-                removeExtraNodes(scenarios[1], self.NodeFilterAttributeId, self.StopFilterAttributeId, self.ConnectorFilterAttributeId, self.AttributeAggregatorString)
-            print "Cleaned networks"
+            periodServices = self._AggregateServiceTable(scenarioSet)
+            
+            if self.InMemoryPipelineFlag and self._LineFiltersDependOnEdits():
+                msg = "Line filters refer to headways or speeds, which the batch line edits change. \
+The networks are generated with the tools instead of in memory."
+                _m.logbook_write(msg)
+                print msg
+                self._GenerateWithTools(scenarioSet, periodServices)
+            elif self.InMemoryPipelineFlag:
+                self._GenerateInMemory(scenarioSet, periodServices)
+            else:
+                self._GenerateWithTools(scenarioSet, periodServices)
                 
-            self.BaseScenario.publish_network(network)
             self.TRACKER.completeTask()
 
 
@@ -971,6 +986,147 @@ class FullNetworkSetGenerator(_m.Tool()):
             
         return atts 
 
+    def _GenerateWithTools(self, scenarioSet, periodServices):
+        # Create time period networks in all the unclean scenario spots
+        # Calls create_transit_time_period
+        for scenarios, periodService in zip(scenarioSet, periodServices):
+            createTimePeriod(self.BaseScenario, scenarios[0], scenarios[2], self.TransitServiceTableFile,
+                             self.AggTypeSelectionFile, self.AlternativeDataFile,
+                             self.DefaultAgg, scenarios[4], scenarios[5], self.AdditionalAlternativeDataFiles,
+                             periodService= periodService)
+            if not (scenarios[6] == None or scenarios[6].lower() == "none"):
+                applyNetUpdate(str(scenarios[0]),scenarios[6])                
+
+        print "Created uncleaned time period networks and applied network updates"
+
+        if self.BatchEditFile:
+            for scenarios in scenarioSet:
+                lineEdit(scenarios[0], self.BatchEditFile) #note that batch edit file should use uncleaned scenario numbers
+            print "Edited transit line data"
+
+        # Prorate the transit speeds in all uncleaned networks
+        for scenarios in scenarioSet:
+            prorateTransitSpeed(scenarios[0], self.LineFilterExpression)
+
+        print "Prorated transit speeds"
+
+        for scenarios in scenarioSet:
+            removeExtraLinks(scenarios[0], self.TransferModesString, True, scenarios[1], scenarios[3])
+            
+            removeExtraNodes(scenarios[1], self.NodeFilterAttributeId, self.StopFilterAttributeId, self.ConnectorFilterAttributeId, self.AttributeAggregatorString)
+        print "Cleaned networks"
+    
+    def _GenerateInMemory(self, scenarioSet, periodServices):
+        self._loadTimes = []
+        self._publishTimes = []
+        
+        for scenarios, periodService in zip(scenarioSet, periodServices):
+            with self.TRACKER.stage("Scenarios %s and %s" %(scenarios[0], scenarios[1])):
+                self._GeneratePeriodInMemory(scenarios, periodService)
+            print "Created scenarios %s and %s" %(scenarios[0], scenarios[1])
+        
+        self.TRACKER.writeTimings("Network set generation timings")
+        self._WriteNetworkIOReport(len(scenarioSet))
+    
+    def _GeneratePeriodInMemory(self, scenarios, periodService):
+        bank = _MODELLER.emmebank
+        network = self._LoadNetwork(self.BaseScenario)
+        
+        with self.TRACKER.stage("Create time period network"):
+            createTimePeriod.processNetwork(network, self.TransitServiceTableFile, self.AggTypeSelectionFile,
+                                            self.AlternativeDataFile, self.DefaultAgg, scenarios[4], scenarios[5],
+                                            self.AdditionalAlternativeDataFiles, periodService= periodService)
+        
+        uncleanedScenario = bank.copy_scenario(self.BaseScenario.id, scenarios[0])
+        uncleanedScenario.title = scenarios[2]
+        
+        #The line filters are evaluated on the uncleaned scenario, as they are by the tools, so the
+        #network is published once its time period headways and speeds are set (and unserviced lines
+        #are removed). Network updates are applied to the scenario, so the network is re-loaded after them.
+        self._PublishNetwork(network, uncleanedScenario)
+        if not (scenarios[6] == None or scenarios[6].lower() == "none"):
+            with self.TRACKER.stage("Apply network update"):
+                applyNetUpdate(str(scenarios[0]), scenarios[6])
+            network = self._LoadNetwork(uncleanedScenario)
+        lineSelector = _editing.TransitLineSelector(uncleanedScenario)
+        
+        if self.BatchEditFile:
+            with self.TRACKER.stage("Apply batch line edits"):
+                #note that batch edit file should use uncleaned scenario numbers
+                lineEdit.processNetwork(network, scenarios[0], self.BatchEditFile, lineSelector)
+        
+        with self.TRACKER.stage("Prorate transit speeds"):
+            prorateTransitSpeed.processNetwork(network, self.LineFilterExpression, lineSelector)
+        
+        self._PublishNetwork(network, uncleanedScenario)
+        
+        with self.TRACKER.stage("Remove extra links"):
+            removeExtraLinks.processNetwork(network, self.TransferModesString)
+        
+        with self.TRACKER.stage("Remove extra nodes"):
+            removeExtraNodes.processNetwork(network, self.NodeFilterAttributeId, self.StopFilterAttributeId,
+                                            self.ConnectorFilterAttributeId, self.AttributeAggregatorString)
+        
+        cleanedScenario = bank.copy_scenario(uncleanedScenario.id, scenarios[1], copy_strat_files= False, copy_path_files= False)
+        cleanedScenario.title = scenarios[3]
+        self._PublishNetwork(network, cleanedScenario)
+    
+    def _LineFiltersDependOnEdits(self):
+        '''
+        Returns True if there are batch line edits, and a line filter (of the edits or of the
+        speed proration) refers to the headways or speeds they change. The tools evaluate each
+        filter after the preceding edits are applied, which the in-memory pipeline cannot do.
+        '''
+        if not self.BatchEditFile: return False
+        filters = [self.LineFilterExpression]
+        with open(self.BatchEditFile) as reader:
+            cells = reader.readline().strip().split(lineEdit.COMMA)
+            filterCol = cells.index('filter')
+            for line in reader:
+                cells = line.strip().split(lineEdit.COMMA)
+                if len(cells) > filterCol: filters.append(cells[filterCol])
+        return any(_regex_search(r'\b(hdw|speed)\b', filter) for filter in filters if filter)
+    
+    def _LoadNetwork(self, scenario):
+        start = _time()
+        with self.TRACKER.stage("Load network from scenario %s" %scenario.id):
+            network = scenario.get_network()
+        self._loadTimes.append(_time() - start)
+        return network
+    
+    def _PublishNetwork(self, network, scenario):
+        start = _time()
+        with self.TRACKER.stage("Publish network to scenario %s" %scenario.id):
+            scenario.publish_network(network, True)
+        self._publishTimes.append(_time() - start)
+    
+    def _WriteNetworkIOReport(self, numberOfPeriods):
+        #Compares the network loads and publishes with those of running each step as a separate tool
+        toolLoads = toolPublishes = numberOfPeriods * self.TOOL_NETWORK_LOADS
+        loads, publishes = len(self._loadTimes), len(self._publishTimes)
+        averageLoad = sum(self._loadTimes) / max(loads, 1)
+        averagePublish = sum(self._publishTimes) / max(publishes, 1)
+        savedTime = (toolLoads - loads) * averageLoad + (toolPublishes - publishes) * averagePublish
+        
+        msg = "Loaded %s networks (avg. %.1fs) and published %s networks (avg. %.1fs). Running each step as a \
+separate tool would load %s and publish %s networks, about %.0fs more." %(loads, averageLoad, publishes, averagePublish,
+                                                                      toolLoads, toolPublishes, savedTime)
+        _m.logbook_write(msg)
+        print msg
+    
+    def _AggregateServiceTable(self, scenarioSet):
+        #The service of all time periods is computed from one load of the service table
+        if not self.TransitServiceTableFile:
+            return [None] * len(scenarioSet)
+        
+        serviceTable = _serviceTable.loadServiceTable(self.TransitServiceTableFile)
+        if serviceTable.skippedTrips > 0:
+            print "%s trips were skipped because their times could not be parsed." %serviceTable.skippedTrips
+        periods = [(_serviceTable.parseIntTime(scenarios[4]), _serviceTable.parseIntTime(scenarios[5]))
+                   for scenarios in scenarioSet]
+        print "Loaded service table"
+        return serviceTable.aggregatePeriods(periods)
+
     def _DeleteOldScenarios(self, scenarios):
         bank = _MODELLER.emmebank
         for items in scenarios:
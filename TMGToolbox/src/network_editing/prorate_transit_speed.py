@@ -33,6 +33,9 @@ Pro-rate Segment Speeds for Select Lines
 '''
     0.0.1 Created on 2014-01-30 by pkucirek
     
+    0.0.2 Added processNetwork, which prorates the selected lines of a Network object in memory
+        for callers which chain several network edits before publishing.
+    
 '''
 
 import inro.modeller as _m
@@ -47,7 +50,7 @@ _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 
 class ProrateSegmentSpeedsByLine(_m.Tool()):
     
-    version = '0.0.1'
+    version = '0.0.2'
     tool_run_msg = ""
     number_of_tasks = 2 # For progress reporting, enter the integer number of tasks here
     
@@ -141,15 +144,39 @@ class ProrateSegmentSpeedsByLine(_m.Tool()):
                 network = self.Scenario.get_network()
                 
                 flaggedLines = [line for line in network.transit_lines() if line[flagAttributeId] == 1]
-                self.TRACKER.startProcess(len(flaggedLines))
-                for line in flaggedLines:
-                    self._ProcessLine(line)
-                    self.TRACKER.completeSubtask()
-                self.TRACKER.completeTask()
+                self._ProcessLines(flaggedLines)
                     
                 self.Scenario.publish_network(network)
             
             return len(flaggedLines)
+    
+    ##########################################################################################################
+    
+    def processNetwork(self, network, filter, lineSelector):
+        '''
+        Prorates the segment speeds of the selected lines of a Network object in
+        memory, without loading or publishing it.
+        
+        Args:
+            - network: The Network object to modify
+            - filter: The line filter expression
+            - lineSelector: A network_editing.TransitLineSelector, used to evaluate
+                the filter expression.
+        
+        Returns: The number of lines modified.
+        '''
+        self.TRACKER.reset()
+        self.LineFilterExpression = filter
+        
+        with _m.logbook_trace(name="{classname} v{version} (in memory)".format(classname=(self.__class__.__name__), version=self.version),
+                                     attributes=self._GetNetworkAtts()):
+            self.TRACKER.completeTask()
+            
+            flaggedLines = [network.transit_line(id) for id in lineSelector(filter)]
+            flaggedLines = [line for line in flaggedLines if line != None] #Skip lines which aren't in the network
+            self._ProcessLines(flaggedLines)
+            
+            return len(flaggedLines)
 
     ##########################################################################################################
 
@@ -184,6 +211,14 @@ class ProrateSegmentSpeedsByLine(_m.Tool()):
             
         return atts 
     
+    def _GetNetworkAtts(self):
+        atts = {
+                "Version": self.version,
+                "Line Selector Expression": self.LineFilterExpression,
+                "self": self.__MODELLER_NAMESPACE__}
+            
+        return atts 
+    
     def _GetNetCalcSpec(self, flagAttributeId):
         return {
                 "result": flagAttributeId,
@@ -195,6 +230,17 @@ class ProrateSegmentSpeedsByLine(_m.Tool()):
                 "type": "NETWORK_CALCULATION"
                 }
     
+    def _ProcessLines(self, lines):
+        if not lines:
+            self.TRACKER.completeTask()
+            return
+        
+        self.TRACKER.startProcess(len(lines))
+        for line in lines:
+            self._ProcessLine(line)
+            self.TRACKER.completeSubtask()
+        self.TRACKER.completeTask()
+    
     def _ProcessLine(self, line):
         lineLength = sum([seg.link.length for seg in line.segments()]) #In km
                     
@@ -32,6 +32,9 @@
 #---VERSION HISTORY
 '''
     0.0.1 Created on 2016-08-22 by nasterska
+    0.0.2 The network is no longer loaded when the tool is constructed, and is only loaded once
+        per run. Added processNetwork, which removes the links from a Network object in memory
+        for callers which chain several network edits before publishing.
             
 '''
 
@@ -49,7 +52,7 @@ _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
 
 class RemoveExtraLinks(_m.Tool()):
        
-    version = '0.0.1'
+    version = '0.0.2'
     tool_run_msg = ""
     number_of_tasks = 4 # For progress reporting, enter the integer number of tasks here
     
@@ -69,7 +72,7 @@ class RemoveExtraLinks(_m.Tool()):
         
         #---Set the defaults of parameters used by Modeller
         self.BaseScenario = _MODELLER.scenario #Default is primary scenario
-        self.BaseNetwork = self.BaseScenario.get_network()
+        self.BaseNetwork = None
         self.NewScenarioFlag = True
 
     
@@ -161,13 +164,7 @@ class RemoveExtraLinks(_m.Tool()):
 
         self.NewScenarioFlag = newScenFlag
 
-        self.BaseNetwork = self.BaseScenario.get_network()
-
-        for modechar in transferModeString:
-            if self.BaseNetwork.mode(modechar):
-                self.TransferModeList.append (self.BaseNetwork.mode(modechar))
-            else:
-                raise Exception ("Transfer mode %s was not found in the network!" %modechar)
+        self.TransferModeList = self._GetTransferModes(self.BaseScenario, transferModeString)
 
         try:
             
@@ -227,6 +224,24 @@ class RemoveExtraLinks(_m.Tool()):
             _MODELLER.desktop.refresh_needed(True)
             self.TRACKER.completeTask()
 
+    ##########################################################################################################
+    
+    def processNetwork(self, network, transferModeString):
+        '''
+        Removes the extra links (and the nodes left stranded) from a Network object
+        in memory, without loading or publishing it.
+        '''
+        self.TRACKER.reset()
+        self.TransferModeList = self._GetTransferModes(network, transferModeString)
+        
+        with _m.logbook_trace(name="{classname} v{version} (in memory)".format(classname=(self.__class__.__name__), version=self.version),
+                                     attributes=self._GetNetworkAtts()):
+            self._RemoveLinks(network)
+            self.TRACKER.completeTask()
+            
+            self._RemoveStrandedNodes(network)
+            self.TRACKER.completeTask()
+
     ##########################################################################################################    
     
     #----SUB FUNCTIONS---------------------------------------------------------------------------------  
@@ -241,7 +256,23 @@ class RemoveExtraLinks(_m.Tool()):
             
         return atts 
     
-
+    def _GetNetworkAtts(self):
+        atts = {
+                "Transfer Modes": self.TransferModeList,
+                "Version": self.version, 
+                "self": self.__MODELLER_NAMESPACE__}
+            
+        return atts 
+    
+    def _GetTransferModes(self, network, transferModeString):
+        #Works with either a Scenario or a Network object
+        modes = []
+        for modechar in transferModeString:
+            if network.mode(modechar):
+                modes.append (network.mode(modechar))
+            else:
+                raise Exception ("Transfer mode %s was not found in the network!" %modechar)
+        return modes
     
     def _RemoveLinks(self,network):
 
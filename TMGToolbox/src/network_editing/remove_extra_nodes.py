@@ -36,6 +36,9 @@
     1.0.0 Published with proper documentation on 2014-05-29
 
     1.0.1 Copy of scenario is not created 2016-08-24
+    
+    1.1.0 Added processNetwork, which removes the nodes from a Network object in memory for
+        callers which chain several network edits before publishing.
         
 '''
 
@@ -76,7 +79,7 @@ class RemoveExtraNodes(_m.Tool()):
         
         return (a1 * l1 + a2 * l2) / (l1 + l2)
     
-    version = '1.0.1'
+    version = '1.1.0'
     tool_run_msg = ""
     number_of_tasks = 6 # For progress reporting, enter the integer number of tasks here
     
@@ -298,26 +301,14 @@ class RemoveExtraNodes(_m.Tool()):
         with _m.logbook_trace(name="{classname} v{version}".format(classname=(self.__class__.__name__), version=self.version),
                                      attributes=self._GetAtts()):
             
-            self._ParseSegmentAggregators()
+            extraAttributes = [(exatt.name, exatt.type) for exatt in self.BaseScenario.extra_attributes()]
+            self._ParseSegmentAggregators(extraAttributes)
             self.TRACKER.completeTask()
             
             network = self.BaseScenario.get_network()
             self.TRACKER.completeTask()
             
-            nodesToDelete = self._GetCandidateNodes(network)
-            
-            if len(nodesToDelete) == 0:
-                raise Exception("Found zero nodes to delete.") 
-            
-            if self.ConnectorFilterAttributeId:
-                self._RemoveCandidateCentroidConnectors(nodesToDelete)
-            
-            log = self._RemoveNodes(network, nodesToDelete)
-
-            
-            self.TRACKER.completeTask()
-            
-            self._WriteReport(log)
+            self._ProcessNetwork(network)
             
             self.TRACKER.startProcess(2)
 
@@ -328,6 +319,29 @@ class RemoveExtraNodes(_m.Tool()):
             _MODELLER.desktop.refresh_needed(True)
             self.TRACKER.completeTask()
 
+    ##########################################################################################################
+    
+    def processNetwork(self, network, nodeFilter, stopFilter, connFilter, attAgg):
+        '''
+        Removes the extra nodes from a Network object in memory, without loading or
+        publishing it. The arguments are the same as the tool's, without the scenario.
+        '''
+        self.TRACKER.reset()
+        self.NodeFilterAttributeId = nodeFilter
+        self.StopFilterAttributeId = stopFilter
+        self.ConnectorFilterAttributeId = connFilter
+        self.AttributeAggregatorString = attAgg
+        
+        with _m.logbook_trace(name="{classname} v{version} (in memory)".format(classname=(self.__class__.__name__), version=self.version),
+                                     attributes=self._GetNetworkAtts()):
+            
+            extraAttributes = [(att, domain) for domain in ['NODE', 'LINK', 'TRANSIT_SEGMENT']
+                               for att in network.attributes(domain) if att.startswith('@')]
+            self._ParseSegmentAggregators(extraAttributes)
+            self.TRACKER.completeTask()
+            
+            self._ProcessNetwork(network)
+
     ##########################################################################################################    
     
     #----SUB FUNCTIONS---------------------------------------------------------------------------------  
@@ -344,7 +358,33 @@ class RemoveExtraNodes(_m.Tool()):
             
         return atts 
     
-    def _ParseSegmentAggregators(self):
+    def _GetNetworkAtts(self):
+        atts = {
+                "Node Filter Attribute": self.NodeFilterAttributeId,
+                "Stop Filter Attribute": self.StopFilterAttributeId,
+                "Connector Filter Attribute": self.ConnectorFilterAttributeId,
+                "Attribute Aggregations": self.AttributeAggregatorString,
+                "Version": self.version, 
+                "self": self.__MODELLER_NAMESPACE__}
+            
+        return atts 
+    
+    def _ProcessNetwork(self, network):
+        nodesToDelete = self._GetCandidateNodes(network)
+        
+        if len(nodesToDelete) == 0:
+            raise Exception("Found zero nodes to delete.") 
+        
+        if self.ConnectorFilterAttributeId:
+            self._RemoveCandidateCentroidConnectors(nodesToDelete)
+        
+        log = self._RemoveNodes(network, nodesToDelete)
+        
+        self.TRACKER.completeTask()
+        
+        self._WriteReport(log)
+    
+    def _ParseSegmentAggregators(self, extraAttributes):
         
         #Setup the translation dictionary to get from Emme Desktop attribute names
         #to Modeller Python attribute names. Extra attributes are named the same.
@@ -386,9 +426,7 @@ class RemoveExtraNodes(_m.Tool()):
         segmentExtraAttributes = []
         nodeExtraAttributes = []
         
-        for exatt in self.BaseScenario.extra_attributes():
-            id = exatt.name
-            t = exatt.type
+        for id, t in extraAttributes:
             if t == 'NODE': nodeExtraAttributes.append(id)
             elif t == 'TRANSIT_SEGMENT': segmentExtraAttributes.append(id)
             elif t == 'LINK': linkExtraAttributes.append(id)
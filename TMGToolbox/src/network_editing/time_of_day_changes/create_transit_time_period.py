@@ -37,6 +37,12 @@ Create Time Period Networks
     0.1.3 Zero values in the alt data file no longer restricts a line from being rightfully deleted
     0.1.4 Fixed error in formatting integer times from alt file header
     0.1.5 Fixed an issue with line deletion from alt file causing headway error
+    0.2.0 The service table is loaded through the service_table module, which indexes the trips
+        of each line (caching the file's columns on disk), and computes headways and speeds for
+        the period in one vectorized pass. Callers processing several periods can pass the
+        pre-computed service of the period.
+    0.2.1 Added processNetwork, which creates the time period network from a Network object in
+        memory, for callers which chain several network edits before publishing.
     
 '''
 
@@ -47,37 +53,13 @@ from contextlib import nested
 _MODELLER = _m.Modeller() #Instantiate Modeller once.
 _util = _MODELLER.module('tmg.common.utilities')
 _tmgTPB = _MODELLER.module('tmg.common.TMG_tool_page_builder')
+_serviceTable = _MODELLER.module('tmg.network_editing.time_of_day_changes.service_table')
 
 ##########################################################################################################
 
-def naiveAggregation(departures, start, end):
-    deltaTime = end - start
-    
-    numDep = len(departures)
-    
-    return deltaTime / numDep
-
-def averageAggregation(departures, start, end):
-    
-    sum = 0
-    counter = 0
-    
-    if len(departures) == 1:
-        return end - start
-    
-    iter = departures.__iter__()
-    prevDep = iter.next()
-    for dep in iter:
-        headway = dep - prevDep
-        counter += 1
-        sum += headway
-        prevDep = dep
-    
-    return sum / counter
-
 class CreateTimePeriodNetworks(_m.Tool()):
     
-    version = '0.1.5'
+    version = '0.2.1'
     tool_run_msg = ""
     number_of_tasks = 1 # For progress reporting, enter the integer number of tasks here
     
@@ -109,6 +91,7 @@ class CreateTimePeriodNetworks(_m.Tool()):
         #---Set the defaults of parameters used by Modeller
         self.BaseScenario = _MODELLER.scenario #Default is primary scenario
         self.DefaultAgg = 'n'
+        self.PeriodService = None
     
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="Create Time Period Network v%s" %self.version,
@@ -196,27 +179,20 @@ class CreateTimePeriodNetworks(_m.Tool()):
     
     ##########################################################################################################
     # allows for the tool to be called from another tool    
-    def __call__(self, baseScen, newScenNum, newScenDescrip, serviceFile, aggFile, altFile, defAgg, start, end, additionalAltFiles):
+    def __call__(self, baseScen, newScenNum, newScenDescrip, serviceFile, aggFile, altFile, defAgg, start, end, additionalAltFiles,
+                 periodService= None):
+        '''
+        periodService (=None): Optional service_table.PeriodService of the time period, for callers which
+            aggregate the service table for several periods at once. Otherwise, the service table file
+            is loaded and aggregated for this period only.
+        '''
         self.tool_run_msg = ""
         self.TRACKER.reset()
 
         self.BaseScenario = baseScen
         self.NewScenarioNumber = newScenNum
         self.NewScenarioDescription = newScenDescrip
-        self.TransitServiceTableFile = serviceFile
-        self.AggTypeSelectionFile = aggFile
-        self.AlternativeDataFile = altFile
-        # Process the additional files, if it is the string None then there are no additional files otherwise they are ; separated
-        if additionalAltFiles == None or additionalAltFiles == "None":
-            self.InputFiles = []
-        else:
-            self.InputFiles = additionalAltFiles.split(';', 1)
-        # Add the base transaction file to the beginning
-        if altFile:
-            self.InputFiles.insert(0, altFile)
-        self.DefaultAgg = defAgg
-        self.TimePeriodStart = start
-        self.TimePeriodEnd = end
+        self._SetParameters(serviceFile, aggFile, altFile, defAgg, start, end, additionalAltFiles, periodService)
         
         try:            
             self._Execute()
@@ -232,6 +208,7 @@ class CreateTimePeriodNetworks(_m.Tool()):
     def run(self):
         self.tool_run_msg = ""
         self.TRACKER.reset()
+        self.PeriodService = None
         if self.AlternativeDataFile == None:
             self.InputFiles = []
         else:
@@ -256,49 +233,86 @@ class CreateTimePeriodNetworks(_m.Tool()):
             self.TRACKER.completeTask()
             print "Loaded network"
             
-            start = self._ParseIntTime(self.TimePeriodStart)
-            end = self._ParseIntTime(self.TimePeriodEnd)
-            
-            badIdSet = self._LoadServiceTable(network, start, end).union(self._LoadAggTypeSelect(network))
-            self.TRACKER.completeTask()
-            print "Loaded service table"
-            if len(badIdSet) > 0:
-                print "%s transit line IDs were not found in the network and were skipped." %len(badIdSet)
-                pb = _m.PageBuilder("Transit line IDs not in network")
-                
-                pb.add_text_element("<b>The following line IDs were not found in the network:</b>")
-                
-                for id in badIdSet:
-                    pb.add_text_element(id)
-                
-                _m.logbook_write("Some IDs were not found in the network. Click for details.",
-                                 value=pb.render())
-            
-            if len(self.InputFiles) <= 0:
-                    self._ProcessTransitLines(network, start, end, None)
-            else:
-                if self.AlternativeDataFile:
-                    altData = self._LoadAltFile(self.InputFiles)
-                else:
-                    altData = None
-                self._ProcessTransitLines(network, start, end, altData)
-                if altData:
-                    self._ProcessAltLines(network, altData)
-            print "Done processing transit lines"
+            self._ProcessNetwork(network)
             
             newScenario = _MODELLER.emmebank.copy_scenario(self.BaseScenario.id, self.NewScenarioNumber)
             newScenario.title = self.NewScenarioDescription
             
             print "Publishing network"
-            network.delete_attribute('TRANSIT_LINE', 'trips')
-            network.delete_attribute('TRANSIT_LINE', 'aggtype')
             newScenario.publish_network(network)
             
 
+    ##########################################################################################################
+    
+    def processNetwork(self, network, serviceFile, aggFile, altFile, defAgg, start, end, additionalAltFiles= None,
+                       periodService= None):
+        '''
+        Converts a base Network object into a time period network in memory, without loading
+        or publishing it, for callers which chain several network edits. The arguments are the
+        same as the tool's, without the scenarios.
+        '''
+        self.TRACKER.reset()
+        self._SetParameters(serviceFile, aggFile, altFile, defAgg, start, end, additionalAltFiles, periodService)
+        
+        with _m.logbook_trace(name="{classname} v{version} (in memory)".format(classname=(self.__class__.__name__), version=self.version),
+                                     attributes=self._GetNetworkAtts()):
+            self.TRACKER.completeTask()
+            self._ProcessNetwork(network)
+    
     ##########################################################################################################    
     
     #----SUB FUNCTIONS---------------------------------------------------------------------------------  
     
+    def _SetParameters(self, serviceFile, aggFile, altFile, defAgg, start, end, additionalAltFiles, periodService):
+        self.PeriodService = periodService
+        self.TransitServiceTableFile = serviceFile
+        self.AggTypeSelectionFile = aggFile
+        self.AlternativeDataFile = altFile
+        # Process the additional files, if it is the string None then there are no additional files otherwise they are ; separated
+        if additionalAltFiles == None or additionalAltFiles == "None":
+            self.InputFiles = []
+        else:
+            self.InputFiles = additionalAltFiles.split(';', 1)
+        # Add the base transaction file to the beginning
+        if altFile:
+            self.InputFiles.insert(0, altFile)
+        self.DefaultAgg = defAgg
+        self.TimePeriodStart = start
+        self.TimePeriodEnd = end
+    
+    def _ProcessNetwork(self, network):
+        start = self._ParseIntTime(self.TimePeriodStart)
+        end = self._ParseIntTime(self.TimePeriodEnd)
+        
+        servicedLines, badIdSet = self._LoadServiceTable(network, start, end)
+        badIdSet = badIdSet.union(self._LoadAggTypeSelect(network))
+        self.TRACKER.completeTask()
+        print "Loaded service table"
+        if len(badIdSet) > 0:
+            print "%s transit line IDs were not found in the network and were skipped." %len(badIdSet)
+            pb = _m.PageBuilder("Transit line IDs not in network")
+            
+            pb.add_text_element("<b>The following line IDs were not found in the network:</b>")
+            
+            for id in badIdSet:
+                pb.add_text_element(id)
+            
+            _m.logbook_write("Some IDs were not found in the network. Click for details.",
+                             value=pb.render())
+        
+        if len(self.InputFiles) <= 0:
+                self._ProcessTransitLines(network, start, end, None, servicedLines)
+        else:
+            if self.AlternativeDataFile:
+                altData = self._LoadAltFile(self.InputFiles)
+            else:
+                altData = None
+            self._ProcessTransitLines(network, start, end, altData, servicedLines)
+            if altData:
+                self._ProcessAltLines(network, altData)
+        print "Done processing transit lines"
+        network.delete_attribute('TRANSIT_LINE', 'aggtype')
+    
     def _GetAtts(self):
         atts = {
                 "Scenario" : str(self.BaseScenario.id),
@@ -307,6 +321,14 @@ class CreateTimePeriodNetworks(_m.Tool()):
             
         return atts 
     
+    def _GetNetworkAtts(self):
+        atts = {
+                "Time Period": "%s - %s" %(self.TimePeriodStart, self.TimePeriodEnd),
+                "Version": self.version, 
+                "self": self.__MODELLER_NAMESPACE__}
+            
+        return atts 
+    
     def _ParseIntTime(self, i):
         try:
             hours = i / 100
@@ -316,19 +338,6 @@ class CreateTimePeriodNetworks(_m.Tool()):
         except Exception, e:
             raise IOError("Error parsing time %s: %s" %(i, e)) 
     
-    def _ParseStringTime(self, s):
-        try:
-            hms = s.split(self.COLON)
-            if len(hms) != 3: raise IOError()
-            
-            hours = int(hms[0])
-            minutes = int(hms[1])
-            seconds = int(hms[2])
-            
-            return hours * 3600.0 + minutes * 60.0 + float(seconds)
-        except Exception, e:
-            raise IOError("Error parsing time %s: %s" %(s, e)) 
-
     def _ParseAggType(self, a):
         choiceSet = ('n', 'a')
         try:
@@ -339,44 +348,25 @@ class CreateTimePeriodNetworks(_m.Tool()):
             raise IOError("You must select either naive or average as an aggregation type %s: %s" %(a, e))                    
             
     def _LoadServiceTable(self, network, start, end):
-        network.create_attribute('TRANSIT_LINE', 'trips', None)
-        
-        bounds = _util.FloatRange(start, end)
-        badIds = set()
-
-        if self.TransitServiceTableFile:
-            with open(self.TransitServiceTableFile) as reader:
-                header = reader.readline()
-                cells = header.strip().split(self.COMMA)
-            
-                emmeIdCol = cells.index('emme_id')
-                departureCol = cells.index('trip_depart')
-                arrivalCol = cells.index('trip_arrive')
+        '''
+        Returns a dictionary of line id : (number of trips, naive headway, average headway,
+        mean travel time) for the lines with trips departing in the period, and the set of
+        service table line ids which are not in the network.
+        '''
+        periodService = self.PeriodService
+        if periodService is None:
+            if not self.TransitServiceTableFile: return {}, set()
             
-                for num, line in enumerate(reader):
-                    cells = line.strip().split(self.COMMA)
-                
-                    id = cells[emmeIdCol]
-                    transitLine = network.transit_line(id)
-                
-                    if transitLine == None:
-                        badIds.add(id)
-                        continue #Skip and report
-                
-                    try:
-                        departure = self._ParseStringTime(cells[departureCol])
-                        arrival = self._ParseStringTime(cells[arrivalCol])
-                    except Exception, e:
-                        print "Line " + str(num) + " skipped: " + str(e)
-                        continue
-                
-                    if not departure in bounds: continue #Skip departures not in the time period
-                
-                    trip = (departure, arrival)
-                    if transitLine.trips == None: transitLine.trips = [trip]
-                    else: transitLine.trips.append(trip)
+            table = _serviceTable.loadServiceTable(self.TransitServiceTableFile)
+            if table.skippedTrips > 0:
+                print "%s trips were skipped because their times could not be parsed." %table.skippedTrips
+            periodService = table.aggregatePeriods([(start, end)])[0]
         
-        return badIds
+        badIds = set(id for id in periodService.lineIds if network.transit_line(id) == None)
+        servicedLines = periodService.getServicedLines()
+        for id in badIds:
+            if id in servicedLines: del servicedLines[id] #Skip and report
+        return servicedLines, badIds
 
     def _LoadAggTypeSelect(self, network):
         network.create_attribute('TRANSIT_LINE', 'aggtype', None)
@@ -450,7 +440,7 @@ class CreateTimePeriodNetworks(_m.Tool()):
                 altData[id] = data
         return altData
         
-    def _ProcessTransitLines(self, network, start, end, altData):              
+    def _ProcessTransitLines(self, network, start, end, altData, servicedLines):              
         bounds = _util.FloatRange(0.01, 1000.0)
         
         toDelete = set()
@@ -467,17 +457,17 @@ class CreateTimePeriodNetworks(_m.Tool()):
         for line in network.transit_lines():
             #Pick aggregation type for given line
             if line.aggtype == 'n':
-                aggregator = naiveAggregation
+                useAverage = False
             elif line.aggtype == 'a':
-                aggregator = averageAggregation
+                useAverage = True
             elif self.DefaultAgg == 'n':
-                aggregator = naiveAggregation
+                useAverage = False
                 _m.logbook_write("Default aggregation was used for line %s" %(line.id))
             else:
-                aggregator = averageAggregation
+                useAverage = True
                 _m.logbook_write("Default aggregation was used for line %s" %(line.id))
 
-            if not line.trips: #Line trips list is empty or None
+            if not line.id in servicedLines: #Line has no trips in the period
                 if doNotDelete:    
                     if line.id not in doNotDelete: #don't delete lines whose headways we wish to manually set
                         toDelete.add(line.id)
@@ -486,18 +476,16 @@ class CreateTimePeriodNetworks(_m.Tool()):
                 self.TRACKER.completeSubtask()
                 continue
             
-            #Calc line headway
-            departures = [dep for dep, arr in line.trips]
-            departures.sort()
-            headway = aggregator(departures, start, end) / 60.0 #Convert from seconds to minutes
+            #Line headway and mean travel time, from the service table
+            nTrips, naiveHeadway, averageHeadway, travelTime = servicedLines[line.id]
+            if useAverage: headway = averageHeadway / 60.0 #Convert from seconds to minutes
+            else: headway = naiveHeadway / 60.0
             
             if not headway in bounds: print "%s: %s" %(line.id, headway)
             line.headway = headway
             
             #Calc line speed
-            sumTimes = 0
-            for dep, arr in line.trips: sumTimes += arr - dep
-            avgTime = sumTimes / len(line.trips) / 3600.0 #Convert from seconds to hours
+            avgTime = travelTime / 3600.0 #Convert from seconds to hours
             length = sum([seg.link.length for seg in line.segments()]) #Given in km
             speed = length / avgTime #km/hr
             if not speed in bounds: print "%s: %s" %(line.id, speed)
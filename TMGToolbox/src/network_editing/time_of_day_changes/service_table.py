@@ -0,0 +1,185 @@
+'''
+    Copyright 2017 Travel Modelling Group, Department of Civil Engineering, University of Toronto
+
+    This file is part of the TMG Toolbox.
+
+    The TMG Toolbox is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    The TMG Toolbox is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with the TMG Toolbox.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+#---METADATA---------------------
+'''
+Transit Service Table
+
+    Indexes a transit service table (emme_id, trip_depart, trip_arrive) by
+    line, keeping each line's departures sorted with their arrivals. Headways
+    and travel times can then be computed for any number of time periods in
+    a single vectorized pass. The columns of the file are read through the
+    GTFS reader, which caches them on disk until the file changes.
+
+'''
+#---VERSION HISTORY
+'''
+    0.0.1 Created
+
+'''
+
+import numpy as _np
+import inro.modeller as _m
+_MODELLER = _m.Modeller() #Instantiate Modeller once.
+_gtfs = _MODELLER.module('tmg.network_editing.GTFS_utilities.gtfs_reader')
+
+##########################################################################################################
+
+class Face(_m.Tool()):
+
+    def page(self):
+        pb = _m.ToolPageBuilder(self, runnable=False, title="Transit Service Table",
+                                description="Collection of private functions used to index transit \
+                                        service tables and aggregate them by time period.",
+                                branding_text="- TMG Toolbox")
+
+        pb.add_text_element("To import, call inro.modeller.Modeller().module('%s')" %str(self))
+
+        return pb.render()
+
+##########################################################################################################
+
+def loadServiceTable(filePath):
+    '''
+    Loads and indexes a transit service table. Trips with times which can't be
+    parsed are skipped (and counted in the table's 'skippedTrips').
+    '''
+    table = _gtfs.loadTable(filePath)
+    for column in ['emme_id', 'trip_depart', 'trip_arrive']:
+        if column not in table:
+            raise IOError("Service table '%s' does not define column '%s'" %(filePath, column))
+
+    departures = _parseTimeColumn(table, 'trip_depart')
+    arrivals = _parseTimeColumn(table, 'trip_arrive')
+    valid = (departures >= 0) & (arrivals >= 0)
+
+    return ServiceTable(table.labels('emme_id').tolist(), table.codes('emme_id')[valid],
+                        departures[valid], arrivals[valid], skippedTrips= int((~valid).sum()))
+
+def parseIntTime(i):
+    '''Converts a time in integer hours (e.g. 2:30 PM = 1430) into seconds after midnight.'''
+    hours = i / 100
+    minutes = i % 100
+    return hours * 3600.0 + minutes * 60.0
+
+def _parseTimeColumn(table, column):
+    #Times are parsed once per distinct value; invalid or blank times are returned as -1
+    labels = table.labels(column).tolist()
+    times = _np.empty(len(labels), dtype= _np.float64)
+    for i, label in enumerate(labels):
+        try:
+            times[i] = _gtfs.parseTime(label)
+        except ValueError:
+            times[i] = -1
+    return times[table.codes(column)]
+
+class ServiceTable():
+    '''
+    Trips of each line, sorted by departure time. The trips of the i-th line in
+    lineIds are at positions offsets[i] to offsets[i + 1] of the departures and
+    arrivals arrays (in seconds).
+    '''
+
+    def __init__(self, lineIds, lineCodes, departures, arrivals, skippedTrips= 0):
+        self.lineIds = lineIds
+        self.skippedTrips = skippedTrips
+        self._lineIndices = dict((id, i) for i, id in enumerate(lineIds))
+
+        order = _np.lexsort((departures, lineCodes))
+        self.departures = _np.asarray(departures, dtype= _np.float64)[order]
+        self.arrivals = _np.asarray(arrivals, dtype= _np.float64)[order]
+        lineCodes = _np.asarray(lineCodes)[order]
+        self.offsets = _np.searchsorted(lineCodes, _np.arange(len(lineIds) + 1))
+
+        #Sort key used to search all lines at once: departures are offset by line
+        self._span = float(self.departures.max()) + 1.0 if len(self.departures) else 1.0
+        self._keys = lineCodes * self._span + self.departures
+        self._cumulativeTimes = _np.concatenate(([0.0], _np.cumsum(self.arrivals - self.departures)))
+
+    def __contains__(self, lineId):
+        return lineId in self._lineIndices
+
+    def __len__(self):
+        return len(self.departures)
+
+    def getTrips(self, lineId):
+        '''Returns the (sorted) departures and the arrivals of a line's trips.'''
+        i = self._lineIndices[lineId]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.departures[start:end], self.arrivals[start:end]
+
+    def aggregatePeriods(self, periods):
+        '''
+        Aggregates the trips of every line for several time periods in a single pass.
+        A trip belongs to a period if it departs in [start, end).
+
+        Args:
+            - periods: A list of (start, end) tuples, in seconds.
+
+        Returns: A list of PeriodService objects, one for each period.
+        '''
+        if not periods: return []
+        starts = _np.array([start for start, end in periods], dtype= _np.float64)
+        ends = _np.array([end for start, end in periods], dtype= _np.float64)
+
+        #Positions of the first trip departing at or after each start and end, for each (period, line)
+        lineOffsets = _np.arange(len(self.lineIds)) * self._span
+        startKeys = lineOffsets[_np.newaxis, :] + _np.clip(starts, 0, self._span)[:, _np.newaxis]
+        endKeys = lineOffsets[_np.newaxis, :] + _np.clip(ends, 0, self._span)[:, _np.newaxis]
+        first = _np.searchsorted(self._keys, startKeys.ravel()).reshape(startKeys.shape)
+        last = _np.searchsorted(self._keys, endKeys.ravel()).reshape(endKeys.shape)
+        counts = last - first
+
+        with _np.errstate(divide= 'ignore', invalid= 'ignore'):
+            periodLengths = (ends - starts)[:, _np.newaxis]
+            naiveHeadways = periodLengths / counts
+            #The average of the differences between consecutive departures
+            lastDepartures = self.departures[_np.maximum(last - 1, 0)] if len(self) else _np.zeros(counts.shape)
+            firstDepartures = self.departures[_np.minimum(first, max(len(self) - 1, 0))] if len(self) else _np.zeros(counts.shape)
+            averageHeadways = _np.where(counts > 1, (lastDepartures - firstDepartures) / (counts - 1),
+                                        _np.broadcast_to(periodLengths, counts.shape))
+            travelTimes = (self._cumulativeTimes[last] - self._cumulativeTimes[first]) / counts
+
+        return [PeriodService(self.lineIds, start, end, counts[i], naiveHeadways[i], averageHeadways[i], travelTimes[i])
+                for i, (start, end) in enumerate(periods)]
+
+class PeriodService():
+    '''
+    The service of each line in a time period. Headways and travel times are
+    in seconds, and are only meaningful for lines with trips in the period.
+    '''
+
+    def __init__(self, lineIds, start, end, tripCounts, naiveHeadways, averageHeadways, travelTimes):
+        self.lineIds = lineIds
+        self.start = start
+        self.end = end
+        self.tripCounts = tripCounts
+        self.naiveHeadways = naiveHeadways
+        self.averageHeadways = averageHeadways
+        self.travelTimes = travelTimes
+
+    def getServicedLines(self):
+        '''
+        Returns a dictionary of line id : (number of trips, naive headway, average
+        headway, mean travel time) for the lines with trips in the period.
+        '''
+        serviced = _np.flatnonzero(self.tripCounts > 0).tolist()
+        return dict((self.lineIds[i], (int(self.tripCounts[i]), float(self.naiveHeadways[i]),
+                                       float(self.averageHeadways[i]), float(self.travelTimes[i])))
+                    for i in serviced)
@@ -69,16 +69,26 @@ Fare-Based Transit Network (FBTN) From Schema
         enables the proper connection of a centroid to a multi-operator station. The station group
         method allows for finer control of centroids, but cannot handle multiple operators at 
         a station. 
+
+    1.5.0 Added a topology cache. The transformed network (transfer grid, zone-crossing grid,
+        virtual nodes, line groups and fare zones) is saved next to the databank, keyed by a
+        hash of the groups, station groups and zones of the schema, the tool's options and the
+        base network (including link modes, line modes and vehicles, and itineraries). When only the fare rules have changed, the fares are re-applied to the
+        existing hyper network scenario instead of re-building it.
     
 '''
+import cPickle
 from copy import copy
 from contextlib import contextmanager
 from contextlib import nested
 from html import HTML
+import hashlib
 from itertools import combinations as get_combinations
+import os
 from os import path
 import traceback as _traceback
 from xml.etree import ElementTree as _ET
+import numpy as _np
 
 import inro.modeller as _m
 from inro.emme.core.exception import ModuleError
@@ -95,6 +105,12 @@ TransitLineProxy = _editing.TransitLineProxy
 NullPointerException = _util.NullPointerException
 EMME_VERSION = _util.getEmmeVersion(tuple) 
 
+#Standard attributes included in the key of the topology cache, in addition to each domain's extra attributes
+_BASE_NETWORK_KEY_ATTRIBUTES = [('NODE', ['x', 'y']),
+                                ('LINK', ['length', 'type', 'num_lanes', 'volume_delay_func']),
+                                ('TRANSIT_LINE', ['headway', 'speed']),
+                                ('TRANSIT_SEGMENT', ['allow_boardings', 'allow_alightings', 'dwell_time'])]
+
 ##########################################################################################################    
 
 class XmlValidationError(Exception):
@@ -129,6 +145,14 @@ class grid():
         x, y = int(x), int(y)
         index = x * self.y + y
         self._data[index] = val
+    
+    def map(self, function):
+        '''
+        Returns a new grid, with the function applied to the contents of each cell.
+        '''
+        result = grid(self.x, self.y)
+        result._data = [function(cell) for cell in self._data]
+        return result
 
 class NodeSpatialProxy():
     def __init__(self, id, x, y):
@@ -147,7 +171,7 @@ class NodeSpatialProxy():
 
 class FBTNFromSchema(_m.Tool()):
     
-    version = '1.4.0'
+    version = '1.5.0'
     tool_run_msg = ""
     number_of_tasks = 5 # For progress reporting, enter the integer number of tasks here
     
@@ -170,6 +194,7 @@ class FBTNFromSchema(_m.Tool()):
     SegmentINodeAttributeId = _m.Attribute(str)
 
     StationConnectorFlag = _m.Attribute(bool)
+    UseTopologyCache = _m.Attribute(bool)
     
     __ZONE_TYPES = ['node_selection', 'from_shapefile']
     __RULE_TYPES = ['initial_boarding', 
@@ -191,6 +216,7 @@ class FBTNFromSchema(_m.Tool()):
         self.SegmentFareAttributeId = "@sfare"
 
         self.StationConnectorFlag = True
+        self.UseTopologyCache = True
     
     def page(self):
         pb = _tmgTPB.TmgToolPageBuilder(self, title="FBTN From Schema v%s" %self.version,
@@ -274,6 +300,12 @@ class FBTNFromSchema(_m.Tool()):
         pb.add_checkbox(tool_attribute_name= 'StationConnectorFlag',
                         label= "Allow station-to-centroid connections?")                      
         
+        pb.add_checkbox(tool_attribute_name= 'UseTopologyCache',
+                        label= "Only re-apply fares if the hyper network is unchanged?",
+                        note= "The hyper network is re-used if the groups, zones, options and \
+                        base network are the same as in the run which created the new scenario. \
+                        Link modes and itineraries are only compared through the element totals.")
+
         #---JAVASCRIPT
         pb.add_html("""
 <script type="text/javascript">
@@ -343,7 +375,7 @@ class FBTNFromSchema(_m.Tool()):
         
     def __call__(self, XMLSchemaFile, xtmf_BaseScenarioNumber, NewScenarioNumber,
                  TransferModeId, SegmentFareAttributeId, LinkFareAttributeId, 
-                 VirtualNodeDomain, StationConnectorFlag):
+                 VirtualNodeDomain, StationConnectorFlag, UseTopologyCache=True):
         
         #---1 Set up scenario
         self.BaseScenario = _MODELLER.emmebank.scenario(xtmf_BaseScenarioNumber)
@@ -370,6 +402,7 @@ class FBTNFromSchema(_m.Tool()):
         self.LinkFareAttributeId = LinkFareAttributeId
         self.VirtualNodeDomain = VirtualNodeDomain
         self.StationConnectorFlag = StationConnectorFlag
+        self.UseTopologyCache = UseTopologyCache
         
         try:
             self._Execute()
@@ -397,47 +430,63 @@ class FBTNFromSchema(_m.Tool()):
             _m.logbook_write("Loading Fare Schema File version %s" %version)
             print "Loading Fare Schema File version %s" %version
             
-            self.TRACKER.startProcess(nGroups + nZones)
-            with nested (_util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_LINE', description= "Line Group"),
-                         _util.tempExtraAttributeMANAGER(self.BaseScenario, 'NODE', description= "Fare Zone")) \
-                     as (lineGroupAtt, zoneAtt):
+            #Re-use the hyper network from a previous run if only the fare rules have changed
+            cachePath = self._GetTopologyCachePath()
+            topologyKey = self._GetTopologyKey(root)
+            network, topology = None, None
+            if self.UseTopologyCache:
+                network, topology = self._LoadCachedHyperNetwork(cachePath, topologyKey)
+            
+            if network != None:
+                transferGrid, zoneCrossingGrid = topology['transferGrid'], topology['zoneCrossingGrid']
+                groupIds2Int, zoneId2Int = topology['groupIds2Int'], topology['zoneId2Int']
+                _m.logbook_write("Re-used the cached hyper network of scenario %s" %self.NewScenarioNumber)
+                print "Re-used the cached hyper network."
+            else:
+                self.TRACKER.startProcess(nGroups + nZones)
+                with nested (_util.tempExtraAttributeMANAGER(self.BaseScenario, 'TRANSIT_LINE', description= "Line Group"),
+                             _util.tempExtraAttributeMANAGER(self.BaseScenario, 'NODE', description= "Fare Zone")) \
+                         as (lineGroupAtt, zoneAtt):
                 
-                with _m.logbook_trace("Transit Line Groups"):
-                    groupsElement = root.find('groups')
-                    groupIds2Int, int2groupIds = self._LoadGroups(groupsElement, lineGroupAtt.id)
-                    print "Loaded groups."
+                    with _m.logbook_trace("Transit Line Groups"):
+                        groupsElement = root.find('groups')
+                        groupIds2Int, int2groupIds = self._LoadGroups(groupsElement, lineGroupAtt.id)
+                        print "Loaded groups."
                 
-                stationGroupsElement = root.find('station_groups')
-                if stationGroupsElement != None:
-                    with _m.logbook_trace("Station Groups"):
-                        stationGroups = self._LoadStationGroups(stationGroupsElement)
-                        print "Loaded station groups"
+                    stationGroupsElement = root.find('station_groups')
+                    if stationGroupsElement != None:
+                        with _m.logbook_trace("Station Groups"):
+                            stationGroups = self._LoadStationGroups(stationGroupsElement)
+                            print "Loaded station groups"
                 
-                zonesElement = root.find('zones')
-                if zonesElement != None:
-                    with _m.logbook_trace("Fare Zones"):
-                        zoneId2Int, int2ZoneId, nodeProxies = self._LoadZones(zonesElement, zoneAtt.id)
-                        print "Loaded zones."
-                else:
-                    zoneId2Int, int2ZoneId, nodeProxies = {}, {}, {}
-                self.TRACKER.completeTask() #Complete the group/zone loading task
+                    zonesElement = root.find('zones')
+                    if zonesElement != None:
+                        with _m.logbook_trace("Fare Zones"):
+                            zoneId2Int, int2ZoneId, nodeProxies = self._LoadZones(zonesElement, zoneAtt.id)
+                            print "Loaded zones."
+                    else:
+                        zoneId2Int, int2ZoneId, nodeProxies = {}, {}, {}
+                    self.TRACKER.completeTask() #Complete the group/zone loading task
                 
-                #Load and prepare the network.
-                self.TRACKER.startProcess(2)
-                network = self.BaseScenario.get_network()
-                print "Loaded network."
-                self.TRACKER.completeSubtask()
-                self._PrepareNetwork(network, nodeProxies, lineGroupAtt.id)
-                self.TRACKER.completeTask()
-                print "Prepared base network."
-            
-            #Transform the network
-            with _m.logbook_trace("Transforming hyper network"):
-                transferGrid, zoneCrossingGrid = self._TransformNetwork(network, nGroups, nZones)
-                #print transferGrid[0,1]
-                if nStationGroups > 0:
-                    self._IndexStationConnectors(network, transferGrid, stationGroups, groupIds2Int)
-                print "Hyper network generated."            
+                    #Load and prepare the network.
+                    self.TRACKER.startProcess(2)
+                    network = self.BaseScenario.get_network()
+                    print "Loaded network."
+                    self.TRACKER.completeSubtask()
+                    self._PrepareNetwork(network, nodeProxies, lineGroupAtt.id)
+                    self.TRACKER.completeTask()
+                    print "Prepared base network."
+            
+                #Transform the network
+                with _m.logbook_trace("Transforming hyper network"):
+                    transferGrid, zoneCrossingGrid = self._TransformNetwork(network, nGroups, nZones)
+                    #print transferGrid[0,1]
+                    if nStationGroups > 0:
+                        self._IndexStationConnectors(network, transferGrid, stationGroups, groupIds2Int)
+                    print "Hyper network generated."
+                
+                topology = self._GetTopology(network, topologyKey, transferGrid, zoneCrossingGrid,
+                                             groupIds2Int, zoneId2Int)
             
             #Apply fare rules to network.
             with _m.logbook_trace("Applying fare rules"):
@@ -452,13 +501,20 @@ class FBTNFromSchema(_m.Tool()):
             
             #Publish the network
             bank = _MODELLER.emmebank
-            if bank.scenario(self.NewScenarioNumber) != None:
-                bank.delete_scenario(self.NewScenarioNumber)
-            newSc = bank.copy_scenario(self.BaseScenario.id, self.NewScenarioNumber, \
-                                       copy_path_files=False, copy_strat_files=False)
+            if topology['cached']:
+                newSc = bank.scenario(self.NewScenarioNumber)
+            else:
+                if bank.scenario(self.NewScenarioNumber) != None:
+                    bank.delete_scenario(self.NewScenarioNumber)
+                newSc = bank.copy_scenario(self.BaseScenario.id, self.NewScenarioNumber, \
+                                           copy_path_files=False, copy_strat_files=False)
             newSc.title = self.NewScenarioTitle
             newSc.publish_network(network, resolve_attributes= True)
             
+            if not topology['cached']:
+                topology['totals'] = dict(network.element_totals)
+                self._SaveTopologyCache(cachePath, topology)
+            
             _MODELLER.desktop.refresh_needed(True) #Tell the desktop app that a data refresh is required
 
     ##########################################################################################################     
@@ -1475,6 +1531,180 @@ class FBTNFromSchema(_m.Tool()):
             
             _m.logbook_write("LINKS AND SEGMENTS WITH NEGATIVE FARES", value=pb.render())
 
+    #---
+    #---TOPOLOGY CACHE------------------------------------------------------------------------------------
+    
+    def _GetTopologyCachePath(self):
+        return path.join(path.dirname(_MODELLER.emmebank.path), "FBTN_topology_%s.pkl" %self.NewScenarioNumber)
+    
+    def _GetTopologyKey(self, root):
+        '''
+        Hashes everything that the hyper network depends on, except for the fare
+        rules: the groups, station groups and zones of the schema (including the
+        shapefiles they refer to), the tool's options, and the base network.
+        '''
+        digest = hashlib.md5()
+        digest.update(repr((self.BaseScenario.id, self.VirtualNodeDomain, self.TransferModeId,
+                            self.StationConnectorFlag, self.SegmentINodeAttributeId,
+                            self.LinkFareAttributeId, self.SegmentFareAttributeId)))
+        
+        for tag in ['groups', 'station_groups', 'zones']:
+            element = root.find(tag)
+            if element != None: digest.update(_ET.tostring(element))
+        
+        zonesElement = root.find('zones')
+        if zonesElement != None:
+            for shapefileElement in zonesElement.findall('shapefile'):
+                pth = self._GetAbsoluteFilepath(shapefileElement.attrib['path'])
+                if path.exists(pth):
+                    stat = os.stat(pth)
+                    digest.update(repr((pth, stat.st_size, stat.st_mtime)))
+        
+        #The base network is hashed from its attribute values, without loading it
+        for domain, attributes in _BASE_NETWORK_KEY_ATTRIBUTES:
+            attributes = attributes + sorted([exatt.name for exatt in self.BaseScenario.extra_attributes()
+                                              if exatt.type == domain])
+            values = self.BaseScenario.get_attribute_values(domain, attributes)
+            digest.update(repr(attributes))
+            digest.update(self._SortedRepr(values[0]))
+            for table in values[1:]:
+                #str() of a large array is summarized with '...', so the raw bytes are hashed
+                digest.update(_np.ascontiguousarray(table).tostring())
+        
+        #Link modes, line modes and vehicles, and line itineraries are not numeric attributes,
+        #so they are read from a partial network (without attributes)
+        partialNetwork = self.BaseScenario.get_partial_network(['TRANSIT_SEGMENT'], include_attributes= False)
+        links = sorted((link.i_node.number, link.j_node.number, ''.join(sorted(mode.id for mode in link.modes)))
+                       for link in partialNetwork.links())
+        digest.update(repr(links))
+        lines = sorted((line.id, line.mode.id, line.vehicle.number, [segment.i_node.number for segment in line.segments(True)])
+                       for line in partialNetwork.transit_lines())
+        digest.update(repr(lines))
+        
+        return digest.hexdigest()
+    
+    def _SortedRepr(self, indices):
+        if isinstance(indices, dict):
+            return '{%s}' %', '.join("%r: %s" %(key, self._SortedRepr(indices[key])) for key in sorted(indices))
+        return repr(indices)
+    
+    def _GetTopology(self, network, topologyKey, transferGrid, zoneCrossingGrid, groupIds2Int, zoneId2Int):
+        '''
+        Records the transformed network, before any fares are applied. Links are
+        recorded by their node numbers and segments by their line id and number,
+        to be found again in the published scenario.
+        '''
+        virtualNodes = {}
+        fareZones = {}
+        for node in network.regular_nodes():
+            if node.to_hyper_node:
+                virtualNodes[node.number] = dict((group, virtualNode.number)
+                                                 for group, virtualNode in node.to_hyper_node.iteritems())
+            if node.fare_zone != 0: fareZones[node.number] = node.fare_zone
+        
+        #Fares copied over from the base network, which the fare rules are added to
+        linkFares = {}
+        for link in network.links():
+            fare = link[self.LinkFareAttributeId]
+            if fare != 0.0: linkFares[(link.i_node.number, link.j_node.number)] = fare
+        segmentFares = {}
+        for segment in network.transit_segments():
+            fare = segment[self.SegmentFareAttributeId]
+            if fare != 0.0: segmentFares[(segment.line.id, segment.number)] = fare
+        
+        return {'cached': False,
+                'key': topologyKey,
+                'transferGrid': transferGrid,
+                'zoneCrossingGrid': zoneCrossingGrid,
+                'groupIds2Int': groupIds2Int,
+                'zoneId2Int': zoneId2Int,
+                'virtualNodes': virtualNodes,
+                'fareZones': fareZones,
+                'lineGroups': dict((line.id, line.group) for line in network.transit_lines()),
+                'linkFares': linkFares,
+                'segmentFares': segmentFares}
+    
+    def _SaveTopologyCache(self, cachePath, topology):
+        contents = dict(topology)
+        del contents['cached']
+        transferGrid = topology['transferGrid'].map(
+            lambda links: [(link.i_node.number, link.j_node.number) for link in links])
+        zoneCrossingGrid = topology['zoneCrossingGrid'].map(list)
+        contents['transferGrid'] = (transferGrid.x, transferGrid.y, transferGrid._data)
+        contents['zoneCrossingGrid'] = (zoneCrossingGrid.x, zoneCrossingGrid.y, zoneCrossingGrid._data)
+        
+        try:
+            with open(cachePath, 'wb') as writer:
+                cPickle.dump(contents, writer, 2)
+        except IOError, e:
+            _m.logbook_write("Could not save the topology cache: %s" %e)
+    
+    def _LoadCachedHyperNetwork(self, cachePath, topologyKey):
+        '''
+        Gets the network of the new scenario, with its fares reset to the
+        values copied from the base network, if the cached topology matches.
+        
+        Returns: network, topology (both None if the hyper network needs
+            to be re-built).
+        '''
+        scenario = _MODELLER.emmebank.scenario(self.NewScenarioNumber)
+        if scenario == None or not path.exists(cachePath): return None, None
+        
+        try:
+            with open(cachePath, 'rb') as reader:
+                topology = cPickle.load(reader)
+        except Exception, e:
+            _m.logbook_write("Could not load the topology cache: %s" %e)
+            return None, None
+        if topology.get('key') != topologyKey: return None, None
+        
+        self.TRACKER.startProcess(2)
+        network = scenario.get_network()
+        self.TRACKER.completeSubtask()
+        if dict(network.element_totals) != topology['totals']:
+            _m.logbook_write("Scenario %s was modified since its hyper network was cached." %self.NewScenarioNumber)
+            return None, None
+        
+        #Every virtual node must still exist in the new scenario
+        for nodeNumber, virtualNodes in topology['virtualNodes'].iteritems():
+            for virtualNodeNumber in virtualNodes.itervalues():
+                if network.node(virtualNodeNumber) == None:
+                    _m.logbook_write("Virtual node %s is missing from scenario %s." %(virtualNodeNumber, self.NewScenarioNumber))
+                    return None, None
+        
+        network.create_attribute('TRANSIT_LINE', 'group', 0)
+        network.create_attribute('NODE', 'fare_zone', 0)
+        network.create_attribute('NODE', 'to_hyper_node', None)
+        for nodeNumber, virtualNodes in topology['virtualNodes'].iteritems():
+            network.node(nodeNumber).to_hyper_node = dict((group, network.node(virtualNodeNumber))
+                                                          for group, virtualNodeNumber in virtualNodes.iteritems())
+        for lineId, group in topology['lineGroups'].iteritems():
+            network.transit_line(lineId).group = group
+        for nodeNumber, zone in topology['fareZones'].iteritems():
+            network.node(nodeNumber).fare_zone = zone
+        
+        linkFares, segmentFares = topology['linkFares'], topology['segmentFares']
+        for link in network.links():
+            link[self.LinkFareAttributeId] = linkFares.get((link.i_node.number, link.j_node.number), 0.0)
+        for segment in network.transit_segments():
+            segment[self.SegmentFareAttributeId] = segmentFares.get((segment.line.id, segment.number), 0.0)
+        
+        x, y, cells = topology['transferGrid']
+        transferGrid = grid(x, y)
+        transferGrid._data = [set(network.link(i, j) for i, j in links) for links in cells]
+        x, y, cells = topology['zoneCrossingGrid']
+        zoneCrossingGrid = grid(x, y)
+        zoneCrossingGrid._data = [set(segments) for segments in cells]
+        topology['transferGrid'], topology['zoneCrossingGrid'] = transferGrid, zoneCrossingGrid
+        topology['cached'] = True
+        self.TRACKER.completeTask()
+        
+        #The groups, zones and transformation tasks are skipped
+        self.TRACKER.completeTask()
+        self.TRACKER.completeTask()
+        
+        return network, topology
+    
     #---              
     #---MODELLER INTERFACE FUNCTIONS----------------------------------------------------------------------      
     